@@ -14,6 +14,15 @@ Uso:
 Variáveis de ambiente necessárias:
     GEROT_API_URL - URL base do GeRot (ex: https://gerot.onrender.com)
     AGENT_API_KEY - Chave de API para autenticação
+    AGENT_ID - Identificação do agente nos leases (default: hostname:pid)
+    AGENT_JOB_TYPES - Tipos de job que o agente aceita (default: rpa,dashboard)
+    AGENT_HOSTS - Hosts MySQL (host:porta) testados e anunciados no registro
+                  (default: o host Brudam abaixo)
+    AGENT_CAPACITY - Jobs executados ao mesmo tempo (default: 5)
+    BUSY_EXCHANGE_INTERVAL - Intervalo máximo entre trocas com jobs rodando (default: 10s)
+    PARTITION_WORKERS - Partes de um job por período executadas em paralelo (default: 4)
+    PARTITION_MAX_SHARD_ROWS - Linhas máximas de uma parte; acima disso o job
+                               falha pedindo partes menores (default: 100000)
     MYSQL_AZ_HOST - Host do MySQL Brudam (default: 10.147.17.88)
     MYSQL_AZ_PORT - Porta do MySQL (default: 3306)
     MYSQL_AZ_USER - Usuário do MySQL
@@ -25,8 +34,13 @@ import os
 import sys
 import time
 import json
+import socket
 import logging
+import tempfile
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait as wait_futures
 from datetime import datetime
+from decimal import Decimal
 from pathlib import Path
 
 # Mudar para o diretório do script
@@ -64,6 +78,12 @@ logger = logging.getLogger(__name__)
 GEROT_API_URL = os.getenv("GEROT_API_URL", "https://gerot.onrender.com")
 AGENT_API_KEY = os.getenv("AGENT_API_KEY", "")
 POLLING_INTERVAL = int(os.getenv("POLLING_INTERVAL", "3"))  # segundos (mais rápido)
+LONG_POLL_TIMEOUT = int(os.getenv("LONG_POLL_TIMEOUT", "150"))  # espera máxima no GeRot
+AGENT_CAPACITY = int(os.getenv("AGENT_CAPACITY", "5"))  # jobs executando ao mesmo tempo
+BUSY_EXCHANGE_INTERVAL = int(os.getenv("BUSY_EXCHANGE_INTERVAL", "10"))  # troca máxima com jobs rodando
+PROTOCOL_VERSION = 1  # versão do /api/agent/work
+AGENT_ID = os.getenv("AGENT_ID") or f"{socket.gethostname()}:{os.getpid()}"
+AGENT_JOB_TYPES = [t.strip() for t in os.getenv("AGENT_JOB_TYPES", "rpa,dashboard").split(",") if t.strip()]
 
 # MySQL Brudam - credenciais devem estar no .env
 MYSQL_CONFIG = {
@@ -86,6 +106,188 @@ except ImportError as e:
     sys.exit(1)
 
 
+# Governança de queries: reaproveita utils/query_governor.py do GeRot. Se a
+# pasta agent_local foi copiada sozinha para outro PC, usa a validação simples.
+GEROT_UTILS_PATH = Path(os.getenv("GEROT_UTILS_PATH", str(Path(__file__).resolve().parent.parent / "utils")))
+sys.path.append(str(GEROT_UTILS_PATH))
+try:
+    from query_governor import QueryGovernor
+    GOVERNOR_AVAILABLE = True
+except ImportError:
+    GOVERNOR_AVAILABLE = False
+    logger.warning(f"[AVISO] query_governor não encontrado em {GEROT_UTILS_PATH}; usando validação simples")
+
+# Extração particionada por data (auditoria fiscal): partes em paralelo com
+# um pool limitado de conexões ao Brudam
+try:
+    from mysql_pool import MySQLConnectionPool
+    from partitioned_extract import parse_partition, run_ordered
+    PARTITIONS_AVAILABLE = True
+except ImportError:
+    PARTITIONS_AVAILABLE = False
+
+# Partes dos uploads grandes no mesmo formato que o GeRot valida
+try:
+    from ndjson_parts import encode_part
+    UPLOADS_AVAILABLE = True
+except ImportError:
+    UPLOADS_AVAILABLE = False
+
+PARTITION_WORKERS = int(os.getenv("PARTITION_WORKERS", "4"))
+PARTITION_MAX_SHARD_ROWS = int(os.getenv("PARTITION_MAX_SHARD_ROWS", "100000"))
+
+BRUDAM_MAX_ROWS = int(os.getenv("BRUDAM_MAX_ROWS", "5000"))
+
+
+def prepare_query(cursor, params: dict, query_params=None) -> str:
+    """
+    Valida e limita a query de um job. Com o governador disponível, confere
+    também o custo via EXPLAIN usando o orçamento enviado pelo GeRot.
+    ``query_params`` são os valores dos marcadores ``%(nome)s`` da query.
+    """
+    query = params.get("query", "SELECT 1 as test")
+    limit = params.get("limit", 100)
+
+    if not GOVERNOR_AVAILABLE:
+        # Adicionar LIMIT se não existir
+        if "LIMIT" not in query.upper():
+            query = f"{query} LIMIT {limit}"
+        # Segurança: apenas SELECT
+        if not query.strip().upper().startswith("SELECT"):
+            raise ValueError("Apenas queries SELECT são permitidas")
+        return query
+
+    governor = QueryGovernor(
+        max_rows=params.get("max_rows") or BRUDAM_MAX_ROWS,
+        max_rows_examined=params.get("max_rows_examined"),
+    )
+    query = governor.prepare(query, limit)
+    governor.check_cost(cursor, query, query_params)
+    return query
+
+
+# Sessões HTTP persistentes (keep-alive): evita um handshake TLS por chamada.
+# O heartbeat roda em outra thread e usa a sua própria sessão.
+http = requests.Session()
+heartbeat_http = requests.Session()
+
+
+def api_headers(json_body: bool = False) -> dict:
+    """Headers das chamadas ao GeRot (API Key e identificação do agente)."""
+    headers = {"X-Agent-Id": AGENT_ID}
+    if AGENT_API_KEY:
+        headers["X-API-Key"] = AGENT_API_KEY
+    if json_body:
+        headers["Content-Type"] = "application/json"
+    return headers
+
+
+http.headers.update(api_headers())
+heartbeat_http.headers.update(api_headers())
+
+
+class LeaseKeeper:
+    """
+    Renova em segundo plano o lease de todos os jobs que o agente segura:
+    os que estão executando e os que esperam a vez no lote, até o resultado
+    ser aceito pelo GeRot.
+
+    Sem heartbeat o GeRot considera o agente caído quando o lease vence e
+    devolve o job à fila (outro agente o executaria de novo).
+    """
+
+    def __init__(self):
+        self._held = {}  # kind -> {job_id: lease_seconds}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def hold(self, kind: str, job_id: int, lease_seconds: int = 300):
+        with self._lock:
+            self._held.setdefault(kind, {})[job_id] = lease_seconds
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def release(self, kind: str, job_id: int):
+        with self._lock:
+            self._held.get(kind, {}).pop(job_id, None)
+
+    def held(self) -> dict:
+        """``{kind: [ids]}`` dos jobs seguros no momento."""
+        with self._lock:
+            return {kind: list(jobs) for kind, jobs in self._held.items() if jobs}
+
+    def interval(self) -> float:
+        with self._lock:
+            leases = [s for jobs in self._held.values() for s in jobs.values()]
+        return max(min(leases, default=300) / 3, 5)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval())
+            held = self.held()
+            if held:
+                self.renew(held)
+
+    def renew(self, held: dict):
+        try:
+            response = heartbeat_http.post(
+                f"{GEROT_API_URL}/api/agent/heartbeat",
+                json=dict(held, running=sum(len(ids) for ids in held.values())),
+                timeout=15
+            )
+            renewed = response.json().get("renewed", {}) if response.status_code == 200 else {}
+        except Exception as e:
+            logger.warning(f"[AVISO] Falha no heartbeat de {held}: {e}")
+            return
+        for kind, ids in held.items():
+            for job_id in set(ids) - set(renewed.get(kind, [])):
+                logger.warning(f"[AVISO] Lease de {kind} #{job_id} não renovado ({response.status_code})")
+
+
+leases = LeaseKeeper()
+
+
+def reachable_hosts() -> list:
+    """Hosts de AGENT_HOSTS que aceitam conexão TCP a partir desta máquina."""
+    default = f"{MYSQL_CONFIG['host']}:{MYSQL_CONFIG['port']}"
+    reachable = []
+    for entry in os.getenv("AGENT_HOSTS", default).split(","):
+        host, _, port = entry.strip().partition(":")
+        if not host:
+            continue
+        try:
+            socket.create_connection((host, int(port or 3306)), timeout=5).close()
+            reachable.append(host)
+        except OSError as e:
+            logger.warning(f"[AVISO] Host {host} inacessível: {e}")
+    return reachable
+
+
+def register_agent():
+    """Anuncia ao GeRot as capacidades do agente (tipos de job, hosts, concorrência)."""
+    capabilities = {
+        "job_types": AGENT_JOB_TYPES,
+        "hosts": reachable_hosts(),
+        "max_concurrency": AGENT_CAPACITY,
+        "hostname": socket.gethostname(),
+        "version": str(PROTOCOL_VERSION),
+    }
+    try:
+        response = http.post(
+            f"{GEROT_API_URL}/api/agent/register",
+            headers=api_headers(json_body=True),
+            json=capabilities,
+            timeout=30
+        )
+        if response.status_code == 200:
+            logger.info(f"[OK] Agente registrado: {response.json().get('capabilities')}")
+        elif response.status_code != 404:
+            logger.warning(f"[AVISO] Registro recusado: {response.status_code} - {response.text[:200]}")
+    except Exception as e:
+        logger.warning(f"[AVISO] Falha ao registrar agente: {e}")
+
+
 def get_mysql_connection():
     """Conecta ao MySQL Brudam."""
     return pymysql.connect(
@@ -110,13 +312,326 @@ def test_mysql_connection():
         return False
 
 
+# Extração em streaming: o resultado é lido em lotes por um cursor não
+# bufferizado e enviado ao GeRot em partes, sem acumular cópias em memória.
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "2000"))
+PREVIEW_ROWS = 1000  # o GeRot guarda no máximo 1000 registros no resultado
+
+
+def to_json_row(row: dict) -> dict:
+    """Converte tipos não serializáveis para JSON (no próprio dict)."""
+    for key, value in row.items():
+        if isinstance(value, datetime):
+            row[key] = value.isoformat()
+        elif hasattr(value, 'isoformat'):
+            row[key] = value.isoformat()
+        elif isinstance(value, Decimal):
+            row[key] = float(value)
+        elif isinstance(value, bytes):
+            row[key] = value.decode('utf-8', errors='replace')
+        elif value is not None and not isinstance(value, (str, int, float, bool, list, dict)):
+            row[key] = str(value)
+    return row
+
+
+def iter_batches(conn, query: str, batch_size: int = STREAM_BATCH_SIZE, query_params=None):
+    """Executa a query com SSDictCursor e gera lotes já convertidos."""
+    cursor = conn.cursor(pymysql.cursors.SSDictCursor)
+    try:
+        cursor.execute(query, query_params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [to_json_row(row) for row in rows]
+    finally:
+        cursor.close()
+
+
+class ResultUpload:
+    """
+    Upload retomável de um resultado grande: partes NDJSON gzip numeradas,
+    com SHA-256 do conteúdo, publicadas de uma vez no commit.
+
+    Ao reabrir o upload de um job (nova tentativa após queda de rede ou
+    reinício do agente) o GeRot devolve os checksums das partes já recebidas;
+    partes idênticas não são reenviadas.
+    """
+
+    def __init__(self, kind: str, job_id: int):
+        self.kind = kind
+        self.job_id = job_id
+        self.upload_id = None
+        self.acked = []  # checksums já confirmados pelo servidor
+        self.parts = 0
+
+    def open(self):
+        if not UPLOADS_AVAILABLE:
+            raise RuntimeError(f"Resultado em partes requer utils/ndjson_parts.py ({GEROT_UTILS_PATH})")
+        response = http.post(f"{GEROT_API_URL}/api/agent/{self.kind}/{self.job_id}/uploads", timeout=30)
+        response.raise_for_status()
+        data = response.json()
+        self.upload_id = data["upload_id"]
+        self.acked = data.get("checksums", [])
+        if self.acked:
+            logger.info(f"[INFO] Retomando upload {self.upload_id}: {len(self.acked)} parte(s) já recebida(s)")
+        return self
+
+    def send(self, rows: list, retries: int = 4):
+        seq = self.parts
+        body, checksum = encode_part(rows)
+        if seq < len(self.acked) and self.acked[seq] == checksum:
+            self.parts += 1
+            return
+        
+        error = None
+        for attempt in range(1, retries + 1):
+            try:
+                response = http.put(
+                    f"{GEROT_API_URL}/api/agent/uploads/{self.upload_id}/parts/{seq}",
+                    headers={
+                        "Content-Type": "application/x-ndjson",
+                        "Content-Encoding": "gzip",
+                        "X-Content-SHA256": checksum,
+                    },
+                    data=body,
+                    timeout=120
+                )
+                if response.status_code == 200:
+                    del self.acked[seq:]
+                    self.parts += 1
+                    return
+                error = f"{response.status_code} - {response.text[:200]}"
+                if response.status_code == 400:
+                    break
+            except requests.RequestException as e:
+                error = str(e)
+            logger.warning(f"[AVISO] Falha ao enviar parte {seq} ({self.kind} #{self.job_id}), tentativa {attempt}: {error}")
+            time.sleep(2 ** attempt)
+        raise RuntimeError(f"Não foi possível enviar a parte {seq} do resultado: {error}")
+
+    def commit(self) -> dict:
+        response = http.post(
+            f"{GEROT_API_URL}/api/agent/uploads/{self.upload_id}/commit",
+            json={"parts": self.parts},
+            timeout=120
+        )
+        response.raise_for_status()
+        return response.json()
+
+
+class ResultSink:
+    """
+    Destino dos lotes de um resultado. Resultados que cabem em um lote seguem
+    inline, como antes; os maiores vão por um ResultUpload e só a prévia
+    (PREVIEW_ROWS) fica em memória.
+    """
+
+    def __init__(self, kind: str, job_id: int):
+        self.kind = kind
+        self.job_id = job_id
+        self.preview = []
+        self.row_count = 0
+        self.upload = None
+        self._pending = None  # lote retido até saber se o resultado cabe inline
+
+    def add(self, batch: list):
+        if not batch:
+            return
+        self.row_count += len(batch)
+        if len(self.preview) < PREVIEW_ROWS:
+            self.preview.extend(batch[:PREVIEW_ROWS - len(self.preview)])
+        if self._pending is not None:
+            self.upload = self.upload or ResultUpload(self.kind, self.job_id).open()
+            self.upload.send(self._pending)
+        self._pending = batch
+
+    def finish(self, logs: list) -> dict:
+        """Publica o upload (se houver) e devolve ``data``, ``row_count`` e ``chunks``."""
+        if self.upload:
+            self.upload.send(self._pending)
+            self.upload.commit()
+            logs.append(f"[{datetime.now().isoformat()}] Resultado enviado em {self.upload.parts} partes.")
+            return {"data": self.preview, "row_count": self.row_count, "chunks": self.upload.parts}
+        return {"data": self._pending or [], "row_count": self.row_count, "chunks": 0}
+
+
+def stream_extraction(kind: str, job_id: int, params: dict, logs: list) -> dict:
+    """Executa a query do job em streaming; ver ResultSink."""
+    if params.get("partition"):
+        return partitioned_extraction(kind, job_id, params, logs)
+    
+    logs.append(f"[{datetime.now().isoformat()}] Conectando ao MySQL Brudam...")
+    conn = get_mysql_connection()
+    try:
+        logs.append(f"[{datetime.now().isoformat()}] Conexão estabelecida!")
+        # Dashboards incrementais: a janela do watermark vem em params
+        query_params = params.get("params") or None
+        with conn.cursor() as cursor:
+            query = prepare_query(cursor, params, query_params)
+        
+        if query_params and "watermark_from" in query_params:
+            logs.append(f"[{datetime.now().isoformat()}] Extração incremental a partir de {query_params['watermark_from']}")
+        logs.append(f"[{datetime.now().isoformat()}] Executando query (streaming)...")
+        sink = ResultSink(kind, job_id)
+        for batch in iter_batches(conn, query, query_params=query_params):
+            sink.add(batch)
+        return sink.finish(logs)
+    finally:
+        conn.close()
+
+
+def report_progress(kind: str, job_id: int, progress: dict):
+    """Informa ao GeRot o andamento de um job particionado (melhor esforço)."""
+    try:
+        http.post(
+            f"{GEROT_API_URL}/api/agent/{kind}/{job_id}/progress",
+            headers=api_headers(json_body=True),
+            json=progress,
+            timeout=15
+        )
+    except Exception as e:
+        logger.warning(f"[AVISO] Falha ao informar progresso de {kind} #{job_id}: {e}")
+
+
+def spool_batches(spool, batch_size: int = STREAM_BATCH_SIZE):
+    """Relê em lotes as linhas NDJSON gravadas por ``run_shard``."""
+    batch = []
+    for line in spool:
+        batch.append(json.loads(line))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def partitioned_extraction(kind: str, job_id: int, params: dict, logs: list) -> dict:
+    """
+    Executa uma query por período em partes (dia/semana) e em paralelo.
+
+    Cada parte usa uma conexão do pool (no máximo PARTITION_WORKERS ao mesmo
+    tempo), é lida em lotes por um cursor não bufferizado e gravada em um
+    arquivo temporário próprio; os arquivos entram no ResultSink na ordem das
+    partes. Em memória fica só um lote por parte em execução, nunca a parte
+    inteira. Uma parte que atinge PARTITION_MAX_SHARD_ROWS (ou o limite do
+    job) falha o job em vez de truncar.
+    """
+    if not PARTITIONS_AVAILABLE:
+        raise RuntimeError(f"Job particionado requer utils/partitioned_extract.py ({GEROT_UTILS_PATH})")
+    
+    partition = parse_partition(params["partition"])
+    base_params = params.get("params") or {}
+    shards = partition.shards
+    pool = MySQLConnectionPool(get_mysql_connection, max_size=max(PARTITION_WORKERS, 1))
+    logs.append(
+        f"[{datetime.now().isoformat()}] Período {partition.start} a {partition.end}: "
+        f"{len(shards)} parte(s) por {partition.unit}, {PARTITION_WORKERS} em paralelo"
+    )
+    
+    try:
+        shard_limit = min(
+            int(params.get("limit") or BRUDAM_MAX_ROWS),
+            int(params.get("max_rows") or BRUDAM_MAX_ROWS),
+            PARTITION_MAX_SHARD_ROWS,
+        )
+        # O LIMIT da query é o da parte: ao abortar, o cursor não bufferizado
+        # descarta no máximo essas linhas
+        with pool.connection() as conn:
+            with conn.cursor() as cursor:
+                query = prepare_query(
+                    cursor, dict(params, limit=shard_limit, max_rows=shard_limit), shards[0].params(base_params)
+                )
+        
+        def run_shard(shard):
+            spool = tempfile.TemporaryFile()
+            rows = 0
+            try:
+                with pool.connection() as conn:
+                    batches = iter_batches(conn, query, query_params=shard.params(base_params))
+                    try:
+                        for batch in batches:
+                            rows += len(batch)
+                            if rows >= shard_limit:
+                                raise RuntimeError(
+                                    f"Parte {shard.label} atingiu o limite de {shard_limit} linhas; use partes menores"
+                                )
+                            spool.write("".join(
+                                json.dumps(row, ensure_ascii=False, default=str) + "\n" for row in batch
+                            ).encode("utf-8"))
+                    finally:
+                        batches.close()
+                spool.seek(0)
+                return spool, rows
+            except BaseException:
+                spool.close()
+                raise
+        
+        sink = ResultSink(kind, job_id)
+        buffer = []  # partes pequenas (um dia) são agrupadas em lotes cheios
+        started = time.monotonic()
+        for done, (shard, (spool, rows)) in enumerate(run_ordered(shards, run_shard, PARTITION_WORKERS), start=1):
+            with spool:
+                for batch in spool_batches(spool):
+                    buffer.extend(batch)
+                    while len(buffer) >= STREAM_BATCH_SIZE:
+                        sink.add(buffer[:STREAM_BATCH_SIZE])
+                        del buffer[:STREAM_BATCH_SIZE]
+            logger.info(f"[PARTE] {kind} #{job_id} {done}/{len(shards)} ({shard.label}): {rows} registros")
+            report_progress(kind, job_id, {
+                "shards_total": len(shards),
+                "shards_done": done,
+                "last_shard": shard.label,
+                "rows": sink.row_count + len(buffer),
+                "elapsed_seconds": round(time.monotonic() - started, 1),
+            })
+        
+        sink.add(buffer)
+        logs.append(f"[{datetime.now().isoformat()}] {len(shards)} parte(s) em {time.monotonic() - started:.1f}s.")
+        return sink.finish(logs)
+    finally:
+        pool.close_all()
+
+
+def wait_for_jobs():
+    """
+    Long-poll no GeRot: a requisição fica parada até surgir job ou vencer
+    LONG_POLL_TIMEOUT. Retorna ``(rpas, dashboards)`` ou ``None`` se o servidor
+    não tiver o endpoint (volta ao polling antigo).
+    """
+    try:
+        response = http.get(
+            f"{GEROT_API_URL}/api/agent/jobs/wait",
+            headers=api_headers(),
+            params={"timeout": LONG_POLL_TIMEOUT, "limit": AGENT_CAPACITY},
+            timeout=LONG_POLL_TIMEOUT + 15
+        )
+        
+        if response.status_code == 200:
+            data = response.json()
+            if data.get("retry_after"):
+                # Servidor no limite de conexões estacionadas
+                time.sleep(data["retry_after"])
+            return data.get("rpas", []), data.get("dashboards", [])
+        elif response.status_code == 404:
+            return None
+        else:
+            logger.warning(f"Erro no long-poll: {response.status_code} - {response.text}")
+    except Exception as e:
+        logger.error(f"Erro ao conectar ao GeRot: {e}")
+    
+    time.sleep(POLLING_INTERVAL)
+    return [], []
+
+
 def fetch_pending_rpas():
     """Busca RPAs pendentes no GeRot."""
     try:
-        headers = {"X-API-Key": AGENT_API_KEY} if AGENT_API_KEY else {}
-        response = requests.get(
+        headers = api_headers()
+        response = http.get(
             f"{GEROT_API_URL}/api/agent/rpas/pending",
             headers=headers,
+            params={"limit": AGENT_CAPACITY},
             timeout=30
         )
         
@@ -145,51 +660,11 @@ def execute_rpa(rpa: dict) -> dict:
     logs.append(f"[{datetime.now().isoformat()}] Iniciando execução: {name}")
     
     try:
-        # Conectar ao MySQL
-        logs.append(f"[{datetime.now().isoformat()}] Conectando ao MySQL Brudam...")
-        conn = get_mysql_connection()
-        cursor = conn.cursor()
-        logs.append(f"[{datetime.now().isoformat()}] Conexão estabelecida!")
-        
-        # Obter query dos parâmetros
-        query = parameters.get("query", "SELECT 1 as test")
-        limit = parameters.get("limit", 100)
-        
-        # Adicionar LIMIT se não existir
-        if "LIMIT" not in query.upper():
-            query = f"{query} LIMIT {limit}"
-        
-        # Segurança: apenas SELECT
-        if not query.strip().upper().startswith("SELECT"):
-            raise ValueError("Apenas queries SELECT são permitidas")
-        
-        logs.append(f"[{datetime.now().isoformat()}] Executando query...")
-        cursor.execute(query)
-        data = cursor.fetchall()
-        
-        # Converter tipos não serializáveis para JSON
-        from decimal import Decimal
-        for row in data:
-            for key, value in row.items():
-                if isinstance(value, datetime):
-                    row[key] = value.isoformat()
-                elif hasattr(value, 'isoformat'):
-                    row[key] = value.isoformat()
-                elif isinstance(value, Decimal):
-                    row[key] = float(value)
-                elif isinstance(value, bytes):
-                    row[key] = value.decode('utf-8', errors='replace')
-                elif value is not None and not isinstance(value, (str, int, float, bool, list, dict)):
-                    row[key] = str(value)
-        
-        logs.append(f"[{datetime.now().isoformat()}] Query executada! {len(data)} registros.")
+        extraction = stream_extraction("rpa", rpa_id, parameters, logs)
+        logs.append(f"[{datetime.now().isoformat()}] Query executada! {extraction['row_count']} registros.")
         
         result["success"] = True
-        result["data"] = data
-        result["row_count"] = len(data)
-        
-        cursor.close()
-        conn.close()
+        result.update(extraction)
         logs.append(f"[{datetime.now().isoformat()}] Conexão fechada.")
         
     except Exception as e:
@@ -203,12 +678,9 @@ def execute_rpa(rpa: dict) -> dict:
 def send_result(rpa_id: int, result: dict):
     """Envia resultado da execução para o GeRot."""
     try:
-        headers = {
-            "Content-Type": "application/json",
-            "X-API-Key": AGENT_API_KEY
-        } if AGENT_API_KEY else {"Content-Type": "application/json"}
+        headers = api_headers(json_body=True)
         
-        response = requests.post(
+        response = http.post(
             f"{GEROT_API_URL}/api/agent/rpa/{rpa_id}/result",
             headers=headers,
             json=result,
@@ -229,10 +701,11 @@ def send_result(rpa_id: int, result: dict):
 def fetch_pending_dashboards():
     """Busca solicitações de dashboard pendentes no GeRot."""
     try:
-        headers = {"X-API-Key": AGENT_API_KEY} if AGENT_API_KEY else {}
-        response = requests.get(
+        headers = api_headers()
+        response = http.get(
             f"{GEROT_API_URL}/api/agent/dashboards/pending",
             headers=headers,
+            params={"limit": AGENT_CAPACITY},
             timeout=30
         )
         
@@ -260,50 +733,11 @@ def execute_dashboard(dash: dict) -> dict:
     logs.append(f"[{datetime.now().isoformat()}] Iniciando dashboard: {title}")
     
     try:
-        # Conectar ao MySQL
-        logs.append(f"[{datetime.now().isoformat()}] Conectando ao MySQL Brudam...")
-        conn = get_mysql_connection()
-        cursor = conn.cursor()
-        
-        # Obter query dos filtros
-        query = filters.get("query", "SELECT 1 as test")
-        limit = filters.get("limit", 100)
-        
-        # Adicionar LIMIT se não existir
-        if "LIMIT" not in query.upper():
-            query = f"{query} LIMIT {limit}"
-        
-        # Segurança: apenas SELECT
-        if not query.strip().upper().startswith("SELECT"):
-            raise ValueError("Apenas queries SELECT são permitidas")
-        
-        logs.append(f"[{datetime.now().isoformat()}] Executando query...")
-        cursor.execute(query)
-        data = cursor.fetchall()
-        
-        # Converter tipos não serializáveis para JSON
-        from decimal import Decimal
-        for row in data:
-            for key, value in row.items():
-                if isinstance(value, datetime):
-                    row[key] = value.isoformat()
-                elif hasattr(value, 'isoformat'):
-                    row[key] = value.isoformat()
-                elif isinstance(value, Decimal):
-                    row[key] = float(value)
-                elif isinstance(value, bytes):
-                    row[key] = value.decode('utf-8', errors='replace')
-                elif value is not None and not isinstance(value, (str, int, float, bool, list, dict)):
-                    row[key] = str(value)
-        
-        logs.append(f"[{datetime.now().isoformat()}] Query executada! {len(data)} registros.")
+        extraction = stream_extraction("dashboard", dash_id, filters, logs)
+        logs.append(f"[{datetime.now().isoformat()}] Query executada! {extraction['row_count']} registros.")
         
         result["success"] = True
-        result["data"] = data
-        result["row_count"] = len(data)
-        
-        cursor.close()
-        conn.close()
+        result.update(extraction)
         logs.append(f"[{datetime.now().isoformat()}] Conexao fechada.")
         
     except Exception as e:
@@ -317,12 +751,9 @@ def execute_dashboard(dash: dict) -> dict:
 def send_dashboard_result(dash_id: int, result: dict):
     """Envia resultado do dashboard para o GeRot."""
     try:
-        headers = {
-            "Content-Type": "application/json",
-            "X-API-Key": AGENT_API_KEY
-        } if AGENT_API_KEY else {"Content-Type": "application/json"}
+        headers = api_headers(json_body=True)
         
-        response = requests.post(
+        response = http.post(
             f"{GEROT_API_URL}/api/agent/dashboard/{dash_id}/result",
             headers=headers,
             json=result,
@@ -340,13 +771,161 @@ def send_dashboard_result(dash_id: int, result: dict):
         return False
 
 
+JOB_RUNNERS = {"rpa": execute_rpa, "dashboard": execute_dashboard}
+JOB_SENDERS = {"rpa": send_result, "dashboard": send_dashboard_result}
+
+
+# Resultados recentes por fingerprint (query + parâmetros, calculado pelo
+# GeRot): jobs idênticos no mesmo lote ou logo em seguida não voltam ao ERP.
+# Só resultados inline; os enviados em partes pertencem ao job de origem.
+RESULT_REUSE_SECONDS = int(os.getenv("RESULT_REUSE_SECONDS", "60"))
+recent_results = {}  # fingerprint -> (instante, resultado, id de origem)
+
+
+def reuse_recent_result(fingerprint):
+    """Resultado de um job idêntico executado há menos de RESULT_REUSE_SECONDS."""
+    now = time.monotonic()
+    for key in [k for k, (at, _, _) in recent_results.items() if now - at >= RESULT_REUSE_SECONDS]:
+        del recent_results[key]
+    return recent_results.get(fingerprint) if fingerprint else None
+
+
+def run_job(job: dict) -> dict:
+    """Executa um job marcado com ``type`` e devolve o resultado marcado."""
+    kind, job_id = job.get("type"), job.get("id")
+    label = job.get("name") or job.get("title") or "Sem nome"
+    fingerprint = job.get("fingerprint")
+    
+    recent = reuse_recent_result(fingerprint)
+    if recent:
+        _, result, source_id = recent
+        logger.info(f"[CACHE] {kind} #{job_id}: mesmo resultado de #{source_id} (query idêntica)")
+        logs = [f"[{datetime.now().isoformat()}] Resultado reaproveitado do job idêntico #{source_id}"]
+        return dict(result, type=kind, id=job_id, logs=logs)
+    
+    logger.info(f"[EXEC] {kind} #{job_id}: {label}")
+    
+    result = JOB_RUNNERS[kind](job)
+    
+    if result["success"]:
+        logger.info(f"[OK] {kind} #{job_id} concluido: {result['row_count']} registros")
+        if fingerprint and not result.get("chunks"):
+            recent_results[fingerprint] = (time.monotonic(), result, job_id)
+    else:
+        logger.error(f"[ERRO] {kind} #{job_id} falhou: {result['error']}")
+    return dict(result, type=kind, id=job_id)
+
+
+def exchange_work(results: list, capacity: int, running: int, wait: float):
+    """
+    Troca única com o GeRot (/api/agent/work): envia os resultados prontos e
+    os heartbeats dos jobs seguros e pede no máximo ``capacity`` jobs (as
+    vagas livres), esperando até ``wait`` segundos por eles. Retorna ``(jobs,
+    resultados a reenviar)``; ``jobs`` é ``None`` se o servidor não tiver o
+    endpoint.
+    """
+    body = {
+        "version": PROTOCOL_VERSION,
+        "capacity": capacity,
+        "wait": wait,
+        "running": running,
+        "heartbeats": leases.held(),
+        "results": results,
+    }
+    try:
+        response = http.post(
+            f"{GEROT_API_URL}/api/agent/work",
+            headers=api_headers(json_body=True),
+            json=body,
+            timeout=wait + 15
+        )
+    except Exception as e:
+        logger.error(f"Erro ao conectar ao GeRot: {e}")
+        time.sleep(POLLING_INTERVAL)
+        return [], results
+    
+    if response.status_code == 404:
+        return None, results
+    if response.status_code != 200:
+        logger.warning(f"Erro na troca de trabalho: {response.status_code} - {response.text[:200]}")
+        time.sleep(POLLING_INTERVAL)
+        return [], results
+    
+    data = response.json()
+    retry = []
+    for ack in data.get("acks", []):
+        if ack.get("code") == 200:
+            logger.info(f"[OK] Resultado enviado para {ack['type']} #{ack['id']}")
+            leases.release(ack["type"], ack["id"])
+            continue
+        logger.warning(f"[AVISO] Resultado de {ack['type']} #{ack['id']} recusado: {ack.get('error')}")
+        if ack.get("code", 500) >= 500:
+            retry += [r for r in results if r["type"] == ack["type"] and r["id"] == ack["id"]]
+        else:
+            leases.release(ack["type"], ack["id"])
+    
+    if data.get("retry_after"):
+        # Servidor no limite de conexões estacionadas
+        time.sleep(data["retry_after"])
+    return data.get("jobs", []), retry
+
+
+def finished_result(future, job: dict) -> dict:
+    """Resultado de um job do pool; exceção inesperada vira falha do job."""
+    try:
+        return future.result()
+    except Exception as e:
+        logger.error(f"[ERRO] {job['type']} #{job['id']} falhou: {e}")
+        return {"type": job["type"], "id": job["id"], "success": False, "data": None,
+                "error": str(e), "row_count": 0, "logs": []}
+
+
+def run_legacy_cycle(long_poll: bool) -> bool:
+    """Ciclo com os endpoints antigos (GeRot sem /api/agent/work)."""
+    has_work = False
+    
+    # Buscar jobs: long-poll quando o GeRot suporta, senão polling
+    jobs = wait_for_jobs() if long_poll else None
+    if jobs is None:
+        if long_poll:
+            logger.info("[INFO] GeRot sem long-poll; usando polling")
+            long_poll = False
+        rpas, dashboards = fetch_pending_rpas(), fetch_pending_dashboards()
+    else:
+        rpas, dashboards = jobs
+    
+    # O lote inteiro fica reservado: o heartbeat cobre também os que esperam
+    batches = (("rpa", rpas), ("dashboard", dashboards))
+    for kind, batch in batches:
+        for job in batch:
+            leases.hold(kind, job["id"], job.get("lease_seconds", 300))
+    
+    for kind, batch in batches:
+        if batch:
+            has_work = True
+            logger.info(f"[INFO] {len(batch)} {kind}(s) pendente(s)")
+        for job in batch:
+            try:
+                result = run_job(dict(job, type=kind))
+                JOB_SENDERS[kind](result["id"], result)
+            finally:
+                leases.release(kind, job["id"])
+    
+    # Aguardar próximo polling (adaptativo); no long-poll a espera é no servidor
+    if not long_poll:
+        sleep_time = 1 if has_work else POLLING_INTERVAL
+        time.sleep(sleep_time)
+    return long_poll
+
+
 def run_agent():
     """Loop principal do agente."""
     logger.info("=" * 60)
     logger.info("[AGENTE] Brudam iniciado")
     logger.info(f"   GeRot URL: {GEROT_API_URL}")
+    logger.info(f"   Agent ID: {AGENT_ID}")
     logger.info(f"   MySQL: {MYSQL_CONFIG['host']}:{MYSQL_CONFIG['port']}")
-    logger.info(f"   Polling: {POLLING_INTERVAL}s")
+    logger.info(f"   Polling: {POLLING_INTERVAL}s (long-poll até {LONG_POLL_TIMEOUT}s)")
     logger.info("=" * 60)
     
     # Testar conexão MySQL
@@ -354,61 +933,50 @@ def run_agent():
         logger.error("Não foi possível conectar ao MySQL. Verifique as configurações.")
         sys.exit(1)
     
+    register_agent()
+    
+    use_work_protocol = True
+    long_poll = True
+    results = []
+    # Até AGENT_CAPACITY jobs em paralelo; cada resultado sai na troca seguinte
+    # ao término e só as vagas livres são pedidas ao GeRot
+    executor = ThreadPoolExecutor(max_workers=AGENT_CAPACITY, thread_name_prefix="job")
+    running = {}  # future -> job
     while True:
         try:
-            has_work = False
+            if not use_work_protocol:
+                long_poll = run_legacy_cycle(long_poll)
+                continue
             
-            # Buscar RPAs pendentes
-            rpas = fetch_pending_rpas()
+            for future in [f for f in running if f.done()]:
+                results.append(finished_result(future, running.pop(future)))
             
-            if rpas:
-                has_work = True
-                logger.info(f"[INFO] {len(rpas)} RPA(s) pendente(s)")
-                
-                for rpa in rpas:
-                    rpa_id = rpa.get("id")
-                    name = rpa.get("name", "Sem nome")
-                    
-                    logger.info(f"[EXEC] Executando RPA #{rpa_id}: {name}")
-                    
-                    # Executar
-                    result = execute_rpa(rpa)
-                    
-                    # Enviar resultado
-                    send_result(rpa_id, result)
-                    
-                    if result["success"]:
-                        logger.info(f"[OK] RPA #{rpa_id} concluida: {result['row_count']} registros")
-                    else:
-                        logger.error(f"[ERRO] RPA #{rpa_id} falhou: {result['error']}")
+            # Com jobs rodando não estaciona no long-poll: o resultado do
+            # próximo a terminar não pode esperar a chegada de job novo
+            free = AGENT_CAPACITY - len(running)
+            jobs, results = exchange_work(results, free, len(running), 0 if running else LONG_POLL_TIMEOUT)
+            if jobs is None:
+                logger.info("[INFO] GeRot sem /api/agent/work; usando endpoints antigos")
+                use_work_protocol = False
+                for future, job in list(running.items()):
+                    results.append(finished_result(future, job))
+                running.clear()
+                for result in results:
+                    JOB_SENDERS[result["type"]](result["id"], result)
+                    leases.release(result["type"], result["id"])
+                results = []
+                continue
             
-            # Buscar Dashboards pendentes
-            dashboards = fetch_pending_dashboards()
-            
-            if dashboards:
-                has_work = True
-                logger.info(f"[INFO] {len(dashboards)} Dashboard(s) pendente(s)")
-                
-                for dash in dashboards:
-                    dash_id = dash.get("id")
-                    title = dash.get("title", "Sem titulo")
-                    
-                    logger.info(f"[EXEC] Processando Dashboard #{dash_id}: {title}")
-                    
-                    # Executar
-                    result = execute_dashboard(dash)
-                    
-                    # Enviar resultado
-                    send_dashboard_result(dash_id, result)
-                    
-                    if result["success"]:
-                        logger.info(f"[OK] Dashboard #{dash_id} concluido: {result['row_count']} registros")
-                    else:
-                        logger.error(f"[ERRO] Dashboard #{dash_id} falhou: {result['error']}")
+            for job in jobs:
+                if job.get("type") not in JOB_RUNNERS:
+                    logger.warning(f"[AVISO] Tipo de job desconhecido: {job.get('type')}")
+                    continue
+                leases.hold(job["type"], job["id"], job.get("lease_seconds", 300))
+                running[executor.submit(run_job, job)] = job
             
-            # Aguardar próximo polling (adaptativo)
-            sleep_time = 1 if has_work else POLLING_INTERVAL
-            time.sleep(sleep_time)
+            if running:
+                # Acorda no primeiro término (ou a cada intervalo, para pegar vagas livres)
+                wait_futures(running, timeout=BUSY_EXCHANGE_INTERVAL, return_when=FIRST_COMPLETED)
             
         except KeyboardInterrupt:
             logger.info("[STOP] Agente interrompido pelo usuario")
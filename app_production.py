@@ -10,14 +10,18 @@ from flask import (
     jsonify,
     request,
     flash,
+    send_file,
     send_from_directory,
     g,
+    has_app_context,
+    Response,
 )
 from flask_cors import CORS
 from flask_compress import Compress
 from flask_restful import Api, Resource
 from dotenv import load_dotenv
 import os
+import threading
 import time
 
 # Carregar variáveis de ambiente do arquivo .env
@@ -30,9 +34,11 @@ import bcrypt
 import psycopg2
 import psycopg2.extras
 import psycopg2.errors
+from contextlib import contextmanager
 from datetime import datetime, date, timedelta
-from functools import wraps
+from functools import partial, wraps
 from typing import Dict, List, Tuple
+from urllib.parse import unquote
 import mimetypes
 from io import BytesIO
 from werkzeug.utils import secure_filename
@@ -40,7 +46,34 @@ from psycopg2 import pool
 import google.generativeai as genai
 from openpyxl import load_workbook
 
+from utils.agent_dispatch import plan_claim, register_agent, remember_affinity, touch_agent
+from utils.agent_jobs import JOB_KINDS, claim_jobs, reap_expired, renew_leases
+from utils.agent_log_store import AgentLogStore
+from utils.agent_protocol import PROTOCOL_VERSION, ProtocolError, parse_work_request, tag_jobs
+from utils.agent_schema import migrate as migrate_agent_schema, tables_exist as agent_tables_exist
+from utils.asset_cache import AssetCache, AssetCacheError
+from utils.asset_pipeline import AssetPipeline, enqueue_glb
+from utils.brudam_broker import BrokerUnavailable, ConnectionBroker
+from utils.dashboard_snapshots import DashboardSnapshotStore, SnapshotScheduler
+from utils.environment_counters import EnvironmentCounters, install as install_environment_counters, tables_exist as environment_tables_exist
+from utils.facilities import RESOURCE_TYPES, SCOPE_INDEX_SQL, SUMMARY_SQL, CursorError, fetch_resource_page, page_size
+from utils.image_variants import FORMATS as IMAGE_FORMATS, PRESETS as IMAGE_PRESETS, ImageVariantError, ImageVariantService, check_variant
+from utils.incremental_extract import IncrementalError, merge_increment, parse_incremental, prepare_incremental_job
+from utils.job_coalescing import coalesce_job, fan_out_results
+from utils.job_notifier import AGENT_JOBS_CHANNEL, JobNotifier
+from utils.mysql_pool import MySQLPoolTimeout, get_mysql_pool
+from utils.metrics import POOL_IN_USE, POOL_WAIT, TimedCursor, begin_request, end_request, outbound, pool_checkout, render_metrics
+from utils.ndjson_parts import PartError, decode_part
+from utils.partitioned_extract import PartitionError, parse_partition
 from utils.planner_client import PlannerClient, PlannerIntegrationError
+from utils.planner_sync import PlannerSyncEngine, PlannerTaskSpec, SyncOutcome, dashboards_hash
+from utils.query_analysis import QueryAnalyzer
+from utils.query_cache import QueryResultCache
+from utils.query_governor import QueryGovernor, QueryRejected
+from utils.result_stream import stream_batches
+from utils.rpa_scheduler import RpaScheduler, ScheduleError, parse_schedule
+from utils.signed_uploads import LocalStorage, UploadRejected, check_completed_upload, check_new_upload, resource_type_for
+from utils.storage_upload import StorageUploadError, SupabaseStorage, UploadResult, UploadTooLarge
 
 
 app = Flask(__name__)
@@ -49,6 +82,35 @@ Compress(app)  # Habilita compressão Gzip
 api = Api(app)
 
 
+# Métricas por requisição (utils/metrics.py): registradas antes dos demais hooks
+@app.before_request
+def start_request_metrics():
+    begin_request()
+    if QUERY_ANALYSIS:
+        query_analyzer.begin_request()
+
+
+@app.after_request
+def finish_request_metrics(response):
+    endpoint = request.endpoint or "unmatched"
+    end_request(endpoint, request.method, response.status_code)
+    summary = query_analyzer.end_request(endpoint) if QUERY_ANALYSIS else None
+    if summary and QUERY_SUMMARY_HEADER:
+        response.headers["X-Query-Summary"] = summary.header()
+        response.headers["Server-Timing"] = f"db;dur={summary.seconds * 1000:.1f}"
+    return response
+
+
+@app.teardown_request
+def finish_failed_request_metrics(error):
+    # Exceção propagada (ou erro em outro hook) pula o after_request: conta como 500.
+    # Requisições já registradas no after_request são ignoradas pelo end_request.
+    endpoint = request.endpoint or "unmatched"
+    end_request(endpoint, request.method, 500)
+    if QUERY_ANALYSIS:
+        query_analyzer.end_request(endpoint)
+
+
 @app.after_request
 def add_header(response):
     if 'Cache-Control' not in response.headers:
@@ -69,6 +131,15 @@ app.config["SECRET_KEY"] = os.getenv(
 app.config["DEBUG"] = os.getenv("FLASK_DEBUG", "false").lower() == "true"
 app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(days=7)  # Sessões persistem por 7 dias
 
+# Análise das consultas por requisição: N+1 e consultas lentas com EXPLAIN (utils/query_analysis.py)
+QUERY_ANALYSIS = os.getenv("QUERY_ANALYSIS", "true").lower() == "true"
+QUERY_SUMMARY_HEADER = app.config["DEBUG"] or os.getenv("QUERY_SUMMARY_HEADER", "false").lower() == "true"
+query_analyzer = QueryAnalyzer(
+    n_plus_one_threshold=int(os.getenv("QUERY_N_PLUS_ONE_THRESHOLD", "10")),
+    slow_ms=float(os.getenv("QUERY_SLOW_MS", "500")),
+    explain_sample=float(os.getenv("QUERY_EXPLAIN_SAMPLE", "0.1")),
+)
+
 DATABASE_URL = (
     os.getenv("DATABASE_URL")
     or os.getenv("DIRECT_URL")
@@ -273,6 +344,9 @@ PLANNER_CONFIG = {
     "client_secret": os.getenv("MS_CLIENT_SECRET"),
     "plan_id": os.getenv("MS_PLANNER_PLAN_ID"),
     "bucket_id": os.getenv("MS_PLANNER_BUCKET_ID"),
+    # Apontar para um Graph falso local (scripts/fake_graph_server.py)
+    "graph_base": os.getenv("MS_GRAPH_BASE_URL"),
+    "token_url": os.getenv("MS_TOKEN_URL"),
 }
 
 planner_client = PlannerClient(**PLANNER_CONFIG)
@@ -452,6 +526,10 @@ class ConnectionWrapper:
     def real_close(self):
         # Fecha de verdade (usado para conexões fora do pool)
         self._conn.close()
+
+    def cursor(self, *args, **kwargs):
+        # Cada statement entra nas métricas e na análise de consultas (N+1, lentas)
+        return TimedCursor(self._conn.cursor(*args, **kwargs), query_analyzer.observe if QUERY_ANALYSIS else None)
         
     def __getattr__(self, name):
         return getattr(self._conn, name)
@@ -463,7 +541,9 @@ def get_db():
         # Tentar pegar do Pool
         if db_pool:
             try:
-                conn = db_pool.getconn()
+                with pool_checkout("postgres"):
+                    conn = db_pool.getconn()
+                POOL_IN_USE.labels("postgres").inc()
                 g.db_wrapper = ConnectionWrapper(conn, from_pool=True)
                 return g.db_wrapper
             except Exception as e:
@@ -505,6 +585,7 @@ def close_db(error):
     if wrapper is not None:
         conn = wrapper._conn
         if wrapper._from_pool and db_pool:
+            POOL_IN_USE.labels("postgres").dec()
             try:
                 db_pool.putconn(conn)
             except Exception as e:
@@ -651,6 +732,86 @@ def ensure_schema() -> None:
         """
     )
 
+    # Conjunto de dashboards enviado em cada sincronização (diff do Planner)
+    cursor.execute(
+        """
+        ALTER TABLE planner_sync_logs ADD COLUMN IF NOT EXISTS dashboard_hash TEXT;
+        CREATE INDEX IF NOT EXISTS idx_planner_sync_logs_user ON planner_sync_logs(user_id, created_at DESC);
+        """
+    )
+
+    # Uploads diretos ao storage (URL assinada): pendentes até a confirmação
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS environment_uploads (
+            id TEXT PRIMARY KEY,
+            environment_id BIGINT NOT NULL,
+            storage_path TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            mime_type TEXT,
+            resource_type TEXT NOT NULL,
+            expected_size BIGINT NOT NULL,
+            sha256 TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            error TEXT,
+            resource_id BIGINT,
+            created_by BIGINT REFERENCES users_new(id) ON DELETE SET NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            expires_at TIMESTAMPTZ NOT NULL,
+            completed_at TIMESTAMPTZ
+        );
+        CREATE INDEX IF NOT EXISTS idx_environment_uploads_pending
+            ON environment_uploads(expires_at) WHERE status = 'pending';
+        """
+    )
+
+    # Variantes otimizadas dos modelos 3D (fila do AssetPipeline)
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS environment_asset_variants (
+            resource_id BIGINT PRIMARY KEY,
+            storage_path TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            locked_until TIMESTAMPTZ,
+            optimized_url TEXT,
+            preview_url TEXT,
+            original_size BIGINT,
+            optimized_size BIGINT,
+            preview_size BIGINT,
+            stats JSONB,
+            error TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+        CREATE INDEX IF NOT EXISTS idx_environment_asset_variants_queue
+            ON environment_asset_variants(created_at) WHERE status IN ('pending', 'processing');
+        """
+    )
+
+    # Recursos por ambiente/tipo na ordem da página de instalações (utils/facilities.py)
+    cursor.execute(
+        f"""
+        DO $$
+        BEGIN
+            IF to_regclass('environment_resources') IS NOT NULL THEN
+                {SCOPE_INDEX_SQL};
+            END IF;
+        END $$;
+        """
+    )
+
+    # Contadores de recursos por ambiente mantidos por trigger (utils/environment_counters.py)
+    if environment_tables_exist(cursor):
+        fixed = install_environment_counters(cursor)
+        if fixed:
+            app.logger.info(f"[ENV-COUNTERS] Contadores recalculados para {len(fixed)} ambiente(s)")
+
+    # Colunas e tabelas novas do agente local (utils/agent_schema.py): as tabelas
+    # base vêm de setup_agent_tables.py, então só migra se elas já existirem
+    if agent_tables_exist(cursor):
+        migrate_agent_schema(cursor, int(os.getenv("AGENT_LOGS_RETENTION_MONTHS", "6")))
+
     conn.commit()
     conn.close()
     
@@ -883,6 +1044,7 @@ def ensure_agent_tables():
             ('max_concurrent_rpas', '{"value": 5}', 'Número máximo de RPAs executando simultaneamente')
             ON CONFLICT (setting_key) DO NOTHING;
         """)
+        migrate_agent_schema(cursor, int(os.getenv("AGENT_LOGS_RETENTION_MONTHS", "6")))
         
         conn.commit()
         conn.close()
@@ -1291,27 +1453,6 @@ def save_user_dashboards(user_id: int, dashboard_ids: List[int], actor_id: int)
     conn.close()
 
 
-def log_planner_sync(
-    user_id: int,
-    user_name: str,
-    dashboard_count: int,
-    status: str,
-    message: str,
-    task_id: str | None = None,
-) -> None:
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        INSERT INTO planner_sync_logs (user_id, user_name, dashboard_count, status, message, task_id)
-        VALUES (%s, %s, %s, %s, %s, %s)
-        """,
-        (user_id, user_name, dashboard_count, status, message, task_id),
-    )
-    conn.commit()
-    conn.close()
-
-
 def get_recent_planner_logs(limit: int = 8) -> List[Dict]:
     conn = get_db()
     cursor = conn.cursor()
@@ -1329,7 +1470,52 @@ def get_recent_planner_logs(limit: int = 8) -> List[Dict]:
     return logs
 
 
-def sync_dashboards_to_planner() -> Tuple[int, List[str]]:
+def log_planner_outcomes(outcomes: List[SyncOutcome]) -> None:
+    """Grava o resultado de cada usuário em planner_sync_logs (uma transação)."""
+    if not outcomes:
+        return
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        psycopg2.extras.execute_values(
+            cursor,
+            """
+            INSERT INTO planner_sync_logs
+                (user_id, user_name, dashboard_count, status, message, task_id, dashboard_hash)
+            VALUES %s
+            """,
+            [
+                (o.spec.user_id, o.spec.user_name, o.spec.dashboard_count, o.status, o.message,
+                 o.task_id, o.spec.dashboard_hash)
+                for o in outcomes
+            ],
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def last_synced_hashes(cursor) -> Dict[int, str]:
+    """Conjunto de dashboards da última sincronização bem-sucedida de cada usuário."""
+    cursor.execute(
+        """
+        SELECT DISTINCT ON (user_id) user_id, dashboard_hash
+        FROM planner_sync_logs
+        WHERE status = 'success' AND user_id IS NOT NULL
+        ORDER BY user_id, created_at DESC
+        """
+    )
+    return {row["user_id"]: row["dashboard_hash"] for row in cursor.fetchall()}
+
+
+def sync_dashboards_to_planner(force: bool = False) -> Tuple[int, List[str]]:
+    """
+    Envia a agenda de dashboards ao Planner. Sem ``force`` só entram os
+    usuários cujo conjunto de dashboards mudou desde a última sincronização.
+    """
     if not planner_client.is_configured:
         raise PlannerIntegrationError(
             "Configure MS_TENANT_ID, MS_CLIENT_ID, MS_CLIENT_SECRET, "
@@ -1364,21 +1550,24 @@ def sync_dashboards_to_planner() -> Tuple[int, List[str]]:
             }
         )
 
+    previous = {} if force else last_synced_hashes(cursor)
     conn.close()
 
     if not assignments:
         raise PlannerIntegrationError("Nenhum usuário possui dashboards atribuídos.")
 
-    successes = 0
-    errors: List[str] = []
     today = date.today().strftime("%d/%m/%Y")
     start_time = datetime.utcnow().replace(hour=11, minute=0, second=0, microsecond=0)
     due_time = start_time + timedelta(hours=6)
 
+    specs: List[PlannerTaskSpec] = []
     for user_id, payload in assignments.items():
         dashboards = payload["dashboards"]
         if not dashboards:
             continue
+        current_hash = dashboards_hash(dashboards)
+        if previous.get(user_id) == current_hash:
+            continue
 
         title = f"Agenda de dashboards - {payload['name']} ({today})"
         description_lines = [
@@ -1391,37 +1580,54 @@ def sync_dashboards_to_planner() -> Tuple[int, List[str]]:
                 f"{idx}. {dash['title']} ({dash['category']}) - {dash['url']}"
             )
 
-        description = "\n".join(description_lines)
+        specs.append(PlannerTaskSpec(
+            user_id=user_id,
+            user_name=payload["name"],
+            title=title,
+            description="\n".join(description_lines),
+            dashboard_count=len(dashboards),
+            dashboard_hash=current_hash,
+        ))
 
-        try:
-            task = planner_client.create_dashboard_task(
-                title=title,
-                description=description,
-                start_time=start_time,
-                due_time=due_time,
-            )
-            log_planner_sync(
-                user_id=user_id,
-                user_name=payload["name"],
-                dashboard_count=len(dashboards),
-                status="success",
-                message="Tarefa criada e agenda enviada.",
-                task_id=task.get("id"),
-            )
-            successes += 1
-        except PlannerIntegrationError as exc:
-            errors.append(f"{payload['name']}: {exc}")
-            log_planner_sync(
-                user_id=user_id,
-                user_name=payload["name"],
-                dashboard_count=len(dashboards),
-                status="error",
-                message=str(exc),
-            )
+    skipped = len(assignments) - len(specs)
+    engine = PlannerSyncEngine(planner_client, max_workers=PLANNER_SYNC_WORKERS)
+    outcomes = engine.run(specs, start_time, due_time)
+    log_planner_outcomes(outcomes)
 
+    successes = sum(1 for o in outcomes if o.status == "success")
+    errors = [f"{o.spec.user_name}: {o.message}" for o in outcomes if o.status != "success"]
+    app.logger.info(
+        f"[PLANNER] Sincronização: {successes} enviada(s), {len(errors)} erro(s), "
+        f"{skipped} sem alteração, {engine.requests_sent} requisição(ões) $batch"
+    )
     return successes, errors
 
 
+PLANNER_SYNC_WORKERS = int(os.getenv("PLANNER_SYNC_WORKERS", "4"))
+planner_sync_lock = threading.Lock()
+
+
+def start_planner_sync(force: bool = False) -> bool:
+    """
+    Roda a sincronização com o Planner em segundo plano. Retorna False quando
+    já há uma sincronização em andamento neste processo.
+    """
+    if not planner_sync_lock.acquire(blocking=False):
+        return False
+
+    def run():
+        try:
+            with app.app_context():
+                sync_dashboards_to_planner(force)
+        except Exception as exc:
+            app.logger.error(f"[PLANNER] Falha na sincronização: {exc}")
+        finally:
+            planner_sync_lock.release()
+
+    threading.Thread(target=run, name="planner-sync", daemon=True).start()
+    return True
+
+
 # --------------------------------------------------------------------------- #
 # Funções de autenticação
 # --------------------------------------------------------------------------- #
@@ -1546,6 +1752,23 @@ def index():
     return redirect(url_for("login"))
 
 
+@app.route("/metrics")
+def metrics():
+    """
+    Métricas Prometheus de todos os workers, com ``Authorization: Bearer
+    <METRICS_TOKEN>``. Sem METRICS_TOKEN o endpoint fica fechado, a menos que
+    METRICS_PUBLIC=true (desenvolvimento local).
+    """
+    token = os.getenv("METRICS_TOKEN")
+    if not token:
+        if os.getenv("METRICS_PUBLIC", "false").lower() != "true":
+            return jsonify({"error": "Métricas desativadas (defina METRICS_TOKEN)"}), 403
+    elif not secrets.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return jsonify({"error": "Não autorizado"}), 401
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+
 @app.route("/login", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
@@ -1803,9 +2026,10 @@ def profile():
         if not errors and avatar_meta:
             try:
                 avatar_buffer = BytesIO(avatar_meta[0])
-                new_avatar_url, _ = upload_to_supabase(
+                new_avatar_url = upload_to_supabase(
                     avatar_buffer, avatar_meta[1], avatar_meta[2], folder="avatars"
-                )
+                ).public_url
+                get_image_variants().warm(new_avatar_url, "avatar")
                 updates.append("avatar_url = %s")
                 params.append(new_avatar_url)
             except Exception as avatar_exc:
@@ -1961,7 +2185,7 @@ def admin_users():
         cursor.execute(
             """
             SELECT id, username, nome_completo, email, nome_usuario, role, 
-                   departamento, is_active, first_login, created_at
+                   departamento, is_active, first_login, created_at, avatar_url
             FROM users_new
             ORDER BY nome_completo
             """
@@ -2222,17 +2446,19 @@ def update_user(user_id):
 @login_required
 @admin_required
 def admin_planner_sync():
-    try:
-        success_count, errors = sync_dashboards_to_planner()
-        if success_count:
-            flash(
-                f"Agenda enviada para {success_count} usuário(s) no Planner.",
-                "success",
-            )
-        if errors:
-            flash("Falha para: " + "; ".join(errors), "error")
-    except PlannerIntegrationError as exc:
-        flash(str(exc), "error")
+    if not planner_client.is_configured:
+        flash(
+            "Configure MS_TENANT_ID, MS_CLIENT_ID, MS_CLIENT_SECRET, "
+            "MS_PLANNER_PLAN_ID e MS_PLANNER_BUCKET_ID para usar esta função.",
+            "error",
+        )
+    elif start_planner_sync(force=request.form.get("force") == "1"):
+        flash(
+            "Sincronização com o Planner iniciada; o resultado aparece no histórico.",
+            "success",
+        )
+    else:
+        flash("Já existe uma sincronização com o Planner em andamento.", "error")
     return redirect(url_for("admin_dashboard"))
 
 
@@ -2388,43 +2614,64 @@ def cd_facilities():
     conn = get_db()
     cursor = conn.cursor()
     try:
-        # Buscar ambientes ordenados por display_order
-        cursor.execute("""
-            SELECT id, code, name, description, icon, floor
-            FROM environments 
-            WHERE is_active = true 
-            ORDER BY display_order ASC
-        """)
+        # Só o resumo (contagens e modelo principal): fotos e plantas vêm sob demanda
+        cursor.execute(SUMMARY_SQL)
         environments = [dict(row) for row in cursor.fetchall()]
-        
-        # Buscar recursos (modelos 3D, fotos, plantas) para cada ambiente
-        # Isso é importante para que o JS saiba o que carregar
-        cursor.execute("""
-            SELECT environment_id, resource_type, file_url, is_primary
-            FROM environment_resources
-            ORDER BY is_primary DESC
-        """)
-        resources = [dict(row) for row in cursor.fetchall()]
-        
-        # Agrupar recursos por ambiente
-        env_resources = {}
-        for res in resources:
-            env_id = res['environment_id']
-            if env_id not in env_resources:
-                env_resources[env_id] = []
-            env_resources[env_id].append(res)
-            
-        # Adicionar recursos aos ambientes
-        for env in environments:
-            env['resources'] = env_resources.get(env['id'], [])
-            
     except Exception as e:
         app.logger.error(f"Erro ao carregar ambientes: {str(e)}")
         environments = []
     finally:
         conn.close()
         
-    return render_template(get_template("cd_facilities.html"), environments=environments)
+    model_urls = {model_type: model_url(model_type) for model_type in MODEL_SOURCES}
+    return render_template(get_template("cd_facilities.html"), environments=environments, model_urls=model_urls)
+
+
+@app.route("/api/facilities/summary")
+@login_required
+def facilities_summary_api():
+    """Ambientes ativos com a contagem de recursos por tipo e o modelo 3D principal."""
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(SUMMARY_SQL)
+        return jsonify([dict(row) for row in cursor.fetchall()])
+    except Exception as e:
+        app.logger.error(f"Erro ao carregar resumo das instalações: {e}")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+
+@app.route("/api/facilities/<int:environment_id>/resources")
+@login_required
+def facilities_resources_api(environment_id):
+    """
+    Recursos de um ambiente em páginas (``?type=photo&limit=24&cursor=...``),
+    só com as colunas usadas pela página de instalações.
+    """
+    resource_type = request.args.get("type") or None
+    if resource_type and resource_type not in RESOURCE_TYPES:
+        return jsonify({"error": f"Tipo de recurso inválido: {resource_type}"}), 400
+
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        page = fetch_resource_page(
+            cursor, environment_id, resource_type, page_size(request.args.get("limit")), request.args.get("cursor")
+        )
+        for item in page["items"]:
+            if item["resource_type"] == "photo":
+                item["thumb_url"] = image_variant_url(item["file_url"], "photo", 640)
+                item["srcset"] = image_srcset(item["file_url"], "photo")
+        return jsonify(page)
+    except CursorError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        app.logger.error(f"Erro ao carregar recursos do ambiente {environment_id}: {e}")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
 
 
 @app.route("/cd/booking")
@@ -2628,83 +2875,153 @@ def room_booking_detail_api(booking_id):
         conn.close()
 
 
+# Modelos 3D do CD (releases do GitHub), servidos a partir do cache em disco
+MODEL_SOURCES = {
+    'glb': 'https://github.com/anaissiabraao/GeRot/releases/download/v1.0-3d-models/Cd_front_12_50_53.glb',
+    'fbx': 'https://github.com/anaissiabraao/GeRot/releases/download/v1.0-3d-models/Cd_front_12_10_17.fbx'
+}
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", str(BASE_DIR / "cache" / "3d_models"))
+MODEL_CACHE_MAX_BYTES = int(os.getenv("MODEL_CACHE_MAX_MB", "2048")) * 1024 * 1024
+# Com nginx/Apache na frente, USE_X_SENDFILE=true entrega o arquivo pelo proxy
+app.config["USE_X_SENDFILE"] = os.getenv("USE_X_SENDFILE", "false").lower() == "true"
+_model_cache: AssetCache | None = None
+
+
+def get_model_cache() -> AssetCache:
+    global _model_cache
+    if _model_cache is None:
+        _model_cache = AssetCache(MODEL_CACHE_DIR, MODEL_CACHE_MAX_BYTES)
+    return _model_cache
+
+
+def model_url(model_type: str) -> str:
+    """URL do modelo com a versão do conteúdo quando ele já está em cache."""
+    version = get_model_cache().version(MODEL_SOURCES[model_type])
+    if version:
+        return url_for("proxy_3d_model", model_type=model_type, v=version[:16])
+    return url_for("proxy_3d_model", model_type=model_type)
+
+
 @app.route("/api/3d-model/<model_type>", methods=['GET', 'OPTIONS'])
 def proxy_3d_model(model_type):
-    """Proxy otimizado para modelos 3D com streaming e CORS"""
+    """
+    Modelo 3D a partir do cache em disco: a origem só é baixada no primeiro
+    acesso. Suporta Range (206), ETag forte e If-None-Match (304).
+    """
     
     # Responder a preflight OPTIONS
     if request.method == 'OPTIONS':
         response = app.make_default_options_response()
         response.headers['Access-Control-Allow-Origin'] = '*'
         response.headers['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+        response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Range'
         return response
     
-    app.logger.info(f"[3D PROXY] Requisitando modelo: {model_type}")
-    
-    urls = {
-        'glb': 'https://github.com/anaissiabraao/GeRot/releases/download/v1.0-3d-models/Cd_front_12_50_53.glb',
-        'fbx': 'https://github.com/anaissiabraao/GeRot/releases/download/v1.0-3d-models/Cd_front_12_10_17.fbx'
-    }
-    
-    if model_type not in urls:
+    if model_type not in MODEL_SOURCES:
         app.logger.error(f"[3D PROXY] Modelo inválido: {model_type}")
         return jsonify({"error": "Modelo inválido"}), 404
     
     try:
-        # Streaming otimizado: chunks grandes + timeout longo
-        app.logger.info(f"[3D PROXY] Baixando: {urls[model_type]}")
-        
-        # Fazer requisição (sem context manager para não fechar antes do generator terminar)
-        # Timeout de 300s (5min) para arquivos grandes
-        r = requests.get(urls[model_type], stream=True, timeout=(30, 300))
-        r.raise_for_status()
-        
-        content_length = r.headers.get('content-length', '0')
-        content_type = r.headers.get('content-type', 'application/octet-stream')
-        
-        app.logger.info(f"[3D PROXY] Tamanho do arquivo: {content_length} bytes ({int(content_length)/(1024*1024):.2f} MB)")
-        
-        def generate():
-            """Generator para streaming eficiente com keep-alive"""
-            try:
-                bytes_sent = 0
-                # Chunks de 256KB para velocidade máxima
-                for chunk in r.iter_content(chunk_size=262144):
-                    if chunk:
-                        bytes_sent += len(chunk)
-                        yield chunk
-                        # Log a cada 10MB para monitorar progresso
-                        if bytes_sent % (10 * 1024 * 1024) < 262144:
-                            app.logger.info(f"[3D PROXY] {bytes_sent/(1024*1024):.1f}MB enviados")
-            finally:
-                # Fechar conexão após streaming completo
-                r.close()
-                app.logger.info(f"[3D PROXY] Streaming concluído: {bytes_sent/(1024*1024):.1f}MB para {model_type}")
-        
-        # Retornar resposta com CORS, Content-Length e streaming
-        from flask import Response
-        response = Response(generate(), mimetype=content_type, direct_passthrough=True)
-        response.headers['Access-Control-Allow-Origin'] = '*'
-        response.headers['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
-        response.headers['Content-Length'] = content_length
-        response.headers['Cache-Control'] = 'public, max-age=86400'
-        response.headers['Connection'] = 'keep-alive'
-        response.headers['Keep-Alive'] = 'timeout=300'
-        
-        app.logger.info(f"[3D PROXY] Streaming iniciado para {model_type}")
-        return response
-        
-    except requests.exceptions.Timeout:
-        app.logger.error(f"[3D PROXY] Timeout ao baixar {model_type}")
-        return jsonify({"error": "Timeout ao baixar modelo"}), 504
-    except requests.exceptions.RequestException as e:
-        app.logger.error(f"[3D PROXY] Erro de rede: {str(e)}")
-        return jsonify({"error": f"Erro ao baixar modelo: {str(e)}"}), 502
+        asset = get_model_cache().fetch(MODEL_SOURCES[model_type])
+    except AssetCacheError as e:
+        app.logger.error(f"[3D PROXY] {e}")
+        return jsonify({"error": "Erro ao baixar modelo"}), 502
     except Exception as e:
         app.logger.error(f"[3D PROXY] Erro inesperado: {str(e)}")
         return jsonify({"error": str(e)}), 500
+    
+    # conditional=True: Range -> 206, If-None-Match -> 304 (o gunicorn usa sendfile)
+    response = send_file(asset.path, mimetype=asset.content_type, conditional=True, etag=asset.sha256)
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Expose-Headers'] = 'Content-Length, Content-Range, Accept-Ranges, ETag'
+    if request.args.get("v") and asset.sha256.startswith(request.args["v"]):
+        # URL versionada pelo conteúdo: nunca muda
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'public, max-age=3600, must-revalidate'
+    return response
+
+
+# Variantes de imagem (avatares e fotos dos ambientes), em cache no disco
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", str(BASE_DIR / "cache" / "images"))
+IMAGE_SOURCE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_SOURCE_CACHE_MAX_MB", "1024")) * 1024 * 1024
+_image_sources: AssetCache | None = None
+_image_variants: ImageVariantService | None = None
+
+
+def load_image_source(url: str) -> Tuple[Path, str]:
+    """Arquivo local e SHA-256 da imagem original (storage local ou cache do download)."""
+    global _image_sources
+    storage = get_storage()
+    if isinstance(storage, LocalStorage):
+        path = unquote(url[len(storage.public_url("")):])
+        info = storage.stat(path)
+        if info is None:
+            raise ImageVariantError("Imagem não encontrada")
+        return storage.local_path(path), info.sha256
+    if _image_sources is None:
+        _image_sources = AssetCache(Path(IMAGE_CACHE_DIR) / "sources", IMAGE_SOURCE_CACHE_MAX_BYTES)
+    asset = _image_sources.fetch(url)
+    return asset.path, asset.sha256
+
+
+def get_image_variants() -> ImageVariantService:
+    global _image_variants
+    if _image_variants is None:
+        _image_variants = ImageVariantService(Path(IMAGE_CACHE_DIR) / "variants", load_image_source)
+    return _image_variants
+
+
+def is_image_source(url) -> bool:
+    """Só imagens do nosso storage passam pelo serviço de variantes."""
+    if not url:
+        return False
+    try:
+        return url.startswith(get_storage().public_url(""))
+    except StorageUploadError:
+        return False
+
+
+def image_variant_url(url, preset: str, width: int, fmt: str = "webp") -> str:
+    """URL da variante; imagens de fora do storage ficam com a URL original."""
+    if not is_image_source(url):
+        return url or ""
+    return url_for("image_variant", preset=preset, width=width, fmt=fmt, src=url)
+
+
+def image_srcset(url, preset: str, fmt: str = "webp") -> str:
+    if not is_image_source(url):
+        return ""
+    return ", ".join(
+        f"{image_variant_url(url, preset, width, fmt)} {width}w" for width in IMAGE_PRESETS[preset]["widths"]
+    )
+
+
+app.jinja_env.globals.update(image_variant_url=image_variant_url, image_srcset=image_srcset)
+
+
+@app.route("/img/<preset>/<int:width>.<fmt>")
+def image_variant(preset, width, fmt):
+    """Variante redimensionada de uma imagem do storage (``?src=<url pública>``)."""
+    source_url = request.args.get("src", "")
+    try:
+        check_variant(preset, width, fmt)
+    except ImageVariantError as e:
+        return jsonify({"error": str(e)}), 404
+    if not is_image_source(source_url):
+        return jsonify({"error": "Imagem não encontrada"}), 404
+
+    try:
+        path = get_image_variants().variant(source_url, preset, width, fmt)
+    except (AssetCacheError, ImageVariantError, StorageUploadError) as e:
+        # Sem variante, a página ainda funciona com a imagem original
+        app.logger.warning(f"[IMAGES] Variante indisponível ({preset}/{width}.{fmt}) para {source_url}: {e}")
+        return redirect(source_url)
+
+    response = send_file(path, mimetype=IMAGE_FORMATS[fmt][1], conditional=True)
+    # As URLs de upload têm timestamp no nome: o conteúdo de uma URL não muda
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
 
 
 # --------------------------------------------------------------------------- #
@@ -2758,16 +3075,10 @@ def environments_api():
                     e.id, e.code, e.name, e.description, e.icon, 
                     e.capacity, e.area_m2, e.floor, e.is_active,
                     e.display_order, e.created_at,
-                    COUNT(DISTINCT er.id) as resource_count,
-                    COUNT(DISTINCT CASE WHEN er.resource_type = 'model_3d' THEN er.id END) as models_3d,
-                    COUNT(DISTINCT CASE WHEN er.resource_type = 'plant_2d' THEN er.id END) as plants_2d,
-                    COUNT(DISTINCT CASE WHEN er.resource_type = 'photo' THEN er.id END) as photos
+                    -- Contadores mantidos pelos triggers de environment_resources
+                    e.resource_count, e.models_3d, e.plants_2d, e.photos
                 FROM environments e
-                LEFT JOIN environment_resources er ON e.id = er.environment_id
                 WHERE e.is_active = true
-                GROUP BY e.id, e.code, e.name, e.description, e.icon, 
-                         e.capacity, e.area_m2, e.floor, e.is_active,
-                         e.display_order, e.created_at
                 ORDER BY e.display_order, e.name
             """)
             environments = cursor.fetchall()
@@ -2971,16 +3282,21 @@ def environment_resources_api(environment_id):
             resource_type = request.args.get('type')
             
             query = """
-                SELECT * FROM environment_resources 
-                WHERE environment_id = %s
+                SELECT er.*,
+                       v.status AS variant_status, v.optimized_url, v.preview_url,
+                       v.original_size, v.optimized_size, v.preview_size, v.stats AS variant_stats,
+                       v.error AS variant_error
+                FROM environment_resources er
+                LEFT JOIN environment_asset_variants v ON v.resource_id = er.id
+                WHERE er.environment_id = %s
             """
             params = [environment_id]
             
             if resource_type:
-                query += " AND resource_type = %s"
+                query += " AND er.resource_type = %s"
                 params.append(resource_type)
             
-            query += " ORDER BY display_order, created_at DESC"
+            query += " ORDER BY er.display_order, er.created_at DESC"
             
             cursor.execute(query, params)
             resources = cursor.fetchall()
@@ -3046,54 +3362,44 @@ def get_supabase_config():
     return url, key
 
 
-def upload_to_supabase(file_obj, filename, content_type, folder="environments"):
-    """Realiza upload de arquivo para o Supabase Storage"""
+# Limite dos uploads de ambiente (modelos 3D, fotos, plantas)
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_MB", "250")) * 1024 * 1024
+# STORAGE_BACKEND=local grava em disco (desenvolvimento e testes, sem Supabase)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase").lower()
+LOCAL_STORAGE_DIR = os.getenv("LOCAL_STORAGE_DIR", str(Path(__file__).resolve().parent / "local_storage"))
+_storage_client: SupabaseStorage | LocalStorage | None = None
+
+
+def get_storage() -> SupabaseStorage | LocalStorage:
+    """Cliente do storage (uma sessão com pool por processo)."""
+    global _storage_client
+    if STORAGE_BACKEND == "local":
+        if _storage_client is None:
+            _storage_client = LocalStorage(LOCAL_STORAGE_DIR, app.config["SECRET_KEY"])
+        return _storage_client
     url, key = get_supabase_config()
-    
     if not url or not key:
-        # Fallback para desenvolvimento local ou erro
         app.logger.error("Supabase credentials not found")
-        raise Exception("Serviço de armazenamento não configurado")
-    
-    # Limpar URL base
-    url = url.rstrip('/')
-    bucket = "environment-assets"
-    
+        raise StorageUploadError("Serviço de armazenamento não configurado")
+    if _storage_client is None:
+        _storage_client = SupabaseStorage(url, key, bucket="environment-assets")
+    return _storage_client
+
+
+def upload_to_supabase(file_obj, filename, content_type, folder="environments", max_bytes=UPLOAD_MAX_BYTES) -> UploadResult:
+    """
+    Envia o arquivo ao Supabase Storage em streaming (TUS acima de 6 MB).
+
+    ``file_obj`` é lido em partes direto do stream do werkzeug; o tamanho e o
+    SHA-256 vêm no resultado.
+    """
     folder = folder.strip("/") if folder else "environments"
     storage_path = f"{folder}/{filename}"
+    stream = getattr(file_obj, "stream", file_obj)
     
-    # Endpoint da API de Storage
-    # POST /storage/v1/object/{bucket}/{path}
-    api_url = f"{url}/storage/v1/object/{bucket}/{storage_path}"
-    
-    headers = {
-        "Authorization": f"Bearer {key}",
-        "Content-Type": content_type,
-        "x-upsert": "true"
-    }
-    
-    # Ler conteúdo do arquivo
-    file_content = file_obj.read()
-    
-    try:
-        response = requests.post(api_url, data=file_content, headers=headers)
-        
-        if response.status_code not in [200, 201]:
-            # Se falhar, tentar criar o bucket e tentar novamente?
-            # Por simplicidade, assumimos que o bucket existe.
-            # Se o erro for 404 (bucket not found), logar erro específico.
-            error_msg = f"Supabase Upload Failed ({response.status_code}): {response.text}"
-            app.logger.error(error_msg)
-            raise Exception("Falha no upload para o storage remoto")
-            
-        # Retornar URL pública
-        # {supabase_url}/storage/v1/object/public/{bucket}/{path}
-        public_url = f"{url}/storage/v1/object/public/{bucket}/{storage_path}"
-        return public_url, len(file_content)
-        
-    except requests.exceptions.RequestException as e:
-        app.logger.error(f"Erro de conexão com Supabase: {e}")
-        raise Exception("Erro de conexão com serviço de storage")
+    result = get_storage().upload(stream, storage_path, content_type, max_bytes=max_bytes)
+    app.logger.info(f"[STORAGE] {storage_path}: {result.size} bytes, sha256 {result.sha256}")
+    return result
 
 
 @app.route("/api/environments/<int:environment_id>/upload", methods=["POST"])
@@ -3104,6 +3410,10 @@ def environment_upload_api(environment_id):
     if session.get("role") not in ["admin", "manager"]:
         return jsonify({"error": "Permissão negada"}), 403
 
+    # Recusar antes de o werkzeug ler o corpo da requisição
+    if request.content_length and request.content_length > UPLOAD_MAX_BYTES:
+        return jsonify({"error": f"Arquivo acima do limite de {UPLOAD_MAX_BYTES // (1024 * 1024)} MB"}), 413
+
     if "file" not in request.files:
         return jsonify({"error": "Nenhum arquivo enviado"}), 400
         
@@ -3120,21 +3430,13 @@ def environment_upload_api(environment_id):
             timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
             unique_filename = f"{environment_id}_{timestamp}_{filename}"
             
-            # Detectar tipo de recurso baseado na extensão
-            ext = os.path.splitext(filename)[1].lower()
+            # Detectar tipo de recurso baseado na extensão (PDF é tratado como planta)
             mime_type = file.mimetype or mimetypes.guess_type(filename)[0]
-            
-            resource_type = "document"
-            if ext in ['.jpg', '.jpeg', '.png', '.webp']:
-                resource_type = "photo"
-            elif ext in ['.glb', '.gltf', '.fbx', '.obj']:
-                resource_type = "model_3d"
-            elif ext in ['.pdf']:
-                # PDFs podem ser plantas ou docs
-                resource_type = "plant_2d" # Assumindo planta por padrão para PDF neste contexto
+            resource_type = resource_type_for(filename)
             
             # Realizar upload
-            public_url, file_size = upload_to_supabase(file, unique_filename, mime_type)
+            upload = upload_to_supabase(file, unique_filename, mime_type)
+            public_url, file_size = upload.public_url, upload.size
             
             # Salvar no banco
             conn = get_db()
@@ -3166,16 +3468,24 @@ def environment_upload_api(environment_id):
             ))
             
             resource_id = cursor.fetchone()['id']
+            queued = enqueue_glb(cursor, resource_id, f"environments/{unique_filename}")
             conn.commit()
             conn.close()
+            if queued:
+                asset_pipeline.wake()
+            if resource_type == "photo":
+                get_image_variants().warm(public_url, "photo")
             
             return jsonify({
                 "success": True, 
                 "id": resource_id, 
                 "url": public_url,
-                "type": resource_type
+                "type": resource_type,
+                "sha256": upload.sha256
             }), 201
             
+        except UploadTooLarge as e:
+            return jsonify({"error": str(e)}), 413
         except Exception as e:
             app.logger.error(f"Erro no upload: {e}")
             return jsonify({"error": str(e)}), 500
@@ -3183,39 +3493,274 @@ def environment_upload_api(environment_id):
     return jsonify({"error": "Erro desconhecido"}), 500
 
 
-@app.route("/api/resources/<int:resource_id>", methods=["DELETE"])
+# Prazo para o navegador enviar o arquivo e confirmar (a URL do Supabase vale 2 horas)
+UPLOAD_COMPLETE_WINDOW = timedelta(hours=2)
+
+
+def expire_pending_uploads(cursor, limit: int = 20) -> None:
+    """Marca uploads abandonados como expirados e remove o objeto do storage."""
+    cursor.execute(
+        """
+        UPDATE environment_uploads SET status = 'expired', completed_at = NOW()
+        WHERE id IN (
+            SELECT id FROM environment_uploads
+            WHERE status = 'pending' AND expires_at < NOW()
+            ORDER BY expires_at
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING storage_path
+        """,
+        (limit,),
+    )
+    for row in cursor.fetchall():
+        try:
+            get_storage().delete(row["storage_path"])
+        except (StorageUploadError, UploadRejected) as e:
+            app.logger.warning(f"[STORAGE] Falha ao remover upload expirado {row['storage_path']}: {e}")
+
+
+@app.route("/api/environments/<int:environment_id>/uploads", methods=["POST"])
 @login_required
-def delete_resource_api(resource_id):
-    """API para excluir um recurso"""
+def environment_upload_init_api(environment_id):
+    """
+    Inicia um upload direto ao storage: valida o arquivo declarado, registra
+    o upload pendente e devolve a URL assinada para o navegador enviar com PUT.
+    """
     if session.get("role") not in ["admin", "manager"]:
         return jsonify({"error": "Permissão negada"}), 403
-        
+
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(data.get("file_name") or "")
+    if not filename:
+        return jsonify({"error": "Nome de arquivo inválido"}), 400
+    sha256 = (data.get("sha256") or "").lower() or None
+    if sha256 and not re.fullmatch(r"[0-9a-f]{64}", sha256):
+        return jsonify({"error": "Checksum inválido"}), 400
+    try:
+        check_new_upload(filename, data.get("file_size"), UPLOAD_MAX_BYTES)
+    except UploadTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+    except UploadRejected as e:
+        return jsonify({"error": str(e)}), 400
+
+    upload_id = secrets.token_hex(16)
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    storage_path = f"environments/{environment_id}_{timestamp}_{upload_id[:8]}_{filename}"
+    mime_type = data.get("mime_type") or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
     conn = get_db()
     cursor = conn.cursor()
-    
     try:
-        # Verificar se existe
-        cursor.execute("SELECT id FROM environment_resources WHERE id = %s", (resource_id,))
+        cursor.execute("SELECT id FROM environments WHERE id = %s", (environment_id,))
         if not cursor.fetchone():
-            return jsonify({"error": "Recurso não encontrado"}), 404
-            
-        # Deletar do banco
-        cursor.execute("DELETE FROM environment_resources WHERE id = %s", (resource_id,))
+            return jsonify({"error": "Ambiente não encontrado"}), 404
+
+        expire_pending_uploads(cursor)
+        upload_url = get_storage().create_signed_upload(storage_path)
+        cursor.execute(
+            """
+            INSERT INTO environment_uploads
+            (id, environment_id, storage_path, file_name, mime_type, resource_type,
+             expected_size, sha256, created_by, expires_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, NOW() + %s)
+            """,
+            (
+                upload_id, environment_id, storage_path, filename, mime_type,
+                resource_type_for(filename), int(data["file_size"]), sha256,
+                session.get("user_id"), UPLOAD_COMPLETE_WINDOW,
+            ),
+        )
         conn.commit()
-        
-        return jsonify({"success": True}), 200
-        
+
+        return jsonify({
+            "upload_id": upload_id,
+            "upload_url": upload_url,
+            "method": "PUT",
+            "headers": {"Content-Type": mime_type, "x-upsert": "true"},
+            "complete_url": url_for("environment_upload_complete_api", environment_id=environment_id, upload_id=upload_id),
+        }), 201
+
+    except StorageUploadError as e:
+        conn.rollback()
+        app.logger.error(f"[STORAGE] Erro ao assinar upload do ambiente {environment_id}: {e}")
+        return jsonify({"error": str(e)}), 502
     except Exception as e:
         conn.rollback()
+        app.logger.error(f"Erro ao iniciar upload do ambiente {environment_id}: {e}")
         return jsonify({"error": str(e)}), 500
     finally:
         conn.close()
 
 
-# --------------------------------------------------------------------------- #
-# Rotas do Agente IA
-# --------------------------------------------------------------------------- #
-@app.route("/agent")
+@app.route("/api/environments/<int:environment_id>/uploads/<upload_id>/complete", methods=["POST"])
+@login_required
+def environment_upload_complete_api(environment_id, upload_id):
+    """
+    Confirma um upload direto: confere tamanho, formato e checksum do objeto
+    no storage e ativa o recurso do ambiente. Arquivos recusados são removidos.
+    """
+    if session.get("role") not in ["admin", "manager"]:
+        return jsonify({"error": "Permissão negada"}), 403
+
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            SELECT *, expires_at < NOW() AS expired FROM environment_uploads
+            WHERE id = %s AND environment_id = %s
+            FOR UPDATE
+            """,
+            (upload_id, environment_id),
+        )
+        pending = cursor.fetchone()
+        if not pending:
+            return jsonify({"error": "Upload não encontrado"}), 404
+        if pending["status"] == "active":
+            # Confirmação repetida (retry do navegador): mesma resposta
+            return jsonify({"success": True, "id": pending["resource_id"], "type": pending["resource_type"],
+                            "url": get_storage().public_url(pending["storage_path"])}), 200
+        if pending["status"] != "pending" or pending["expired"]:
+            return jsonify({"error": "Upload expirado ou já recusado"}), 410
+
+        storage = get_storage()
+        try:
+            info = storage.stat(pending["storage_path"])
+            head = storage.read_head(pending["storage_path"]) if info else b""
+            check_completed_upload(pending, info, head)
+        except UploadRejected as e:
+            cursor.execute(
+                """
+                UPDATE environment_uploads SET status = 'rejected', error = %s, completed_at = NOW()
+                WHERE id = %s
+                """,
+                (str(e), upload_id),
+            )
+            conn.commit()
+            storage.delete(pending["storage_path"])
+            app.logger.warning(f"[STORAGE] Upload {upload_id} recusado: {e}")
+            return jsonify({"error": str(e)}), 422
+
+        public_url = storage.public_url(pending["storage_path"])
+        cursor.execute("""
+            SELECT id FROM environment_resources
+            WHERE environment_id = %s AND resource_type = %s AND is_primary = true
+        """, (environment_id, pending["resource_type"]))
+        has_primary = cursor.fetchone() is not None
+
+        cursor.execute("""
+            INSERT INTO environment_resources
+            (environment_id, resource_type, file_name, file_url, file_size,
+             mime_type, is_primary, uploaded_by)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            RETURNING id
+        """, (
+            environment_id,
+            pending["resource_type"],
+            pending["file_name"],
+            public_url,
+            info.size,
+            pending["mime_type"],
+            not has_primary,
+            session.get("user_id"),
+        ))
+        resource_id = cursor.fetchone()["id"]
+
+        cursor.execute(
+            """
+            UPDATE environment_uploads SET status = 'active', resource_id = %s, completed_at = NOW()
+            WHERE id = %s
+            """,
+            (resource_id, upload_id),
+        )
+        queued = enqueue_glb(cursor, resource_id, pending["storage_path"])
+        conn.commit()
+        if queued:
+            asset_pipeline.wake()
+        if pending["resource_type"] == "photo":
+            get_image_variants().warm(public_url, "photo")
+        app.logger.info(f"[STORAGE] {pending['storage_path']}: {info.size} bytes ativados (upload direto)")
+
+        return jsonify({
+            "success": True,
+            "id": resource_id,
+            "url": public_url,
+            "type": pending["resource_type"],
+            "sha256": info.sha256 or pending["sha256"],
+        }), 201
+
+    except StorageUploadError as e:
+        conn.rollback()
+        app.logger.error(f"[STORAGE] Erro ao confirmar upload {upload_id}: {e}")
+        return jsonify({"error": str(e)}), 502
+    except Exception as e:
+        conn.rollback()
+        app.logger.error(f"Erro ao confirmar upload {upload_id}: {e}")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+
+@app.route("/api/storage/local/<path:path>", methods=["PUT"])
+def local_storage_put(path):
+    """Destino das URLs assinadas do storage local (STORAGE_BACKEND=local)."""
+    if STORAGE_BACKEND != "local":
+        return jsonify({"error": "Not found"}), 404
+    storage = get_storage()
+    if not storage.verify(path, request.args.get("expires"), request.args.get("signature")):
+        return jsonify({"error": "Assinatura inválida ou expirada"}), 403
+    try:
+        info = storage.write(path, request.stream, UPLOAD_MAX_BYTES)
+    except UploadTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+    except UploadRejected as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"Key": path, "size": info.size}), 200
+
+
+@app.route("/api/storage/local/<path:path>", methods=["GET"])
+def local_storage_get(path):
+    """Leitura pública dos objetos do storage local."""
+    if STORAGE_BACKEND != "local":
+        return jsonify({"error": "Not found"}), 404
+    return send_from_directory(LOCAL_STORAGE_DIR, path, conditional=True)
+
+
+@app.route("/api/resources/<int:resource_id>", methods=["DELETE"])
+@login_required
+def delete_resource_api(resource_id):
+    """API para excluir um recurso"""
+    if session.get("role") not in ["admin", "manager"]:
+        return jsonify({"error": "Permissão negada"}), 403
+        
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    try:
+        # Verificar se existe
+        cursor.execute("SELECT id FROM environment_resources WHERE id = %s", (resource_id,))
+        if not cursor.fetchone():
+            return jsonify({"error": "Recurso não encontrado"}), 404
+            
+        # Deletar do banco
+        cursor.execute("DELETE FROM environment_asset_variants WHERE resource_id = %s", (resource_id,))
+        cursor.execute("DELETE FROM environment_resources WHERE id = %s", (resource_id,))
+        conn.commit()
+        
+        return jsonify({"success": True}), 200
+        
+    except Exception as e:
+        conn.rollback()
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+
+# --------------------------------------------------------------------------- #
+# Rotas do Agente IA
+# --------------------------------------------------------------------------- #
+@app.route("/agent")
 @login_required
 @admin_required
 def agent_page():
@@ -3341,6 +3886,11 @@ def create_rpa():
     if not data.get('name') or not data.get('description'):
         return jsonify({"error": "Nome e descrição são obrigatórios"}), 400
     
+    try:
+        parse_schedule(data.get('frequency'), SCHEDULER_TIMEZONE)
+    except ScheduleError as e:
+        return jsonify({"error": str(e)}), 400
+    
     conn = get_db()
     cursor = conn.cursor()
     
@@ -3369,16 +3919,21 @@ def create_rpa():
         ))
         
         rpa_id = cursor.fetchone()['id']
+        # Recorrente: a primeira execução é agora; as próximas ficam com o agendador
+        cursor.execute(
+            "UPDATE agent_rpas SET next_run_at = %s WHERE id = %s",
+            (rpa_scheduler.first_run(rpa_id, data.get('frequency')), rpa_id),
+        )
+        # Query idêntica já em andamento ou recém-concluída: não vai ao ERP de novo
+        coalesced = coalesce_job(cursor, "rpa", rpa_id, parameters, AGENT_COALESCE_FRESHNESS)
         conn.commit()
+        if coalesced is None:
+            notify_agent_jobs(conn, "rpa")
         
         # Log da ação
-        cursor.execute("""
-            INSERT INTO agent_logs (action_type, entity_type, entity_id, user_id, details)
-            VALUES ('create', 'rpa', %s, %s, %s)
-        """, (rpa_id, session['user_id'], psycopg2.extras.Json({'name': data['name']})))
-        conn.commit()
+        agent_log_store.write('create', 'rpa', rpa_id, session['user_id'], {'name': data['name']})
         
-        return jsonify({"success": True, "id": rpa_id}), 201
+        return jsonify({"success": True, "id": rpa_id, **coalesced_fields(coalesced)}), 201
         
     except Exception as e:
         conn.rollback()
@@ -3500,6 +4055,10 @@ def create_dashboard_gen():
                 filters = json.loads(data['filters']) if isinstance(data['filters'], str) else data['filters']
             except:
                 return jsonify({"error": "Filtros JSON inválidos"}), 400
+            try:
+                parse_incremental(filters)
+            except IncrementalError as e:
+                return jsonify({"error": str(e)}), 400
         
         chart_types = data.get('chart_types', [])
         
@@ -3519,16 +4078,15 @@ def create_dashboard_gen():
         ))
         
         request_id = cursor.fetchone()['id']
+        coalesced = coalesce_job(cursor, "dashboard", request_id, filters, AGENT_COALESCE_FRESHNESS)
         conn.commit()
+        if coalesced is None:
+            notify_agent_jobs(conn, "dashboard")
         
         # Log da ação
-        cursor.execute("""
-            INSERT INTO agent_logs (action_type, entity_type, entity_id, user_id, details)
-            VALUES ('create', 'dashboard_request', %s, %s, %s)
-        """, (request_id, session['user_id'], psycopg2.extras.Json({'title': data['title']})))
-        conn.commit()
+        agent_log_store.write('create', 'dashboard_request', request_id, session['user_id'], {'title': data['title']})
         
-        return jsonify({"success": True, "id": request_id}), 201
+        return jsonify({"success": True, "id": request_id, **coalesced_fields(coalesced)}), 201
         
     except Exception as e:
         conn.rollback()
@@ -3880,12 +4438,19 @@ def refresh_dashboard(dash_id):
             SET status = 'pending', 
                 result_data = NULL,
                 error_message = NULL,
+                queued_at = NOW(),
                 updated_at = NOW()
             WHERE id = %s
+            RETURNING filters
         """, (dash_id,))
+        filters = cursor.fetchone()['filters']
+        coalesced = coalesce_job(cursor, "dashboard", dash_id, filters, AGENT_COALESCE_FRESHNESS)
         conn.commit()
+        if coalesced is None:
+            notify_agent_jobs(conn, "dashboard")
         
-        return jsonify({"success": True, "message": "Dashboard recolocado na fila"}), 200
+        return jsonify({"success": True, "message": "Dashboard recolocado na fila",
+                        **coalesced_fields(coalesced)}), 200
         
     except Exception as e:
         conn.rollback()
@@ -4082,71 +4647,299 @@ def delete_dashboard_template(template_id):
         conn.close()
 
 
+DASHBOARD_CACHE_TTL = int(os.getenv("DASHBOARD_CACHE_TTL", "300"))  # segundos
+DASHBOARD_CACHE_MAX_TTL = int(os.getenv("DASHBOARD_CACHE_MAX_TTL", "86400"))
+dashboard_query_cache = QueryResultCache(
+    max_entries=int(os.getenv("DASHBOARD_CACHE_MAX_ENTRIES", "256"))
+)
+
+
+def dashboard_cache_ttl(query_config: dict) -> int:
+    """
+    TTL do cache de um dashboard (``query_config.cache_ttl``, em segundos),
+    entre 0 (sem cache) e ``DASHBOARD_CACHE_MAX_TTL``. O valor vem do JSON do
+    template: ausente ou inválido (texto, lista) usa ``DASHBOARD_CACHE_TTL``.
+    """
+    value = query_config.get('cache_ttl')
+    if value is None or value == '':
+        return DASHBOARD_CACHE_TTL
+    try:
+        ttl = int(value)
+    except (TypeError, ValueError):
+        app.logger.warning(f"[DASHBOARD-EDITOR] cache_ttl inválido ({value!r}); usando {DASHBOARD_CACHE_TTL}s")
+        return DASHBOARD_CACHE_TTL
+    return max(0, min(ttl, DASHBOARD_CACHE_MAX_TTL))
+
+
+def _json_safe_value(v):
+    """Converte tipos retornados pelo pymysql em valores serializáveis."""
+    from decimal import Decimal
+
+    if isinstance(v, Decimal):
+        return float(v)
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    if isinstance(v, bytes):
+        return v.decode('utf-8', errors='ignore')
+    return v
+
+
+query_governor = QueryGovernor(
+    max_rows=int(os.getenv("BRUDAM_MAX_ROWS", "5000")),
+    default_limit=500,
+    max_execution_ms=int(os.getenv("BRUDAM_MAX_EXECUTION_MS", "60000")),
+    max_rows_examined=int(os.getenv("BRUDAM_MAX_ROWS_EXAMINED", "5000000")),
+)
+
+
+# Extrações (RPAs) são lidas em streaming, então toleram bem mais linhas e tempo
+extraction_governor = QueryGovernor(
+    max_rows=int(os.getenv("BRUDAM_MAX_EXTRACT_ROWS", "2000000")),
+    default_limit=500,
+    max_execution_ms=int(os.getenv("BRUDAM_EXTRACT_MAX_EXECUTION_MS", "600000")),
+    max_rows_examined=query_governor.max_rows_examined,
+)
+
+RESULT_BATCH_SIZE = int(os.getenv("RESULT_BATCH_SIZE", "2000"))
+RESULT_PREVIEW_ROWS = 1000  # registros guardados inline em result/result_data
+RESULT_TABLES = {
+    "rpa": ("agent_rpas", "result"),
+    "dashboard": ("agent_dashboard_requests", "result_data"),
+}
+
+
+def save_result_chunk(cursor, entity_type: str, entity_id: int, seq: int, rows: list) -> None:
+    """Grava uma parte do resultado; a parte 0 descarta as de execuções anteriores."""
+    if seq == 0:
+        clear_result_chunks(cursor, entity_type, entity_id)
+    cursor.execute("""
+        INSERT INTO agent_result_chunks (entity_type, entity_id, seq, rows, row_count)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (entity_type, entity_id, seq) DO UPDATE SET
+            rows = EXCLUDED.rows, row_count = EXCLUDED.row_count, created_at = NOW()
+    """, (entity_type, entity_id, seq, psycopg2.extras.Json(rows), len(rows)))
+
+
+def clear_result_chunks(cursor, entity_type: str, entity_id: int) -> None:
+    cursor.execute(
+        "DELETE FROM agent_result_chunks WHERE entity_type = %s AND entity_id = %s",
+        (entity_type, entity_id),
+    )
+
+
+def run_brudam_select(query: str, params=None, max_rows: int | None = None) -> dict:
+    """
+    Executa um SELECT no Brudam usando o pool e devolve dados serializáveis.
+
+    A query passa pelo governador (somente leitura, LIMIT, tempo máximo e
+    orçamento de linhas via EXPLAIN); levanta QueryRejected se for recusada.
+    """
+    query = query_governor.prepare(query, max_rows)
+    with brudam_connection() as mysql_conn:
+        with mysql_conn.cursor() as cursor:
+            query_governor.check_cost(cursor, query, params)
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+
+    return {
+        "data": [{k: _json_safe_value(v) for k, v in row.items()} for row in rows],
+        "fields": list(rows[0].keys()) if rows else [],
+    }
+
+
+@contextmanager
+def background_db():
+    """Conexão do pool para código que pode rodar fora de uma requisição."""
+    if has_app_context():
+        yield get_db()
+        return
+    with app.app_context():
+        yield get_db()
+
+
+# Logs do agente: escrita em lote por processo e partições mensais com retenção
+agent_log_store = AgentLogStore(
+    background_db,
+    retention_months=int(os.getenv("AGENT_LOGS_RETENTION_MONTHS", "6")),
+    flush_seconds=float(os.getenv("AGENT_LOGS_FLUSH_SECONDS", "2")),
+    batch_size=int(os.getenv("AGENT_LOGS_BATCH_SIZE", "500")),
+)
+
+snapshot_store = DashboardSnapshotStore(
+    background_db,
+    run_brudam_select,
+    default_interval=int(os.getenv("DASHBOARD_SNAPSHOT_INTERVAL", "0")),
+    max_rows=int(os.getenv("DASHBOARD_SNAPSHOT_MAX_ROWS", "5000")),
+    max_pages=int(os.getenv("DASHBOARD_SNAPSHOT_MAX_PAGES", "10")),
+)
+# Primeira carga com outro worker gerando o snapshot: espera por ele, sem ir ao ERP
+DASHBOARD_SNAPSHOT_FIRST_LOAD_WAIT = float(os.getenv("DASHBOARD_SNAPSHOT_FIRST_LOAD_WAIT", "30"))
+snapshot_scheduler = SnapshotScheduler(
+    snapshot_store, tick_seconds=float(os.getenv("DASHBOARD_SNAPSHOT_TICK", "30"))
+)
+
+# Otimização dos modelos 3D enviados (variante otimizada + prévia low-poly)
+asset_pipeline = AssetPipeline(
+    background_db,
+    get_storage,
+    max_texture_size=int(os.getenv("ASSET_MAX_TEXTURE_SIZE", "2048")),
+    preview_grid=int(os.getenv("ASSET_PREVIEW_GRID", "64")),
+)
+
+# Correção periódica dos contadores de recursos dos ambientes
+environment_counters = EnvironmentCounters(
+    background_db, interval_seconds=float(os.getenv("ENVIRONMENT_COUNTERS_RECONCILE_SECONDS", "3600"))
+)
+
+
+def max_concurrent_rpas(cursor) -> int:
+    """Limite de RPAs pendentes/em execução (agent_settings.max_concurrent_rpas)."""
+    cursor.execute("SELECT setting_value FROM agent_settings WHERE setting_key = 'max_concurrent_rpas'")
+    row = cursor.fetchone()
+    try:
+        return int(((row or {}).get('setting_value') or {}).get('value', 5))
+    except (TypeError, ValueError, AttributeError):
+        return 5
+
+
+# RPAs recorrentes (coluna frequency). Roda em todos os workers: a reserva com
+# SKIP LOCKED garante um único disparo por horário.
+SCHEDULER_TIMEZONE = os.getenv("SCHEDULER_TIMEZONE", "America/Sao_Paulo")
+rpa_scheduler = RpaScheduler(
+    background_db,
+    max_concurrent_rpas,
+    on_fired=lambda conn: notify_agent_jobs(conn, "rpa"),
+    tick_seconds=float(os.getenv("RPA_SCHEDULER_TICK", "30")),
+    max_jitter=float(os.getenv("RPA_SCHEDULER_MAX_JITTER", "300")),
+    catch_up=os.getenv("RPA_SCHEDULER_CATCH_UP", "once"),
+    grace_seconds=float(os.getenv("RPA_SCHEDULER_GRACE", "300")),
+    tz_name=SCHEDULER_TIMEZONE,
+)
+
+
+def serve_dashboard_snapshot(template_id: int, query_config: dict, force_refresh: bool = False):
+    """
+    Responde com o snapshot materializado do dashboard (stale-while-revalidate).
+
+    Snapshot vencido ou ``force_refresh`` apenas agendam a atualização em
+    segundo plano; o visitante recebe imediatamente a versão armazenada. Sem
+    snapshot e com a primeira carga demorando mais que
+    DASHBOARD_SNAPSHOT_FIRST_LOAD_WAIT, responde 503 com ``Retry-After``.
+    """
+    query = query_config.get('query') or ''
+    interval = snapshot_store.interval_for(query_config)
+    snapshot = snapshot_store.get(template_id, query)
+
+    if snapshot is None:
+        # Primeira carga: uma única execução, compartilhada entre visitantes
+        # simultâneos; nos outros workers espera o snapshot de quem a executa
+        cache_key = dashboard_query_cache.make_key(f"snapshot:{template_id}", query)
+        result, _, _ = dashboard_query_cache.get_or_compute(
+            cache_key, 0,
+            lambda: snapshot_store.load(template_id, query_config, DASHBOARD_SNAPSHOT_FIRST_LOAD_WAIT),
+        )
+        if result is None:
+            response = jsonify({
+                "error": "Dashboard sendo atualizado, tente novamente em instantes",
+                "refreshing": True,
+            })
+            response.headers["Retry-After"] = "5"
+            return response, 503
+        data, fields, age, refreshing = result["data"], result["fields"], 0.0, False
+    else:
+        data, fields, age = snapshot["data"] or [], snapshot["fields"] or [], snapshot["age_seconds"]
+        refreshing = force_refresh or age > interval
+        if refreshing:
+            snapshot_scheduler.revalidate(template_id, query_config)
+
+    return jsonify({
+        "success": True,
+        "data": data,
+        "fields": fields,
+        "row_count": len(data),
+        "source": "snapshot",
+        "cached": snapshot is not None,
+        "cache_age": round(age, 1),
+        "cache_ttl": interval,
+        "refreshing": refreshing,
+    }), 200
+
+
 @app.route("/api/agent/dashboard-editor/execute-query", methods=["POST"])
 @login_required
 def execute_dashboard_query():
-    """Executar query SQL para preview no editor de dashboard."""
-    data = request.get_json()
-    query = data.get('query', '').strip()
-    
+    """
+    Executar query SQL para preview no editor ou visualização de dashboard.
+
+    Quando ``template_id`` é enviado, a query salva no template é usada e o
+    resultado fica em cache pelo TTL do dashboard (``query_config.cache_ttl``).
+    """
+    data = request.get_json() or {}
+    query = (data.get('query') or '').strip()
+    params = data.get('params')
+    template_id = data.get('template_id')
+
+    scope = "preview"
+    ttl = 0
+    snapshot_mode = False
+    if template_id:
+        conn = get_db()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id, created_by, is_public, query_config FROM agent_dashboard_templates WHERE id = %s",
+            (template_id,),
+        )
+        template = cursor.fetchone()
+        conn.close()
+
+        if not template:
+            return jsonify({"error": "Dashboard não encontrado"}), 404
+        if not template['is_public'] and template['created_by'] != session['user_id'] and session.get('role') != 'admin':
+            return jsonify({"error": "Permissão negada"}), 403
+
+        query_config = template['query_config'] or {}
+        query = (query_config.get('query') or query).strip()
+        scope = f"template:{template['id']}"
+        ttl = dashboard_cache_ttl(query_config)
+
+        snapshot_mode = bool(query_config.get('query')) and snapshot_store.interval_for(query_config) > 0
+
     if not query:
         return jsonify({"error": "Query não fornecida"}), 400
     
-    # Validar query (apenas SELECT)
-    if not query.upper().startswith('SELECT'):
-        return jsonify({"error": "Apenas queries SELECT são permitidas"}), 400
-    
-    # Limitar resultados
-    if 'LIMIT' not in query.upper():
-        query = query.rstrip(';') + ' LIMIT 500'
-    
     try:
-        import pymysql
-        
-        host = os.getenv("MYSQL_AZ_HOST", "")
-        port = int(os.getenv("MYSQL_AZ_PORT", "3307"))
-        user = os.getenv("MYSQL_AZ_USER", "")
-        password = os.getenv("MYSQL_AZ_PASSWORD", "")
-        database = os.getenv("MYSQL_AZ_DB", "")
-        
-        if not all([host, user, password, database]):
-            return jsonify({"error": "Credenciais MySQL não configuradas"}), 500
+        if snapshot_mode:
+            return serve_dashboard_snapshot(
+                template['id'], query_config, force_refresh=bool(data.get('refresh'))
+            )
         
-        mysql_conn = pymysql.connect(
-            host=host, port=port, user=user, password=password, database=database,
-            charset='utf8mb4', cursorclass=pymysql.cursors.DictCursor,
-            connect_timeout=30, read_timeout=60
+        cache_key = dashboard_query_cache.make_key(scope, query, params)
+        result, cache_age, cached = dashboard_query_cache.get_or_compute(
+            cache_key, ttl, lambda: run_brudam_select(query, params)
         )
         
-        with mysql_conn.cursor() as cursor:
-            cursor.execute(query)
-            rows = cursor.fetchall()
-            
-            # Converter tipos não serializáveis
-            from decimal import Decimal
-            from datetime import datetime, date
-            
-            def convert_value(v):
-                if isinstance(v, Decimal):
-                    return float(v)
-                if isinstance(v, (datetime, date)):
-                    return v.isoformat()
-                if isinstance(v, bytes):
-                    return v.decode('utf-8', errors='ignore')
-                return v
-            
-            data = [{k: convert_value(v) for k, v in row.items()} for row in rows]
-            fields = list(rows[0].keys()) if rows else []
-        
-        mysql_conn.close()
-        
         return jsonify({
             "success": True,
-            "data": data,
-            "fields": fields,
-            "row_count": len(data)
+            "data": result["data"],
+            "fields": result["fields"],
+            "row_count": len(result["data"]),
+            "cached": cached,
+            "cache_age": round(cache_age, 1),
+            "cache_ttl": ttl,
         }), 200
         
+    except QueryRejected as e:
+        return jsonify({"error": str(e)}), 400
+    except MySQLPoolTimeout as e:
+        app.logger.warning(f"[DASHBOARD-EDITOR] {e}")
+        return jsonify({"error": "Banco Brudam ocupado, tente novamente em instantes"}), 503
+    except BrokerUnavailable as e:
+        app.logger.warning(f"[DASHBOARD-EDITOR] {e}")
+        return jsonify({"error": str(e)}), 503
+    except psycopg2.Error as e:
+        get_db().rollback()
+        app.logger.error(f"[SNAPSHOT] Snapshot indisponível: {e}")
+        return jsonify({"error": "Snapshot do dashboard indisponível, tente novamente em instantes"}), 503
     except Exception as e:
         app.logger.error(f"[DASHBOARD-EDITOR] Erro ao executar query: {e}")
         return jsonify({"error": str(e)}), 500
@@ -4155,12 +4948,15 @@ def execute_dashboard_query():
 # --------------------------------------------------------------------------- #
 # Executor de RPAs - Conexão MySQL Brudam
 # --------------------------------------------------------------------------- #
-def get_brudam_db():
-    """Conecta ao banco MySQL Brudam (azportoex). Credenciais via .env"""
-    import pymysql
-    
+BRUDAM_FALLBACK_DNS = "portoex.db.brudam.com.br"
+BRUDAM_FALLBACK_IP = "10.147.17.88"
+BRUDAM_POOL_SIZE = int(os.getenv("BRUDAM_POOL_SIZE", "5"))
+
+
+def _brudam_settings() -> dict:
+    """Lê host, porta e credenciais do MySQL Brudam a partir do .env."""
     # Host atualizado conforme Workbench
-    host = os.getenv("MYSQL_AZ_HOST", "portoex.db.brudam.com.br")
+    host = os.getenv("MYSQL_AZ_HOST", BRUDAM_FALLBACK_DNS)
     
     # Tenta pegar porta do env, se falhar usa 3306 como padrão
     env_port = os.getenv("MYSQL_AZ_PORT", "3306")
@@ -4182,56 +4978,104 @@ def get_brudam_db():
         
     if not all([host, user, password, database]):
         raise ValueError("Credenciais MySQL Brudam não configuradas no .env")
-    
-    # Função auxiliar para tentar conexão
-    def try_connect(target_host, target_port):
-        return pymysql.connect(
-            host=target_host,
-            port=target_port,
-            user=user,
-            password=password,
-            database=database,
-            charset='utf8mb4',
-            cursorclass=pymysql.cursors.DictCursor,
-            connect_timeout=10,
-            read_timeout=60
-        )
 
-    # Lógica de tentativa:
-    # 1. Tenta host/porta configurados
-    # 2. Se falhar e for IP, tenta o DNS
-    # 3. Se falhar e for DNS, tenta o IP antigo (fallback)
-    
-    try:
-        app.logger.info(f"[MYSQL] Tentando conexão em {host}:{port}...")
-        return try_connect(host, port)
-    except pymysql.err.OperationalError as e:
-        app.logger.warning(f"[MYSQL] Falha na conexão principal: {e}")
-        
-        # Se falhou e estamos usando o DNS, tenta o IP antigo como fallback
-        if "portoex.db.brudam.com.br" in host:
-            fallback_ip = "10.147.17.88"
-            app.logger.info(f"[MYSQL] Tentando fallback para IP {fallback_ip}...")
-            try:
-                return try_connect(fallback_ip, port)
-            except Exception:
-                pass # Ignora erro do fallback para lançar o original
-        
-        # Se falhou e estamos usando IP, tenta o DNS
-        elif "10." in host:
-            fallback_host = "portoex.db.brudam.com.br"
-            app.logger.info(f"[MYSQL] Tentando fallback para DNS {fallback_host}...")
-            try:
-                return try_connect(fallback_host, port)
-            except Exception:
-                pass
-                
-        raise e
+    return {"host": host, "port": port, "user": user, "password": password, "database": database}
+
+
+def _brudam_candidate_hosts(host: str) -> list[str]:
+    """
+    Hosts que disputam a conexão: o configurado, a rota alternativa
+    (DNS <-> IP antigo) e os extras de MYSQL_AZ_HOSTS (separados por vírgula).
+    """
+    hosts = [host]
+    if BRUDAM_FALLBACK_DNS in host:
+        hosts.append(BRUDAM_FALLBACK_IP)
+    elif "10." in host:
+        hosts.append(BRUDAM_FALLBACK_DNS)
+    hosts.extend(h.strip() for h in os.getenv("MYSQL_AZ_HOSTS", "").split(",") if h.strip())
+    return list(dict.fromkeys(hosts))
+
+
+def _connect_brudam(target_host: str, settings: dict, sock=None, **extra):
+    """Abre a conexão pymysql; com ``sock`` reaproveita o socket já conectado."""
+    import pymysql
+
+    conn = pymysql.connect(
+        host=target_host,
+        port=settings["port"],
+        user=settings["user"],
+        password=settings["password"],
+        database=settings["database"],
+        charset='utf8mb4',
+        cursorclass=pymysql.cursors.DictCursor,
+        connect_timeout=10,
+        read_timeout=60,
+        defer_connect=sock is not None,
+        **extra,
+    )
+    if sock is not None:
+        conn.connect(sock)
+    return conn
+
+
+_brudam_brokers: dict = {}
+
+
+def get_brudam_broker(settings: dict) -> ConnectionBroker:
+    """Broker (corrida de hosts + circuit breaker) compartilhado pelo worker."""
+    hosts = tuple(_brudam_candidate_hosts(settings["host"]))
+    key = (hosts, settings["port"])
+    broker = _brudam_brokers.get(key)
+    if broker is None:
+        broker = _brudam_brokers.setdefault(key, ConnectionBroker(
+            hosts,
+            settings["port"],
+            connect_timeout=float(os.getenv("BRUDAM_CONNECT_TIMEOUT", "10")),
+            failure_threshold=int(os.getenv("BRUDAM_BREAKER_THRESHOLD", "3")),
+            reset_timeout=float(os.getenv("BRUDAM_BREAKER_RESET", "60")),
+        ))
+    return broker
+
+
+def get_brudam_db(**extra):
+    """Conecta ao banco MySQL Brudam (azportoex). Credenciais via .env"""
+    settings = _brudam_settings()
+    broker = get_brudam_broker(settings)
+    conn = broker.connect(
+        lambda target_host, sock: _connect_brudam(target_host, settings, sock=sock, **extra)
+    )
+    app.logger.info(f"[MYSQL] Conectado em {conn.host}:{settings['port']}")
+    return conn
+
+
+@contextmanager
+def brudam_connection():
+    """
+    Empresta uma conexão do pool MySQL Brudam.
+
+    Novas conexões passam pelo broker (host mais rápido / circuit breaker).
+    As conexões do pool usam autocommit para que cada SELECT enxergue dados
+    atuais, sem herdar o snapshot de uma transação anterior.
+    """
+    settings = _brudam_settings()
+    broker = get_brudam_broker(settings)
+    mysql_pool = get_mysql_pool(
+        ",".join(broker.hosts),
+        settings["port"],
+        factory=partial(get_brudam_db, autocommit=True),
+        max_size=BRUDAM_POOL_SIZE,
+    )
+
+    started = time.perf_counter()
+    with mysql_pool.connection() as mysql_conn:
+        POOL_WAIT.labels("mysql").observe(time.perf_counter() - started)
+        # Tempo com a conexão emprestada (consultas e leitura do resultado)
+        with outbound("mysql"):
+            yield mysql_conn
 
 
 def execute_rpa(rpa_id: int) -> dict:
     """Executa uma automação RPA e retorna o resultado."""
-    import json
     from datetime import datetime
     
     conn = get_db()
@@ -4272,29 +5116,45 @@ def execute_rpa(rpa_id: int) -> dict:
             logs.append(f"[{datetime.now().isoformat()}] Conectando ao MySQL Brudam...")
             
             try:
+                import pymysql
+                
+                # Query padrão ou customizada, validada pelo governador
+                query = extraction_governor.prepare(
+                    parameters.get('query', 'SELECT 1 as test'),
+                    parameters.get('limit', 100),
+                )
+                
                 brudam_conn = get_brudam_db()
                 brudam_cursor = brudam_conn.cursor()
                 logs.append(f"[{datetime.now().isoformat()}] Conexão estabelecida com sucesso!")
                 
-                # Query padrão ou customizada
-                query = parameters.get('query', 'SELECT 1 as test')
-                limit = parameters.get('limit', 100)
+                estimated = extraction_governor.check_cost(brudam_cursor, query)
+                brudam_cursor.close()
+                logs.append(f"[{datetime.now().isoformat()}] Executando query (~{estimated} linhas estimadas)...")
                 
-                # Adicionar LIMIT se não existir
-                if 'LIMIT' not in query.upper():
-                    query = f"{query} LIMIT {limit}"
+                # Cursor não bufferizado: cada lote vira uma parte do resultado e
+                # apenas a prévia fica em memória
+                def save_batch(seq, rows):
+                    save_result_chunk(cursor, "rpa", rpa_id, seq, rows)
+                    conn.commit()
                 
-                logs.append(f"[{datetime.now().isoformat()}] Executando query...")
-                brudam_cursor.execute(query)
-                data = brudam_cursor.fetchall()
+                with brudam_conn.cursor(pymysql.cursors.SSDictCursor) as stream_cursor:
+                    stream_cursor.execute(query)
+                    preview, row_count, chunks = stream_batches(
+                        stream_cursor,
+                        RESULT_BATCH_SIZE,
+                        save_batch,
+                        RESULT_PREVIEW_ROWS,
+                        convert=lambda row: {k: _json_safe_value(v) for k, v in row.items()},
+                    )
                 
-                logs.append(f"[{datetime.now().isoformat()}] Query executada! {len(data)} registros retornados.")
+                logs.append(f"[{datetime.now().isoformat()}] Query executada! {row_count} registros retornados.")
                 
                 result["success"] = True
-                result["data"] = data
-                result["row_count"] = len(data)
+                result["data"] = preview
+                result["row_count"] = row_count
+                result["chunks"] = chunks
                 
-                brudam_cursor.close()
                 brudam_conn.close()
                 logs.append(f"[{datetime.now().isoformat()}] Conexão fechada.")
                 
@@ -4323,18 +5183,19 @@ def execute_rpa(rpa_id: int) -> dict:
             WHERE id = %s
         """, (
             final_status,
-            psycopg2.extras.Json({"data": result.get("data"), "row_count": result.get("row_count", 0)}),
+            psycopg2.extras.Json({
+                "data": result.get("data"),
+                "row_count": result.get("row_count", 0),
+                "chunks": result.get("chunks", 0),
+            }),
             result.get("error"),
             rpa_id
         ))
+        fan_out_results(cursor, "rpa")
         conn.commit()
         
         # Salvar logs
-        cursor.execute("""
-            INSERT INTO agent_logs (action_type, entity_type, entity_id, user_id, details)
-            VALUES ('execute', 'rpa', %s, %s, %s)
-        """, (rpa_id, rpa['created_by'], psycopg2.extras.Json({"logs": logs, "success": result["success"]})))
-        conn.commit()
+        agent_log_store.write('execute', 'rpa', rpa_id, rpa['created_by'], {"logs": logs, "success": result["success"]})
         
         result["logs"] = logs
         return result
@@ -4474,6 +5335,7 @@ def test_brudam_connection():
             "success": True,
             "tables": tables[:20],  # Primeiras 20 tabelas
             "total_tables": len(tables),
+            "hosts": get_brudam_broker(_brudam_settings()).status(),
             "logs": logs
         }), 200
         
@@ -4498,8 +5360,9 @@ def request_auditoria_fiscal():
     if not data_inicio or not data_fim:
         return jsonify({"error": "Datas de início e fim são obrigatórias"}), 400
     
-    # Construir a query SQL para o agente executar
-    query = f"""
+    # Query parametrizada: o agente executa uma vez por parte do período
+    # (%(inicio)s inclusivo, %(fim)s exclusivo)
+    query = """
         SELECT 
             m.id_manifesto,
             m.data_emissao,
@@ -4530,14 +5393,35 @@ def request_auditoria_fiscal():
         LEFT JOIN azportoex.funcionario func ON m.motorista = func.id_funcionario
         LEFT JOIN azportoex.usuarios u ON m.operador = u.id_usuario
         LEFT JOIN azportoex.veiculos v ON m.veiculo = v.id_veiculo
-        WHERE m.data_emissao BETWEEN '{data_inicio}' AND '{data_fim}'
+        WHERE m.data_emissao >= %(inicio)s AND m.data_emissao < %(fim)s
     """
-    
+    params = {}
     if operador_id:
-        query += f" AND m.operador = {operador_id}"
+        try:
+            params["operador"] = int(operador_id)
+        except (TypeError, ValueError):
+            return jsonify({"error": "Operador inválido"}), 400
+        query += " AND m.operador = %(operador)s"
     
     query += " ORDER BY m.data_emissao DESC, m.id_manifesto DESC"
     
+    try:
+        partition = parse_partition({"start": data_inicio, "end": data_fim})
+    except PartitionError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    filters = {
+        "query": query,
+        "params": params,
+        "partition": {
+            "start": partition.start.isoformat(),
+            "end": partition.end.isoformat(),
+            "unit": partition.unit,
+        },
+        # Por parte; uma parte que atinja o limite falha em vez de truncar
+        "limit": extraction_governor.max_rows,
+    }
+    
     conn = get_db()
     cursor = conn.cursor()
     
@@ -4554,17 +5438,22 @@ def request_auditoria_fiscal():
             "Auditoria Fiscal de Manifestos",
             "auditoria",
             ["table"],
-            psycopg2.extras.Json({"query": query, "limit": 2000}),
+            psycopg2.extras.Json(filters),
             session['user_id']
         ))
         
         request_id = cursor.fetchone()['id']
+        coalesced = coalesce_job(cursor, "dashboard", request_id, filters, AGENT_COALESCE_FRESHNESS)
         conn.commit()
+        if coalesced is None:
+            notify_agent_jobs(conn, "dashboard")
         
         return jsonify({
             "success": True,
             "request_id": request_id,
-            "message": "Solicitação enviada para o Agente Local"
+            "message": "Solicitação enviada para o Agente Local",
+            "shards": len(partition.shards),
+            **coalesced_fields(coalesced),
         }), 200
         
     except Exception as e:
@@ -4586,7 +5475,7 @@ def check_auditoria_status(request_id):
     
     try:
         cursor.execute("""
-            SELECT status, result_data, error_message, updated_at
+            SELECT status, result_data, error_message, progress, updated_at
             FROM agent_dashboard_requests
             WHERE id = %s AND created_by = %s
         """, (request_id, session['user_id']))
@@ -4602,6 +5491,14 @@ def check_auditoria_status(request_id):
         if data['status'] == 'completed' and data.get('result_data'):
             result = data['result_data']
             manifestos = result.get('data', [])
+            # Resultado em partes: a prévia tem só os primeiros registros
+            if result.get('chunks'):
+                cursor.execute("""
+                    SELECT rows FROM agent_result_chunks
+                    WHERE entity_type = 'dashboard' AND entity_id = %s
+                    ORDER BY seq
+                """, (result.get('coalesced_from') or request_id,))
+                manifestos = [row for chunk in cursor.fetchall() for row in chunk['rows']]
             
             # Calcular estatísticas aqui se necessário, ou mandar tudo pro front
             # Vamos mandar tudo pro front processar por enquanto
@@ -4622,7 +5519,8 @@ def check_auditoria_status(request_id):
         else:
             return jsonify({
                 "success": True,
-                "status": data['status']
+                "status": data['status'],
+                "progress": data.get('progress')
             }), 200
             
     except Exception as e:
@@ -4659,31 +5557,28 @@ def execute_brudam_query():
     if not query:
         return jsonify({"error": "Query é obrigatória"}), 400
     
-    # Segurança: apenas SELECT permitido
-    if not query.strip().upper().startswith('SELECT'):
-        return jsonify({"error": "Apenas queries SELECT são permitidas"}), 403
-    
-    # Adicionar LIMIT se não existir
-    if 'LIMIT' not in query.upper():
-        query = f"{query} LIMIT {limit}"
+    # Segurança: apenas leitura, LIMIT externo e tempo máximo
+    try:
+        query = query_governor.prepare(query, limit)
+    except QueryRejected as e:
+        return jsonify({"error": str(e)}), 403
     
     logs = []
+    brudam_conn = None
+    brudam_cursor = None
     
     try:
-        from datetime import datetime
         logs.append(f"[{datetime.now().isoformat()}] Executando query...")
         
         brudam_conn = get_brudam_db()
         brudam_cursor = brudam_conn.cursor()
         
+        query_governor.check_cost(brudam_cursor, query)
         brudam_cursor.execute(query)
         data = brudam_cursor.fetchall()
         
         logs.append(f"[{datetime.now().isoformat()}] {len(data)} registros retornados")
         
-        brudam_cursor.close()
-        brudam_conn.close()
-        
         return jsonify({
             "success": True,
             "data": data,
@@ -4691,6 +5586,14 @@ def execute_brudam_query():
             "logs": logs
         }), 200
         
+    except QueryRejected as e:
+        # Orçamento do EXPLAIN estourado: recusa como no prepare
+        logs.append(f"[{datetime.now().isoformat()}] RECUSADA: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "logs": logs
+        }), 403
     except Exception as e:
         logs.append(f"[{datetime.now().isoformat()}] ERRO: {str(e)}")
         return jsonify({
@@ -4698,6 +5601,11 @@ def execute_brudam_query():
             "error": str(e),
             "logs": logs
         }), 500
+    finally:
+        if brudam_cursor is not None:
+            brudam_cursor.close()
+        if brudam_conn is not None:
+            brudam_conn.close()
 
 
 # --------------------------------------------------------------------------- #
@@ -4716,10 +5624,391 @@ def verify_agent_api_key():
     return api_key and api_key == AGENT_API_KEY
 
 
-@app.route("/api/agent/sync/knowledge", methods=["POST"])
-def sync_knowledge():
+def govern_agent_query(container: dict | None, governor: QueryGovernor = query_governor) -> dict:
     """
-    API para o agente local enviar dados do Brudam para a Base de Conhecimento.
+    Aplica o governador à query de um job do agente local.
+
+    O agente recebe a query já reescrita (LIMIT externo e MAX_EXECUTION_TIME)
+    e o orçamento ``max_rows_examined`` para conferir via EXPLAIN no ERP.
+    """
+    governed = dict(container or {})
+    governed["query"] = governor.prepare(
+        governed.get("query", "SELECT 1 as test"), governed.get("limit", 100)
+    )
+    governed["max_rows"] = governor.max_rows
+    governed["max_rows_examined"] = governor.max_rows_examined
+    return governed
+
+
+def reject_agent_jobs(cursor, table: str, rejected: list) -> None:
+    """Marca como 'failed' os jobs cuja query foi recusada pelo governador."""
+    for job_id, reason in rejected:
+        cursor.execute(
+            f"""UPDATE {table} SET status = 'failed', error_message = %s,
+                   lease_expires_at = NULL, updated_at = NOW() WHERE id = %s""",
+            (reason, job_id),
+        )
+        app.logger.warning(f"[AGENT-API] Job #{job_id} ({table}) recusado: {reason}")
+
+
+AGENT_LEASE_SECONDS = int(os.getenv("AGENT_LEASE_SECONDS", "300"))
+# Janela em que o resultado de um job idêntico recém-concluído é reaproveitado
+AGENT_COALESCE_FRESHNESS = float(os.getenv("AGENT_COALESCE_FRESHNESS_SECONDS", "120"))
+AGENT_MAX_ATTEMPTS = int(os.getenv("AGENT_MAX_ATTEMPTS", "3"))
+# Campo com a query de cada tipo de job e o governador aplicado a ela
+AGENT_JOB_PAYLOAD = {
+    "rpa": ("parameters", extraction_governor),
+    "dashboard": ("filters", query_governor),
+}
+
+
+def current_agent_id() -> str:
+    """Identificação do agente local (header X-Agent-Id ou IP de origem)."""
+    return request.headers.get("X-Agent-Id") or request.remote_addr or "agent"
+
+
+# Distribuição entre vários agentes (utils/agent_dispatch.py)
+AGENT_LIVENESS_SECONDS = int(os.getenv("AGENT_LIVENESS_SECONDS", "200"))
+AGENT_DISPATCH_MAX_WAIT = float(os.getenv("AGENT_DISPATCH_MAX_WAIT", "30"))
+AGENT_AFFINITY_BONUS = float(os.getenv("AGENT_AFFINITY_BONUS", "0.5"))
+
+
+def log_dispatch_decisions(kind: str, agent_id: str, claimed: list, decisions: dict) -> None:
+    """Registra em agent_logs por que cada job reservado foi para este agente."""
+    for job in claimed:
+        decision = decisions.get(job["id"])
+        if decision is None:
+            continue
+        agent_log_store.write('dispatch', kind, job["id"], details={
+            "agent_id": agent_id,
+            "reason": decision.reason,
+            "scores": decision.scores,
+        })
+    if claimed:
+        app.logger.info(
+            f"[AGENT-DISPATCH] {kind}: {len(claimed)} job(s) para {agent_id} "
+            f"({', '.join('#' + str(job['id']) for job in claimed)})"
+        )
+
+
+def claim_agent_jobs(cursor, kind: str, agent_id: str, limit: int = 10) -> list:
+    """
+    Reserva jobs para o agente: roda o reaper, escolhe os jobs que cabem a
+    ele entre os agentes registrados, reserva com SKIP LOCKED e aplica o
+    governador às queries. O commit fica com o chamador.
+    """
+    reap_expired(cursor, kind, AGENT_MAX_ATTEMPTS)
+    
+    # Sem registro ou com um agente só, a reserva segue a ordem da fila
+    plan = plan_claim(
+        cursor, kind, agent_id, limit,
+        AGENT_LIVENESS_SECONDS, AGENT_DISPATCH_MAX_WAIT, AGENT_AFFINITY_BONUS,
+    )
+    only_ids, decisions, affinity_keys = plan if plan is not None else (None, {}, {})
+    if only_ids == []:
+        return []
+    claimed = claim_jobs(cursor, kind, agent_id, limit, AGENT_LEASE_SECONDS, only_ids=only_ids)
+    if plan is not None:
+        log_dispatch_decisions(kind, agent_id, claimed, decisions)
+        remember_affinity(cursor, agent_id, (affinity_keys.get(job["id"]) for job in claimed))
+    
+    field, governor = AGENT_JOB_PAYLOAD[kind]
+    jobs, rejected = [], []
+    for job in claimed:
+        try:
+            # Dashboards incrementais recebem só a janela a partir do watermark
+            if kind == "dashboard":
+                job[field] = prepare_incremental_job(cursor, JOB_KINDS[kind].table, job["id"], job[field])
+            # Jobs particionados limitam linhas por parte: orçamento de extração
+            partitioned = isinstance(job[field], dict) and job[field].get("partition")
+            job[field] = govern_agent_query(job[field], extraction_governor if partitioned else governor)
+            job["lease_seconds"] = AGENT_LEASE_SECONDS
+            jobs.append(job)
+        except (QueryRejected, IncrementalError) as e:
+            rejected.append((job["id"], str(e)))
+    reject_agent_jobs(cursor, JOB_KINDS[kind].table, rejected)
+    # Líderes recusados ou falhos pelo reaper também repassam aos seguidores
+    fan_out_results(cursor, kind)
+    return jobs
+
+
+# Long-poll: o agente fica estacionado até surgir job (ou até o tempo máximo).
+# LISTEN exige conexão direta/sessão; pelo pgbouncer (6543) só o NOTIFY funciona.
+AGENT_LONGPOLL_MAX_WAIT = int(os.getenv("AGENT_LONGPOLL_MAX_WAIT", "150"))
+AGENT_LONGPOLL_RECHECK = int(os.getenv("AGENT_LONGPOLL_RECHECK", "10"))
+AGENT_WORK_MAX_CAPACITY = int(os.getenv("AGENT_WORK_MAX_CAPACITY", "20"))
+
+
+def legacy_claim_limit() -> int:
+    """
+    Jobs reservados por chamada nos endpoints antigos (``?limit=``). Sem o
+    parâmetro, um só: agentes antigos renovam apenas o lease do job em
+    execução, e os demais do lote venceriam na fila local.
+    """
+    return min(max(request.args.get("limit", 1, type=int), 1), AGENT_WORK_MAX_CAPACITY)
+
+
+job_notifier = JobNotifier(max_parked=int(os.getenv("AGENT_LONGPOLL_MAX_PARKED", "4")))
+_jobs_listen_url = os.getenv("AGENT_JOBS_LISTEN_URL") or os.getenv("DIRECT_URL")
+
+
+def start_background_workers() -> None:
+    """
+    Inicia as threads de segundo plano deste processo (cada uma com a sua
+    variável para desligar). Chamada pelo hook ``post_worker_init`` do
+    gunicorn.conf.py, depois do fork de cada worker, e pelo ``python
+    app_production.py``; importar o módulo (testes, scripts, ``flask shell``)
+    não inicia nada. Outros servidores WSGI: ``START_BACKGROUND_WORKERS=true``.
+
+    O writer de ``agent_log_store`` não entra aqui: ele sobe sozinho no
+    primeiro ``write`` de cada processo.
+    """
+    if os.getenv("DASHBOARD_SNAPSHOT_SCHEDULER", "true").lower() == "true":
+        snapshot_scheduler.start()
+    if os.getenv("ASSET_PIPELINE", "true").lower() == "true":
+        asset_pipeline.start()
+    if os.getenv("ENVIRONMENT_COUNTERS_RECONCILE", "true").lower() == "true":
+        environment_counters.start()
+    if os.getenv("RPA_SCHEDULER", "true").lower() == "true":
+        rpa_scheduler.start()
+    if _jobs_listen_url:
+        job_notifier.listen(_jobs_listen_url)
+
+
+if os.getenv("START_BACKGROUND_WORKERS", "false").lower() == "true":
+    start_background_workers()
+
+
+def coalesced_fields(coalesced) -> dict:
+    """Campos da resposta de criação quando o job foi ligado a um job idêntico."""
+    if coalesced is None:
+        return {}
+    mode, source_id = coalesced
+    return {"coalesced": mode, "coalesced_with": source_id}
+
+
+def notify_agent_jobs(conn, kind: str) -> None:
+    """Avisa os agentes em long-poll que há job novo. Chamar após o commit."""
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_notify(%s, %s)", (AGENT_JOBS_CHANNEL, kind))
+        conn.commit()
+    except psycopg2.Error as e:
+        conn.rollback()
+        app.logger.warning(f"[AGENT-JOBS] Falha no NOTIFY ({kind}): {e}")
+    job_notifier.notify()
+
+
+def poll_agent_jobs(agent_id: str, timeout: float, capacity: int = 10):
+    """
+    Reserva até ``capacity`` jobs (RPAs primeiro), esperando até ``timeout``
+    segundos se não houver nenhum. Retorna ``({"rpa": [...], "dashboard": [...]},
+    admitido)``; ``admitido`` é False quando o limite de estacionados foi atingido.
+
+    A conexão do pool é devolvida antes de estacionar.
+    """
+    deadline = time.monotonic() + timeout
+    # Sem LISTEN, jobs criados em outro worker só são vistos na reconsulta.
+    # Com LISTEN ainda reconsulta: jobs deixados para outro agente passam a
+    # ser de quem estiver esperando após AGENT_DISPATCH_MAX_WAIT.
+    recheck = AGENT_DISPATCH_MAX_WAIT if job_notifier.listening else AGENT_LONGPOLL_RECHECK
+    
+    with job_notifier.parked() as admitted:
+        while True:
+            version = job_notifier.version
+            conn = get_db()
+            cursor = conn.cursor()
+            try:
+                jobs = {"rpa": [], "dashboard": []}
+                if capacity > 0:
+                    jobs["rpa"] = claim_agent_jobs(cursor, "rpa", agent_id, capacity)
+                if capacity - len(jobs["rpa"]) > 0:
+                    jobs["dashboard"] = claim_agent_jobs(cursor, "dashboard", agent_id, capacity - len(jobs["rpa"]))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                close_db(None)
+            
+            remaining = deadline - time.monotonic()
+            if jobs["rpa"] or jobs["dashboard"] or not admitted or remaining <= 0 or capacity <= 0:
+                return jobs, admitted
+            
+            job_notifier.wait(version, min(remaining, recheck))
+
+
+@app.route("/api/agent/jobs/wait", methods=["GET"])
+def wait_agent_jobs():
+    """
+    Long-poll do agente local: devolve RPAs e dashboards assim que houver
+    jobs, esperando no máximo ``timeout`` segundos. Acima do limite de
+    requisições estacionadas responde na hora, com ``retry_after``.
+    """
+    if not verify_agent_api_key():
+        return jsonify({"error": "API Key inválida"}), 401
+    
+    timeout = min(max(request.args.get("timeout", 25, type=float), 0), AGENT_LONGPOLL_MAX_WAIT)
+    agent_id = current_agent_id()
+    try:
+        jobs, admitted = poll_agent_jobs(agent_id, timeout, legacy_claim_limit())
+    except Exception as e:
+        app.logger.error(f"[AGENT-API] Erro no long-poll do agente {agent_id}: {e}")
+        return jsonify({"error": str(e)}), 500
+    
+    body = {"rpas": jobs["rpa"], "dashboards": jobs["dashboard"]}
+    if not admitted:
+        body["retry_after"] = 3
+    return jsonify(body), 200
+
+
+@app.route("/api/agent/work", methods=["POST"])
+def agent_work():
+    """
+    Troca única com o agente local (protocolo versionado, ver
+    utils/agent_protocol.py): grava resultados, renova leases e devolve o
+    próximo lote de jobs, cada um marcado com ``type``.
+    """
+    if not verify_agent_api_key():
+        return jsonify({"error": "API Key inválida"}), 401
+    
+    try:
+        work = parse_work_request(
+            request.get_json(silent=True),
+            max_capacity=AGENT_WORK_MAX_CAPACITY,
+            max_wait=AGENT_LONGPOLL_MAX_WAIT,
+        )
+    except ProtocolError as e:
+        return jsonify({"error": str(e), "version": PROTOCOL_VERSION}), 400
+    
+    agent_id = current_agent_id()
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    try:
+        # Resultados: cada um em um savepoint para um erro não descartar os demais
+        acks = []
+        for result in work.results:
+            cursor.execute("SAVEPOINT agent_result")
+            try:
+                body, status = save_agent_result(cursor, result["type"], result["id"], result, agent_id)
+                cursor.execute("RELEASE SAVEPOINT agent_result")
+            except Exception as e:
+                cursor.execute("ROLLBACK TO SAVEPOINT agent_result")
+                app.logger.error(f"[AGENT-API] Erro ao salvar resultado ({result['type']} #{result['id']}): {e}")
+                body, status = {"error": str(e)}, 500
+            acks.append({"type": result["type"], "id": result["id"], "code": status, **body})
+        
+        renewed = {
+            kind: renew_leases(cursor, kind, agent_id, work.heartbeats.get(kind) or [], AGENT_LEASE_SECONDS)
+            for kind in JOB_KINDS
+        }
+        touch_agent(cursor, agent_id, work.running)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        app.logger.error(f"[AGENT-API] Erro na troca de trabalho do agente {agent_id}: {e}")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        close_db(None)
+    
+    try:
+        jobs, admitted = poll_agent_jobs(agent_id, work.wait, work.capacity)
+    except Exception as e:
+        app.logger.error(f"[AGENT-API] Erro ao reservar jobs do agente {agent_id}: {e}")
+        jobs, admitted = {"rpa": [], "dashboard": []}, True
+    
+    body = {
+        "version": PROTOCOL_VERSION,
+        "acks": acks,
+        "renewed": renewed,
+        "lease_seconds": AGENT_LEASE_SECONDS,
+        "jobs": tag_jobs("rpa", jobs["rpa"]) + tag_jobs("dashboard", jobs["dashboard"]),
+    }
+    if not admitted:
+        body["retry_after"] = 3
+    return jsonify(body), 200
+
+
+@app.route("/api/agent/heartbeat", methods=["POST"])
+def agent_heartbeat():
+    """API para o agente local renovar o lease dos jobs em execução."""
+    if not verify_agent_api_key():
+        return jsonify({"error": "API Key inválida"}), 401
+    
+    data = request.get_json(silent=True) or {}
+    agent_id = current_agent_id()
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    try:
+        renewed = {
+            kind: renew_leases(cursor, kind, agent_id, data.get(kind) or [], AGENT_LEASE_SECONDS)
+            for kind in JOB_KINDS
+        }
+        running = data.get("running")
+        touch_agent(cursor, agent_id, int(running) if isinstance(running, int) else None)
+        conn.commit()
+        return jsonify({"renewed": renewed, "lease_seconds": AGENT_LEASE_SECONDS}), 200
+        
+    except Exception as e:
+        conn.rollback()
+        app.logger.error(f"[AGENT-API] Erro no heartbeat do agente {agent_id}: {e}")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+
+@app.route("/api/agent/register", methods=["POST"])
+def agent_register():
+    """
+    Registro do agente local com as suas capacidades::
+
+        {"job_types": ["rpa", "dashboard"], "hosts": ["brudam-db"],
+         "max_concurrency": 4, "hostname": "...", "version": "..."}
+
+    ``hosts`` omitido significa que o agente alcança qualquer host.
+    """
+    if not verify_agent_api_key():
+        return jsonify({"error": "API Key inválida"}), 401
+    
+    data = request.get_json(silent=True) or {}
+    job_types = data.get("job_types") or list(JOB_KINDS)
+    hosts = data.get("hosts")
+    if not isinstance(job_types, list) or set(job_types) - set(JOB_KINDS):
+        return jsonify({"error": f"job_types deve ser uma lista com {', '.join(JOB_KINDS)}"}), 400
+    if hosts is not None and not isinstance(hosts, list):
+        return jsonify({"error": "hosts deve ser uma lista"}), 400
+    try:
+        max_concurrency = max(int(data.get("max_concurrency") or 1), 1)
+    except (TypeError, ValueError):
+        return jsonify({"error": "max_concurrency inválido"}), 400
+    
+    agent_id = current_agent_id()
+    capabilities = {"job_types": job_types, "hosts": hosts, "max_concurrency": max_concurrency}
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    try:
+        register_agent(cursor, agent_id, capabilities, data.get("hostname"), data.get("version"))
+        conn.commit()
+        app.logger.info(f"[AGENT-DISPATCH] Agente {agent_id} registrado: {capabilities}")
+        return jsonify({"agent_id": agent_id, "capabilities": capabilities,
+                        "liveness_seconds": AGENT_LIVENESS_SECONDS}), 200
+        
+    except Exception as e:
+        conn.rollback()
+        app.logger.error(f"[AGENT-API] Erro ao registrar agente {agent_id}: {e}")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+
+@app.route("/api/agent/sync/knowledge", methods=["POST"])
+def sync_knowledge():
+    """
+    API para o agente local enviar dados do Brudam para a Base de Conhecimento.
     Usa X-API-Key para autenticação.
     """
     if not verify_agent_api_key():
@@ -4783,115 +6072,196 @@ def get_pending_rpas():
     cursor = conn.cursor()
     
     try:
-        # Buscar RPAs pendentes do tipo "Extração de Dados" ou com parâmetros brudam
-        cursor.execute("""
-            SELECT r.id, r.name, r.description, r.parameters, r.priority,
-                   t.name as type_name
-            FROM agent_rpas r
-            LEFT JOIN agent_rpa_types t ON r.rpa_type_id = t.id
-            WHERE r.status = 'pending'
-              AND (t.name LIKE '%Extração%' OR r.parameters::text LIKE '%brudam%' OR r.parameters::text LIKE '%query%')
-            ORDER BY 
-                CASE r.priority 
-                    WHEN 'critical' THEN 1 
-                    WHEN 'high' THEN 2 
-                    WHEN 'medium' THEN 3 
-                    ELSE 4 
-                END,
-                r.created_at ASC
-            LIMIT 10
-        """)
-        rpas = [dict(row) for row in cursor.fetchall()]
-        
-        # Marcar como "running" para evitar execução duplicada
-        for rpa in rpas:
-            cursor.execute("""
-                UPDATE agent_rpas 
-                SET status = 'running', executed_at = NOW() 
-                WHERE id = %s AND status = 'pending'
-            """, (rpa['id'],))
+        rpas = claim_agent_jobs(cursor, "rpa", current_agent_id(), legacy_claim_limit())
         conn.commit()
         
         return jsonify({"rpas": rpas}), 200
         
     except Exception as e:
+        conn.rollback()
         app.logger.error(f"[AGENT-API] Erro ao buscar RPAs pendentes: {e}")
         return jsonify({"error": str(e)}), 500
     finally:
         conn.close()
 
 
-@app.route("/api/agent/rpa/<int:rpa_id>/result", methods=["POST"])
-def receive_rpa_result(rpa_id):
-    """API para o agente local enviar resultado da execução."""
+AGENT_JOB_NOT_FOUND = {"rpa": "RPA não encontrada", "dashboard": "Dashboard não encontrado"}
+AGENT_JOB_LABELS = {"rpa": "RPA", "dashboard": "Dashboard"}
+
+
+DASHBOARD_INCREMENTAL_MAX_ROWS = int(os.getenv("DASHBOARD_INCREMENTAL_MAX_ROWS", "200000"))
+
+
+def merge_incremental_result(cursor, dash_id: int, data: dict):
+    """
+    Dashboards com bloco ``incremental``: junta as linhas recebidas ao
+    snapshot guardado e regrava o resultado completo (inline ou em partes).
+    Retorna ``(dados, resumo)``; ``resumo`` é ``None`` para dashboards comuns.
+    """
+    cursor.execute(
+        "SELECT filters, watermark_from FROM agent_dashboard_requests WHERE id = %s",
+        (dash_id,),
+    )
+    job = cursor.fetchone()
+    if not job or not parse_incremental(job['filters']):
+        return data, None
+    
+    # Resultados grandes chegaram em partes antes do resultado final
+    new_rows = data.get("data") or []
+    if data.get("chunks"):
+        cursor.execute("""
+            SELECT rows FROM agent_result_chunks
+            WHERE entity_type = 'dashboard' AND entity_id = %s
+            ORDER BY seq
+        """, (dash_id,))
+        new_rows = [row for chunk in cursor.fetchall() for row in chunk['rows']]
+    
+    rows, summary = merge_increment(
+        cursor, dash_id, job['filters'], new_rows,
+        job['watermark_from'] is not None, DASHBOARD_INCREMENTAL_MAX_ROWS,
+    )
+    chunks = 0
+    if len(rows) > RESULT_PREVIEW_ROWS:
+        for seq, start in enumerate(range(0, len(rows), RESULT_BATCH_SIZE)):
+            save_result_chunk(cursor, "dashboard", dash_id, seq, rows[start:start + RESULT_BATCH_SIZE])
+            chunks = seq + 1
+    return dict(data, data=rows, row_count=len(rows), chunks=chunks), summary
+
+
+def save_agent_result(cursor, kind: str, job_id: int, data: dict, agent_id: str | None = None):
+    """
+    Grava o resultado de um job do agente local (sem commit).
+
+    Retorna ``(resposta, status_http)``. Resultados de um agente que já não
+    detém o lease (job reservado por outro) são recusados com 409.
+    """
+    table, result_column = RESULT_TABLES[kind]
+    
+    # Verificar se o job existe
+    cursor.execute(f"SELECT id, created_by, leased_by FROM {table} WHERE id = %s", (job_id,))
+    job = cursor.fetchone()
+    
+    if not job:
+        return {"error": AGENT_JOB_NOT_FOUND[kind]}, 404
+    
+    # O lease venceu e o job foi reservado por outro agente: descartar
+    if agent_id and job['leased_by'] and job['leased_by'] != agent_id:
+        return {"error": "Lease pertence a outro agente"}, 409
+    
+    success = data.get("success", False)
+    final_status = "completed" if success else "failed"
+    
+    incremental = None
+    if kind == "dashboard" and success:
+        data, incremental = merge_incremental_result(cursor, job_id, data)
+    
+    # Limitar tamanho dos dados para evitar problemas de armazenamento;
+    # resultados grandes chegam em partes por /result/chunks
+    result_data = data.get("data", [])
+    if isinstance(result_data, list) and len(result_data) > RESULT_PREVIEW_ROWS:
+        result_data = result_data[:RESULT_PREVIEW_ROWS]
+    chunks = int(data.get("chunks") or 0)
+    
+    cursor.execute(f"""
+        UPDATE {table} 
+        SET status = %s, 
+            {result_column} = %s,
+            error_message = %s,
+            lease_expires_at = NULL,
+            completed_at = NOW(),
+            updated_at = NOW()
+        WHERE id = %s
+    """, (
+        final_status,
+        psycopg2.extras.Json({
+            "data": result_data,
+            "row_count": data.get("row_count", 0),
+            "chunks": chunks,
+            "source": "agent_local",
+            **({"incremental": incremental} if incremental else {}),
+        }),
+        data.get("error"),
+        job_id
+    ))
+    if not chunks:
+        clear_result_chunks(cursor, kind, job_id)
+    fan_out_results(cursor, kind)
+    
+    # Salvar logs
+    agent_log_store.write('execute_remote', kind, job_id, job['created_by'], {
+        "logs": data.get("logs", []),
+        "success": success,
+        "source": "agent_local"
+    })
+    
+    app.logger.info(f"[AGENT-API] Resultado recebido para {AGENT_JOB_LABELS[kind]} #{job_id}: {final_status}")
+    return {"success": True, "status": final_status}, 200
+
+
+@app.route("/api/agent/<any(rpa, dashboard):kind>/<int:job_id>/progress", methods=["POST"])
+def receive_agent_progress(kind, job_id):
+    """Andamento de um job particionado (partes concluídas, linhas até agora)."""
     if not verify_agent_api_key():
         return jsonify({"error": "API Key inválida"}), 401
     
-    data = request.get_json()
+    data = request.get_json(silent=True) or {}
+    progress = {key: data.get(key) for key in ("shards_total", "shards_done", "last_shard", "rows", "elapsed_seconds")}
+    agent_id = current_agent_id()
+    table = JOB_KINDS[kind].table
     
     conn = get_db()
     cursor = conn.cursor()
     
     try:
-        # Verificar se RPA existe
-        cursor.execute("SELECT id, created_by FROM agent_rpas WHERE id = %s", (rpa_id,))
-        rpa = cursor.fetchone()
-        
-        if not rpa:
-            return jsonify({"error": "RPA não encontrada"}), 404
-        
-        # Atualizar RPA com resultado
-        success = data.get("success", False)
-        final_status = "completed" if success else "failed"
-        
-        # Limitar tamanho dos dados para evitar problemas de armazenamento
-        result_data = data.get("data", [])
-        if isinstance(result_data, list) and len(result_data) > 1000:
-            result_data = result_data[:1000]  # Limitar a 1000 registros
-        
-        cursor.execute("""
-            UPDATE agent_rpas 
-            SET status = %s, 
-                completed_at = NOW(),
-                result = %s,
-                error_message = %s,
-                updated_at = NOW()
-            WHERE id = %s
-        """, (
-            final_status,
-            psycopg2.extras.Json({
-                "data": result_data,
-                "row_count": data.get("row_count", 0),
-                "source": "agent_local"
-            }),
-            data.get("error"),
-            rpa_id
-        ))
-        
-        # Salvar logs
-        logs = data.get("logs", [])
-        cursor.execute("""
-            INSERT INTO agent_logs (action_type, entity_type, entity_id, user_id, details)
-            VALUES ('execute_remote', 'rpa', %s, %s, %s)
-        """, (rpa_id, rpa['created_by'], psycopg2.extras.Json({
-            "logs": logs,
-            "success": success,
-            "source": "agent_local"
-        })))
-        
+        cursor.execute(f"""
+            UPDATE {table}
+            SET progress = %s, updated_at = NOW()
+            WHERE id = %s AND status = %s AND (leased_by IS NULL OR leased_by = %s)
+            RETURNING id
+        """, (psycopg2.extras.Json(progress), job_id, JOB_KINDS[kind].running_status, agent_id))
+        updated = cursor.fetchone()
         conn.commit()
-        
-        app.logger.info(f"[AGENT-API] Resultado recebido para RPA #{rpa_id}: {final_status}")
+        if not updated:
+            return jsonify({"error": "Job não está em execução por este agente"}), 409
         return jsonify({"success": True}), 200
         
     except Exception as e:
         conn.rollback()
-        app.logger.error(f"[AGENT-API] Erro ao salvar resultado: {e}")
+        app.logger.error(f"[AGENT-API] Erro ao gravar progresso de {kind} #{job_id}: {e}")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+
+def receive_agent_result(kind: str, job_id: int):
+    """Endpoint de resultado avulso (protocolo anterior ao /api/agent/work)."""
+    if not verify_agent_api_key():
+        return jsonify({"error": "API Key inválida"}), 401
+    
+    data = request.get_json() or {}
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    try:
+        body, status = save_agent_result(cursor, kind, job_id, data, request.headers.get("X-Agent-Id"))
+        conn.commit()
+        return jsonify(body), status
+        
+    except Exception as e:
+        conn.rollback()
+        app.logger.error(f"[AGENT-API] Erro ao salvar resultado ({kind} #{job_id}): {e}")
         return jsonify({"error": str(e)}), 500
     finally:
         conn.close()
 
 
+@app.route("/api/agent/rpa/<int:rpa_id>/result", methods=["POST"])
+def receive_rpa_result(rpa_id):
+    """API para o agente local enviar resultado da execução. Compatibilidade: ver /api/agent/work."""
+    return receive_agent_result("rpa", rpa_id)
+
+
 @app.route("/api/agent/dashboards/pending", methods=["GET"])
 def get_pending_dashboards():
     """API para o agente local buscar solicitações de dashboard pendentes."""
@@ -4902,30 +6272,13 @@ def get_pending_dashboards():
     cursor = conn.cursor()
     
     try:
-        # Buscar dashboards pendentes que têm query nos filtros
-        cursor.execute("""
-            SELECT id, title, description, category, chart_types, filters, created_by
-            FROM agent_dashboard_requests
-            WHERE status = 'pending'
-              AND filters IS NOT NULL
-              AND filters::text LIKE '%query%'
-            ORDER BY created_at ASC
-            LIMIT 10
-        """)
-        dashboards = [dict(row) for row in cursor.fetchall()]
-        
-        # Marcar como "processing" para evitar execução duplicada
-        for dash in dashboards:
-            cursor.execute("""
-                UPDATE agent_dashboard_requests 
-                SET status = 'processing', updated_at = NOW() 
-                WHERE id = %s AND status = 'pending'
-            """, (dash['id'],))
+        dashboards = claim_agent_jobs(cursor, "dashboard", current_agent_id(), legacy_claim_limit())
         conn.commit()
         
         return jsonify({"dashboards": dashboards}), 200
         
     except Exception as e:
+        conn.rollback()
         app.logger.error(f"[AGENT-API] Erro ao buscar dashboards pendentes: {e}")
         return jsonify({"error": str(e)}), 500
     finally:
@@ -4934,75 +6287,330 @@ def get_pending_dashboards():
 
 @app.route("/api/agent/dashboard/<int:dash_id>/result", methods=["POST"])
 def receive_dashboard_result(dash_id):
-    """API para o agente local enviar resultado do dashboard."""
+    """API para o agente local enviar resultado do dashboard. Compatibilidade: ver /api/agent/work."""
+    return receive_agent_result("dashboard", dash_id)
+
+
+@app.route("/api/agent/<any(rpa, dashboard):kind>/<int:job_id>/result/chunks", methods=["POST"])
+def receive_result_chunk(kind, job_id):
+    """API para o agente local enviar uma parte de um resultado grande (JSON, sem retomada; ver /uploads)."""
     if not verify_agent_api_key():
         return jsonify({"error": "API Key inválida"}), 401
     
-    data = request.get_json()
+    data = request.get_json(silent=True) or {}
+    rows = data.get("rows")
+    try:
+        seq = int(data.get("seq"))
+    except (TypeError, ValueError):
+        return jsonify({"error": "seq inválido"}), 400
+    if not isinstance(rows, list) or seq < 0:
+        return jsonify({"error": "Parte inválida"}), 400
     
     conn = get_db()
     cursor = conn.cursor()
     
     try:
-        # Verificar se dashboard existe
-        cursor.execute("SELECT id, created_by FROM agent_dashboard_requests WHERE id = %s", (dash_id,))
-        dash = cursor.fetchone()
+        table, _ = RESULT_TABLES[kind]
+        cursor.execute(f"SELECT id FROM {table} WHERE id = %s", (job_id,))
+        if not cursor.fetchone():
+            return jsonify({"error": "Job não encontrado"}), 404
         
-        if not dash:
-            return jsonify({"error": "Dashboard não encontrado"}), 404
+        save_result_chunk(cursor, kind, job_id, seq, rows)
+        conn.commit()
+        return jsonify({"success": True, "seq": seq, "rows": len(rows)}), 200
         
-        # Atualizar dashboard com resultado
-        success = data.get("success", False)
-        final_status = "completed" if success else "failed"
+    except Exception as e:
+        conn.rollback()
+        app.logger.error(f"[AGENT-API] Erro ao salvar parte {seq} ({kind} #{job_id}): {e}")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+
+RESULT_UPLOAD_MAX_PART_BYTES = int(os.getenv("RESULT_UPLOAD_MAX_PART_BYTES", str(64 * 1024 * 1024)))
+
+
+def _upload_part_checksums(cursor, upload_id: str) -> list:
+    cursor.execute(
+        "SELECT checksum FROM agent_result_upload_parts WHERE upload_id = %s ORDER BY seq",
+        (upload_id,),
+    )
+    return [row['checksum'] for row in cursor.fetchall()]
+
+
+def _upload_lease_error(cursor, upload: dict, agent_id: str):
+    """
+    ``(resposta, status_http)`` se o agente não pode mexer no upload: ele foi
+    aberto por outro agente ou o lease do job passou para outro. ``None`` se pode.
+    """
+    if upload['agent_id'] and upload['agent_id'] != agent_id:
+        return {"error": "Upload pertence a outro agente"}, 409
+    table, _ = RESULT_TABLES[upload['entity_type']]
+    cursor.execute(f"SELECT leased_by FROM {table} WHERE id = %s", (upload['entity_id'],))
+    job = cursor.fetchone()
+    if not job:
+        return {"error": AGENT_JOB_NOT_FOUND[upload['entity_type']]}, 404
+    if job['leased_by'] and job['leased_by'] != agent_id:
+        return {"error": "Lease pertence a outro agente"}, 409
+    return None
+
+
+@app.route("/api/agent/<any(rpa, dashboard):kind>/<int:job_id>/uploads", methods=["POST"])
+def open_result_upload(kind, job_id):
+    """
+    Abre (ou retoma) o upload em partes do resultado de um job.
+
+    Se o agente já tem um upload aberto para o job, devolve o mesmo
+    ``upload_id`` com os checksums das partes recebidas: o agente pula as que
+    coincidem e continua da primeira que falta.
+    """
+    if not verify_agent_api_key():
+        return jsonify({"error": "API Key inválida"}), 401
+    
+    import uuid
+    
+    agent_id = current_agent_id()
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    try:
+        table, _ = RESULT_TABLES[kind]
+        cursor.execute(f"SELECT id FROM {table} WHERE id = %s", (job_id,))
+        if not cursor.fetchone():
+            return jsonify({"error": AGENT_JOB_NOT_FOUND[kind]}), 404
         
-        # Limitar tamanho dos dados
-        result_data = data.get("data", [])
-        if isinstance(result_data, list) and len(result_data) > 1000:
-            result_data = result_data[:1000]
+        # Staging abandonado há mais de um dia
+        cursor.execute("""
+            DELETE FROM agent_result_uploads
+            WHERE status = 'open' AND updated_at < NOW() - INTERVAL '1 day'
+        """)
         
         cursor.execute("""
-            UPDATE agent_dashboard_requests 
-            SET status = %s, 
-                result_data = %s,
-                error_message = %s,
-                completed_at = NOW(),
-                updated_at = NOW()
-            WHERE id = %s
-        """, (
-            final_status,
-            psycopg2.extras.Json({
-                "data": result_data,
-                "row_count": data.get("row_count", 0),
-                "source": "agent_local"
-            }),
-            data.get("error"),
-            dash_id
-        ))
+            SELECT upload_id FROM agent_result_uploads
+            WHERE entity_type = %s AND entity_id = %s AND agent_id = %s AND status = 'open'
+            ORDER BY created_at DESC
+            LIMIT 1
+        """, (kind, job_id, agent_id))
+        row = cursor.fetchone()
+        if row:
+            upload_id = row['upload_id']
+            checksums = _upload_part_checksums(cursor, upload_id)
+        else:
+            upload_id = uuid.uuid4().hex
+            checksums = []
+            cursor.execute("""
+                INSERT INTO agent_result_uploads (upload_id, entity_type, entity_id, agent_id)
+                VALUES (%s, %s, %s, %s)
+            """, (upload_id, kind, job_id, agent_id))
+        conn.commit()
+        
+        return jsonify({"upload_id": upload_id, "next_seq": len(checksums), "checksums": checksums}), 200
+        
+    except Exception as e:
+        conn.rollback()
+        app.logger.error(f"[AGENT-API] Erro ao abrir upload ({kind} #{job_id}): {e}")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+
+@app.route("/api/agent/uploads/<upload_id>/parts/<int:seq>", methods=["PUT"])
+def put_result_upload_part(upload_id, seq):
+    """
+    Recebe uma parte NDJSON gzip (header ``X-Content-SHA256`` com o hash do
+    NDJSON). Reenvio da mesma parte é idempotente; uma parte já recebida com
+    conteúdo diferente descarta ela e as seguintes.
+    """
+    if not verify_agent_api_key():
+        return jsonify({"error": "API Key inválida"}), 401
+    
+    checksum = (request.headers.get("X-Content-SHA256") or "").lower()
+    try:
+        rows = decode_part(request.get_data(cache=False), checksum, RESULT_UPLOAD_MAX_PART_BYTES)
+    except PartError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    agent_id = current_agent_id()
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute(
+            "SELECT entity_type, entity_id, agent_id, status FROM agent_result_uploads WHERE upload_id = %s FOR UPDATE",
+            (upload_id,),
+        )
+        upload = cursor.fetchone()
+        if not upload:
+            return jsonify({"error": "Upload não encontrado"}), 404
+        if upload['status'] != 'open':
+            return jsonify({"error": "Upload já finalizado"}), 409
+        lease_error = _upload_lease_error(cursor, upload, agent_id)
+        if lease_error:
+            conn.rollback()
+            return jsonify(lease_error[0]), lease_error[1]
+        
+        checksums = _upload_part_checksums(cursor, upload_id)
+        if seq > len(checksums):
+            return jsonify({"error": "Parte fora de ordem", "next_seq": len(checksums)}), 409
+        if seq < len(checksums):
+            if checksums[seq] == checksum:
+                conn.rollback()
+                return jsonify({"success": True, "next_seq": len(checksums)}), 200
+            cursor.execute(
+                "DELETE FROM agent_result_upload_parts WHERE upload_id = %s AND seq >= %s",
+                (upload_id, seq),
+            )
         
-        # Salvar logs
-        logs = data.get("logs", [])
         cursor.execute("""
-            INSERT INTO agent_logs (action_type, entity_type, entity_id, user_id, details)
-            VALUES ('execute_remote', 'dashboard', %s, %s, %s)
-        """, (dash_id, dash['created_by'], psycopg2.extras.Json({
-            "logs": logs,
-            "success": success,
-            "source": "agent_local"
-        })))
+            INSERT INTO agent_result_upload_parts (upload_id, seq, rows, row_count, checksum)
+            VALUES (%s, %s, %s, %s, %s)
+        """, (upload_id, seq, psycopg2.extras.Json(rows), len(rows), checksum))
+        cursor.execute(
+            "UPDATE agent_result_uploads SET updated_at = NOW() WHERE upload_id = %s",
+            (upload_id,),
+        )
+        conn.commit()
+        
+        return jsonify({"success": True, "next_seq": seq + 1}), 200
+        
+    except Exception as e:
+        conn.rollback()
+        app.logger.error(f"[AGENT-API] Erro ao gravar parte {seq} do upload {upload_id}: {e}")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+
+@app.route("/api/agent/uploads/<upload_id>/commit", methods=["POST"])
+def commit_result_upload(upload_id):
+    """
+    Publica o upload: em uma única transação as partes em staging substituem
+    as partes do resultado do job (``agent_result_chunks``).
+
+    Só o agente que abriu o upload e ainda detém o lease do job publica, e só
+    com as partes ``0..N-1`` completas (sem buracos).
+    """
+    if not verify_agent_api_key():
+        return jsonify({"error": "API Key inválida"}), 401
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        expected = int(data["parts"]) if data.get("parts") is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "parts inválido"}), 400
+    
+    agent_id = current_agent_id()
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute(
+            "SELECT entity_type, entity_id, agent_id, status FROM agent_result_uploads WHERE upload_id = %s FOR UPDATE",
+            (upload_id,),
+        )
+        upload = cursor.fetchone()
+        if not upload:
+            return jsonify({"error": "Upload não encontrado"}), 404
+        lease_error = _upload_lease_error(cursor, upload, agent_id)
+        if lease_error:
+            conn.rollback()
+            return jsonify(lease_error[0]), lease_error[1]
+        if upload['status'] == 'committed':
+            conn.rollback()
+            return jsonify({"success": True, "already_committed": True}), 200
         
+        cursor.execute("""
+            SELECT COUNT(*) AS parts, MIN(seq) AS first_seq, MAX(seq) AS last_seq,
+                   COALESCE(SUM(row_count), 0) AS row_count
+            FROM agent_result_upload_parts WHERE upload_id = %s
+        """, (upload_id,))
+        stats = cursor.fetchone()
+        
+        # (upload_id, seq) é chave: N partes de 0 a N-1 não deixam buraco
+        contiguous = stats['parts'] == 0 or (stats['first_seq'] == 0 and stats['last_seq'] == stats['parts'] - 1)
+        if not contiguous or (expected is not None and expected != stats['parts']):
+            next_seq = stats['parts']
+            if not contiguous:
+                # Primeira parte que falta: o agente retoma dali
+                cursor.execute(
+                    "SELECT seq FROM agent_result_upload_parts WHERE upload_id = %s ORDER BY seq",
+                    (upload_id,),
+                )
+                seqs = [row['seq'] for row in cursor.fetchall()]
+                next_seq = next(i for i, seq in enumerate(seqs + [None]) if seq != i)
+            conn.rollback()
+            return jsonify({"error": "Upload incompleto", "next_seq": next_seq}), 409
+        
+        kind, job_id = upload['entity_type'], upload['entity_id']
+        clear_result_chunks(cursor, kind, job_id)
+        cursor.execute("""
+            INSERT INTO agent_result_chunks (entity_type, entity_id, seq, rows, row_count)
+            SELECT %s, %s, seq, rows, row_count
+            FROM agent_result_upload_parts WHERE upload_id = %s
+        """, (kind, job_id, upload_id))
+        cursor.execute("DELETE FROM agent_result_upload_parts WHERE upload_id = %s", (upload_id,))
+        cursor.execute("""
+            UPDATE agent_result_uploads SET status = 'committed', updated_at = NOW()
+            WHERE upload_id = %s
+        """, (upload_id,))
         conn.commit()
         
-        app.logger.info(f"[AGENT-API] Resultado recebido para Dashboard #{dash_id}: {final_status}")
-        return jsonify({"success": True}), 200
+        app.logger.info(f"[AGENT-API] Upload {upload_id} publicado: {stats['parts']} partes, {stats['row_count']} registros")
+        return jsonify({"success": True, "chunks": stats['parts'], "row_count": stats['row_count']}), 200
         
     except Exception as e:
         conn.rollback()
-        app.logger.error(f"[AGENT-API] Erro ao salvar resultado dashboard: {e}")
+        app.logger.error(f"[AGENT-API] Erro ao publicar upload {upload_id}: {e}")
         return jsonify({"error": str(e)}), 500
     finally:
         conn.close()
 
 
+@app.route("/api/agent/<any(rpa, dashboard):kind>/<int:job_id>/result/rows", methods=["GET"])
+@login_required
+def download_result_rows(kind, job_id):
+    """Baixa o resultado completo de um job como NDJSON (uma linha por registro)."""
+    import json
+    from flask import Response, stream_with_context
+    
+    table, result_column = RESULT_TABLES[kind]
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    cursor.execute(f"SELECT created_by, {result_column} AS result FROM {table} WHERE id = %s", (job_id,))
+    job = cursor.fetchone()
+    if not job:
+        return jsonify({"error": "Job não encontrado"}), 404
+    if job['created_by'] != session['user_id'] and session.get('role') != 'admin':
+        return jsonify({"error": "Permissão negada"}), 403
+    
+    # Resultado repassado por um job idêntico: as partes estão no job de origem
+    source_id = (job['result'] or {}).get("coalesced_from") or job_id
+    cursor.execute(
+        "SELECT seq FROM agent_result_chunks WHERE entity_type = %s AND entity_id = %s ORDER BY seq",
+        (kind, source_id),
+    )
+    seqs = [row['seq'] for row in cursor.fetchall()]
+    inline_rows = ((job['result'] or {}).get("data") or []) if not seqs else []
+    
+    def generate():
+        # Uma parte por vez: a memória fica limitada ao tamanho de um lote
+        for row in inline_rows:
+            yield json.dumps(row, ensure_ascii=False, default=str) + "\n"
+        for seq in seqs:
+            cursor.execute(
+                "SELECT rows FROM agent_result_chunks WHERE entity_type = %s AND entity_id = %s AND seq = %s",
+                (kind, source_id, seq),
+            )
+            chunk = cursor.fetchone()
+            for row in (chunk['rows'] if chunk else []):
+                yield json.dumps(row, ensure_ascii=False, default=str) + "\n"
+    
+    response = Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+    response.headers['Content-Disposition'] = f'attachment; filename="{kind}_{job_id}.ndjson"'
+    return response
+
+
 @app.route("/api/agent/health", methods=["GET"])
 def agent_health_check():
     """Health check para o agente local."""
@@ -5208,7 +6816,8 @@ Pergunta atual: {user_message}
                 for model_name in variant_chain:
                     try:
                         model = genai.GenerativeModel(model_name)
-                        response = model.generate_content(system_prompt)
+                        with outbound("gemini"):
+                            response = model.generate_content(system_prompt)
                         break
                     except Exception as model_error:
                         last_error = model_error
@@ -5358,5 +6967,8 @@ def internal_error(error):
 
 
 if __name__ == "__main__":
+    # Com o reloader do modo debug, só o processo que atende as requisições
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_workers()
     app.run(debug=True, host="0.0.0.0", port=5000)
 
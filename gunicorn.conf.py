@@ -0,0 +1,36 @@
+"""
+Hooks do gunicorn (carregado automaticamente de ./gunicorn.conf.py).
+
+As métricas de ``/metrics`` (utils/metrics.py) são somadas entre os workers
+pelo modo multiprocesso do prometheus_client: cada worker grava em
+``PROMETHEUS_MULTIPROC_DIR``. O diretório é limpo quando o master sobe e os
+arquivos de um worker que morreu saem da soma dos gauges.
+
+As threads de segundo plano do app (agendadores, pipeline de assets, LISTEN
+dos jobs do agente) sobem em cada worker depois do fork, no
+``post_worker_init``; importar ``app_production`` não as inicia.
+"""
+
+import os
+import shutil
+
+# Definido no master, antes do fork: os workers herdam a variável
+METRICS_DIR = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/gerot-metrics")
+
+
+def on_starting(server):
+    shutil.rmtree(METRICS_DIR, ignore_errors=True)
+    os.makedirs(METRICS_DIR, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_worker_init(worker):
+    # A aplicação já foi carregada neste worker (com ou sem --preload)
+    from app_production import start_background_workers
+
+    start_background_workers()
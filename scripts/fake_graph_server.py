@@ -0,0 +1,205 @@
+"""
+Graph falso local para testar a sincronização com o Planner (utils/planner_sync.py).
+
+Atende o token (client credentials), ``$batch`` e as rotas avulsas de tarefas
+do Planner, exige ``If-Match`` no PATCH dos detalhes e devolve 429 com
+``Retry-After`` em uma fração das chamadas.
+
+Servidor para o GeRot (MS_GRAPH_BASE_URL=http://127.0.0.1:8765/v1.0,
+MS_TOKEN_URL=http://127.0.0.1:8765/token):
+    python scripts/fake_graph_server.py --port 8765 --throttle 0.1
+
+Sincronização de usuários fictícios contra o servidor:
+    python scripts/fake_graph_server.py --selftest --users 200 --throttle 0.1
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+
+class FakePlanner:
+    """Estado em memória: tarefas, detalhes e contadores de chamadas."""
+
+    def __init__(self, throttle: float = 0.0, retry_after: int = 1, seed: int = 42):
+        self.throttle = throttle
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.tasks = {}
+        self.details = {}
+        self.http_calls = 0
+        self.operations = 0
+        self.throttled = 0
+
+    def throttled_response(self):
+        with self.lock:
+            if self.rng.random() < self.throttle:
+                self.throttled += 1
+                return {"status": 429, "headers": {"Retry-After": str(self.retry_after)},
+                        "body": {"error": {"code": "TooManyRequests", "message": "Throttled"}}}
+        return None
+
+    def handle(self, method: str, url: str, headers: dict, body):
+        """Executa uma operação do Planner; devolve ``{status, headers, body}``."""
+        with self.lock:
+            self.operations += 1
+        throttled = self.throttled_response()
+        if throttled:
+            return throttled
+
+        parts = [p for p in url.split("?")[0].split("/") if p]
+        if method == "POST" and parts == ["planner", "tasks"]:
+            task_id = uuid.uuid4().hex[:16]
+            task = dict(body or {}, id=task_id)
+            with self.lock:
+                self.tasks[task_id] = task
+                self.details[task_id] = {"id": task_id, "description": "", "etag": uuid.uuid4().hex}
+            return {"status": 201, "headers": {}, "body": task}
+
+        if len(parts) == 4 and parts[:2] == ["planner", "tasks"] and parts[3] == "details":
+            details = self.details.get(parts[2])
+            if details is None:
+                return {"status": 404, "headers": {}, "body": {"error": {"message": "Tarefa não encontrada"}}}
+            etag = f'W/"{details["etag"]}"'
+            if method == "GET":
+                return {"status": 200, "headers": {"ETag": etag},
+                        "body": {"id": details["id"], "description": details["description"], "@odata.etag": etag}}
+            if method == "PATCH":
+                if {k.lower(): v for k, v in (headers or {}).items()}.get("if-match") != etag:
+                    return {"status": 412, "headers": {}, "body": {"error": {"message": "ETag divergente"}}}
+                with self.lock:
+                    details.update(body or {}, etag=uuid.uuid4().hex)
+                return {"status": 204, "headers": {}, "body": None}
+
+        return {"status": 400, "headers": {}, "body": {"error": {"message": f"Rota não suportada: {method} {url}"}}}
+
+
+def make_handler(state: FakePlanner):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, como o Graph
+
+        def log_message(self, *args):
+            pass
+
+        def _read_json(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b""
+            try:
+                return json.loads(raw or b"null")
+            except ValueError:
+                return raw.decode("utf-8", "replace")
+
+        def _send(self, status: int, body=None, headers=None):
+            payload = b"" if body is None else json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _dispatch(self, method):
+            with state.lock:
+                state.http_calls += 1
+            body = self._read_json() if method in ("POST", "PATCH") else None
+            path = self.path.split("?")[0]
+
+            if method == "POST" and path.endswith("/token"):
+                return self._send(200, {"access_token": "fake-token", "expires_in": 3600, "token_type": "Bearer"})
+            if not path.startswith("/v1.0/"):
+                return self._send(404, {"error": {"message": "Not found"}})
+            path = path[len("/v1.0"):]
+
+            if method == "POST" and path == "/$batch":
+                items = (body or {}).get("requests", [])
+                if len(items) > 20:
+                    return self._send(400, {"error": {"message": "Máximo de 20 requisições por lote"}})
+                responses = []
+                for item in items:
+                    result = state.handle(item["method"], item["url"], item.get("headers"), item.get("body"))
+                    responses.append(dict(result, id=item["id"]))
+                return self._send(200, {"responses": responses})
+
+            result = state.handle(method, path, dict(self.headers), body)
+            return self._send(result["status"], result["body"], result["headers"])
+
+        def do_GET(self):
+            self._dispatch("GET")
+
+        def do_POST(self):
+            self._dispatch("POST")
+
+        def do_PATCH(self):
+            self._dispatch("PATCH")
+
+    return Handler
+
+
+def selftest(server_url: str, state: FakePlanner, users: int, workers: int):
+    from utils.planner_client import PlannerClient
+    from utils.planner_sync import PlannerSyncEngine, PlannerTaskSpec
+
+    client = PlannerClient(
+        tenant_id="fake", client_id="fake", client_secret="fake", plan_id="plan", bucket_id="bucket",
+        graph_base=f"{server_url}/v1.0", token_url=f"{server_url}/token",
+    )
+    specs = [
+        PlannerTaskSpec(i, f"Usuário {i}", f"Agenda de dashboards - Usuário {i}", f"Dashboards do usuário {i}", 3, str(i))
+        for i in range(users)
+    ]
+    start = datetime.utcnow().replace(microsecond=0)
+    engine = PlannerSyncEngine(client, max_workers=workers, backoff_seconds=0.2)
+
+    began = time.monotonic()
+    outcomes = engine.run(specs, start, start + timedelta(hours=6))
+    elapsed = time.monotonic() - began
+
+    ok = sum(1 for o in outcomes if o.status == "success")
+    described = sum(1 for d in state.details.values() if d["description"])
+    print(f"usuários: {users}  sucesso: {ok}  erros: {users - ok}  descrições gravadas: {described}")
+    print(f"requisições HTTP: {state.http_calls} (antes: {users * 3})  operações: {state.operations}  "
+          f"429: {state.throttled}  tempo: {elapsed:.2f}s")
+    return ok == users
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--throttle", type=float, default=0.0, help="fração das operações respondidas com 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--selftest", action="store_true")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    state = FakePlanner(args.throttle, args.retry_after)
+    server = ThreadingHTTPServer(("127.0.0.1", 0 if args.selftest else args.port), make_handler(state))
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    if not args.selftest:
+        print(f"Graph falso em {url}/v1.0 (token em {url}/token)")
+        server.serve_forever()
+        return
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        sys.exit(0 if selftest(url, state, args.users, args.workers) else 1)
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
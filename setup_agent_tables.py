@@ -2,10 +2,13 @@
 """Script para criar as tabelas do Agente IA no Supabase."""
 
 import os
+
 import psycopg2
 import psycopg2.extras
 from pathlib import Path
 
+from utils.agent_schema import migrate as migrate_agent_schema
+
 # Tentar carregar variáveis do .env localmente (pasta atual ou raiz)
 env_paths = [
     Path(__file__).parent / ".env",
@@ -265,23 +268,11 @@ def create_tables():
         END $$;
     """)
     print("  - agent_dashboard_requests.template_id: OK")
-    
-    # Tabela de Logs do Agente
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS agent_logs (
-            id BIGSERIAL PRIMARY KEY,
-            action_type TEXT NOT NULL,
-            entity_type TEXT,
-            entity_id BIGINT,
-            user_id BIGINT REFERENCES users_new(id) ON DELETE SET NULL,
-            details JSONB,
-            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-        );
-        
-        CREATE INDEX IF NOT EXISTS idx_agent_logs_action_type ON agent_logs(action_type);
-        CREATE INDEX IF NOT EXISTS idx_agent_logs_created_at ON agent_logs(created_at);
-    """)
-    print("  - agent_logs: OK")
+
+    # Lease, agendamento, coalescência, snapshots, uploads, registro e
+    # agent_logs particionada: as mesmas migrações do ensure_schema() do app
+    migrate_agent_schema(cursor, int(os.getenv("AGENT_LOGS_RETENTION_MONTHS", "6")))
+    print("  - migrações do agente (utils/agent_schema.py): OK")
 
     # Tabela de Conversas do Chat
     cursor.execute("""
@@ -0,0 +1,203 @@
+"""
+Fixtures comuns dos testes.
+
+Os testes de Postgres rodam em um schema temporário por teste no banco de
+``TEST_DATABASE_URL`` (nunca o de produção) e são pulados sem a variável::
+
+    TEST_DATABASE_URL=postgresql://postgres@localhost:5432/postgres python -m pytest -q tests
+"""
+
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+# pytester: roda sessões do pytest dentro do teste (plugin de orçamento de consultas)
+pytest_plugins = ["pytester"]
+
+
+@pytest.fixture
+def pg_url():
+    url = os.getenv("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL não definida")
+    return url
+
+
+@pytest.fixture
+def pg_schema(pg_url):
+    """Nome de um schema vazio, removido ao fim do teste."""
+    psycopg2 = pytest.importorskip("psycopg2")
+    schema = f"test_{uuid.uuid4().hex[:12]}"
+    admin = psycopg2.connect(pg_url)
+    admin.autocommit = True
+    admin.cursor().execute(f"CREATE SCHEMA {schema}")
+    try:
+        yield schema
+    finally:
+        admin.cursor().execute(f"DROP SCHEMA {schema} CASCADE")
+        admin.close()
+
+
+@pytest.fixture
+def pg_connect(pg_url, pg_schema):
+    """Abre conexões (RealDictCursor, como o app) com o schema do teste no search_path."""
+    import psycopg2
+    import psycopg2.extras
+
+    opened = []
+
+    def connect():
+        conn = psycopg2.connect(pg_url, cursor_factory=psycopg2.extras.RealDictCursor)
+        with conn.cursor() as cursor:
+            cursor.execute(f"SET search_path TO {pg_schema}")
+        conn.commit()
+        opened.append(conn)
+        return conn
+
+    yield connect
+    for conn in opened:
+        conn.close()
+
+
+# Tabelas do agente como setup_agent_tables.py criava antes das migrações de
+# utils/agent_schema.py (bancos antigos)
+LEGACY_AGENT_TABLES_SQL = """
+CREATE TABLE users_new (
+    id BIGSERIAL PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE
+);
+CREATE TABLE agent_rpa_types (
+    id BIGSERIAL PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE agent_rpas (
+    id BIGSERIAL PRIMARY KEY,
+    name TEXT NOT NULL,
+    description TEXT,
+    rpa_type_id BIGINT REFERENCES agent_rpa_types(id) ON DELETE SET NULL,
+    priority TEXT NOT NULL DEFAULT 'medium',
+    frequency TEXT DEFAULT 'once',
+    parameters JSONB,
+    status TEXT NOT NULL DEFAULT 'pending',
+    result JSONB,
+    error_message TEXT,
+    created_by BIGINT REFERENCES users_new(id) ON DELETE SET NULL,
+    executed_at TIMESTAMPTZ,
+    completed_at TIMESTAMPTZ,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+CREATE TABLE agent_dashboard_templates (
+    id BIGSERIAL PRIMARY KEY,
+    title TEXT NOT NULL,
+    query_config JSONB,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+CREATE TABLE agent_dashboard_requests (
+    id BIGSERIAL PRIMARY KEY,
+    title TEXT NOT NULL,
+    description TEXT,
+    category TEXT NOT NULL DEFAULT 'Outros',
+    chart_types TEXT[],
+    filters JSONB,
+    status TEXT NOT NULL DEFAULT 'pending',
+    result_url TEXT,
+    result_data JSONB,
+    error_message TEXT,
+    created_by BIGINT REFERENCES users_new(id) ON DELETE SET NULL,
+    processed_at TIMESTAMPTZ,
+    completed_at TIMESTAMPTZ,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+CREATE TABLE agent_logs (
+    id BIGSERIAL PRIMARY KEY,
+    action_type TEXT NOT NULL,
+    entity_type TEXT,
+    entity_id BIGINT,
+    user_id BIGINT REFERENCES users_new(id) ON DELETE SET NULL,
+    details JSONB,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+CREATE INDEX idx_agent_logs_action_type ON agent_logs(action_type);
+INSERT INTO agent_rpa_types (name) VALUES ('Extração de Dados'), ('Monitoramento');
+"""
+
+
+@pytest.fixture
+def agent_db(pg_connect):
+    """Conexão com as tabelas antigas do agente já migradas por ``agent_schema.migrate``."""
+    from utils.agent_schema import migrate
+
+    conn = pg_connect()
+    cursor = conn.cursor()
+    cursor.execute(LEGACY_AGENT_TABLES_SQL)
+    migrate(cursor)
+    conn.commit()
+    return conn
+
+
+# Versão mínima das tabelas de ambientes (criadas no Supabase, fora do
+# ensure_schema), com as colunas usadas por utils/facilities.py e
+# utils/asset_pipeline.py
+ENVIRONMENT_TABLES_SQL = """
+CREATE TABLE environments (
+    id SERIAL PRIMARY KEY,
+    code TEXT NOT NULL,
+    name TEXT,
+    description TEXT,
+    icon TEXT,
+    floor TEXT,
+    is_active BOOLEAN NOT NULL DEFAULT TRUE,
+    display_order INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE environment_resources (
+    id SERIAL PRIMARY KEY,
+    environment_id INTEGER NOT NULL REFERENCES environments(id) ON DELETE CASCADE,
+    resource_type TEXT,
+    file_name TEXT,
+    mime_type TEXT,
+    file_url TEXT,
+    is_primary BOOLEAN NOT NULL DEFAULT FALSE,
+    display_order INTEGER
+);
+CREATE TABLE environment_asset_variants (
+    resource_id BIGINT PRIMARY KEY,
+    storage_path TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    locked_until TIMESTAMPTZ,
+    optimized_url TEXT,
+    preview_url TEXT,
+    original_size BIGINT,
+    optimized_size BIGINT,
+    preview_size BIGINT,
+    stats JSONB,
+    error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+"""
+
+
+@pytest.fixture
+def environment_db(pg_connect):
+    """Conexão com as tabelas de ambientes, os contadores e o índice da página de instalações."""
+    from utils.environment_counters import install
+    from utils.facilities import SCOPE_INDEX_SQL
+
+    conn = pg_connect()
+    cursor = conn.cursor()
+    cursor.execute(ENVIRONMENT_TABLES_SQL)
+    install(cursor)
+    cursor.execute(SCOPE_INDEX_SQL)
+    conn.commit()
+    return conn
@@ -0,0 +1,98 @@
+from contextlib import contextmanager
+
+from utils.agent_dispatch import pending_jobs, plan_claim, register_agent, remember_affinity
+from utils.agent_jobs import claim_jobs, reap_expired
+from utils.rpa_scheduler import RpaScheduler
+
+
+def add_old_rpa(conn, status="pending", frequency="once"):
+    """RPA criada há duas horas (e enfileirada na criação)."""
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        INSERT INTO agent_rpas (name, rpa_type_id, parameters, status, frequency, created_at, queued_at)
+        VALUES ('rpa', (SELECT id FROM agent_rpa_types WHERE name = 'Extração de Dados'),
+                '{"query": "SELECT 1"}'::jsonb, %s, %s, NOW() - INTERVAL '2 hours', NOW() - INTERVAL '2 hours')
+        RETURNING id
+        """,
+        (status, frequency),
+    )
+    job_id = cursor.fetchone()["id"]
+    conn.commit()
+    return job_id
+
+
+def waited(cursor, job_id):
+    return next(job.waited for job in pending_jobs(cursor, "rpa", 10) if job.job_id == job_id)
+
+
+def test_requeued_recurring_rpa_waits_from_requeue(agent_db):
+    job_id = add_old_rpa(agent_db, status="completed", frequency="every 1h")
+    cursor = agent_db.cursor()
+    cursor.execute("UPDATE agent_rpas SET next_run_at = NOW() - INTERVAL '1 second' WHERE id = %s", (job_id,))
+    agent_db.commit()
+
+    @contextmanager
+    def scope():
+        yield agent_db
+
+    scheduler = RpaScheduler(scope, lambda cursor: 5, max_jitter=0)
+    assert scheduler.run_once() == [job_id]
+    assert waited(cursor, job_id) < 60
+
+
+def test_scheduler_slots_ignore_rpas_the_agent_never_claims(agent_db):
+    cursor = agent_db.cursor()
+    # Pendentes que o agente não reserva: outro tipo e seguidora de um líder
+    cursor.execute(
+        """
+        INSERT INTO agent_rpas (name, rpa_type_id, parameters, status)
+        VALUES ('monitor', (SELECT id FROM agent_rpa_types WHERE name = 'Monitoramento'), '{}'::jsonb, 'pending')
+        """
+    )
+    leader_id = add_old_rpa(agent_db, status="running")
+    follower_id = add_old_rpa(agent_db)
+    cursor.execute("UPDATE agent_rpas SET leader_id = %s WHERE id = %s", (leader_id, follower_id))
+    job_id = add_old_rpa(agent_db, status="completed", frequency="every 1h")
+    cursor.execute("UPDATE agent_rpas SET next_run_at = NOW() - INTERVAL '1 second' WHERE id = %s", (job_id,))
+    agent_db.commit()
+
+    @contextmanager
+    def scope():
+        yield agent_db
+
+    # Só a líder em execução ocupa vaga
+    assert RpaScheduler(scope, lambda cursor: 1, max_jitter=0).run_once() == []
+    assert RpaScheduler(scope, lambda cursor: 2, max_jitter=0).run_once() == [job_id]
+
+
+def test_reaped_job_waits_from_requeue(agent_db):
+    job_id = add_old_rpa(agent_db)
+    cursor = agent_db.cursor()
+    assert waited(cursor, job_id) > 3600
+    claim_jobs(cursor, "rpa", "agent-a")
+    cursor.execute("UPDATE agent_rpas SET lease_expires_at = NOW() - INTERVAL '1 second' WHERE id = %s", (job_id,))
+    reap_expired(cursor, "rpa")
+    agent_db.commit()
+    assert waited(cursor, job_id) < 60
+
+
+def test_requeued_job_goes_through_affinity_again(agent_db):
+    cursor = agent_db.cursor()
+    for agent_id in ("agent-a", "agent-b"):
+        register_agent(cursor, agent_id, {"job_types": ["rpa"], "max_concurrency": 2})
+    agent_db.commit()
+    job_id = add_old_rpa(agent_db)
+    [job] = pending_jobs(cursor, "rpa", 10)
+    remember_affinity(cursor, "agent-a", [job.affinity_key])
+
+    # Criada há duas horas: quem pedir primeiro leva, passando por cima da afinidade
+    ids, decisions, _ = plan_claim(cursor, "rpa", "agent-b", 5, max_wait=30)
+    assert ids == [job_id] and decisions[job_id].reason.startswith("espera")
+
+    # Reenfileirada agora: volta a respeitar a afinidade com agent-a
+    cursor.execute("UPDATE agent_rpas SET queued_at = NOW() WHERE id = %s", (job_id,))
+    ids, decisions, _ = plan_claim(cursor, "rpa", "agent-b", 5, max_wait=30)
+    assert ids == []
+    ids, decisions, _ = plan_claim(cursor, "rpa", "agent-a", 5, max_wait=30)
+    assert ids == [job_id] and decisions[job_id].reason == "afinidade"
@@ -0,0 +1,100 @@
+import threading
+
+from utils.agent_jobs import claim_jobs, reap_expired, renew_leases
+
+
+def add_rpas(conn, count, **fields):
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        INSERT INTO agent_rpas (name, rpa_type_id, parameters, priority)
+        SELECT 'rpa-' || n, (SELECT id FROM agent_rpa_types WHERE name = 'Extração de Dados'),
+               '{"query": "SELECT 1"}'::jsonb, %s
+        FROM generate_series(1, %s) n
+        RETURNING id
+        """,
+        (fields.get("priority", "medium"), count),
+    )
+    ids = [row["id"] for row in cursor.fetchall()]
+    conn.commit()
+    return ids
+
+
+def expire(conn, ids):
+    """Simula o tempo passando sem heartbeat para esses jobs."""
+    cursor = conn.cursor()
+    cursor.execute("UPDATE agent_rpas SET lease_expires_at = NOW() - INTERVAL '1 second' WHERE id = ANY(%s)", (ids,))
+    conn.commit()
+
+
+def test_concurrent_agents_never_claim_the_same_job(agent_db, pg_connect):
+    add_rpas(agent_db, 40)
+    barrier = threading.Barrier(4)
+    claimed = {}
+
+    def agent(name):
+        conn = pg_connect()
+        cursor = conn.cursor()
+        barrier.wait()
+        jobs = []
+        while True:
+            batch = claim_jobs(cursor, "rpa", name, limit=3)
+            conn.commit()
+            if not batch:
+                break
+            jobs += [job["id"] for job in batch]
+        claimed[name] = jobs
+
+    threads = [threading.Thread(target=agent, args=(f"agent-{n}",)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    all_ids = [job_id for jobs in claimed.values() for job_id in jobs]
+    assert len(all_ids) == 40
+    assert len(set(all_ids)) == 40
+
+
+def test_held_jobs_survive_while_renewed_and_requeue_when_not(agent_db, pg_connect):
+    ids = add_rpas(agent_db, 5)
+    a, b = agent_db.cursor(), pg_connect().cursor()
+
+    held = [job["id"] for job in claim_jobs(a, "rpa", "agent-a", limit=5, lease_seconds=60)]
+    agent_db.commit()
+    assert sorted(held) == ids
+
+    # O agente A renova todos os jobs que segura, inclusive os que esperam a vez
+    expire(agent_db, held)
+    assert sorted(renew_leases(a, "rpa", "agent-a", held, 60)) == ids
+    agent_db.commit()
+    assert reap_expired(b, "rpa") == (0, 0)
+    assert claim_jobs(b, "rpa", "agent-b") == []
+    b.connection.commit()
+
+    # Sem heartbeat para dois deles: voltam à fila e o agente B os recebe
+    expire(agent_db, held[:2])
+    assert reap_expired(b, "rpa") == (2, 0)
+    reclaimed = [job["id"] for job in claim_jobs(b, "rpa", "agent-b")]
+    b.connection.commit()
+    assert sorted(reclaimed) == sorted(held[:2])
+
+    # A não renova mais o que foi para B
+    assert sorted(renew_leases(a, "rpa", "agent-a", held, 60)) == sorted(held[2:])
+    agent_db.commit()
+
+
+def test_job_fails_after_max_attempts(agent_db):
+    [job_id] = add_rpas(agent_db, 1)
+    cursor = agent_db.cursor()
+    for attempt in range(3):
+        assert [job["id"] for job in claim_jobs(cursor, "rpa", "agent-a")] == [job_id]
+        agent_db.commit()
+        expire(agent_db, [job_id])
+        assert reap_expired(cursor, "rpa", max_attempts=3) == ((1, 0) if attempt < 2 else (0, 1))
+        agent_db.commit()
+
+    cursor.execute("SELECT status, attempts, error_message FROM agent_rpas WHERE id = %s", (job_id,))
+    row = cursor.fetchone()
+    assert (row["status"], row["attempts"]) == ("failed", 3)
+    assert "agent-a" in row["error_message"]
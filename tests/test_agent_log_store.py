@@ -0,0 +1,153 @@
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+
+import pytest
+
+from utils.agent_log_store import AgentLogStore, expired_partitions, month_start, partition_name
+
+
+@pytest.mark.parametrize("day, offset, expected", [
+    (date(2024, 3, 31), 0, date(2024, 3, 1)),
+    (date(2024, 11, 15), 1, date(2024, 12, 1)),
+    (date(2024, 11, 15), 2, date(2025, 1, 1)),  # virada do ano para frente
+    (date(2024, 1, 31), -1, date(2023, 12, 1)),  # e para trás
+    (date(2024, 3, 10), -14, date(2023, 1, 1)),
+    (date(2024, 12, 1), 25, date(2027, 1, 1)),
+])
+def test_month_start(day, offset, expected):
+    assert month_start(day, offset) == expected
+
+
+def test_partition_name():
+    assert partition_name(date(2025, 1, 1)) == "agent_logs_202501"
+
+
+PARTITIONS = [
+    "agent_logs_202402", "agent_logs_202212", "agent_logs_202309", "agent_logs_202308",
+    "agent_logs_202401", "agent_logs", "agent_logs_legacy", "agent_logs_2023", "agent_logs_default",
+]
+
+
+@pytest.mark.parametrize("today, retention, expected", [
+    # Seis meses a partir de fevereiro/2024: setembro/2023 é o mais antigo mantido
+    (date(2024, 2, 10), 6, ["agent_logs_202212", "agent_logs_202308"]),
+    (date(2024, 2, 29), 6, ["agent_logs_202212", "agent_logs_202308"]),
+    (date(2024, 3, 1), 6, ["agent_logs_202212", "agent_logs_202308", "agent_logs_202309"]),
+    # Retenção de um mês: só o mês atual fica
+    (date(2024, 2, 1), 1, ["agent_logs_202212", "agent_logs_202308", "agent_logs_202309", "agent_logs_202401"]),
+    # Janela atravessando a virada do ano
+    (date(2024, 1, 5), 5, ["agent_logs_202212", "agent_logs_202308"]),
+    (date(2024, 1, 5), 15, []),
+])
+def test_expired_partitions(today, retention, expected):
+    assert expired_partitions(PARTITIONS, today, retention) == expected
+
+
+@pytest.fixture
+def store_factory(agent_db, pg_connect):
+    """Lojas ligadas ao ``agent_logs`` particionado de ``agent_db``; contam os INSERTs."""
+    made = []
+
+    @contextmanager
+    def scope():
+        yield pg_connect()
+
+    def make(threaded=False, **kwargs):
+        store = AgentLogStore(scope, **kwargs)
+        store.inserts = []
+        insert = store._insert
+
+        def counting_insert(batch):
+            store.inserts.append(len(batch))
+            insert(batch)
+
+        store._insert = counting_insert
+        if not threaded:
+            store._ensure_thread = lambda: None  # o teste chama flush
+        made.append(store)
+        return store
+
+    yield make
+    for store in made:
+        store._stop.set()
+        store._wake.set()
+
+
+def logged(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT action_type, entity_id, details, created_at FROM agent_logs ORDER BY entity_id")
+    rows = cursor.fetchall()
+    conn.commit()
+    return rows
+
+
+def test_flush_writes_the_queue_in_batches(agent_db, store_factory):
+    store = store_factory(batch_size=500)
+    before = datetime.now(timezone.utc)
+    for n in range(1203):
+        store.write("rpa_executed", "rpa", n, None, {"n": n} if n % 2 else None)
+    written_at = datetime.now(timezone.utc)
+    time.sleep(0.05)
+
+    assert store.flush() == 1203
+    assert store.inserts == [500, 500, 203]
+    assert store.flush() == 0
+
+    rows = logged(agent_db)
+    assert [row["entity_id"] for row in rows] == list(range(1203))
+    assert rows[1]["details"] == {"n": 1} and rows[0]["details"] is None
+    # created_at é o momento do write, não o do flush
+    assert all(before <= row["created_at"] <= written_at for row in rows)
+
+
+def test_full_queue_drops_instead_of_blocking(agent_db, store_factory):
+    store = store_factory(max_queue=3)
+    for n in range(5):
+        store.write("rpa_executed", "rpa", n)
+
+    assert store.dropped == 2
+    assert store.flush() == 3
+    assert [row["entity_id"] for row in logged(agent_db)] == [0, 1, 2]
+
+
+def test_failed_batch_is_logged_and_the_rest_waits(agent_db, store_factory):
+    store = store_factory(batch_size=2)
+    for n in range(4):
+        store.write("rpa_executed", "rpa", n, details={"bad": "\x00"} if n == 1 else None)
+
+    # O primeiro lote falha (NUL não cabe em JSONB): o flush para e o próximo lote fica na fila
+    assert store.flush() == 0
+    assert store.flush() == 2
+    assert [row["entity_id"] for row in logged(agent_db)] == [2, 3]
+
+
+def test_writer_thread_flushes_when_the_batch_fills(agent_db, store_factory):
+    store = store_factory(threaded=True, batch_size=10, flush_seconds=3600)
+    for n in range(10):
+        store.write("rpa_executed", "rpa", n)
+
+    deadline = time.monotonic() + 10
+    while len(logged(agent_db)) < 10 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert len(logged(agent_db)) == 10  # sem esperar os flush_seconds
+    assert store.inserts == [10]
+
+
+def test_maintain_creates_upcoming_and_drops_expired_partitions(agent_db, store_factory):
+    cursor = agent_db.cursor()
+    cursor.execute("SELECT relname FROM pg_inherits JOIN pg_class ON oid = inhrelid "
+                   "WHERE inhparent = 'agent_logs'::regclass")
+    existing = sorted(row["relname"] for row in cursor.fetchall())
+    agent_db.commit()
+    store = store_factory(retention_months=3, months_ahead=2)
+
+    # Três anos depois: todas as partições atuais saíram da retenção
+    later = month_start(date.today(), 36)
+    upcoming = [partition_name(month_start(later, offset)) for offset in range(3)]
+    assert store.maintain(today=later) == {"created": upcoming, "dropped": existing}
+    assert store.maintain(today=later) == {"created": [], "dropped": []}
+
+    cursor.execute("SELECT relname FROM pg_inherits JOIN pg_class ON oid = inhrelid "
+                   "WHERE inhparent = 'agent_logs'::regclass ORDER BY relname")
+    assert [row["relname"] for row in cursor.fetchall()] == upcoming
@@ -0,0 +1,45 @@
+from datetime import date
+
+from utils.agent_schema import migrate, tables_exist
+
+from conftest import LEGACY_AGENT_TABLES_SQL
+
+
+def columns(cursor, table):
+    cursor.execute(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = %s",
+        (table,),
+    )
+    return {row["column_name"] for row in cursor.fetchall()}
+
+
+def test_migrate_upgrades_legacy_tables_and_is_idempotent(pg_connect):
+    conn = pg_connect()
+    cursor = conn.cursor()
+    assert not tables_exist(cursor)
+    cursor.execute(LEGACY_AGENT_TABLES_SQL)
+    cursor.execute(
+        "INSERT INTO agent_logs (action_type, created_at) VALUES ('old', NOW() - INTERVAL '3 years'), ('recent', NOW())"
+    )
+    assert tables_exist(cursor)
+
+    migrate(cursor, retention_months=6, today=date.today())
+    migrate(cursor, retention_months=6, today=date.today())  # segunda inicialização: nada muda
+    conn.commit()
+
+    assert {"leased_by", "lease_expires_at", "attempts", "progress", "fingerprint", "leader_id",
+            "next_run_at", "last_scheduled_at"} <= columns(cursor, "agent_rpas")
+    assert {"leased_by", "fingerprint", "leader_id", "watermark_from", "template_id"} <= columns(
+        cursor, "agent_dashboard_requests"
+    )
+    for table in ("agent_dashboard_snapshots", "agent_dashboard_watermarks", "agent_result_chunks",
+                  "agent_result_uploads", "agent_result_upload_parts", "agent_registry", "agent_affinity"):
+        assert columns(cursor, table), table
+
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('agent_logs')")
+    assert cursor.fetchone()["relkind"] == "p"
+    cursor.execute("SELECT action_type FROM agent_logs")
+    assert [row["action_type"] for row in cursor.fetchall()] == ["recent"]  # fora da retenção fica de fora
+    cursor.execute("INSERT INTO agent_logs (action_type) VALUES ('new') RETURNING id")
+    assert cursor.fetchone()["id"] > 2
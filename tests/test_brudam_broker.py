@@ -0,0 +1,156 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from utils.brudam_broker import BrokerUnavailable, ConnectionBroker
+
+
+class Host:
+    """Servidor TCP local em 127.0.0.x, sem ``accept``: o kernel completa o handshake."""
+
+    def __init__(self, address, port, backlog=16):
+        self.address = address
+        self.port = port
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind((address, port))
+        self.server.listen(backlog)
+        self.fillers = []
+
+    def black_hole(self):
+        """Enche a fila de conexões: os próximos SYN são descartados (sem resposta)."""
+        while True:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.settimeout(0.3)
+            try:
+                sock.connect((self.address, self.port))
+            except socket.timeout:
+                sock.close()
+                return
+            self.fillers.append(sock)
+
+    def release_after(self, delay):
+        """Esvazia a fila depois de ``delay`` s: o SYN reenviado pelo cliente é aceito."""
+        def drain():
+            time.sleep(delay)
+            self.server.settimeout(0.1)
+            try:
+                while True:
+                    self.server.accept()[0].close()
+            except OSError:
+                pass
+
+        threading.Thread(target=drain, daemon=True).start()
+
+    def close(self):
+        for sock in self.fillers:
+            sock.close()
+        self.server.close()
+
+
+@pytest.fixture
+def hosts():
+    """Fábrica de hosts na mesma porta (o broker usa uma porta para todos)."""
+    probe = socket.socket()
+    probe.bind(("127.0.0.1", 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    opened = []
+
+    def make(address, listening=True, backlog=16):
+        if not listening:
+            return address  # nada escutando: conexão recusada
+        host = Host(address, port, backlog)
+        opened.append(host)
+        return host
+
+    make.port = port
+    yield make
+    for host in opened:
+        host.close()
+
+
+def connected_host(broker):
+    def factory(host, sock):
+        sock.close()
+        return host
+    return broker.connect(factory)
+
+
+def test_black_holed_host_loses_the_race(hosts):
+    dead = hosts("127.0.0.2", backlog=0)
+    dead.black_hole()
+    hosts("127.0.0.3")
+    broker = ConnectionBroker(["127.0.0.2", "127.0.0.3"], hosts.port, connect_timeout=5)
+
+    started = time.monotonic()
+    assert connected_host(broker) == "127.0.0.3"
+    assert time.monotonic() - started < 1
+    assert broker.status()["preferred"] == "127.0.0.3"
+
+
+def test_refusing_host_opens_its_circuit(hosts):
+    refused = hosts("127.0.0.2", listening=False)
+    hosts("127.0.0.3")
+    broker = ConnectionBroker([refused, "127.0.0.3"], hosts.port, failure_threshold=1, reset_timeout=60)
+
+    assert connected_host(broker) == "127.0.0.3"
+    assert broker.status()["hosts"][refused]["state"] == "open"
+    # Circuito aberto: o host recusado nem entra mais na corrida
+    with pytest.raises(BrokerUnavailable, match="circuit breaker"):
+        broker.acquire_socket(exclude=["127.0.0.3"])
+
+
+def test_slow_host_connects_within_timeout(hosts):
+    slow = hosts("127.0.0.2", backlog=0)
+    slow.black_hole()
+    slow.release_after(0.3)
+    broker = ConnectionBroker(["127.0.0.2"], hosts.port, connect_timeout=5)
+
+    started = time.monotonic()
+    assert connected_host(broker) == "127.0.0.2"
+    assert time.monotonic() - started >= 0.3
+
+
+def test_no_host_answering_raises_within_connect_timeout(hosts):
+    dead = hosts("127.0.0.2", backlog=0)
+    dead.black_hole()
+    refused = hosts("127.0.0.3", listening=False)
+    broker = ConnectionBroker(["127.0.0.2", refused], hosts.port, connect_timeout=0.5)
+
+    started = time.monotonic()
+    with pytest.raises(BrokerUnavailable, match="127.0.0.2") as info:
+        connected_host(broker)
+    assert time.monotonic() - started < 2
+    assert "127.0.0.3" in str(info.value)
+    assert broker.status()["hosts"]["127.0.0.2"]["failures"] == 1
+
+
+def test_sticky_host_falls_back_to_race_when_black_holed(hosts):
+    first = hosts("127.0.0.2", backlog=0)
+    hosts("127.0.0.3")
+    broker = ConnectionBroker(["127.0.0.2", "127.0.0.3"], hosts.port, connect_timeout=5, sticky_timeout=0.3)
+    broker._record("127.0.0.2", success=True)  # vencedor anterior
+    first.black_hole()
+
+    started = time.monotonic()
+    assert connected_host(broker) == "127.0.0.3"
+    assert time.monotonic() - started < 1.5
+    assert broker.status()["preferred"] == "127.0.0.3"
+
+
+def test_mysql_failure_on_every_host_is_chained(hosts):
+    hosts("127.0.0.2")
+    hosts("127.0.0.3")
+    broker = ConnectionBroker(["127.0.0.2", "127.0.0.3"], hosts.port)
+    attempts = []
+
+    def factory(host, sock):
+        attempts.append(host)
+        raise ConnectionResetError(f"handshake MySQL recusado por {host}")
+
+    with pytest.raises(BrokerUnavailable) as info:
+        broker.connect(factory)
+    assert sorted(attempts) == ["127.0.0.2", "127.0.0.3"]
+    assert isinstance(info.value.__cause__, ConnectionResetError)
@@ -0,0 +1,131 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import pytest
+
+from utils.dashboard_snapshots import DashboardSnapshotStore
+
+
+class FakeBrudam:
+    """ERP de mentira: ``rows`` fora de ordem, ordenadas por ``id`` só com ORDER BY; conta as execuções."""
+
+    def __init__(self, rows, delay=0.0):
+        self.rows = rows
+        self.delay = delay
+        self.calls = []
+
+    def __call__(self, sql, params=None, max_rows=None):
+        self.calls.append((sql, params))
+        time.sleep(self.delay)
+        rows = self.rows
+        if "ORDER BY snapshot_src.`id` ASC" in sql:
+            rows = sorted(rows, key=lambda row: row["id"])
+        if params:
+            assert "ORDER BY snapshot_src.`id` ASC" in sql
+            rows = [row for row in rows if row["id"] > int(params[0])]
+        return {"data": [dict(row) for row in rows[:max_rows]], "fields": ["id", "n"]}
+
+
+@pytest.fixture
+def template(agent_db):
+    cursor = agent_db.cursor()
+    cursor.execute("INSERT INTO agent_dashboard_templates (title) VALUES ('t') RETURNING id")
+    template_id = cursor.fetchone()["id"]
+    agent_db.commit()
+    return template_id
+
+
+@pytest.fixture
+def make_store(pg_connect):
+    def make(run_query, **kwargs):
+        conn = pg_connect()
+
+        @contextmanager
+        def scope():
+            try:
+                yield conn
+            finally:
+                conn.rollback()
+
+        return DashboardSnapshotStore(scope, run_query, **kwargs)
+
+    return make
+
+
+def test_first_load_waits_for_the_lease_holder(template, make_store):
+    brudam = FakeBrudam([{"id": 1, "n": "a"}], delay=1.0)
+    config = {"query": "SELECT id, n FROM t"}
+    holder, waiter = make_store(brudam), make_store(brudam)
+
+    results = {}
+    thread = threading.Thread(target=lambda: results.setdefault("holder", holder.load(template, config, 10)))
+    thread.start()
+    time.sleep(0.2)  # o outro worker já tem o lease
+    results["waiter"] = waiter.load(template, config, 10, poll=0.1)
+    thread.join()
+
+    assert len(brudam.calls) == 1
+    assert results["waiter"]["data"] == results["holder"]["data"] == [{"id": 1, "n": "a"}]
+
+
+def test_first_load_gives_up_after_timeout(template, make_store):
+    config = {"query": "SELECT id, n FROM t"}
+    brudam = FakeBrudam([])
+    holder = make_store(brudam)
+    assert holder.claim(template)
+
+    assert make_store(brudam).load(template, config, 0.3, poll=0.1) is None
+    assert brudam.calls == []
+
+
+def test_incremental_refresh_pages_in_watermark_order(template, make_store):
+    brudam = FakeBrudam([{"id": 1, "n": "a"}, {"id": 2, "n": "b"}])
+    config = {"query": "SELECT id, n FROM t", "watermark_column": "id"}
+    store = make_store(brudam, max_rows=4)
+    store.refresh(template, config)
+
+    # Chegam linhas com empate no meio de uma página cheia
+    brudam.rows = [{"id": i, "n": "x"} for i in (6, 4, 3, 4, 5, 4)]
+    store.refresh(template, config)
+
+    read = [params for _, params in brudam.calls[1:]]
+    assert read == [("2",), ("3",), ("4",)]  # watermark só avança até a última linha completa
+    snapshot = store.get(template, config["query"])
+    assert snapshot["watermark"] == "6"
+    assert [row["id"] for row in snapshot["data"]] == [4, 4, 5, 6]  # max_rows mais recentes
+
+
+def test_incremental_refresh_resumes_where_the_page_budget_stopped(template, make_store):
+    brudam = FakeBrudam([{"id": 0, "n": "a"}])
+    config = {"query": "SELECT id, n FROM t", "watermark_column": "id", "key_columns": ["id"]}
+    store = make_store(brudam, max_rows=2, max_pages=1)
+    store.refresh(template, config)
+
+    brudam.rows = [{"id": i, "n": "x"} for i in range(1, 6)]
+    watermarks = []
+    for _ in range(5):
+        store.refresh(template, config)
+        watermarks.append(store.get(template, config["query"])["watermark"])
+    # Página cheia: a última linha pode ter empates além do LIMIT e fica para a próxima
+    assert watermarks == ["1", "2", "3", "4", "5"]
+
+
+def test_truncated_first_load_keeps_the_skipped_rows_for_later(template, make_store):
+    # Fora de ordem: sem ORDER BY, o LIMIT 3 pegaria 5, 3 e 1 e o watermark 5 perderia 2 e 4
+    brudam = FakeBrudam([{"id": i, "n": "x"} for i in (5, 3, 1, 4, 2)])
+    config = {"query": "SELECT id, n FROM t", "watermark_column": "id", "key_columns": ["id"]}
+    store = make_store(brudam, max_rows=3, max_pages=2)
+
+    store.refresh(template, config)
+    sql, params = brudam.calls[0]
+    assert "ORDER BY snapshot_src.`id` ASC" in sql and "WHERE" not in sql and params is None
+    assert [params for _, params in brudam.calls[1:]] == [("2",)]
+    snapshot = store.get(template, config["query"])
+    assert snapshot["watermark"] == "4"  # páginas cheias: o empate com a última fica para depois
+    assert [row["id"] for row in snapshot["data"]] == [2, 3, 4]
+
+    store.refresh(template, config)
+    snapshot = store.get(template, config["query"])
+    assert snapshot["watermark"] == "5"
+    assert [row["id"] for row in snapshot["data"]] == [3, 4, 5]
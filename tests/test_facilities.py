@@ -0,0 +1,93 @@
+import pytest
+
+from utils.facilities import SCOPE_INDEX, SUMMARY_SQL, CursorError, fetch_resource_page, resource_page_query
+
+
+def plan_nodes(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def explain(cursor, sql, params=None):
+    cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+    return list(plan_nodes(next(iter(cursor.fetchone().values()))[0]["Plan"]))
+
+
+@pytest.fixture
+def facilities(environment_db):
+    """Três ambientes; o primeiro com 2000 recursos de todos os tipos."""
+    cursor = environment_db.cursor()
+    cursor.execute(
+        "INSERT INTO environments (code, name, display_order) SELECT 'env-' || n, 'Ambiente ' || n, n "
+        "FROM generate_series(1, 3) n"
+    )
+    cursor.execute(
+        """
+        INSERT INTO environment_resources (environment_id, resource_type, file_name, file_url, is_primary, display_order)
+        SELECT CASE WHEN n <= 2000 THEN 1 ELSE 2 END,
+               (ARRAY['model_3d', 'photo', 'plant_2d', 'document'])[n % 4 + 1],
+               'arquivo-' || n, 'https://cdn/' || n, n IN (400, 401), n % 5
+        FROM generate_series(1, 2100) n
+        """
+    )
+    cursor.execute("ANALYZE environments; ANALYZE environment_resources")
+    environment_db.commit()
+    return environment_db
+
+
+def test_summary_and_pages_come_from_the_scope_index(facilities):
+    cursor = facilities.cursor()
+    # Tabelas pequenas: o planner prefere seq scan; sem ele, o índice tem de atender
+    cursor.execute("SET LOCAL enable_seqscan = off")
+    plans = {
+        "resumo": (explain(cursor, SUMMARY_SQL), True),  # ordena só os ambientes
+        "página": (explain(cursor, *resource_page_query(1, "photo", 24)), False),
+        "página seguinte": (explain(cursor, *resource_page_query(1, "photo", 24, (True, 2, 100))), False),
+    }
+    for name, (nodes, allow_sort) in plans.items():
+        assert any(node.get("Index Name") == SCOPE_INDEX for node in nodes), name
+        assert not any(
+            node["Node Type"] == "Seq Scan" and node.get("Relation Name") == "environment_resources" for node in nodes
+        ), name
+        if not allow_sort:
+            assert not any(node["Node Type"] in ("Sort", "Incremental Sort") for node in nodes), name
+    facilities.rollback()
+
+
+def test_cursor_pages_walk_every_resource_once_in_order(facilities):
+    cursor = facilities.cursor()
+    cursor.execute(
+        """
+        SELECT id FROM environment_resources
+        WHERE environment_id = 1 AND resource_type = 'photo'
+        ORDER BY (is_primary IS NOT TRUE), COALESCE(display_order, 0), id
+        """
+    )
+    expected = [row["id"] for row in cursor.fetchall()]
+
+    seen, after = [], None
+    while True:
+        page = fetch_resource_page(cursor, 1, "photo", limit=24, after=after)
+        assert len(page["items"]) <= 24
+        seen.extend(item["id"] for item in page["items"])
+        after = page["next_cursor"]
+        if after is None:
+            break
+
+    assert seen == expected
+    assert seen[0] == 401  # recurso primário primeiro
+
+
+def test_summary_counts_come_from_the_counters(facilities):
+    cursor = facilities.cursor()
+    cursor.execute(SUMMARY_SQL)
+    summary = {row["code"]: row for row in cursor.fetchall()}
+    assert [summary["env-1"][column] for column in ("models", "photos", "plants", "documents")] == [500] * 4
+    assert summary["env-1"]["model_url"] == "https://cdn/400"  # modelo primário
+    assert summary["env-3"]["model_url"] is None
+
+
+def test_invalid_cursor_is_rejected(facilities):
+    with pytest.raises(CursorError):
+        fetch_resource_page(facilities.cursor(), 1, "photo", after="nao-e-um-cursor")
@@ -0,0 +1,241 @@
+import io
+import struct
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils.asset_pipeline import AssetPipeline, enqueue_glb, variant_path
+from utils.glb_optimizer import (
+    ARRAY_BUFFER,
+    ELEMENT_ARRAY_BUFFER,
+    FLOAT,
+    QUANTIZATION_EXTENSION,
+    UNSIGNED_INT,
+    GltfDocument,
+    GlbError,
+    optimize_glb,
+    preview_glb,
+    read_glb,
+    write_glb,
+)
+
+GRID = 4  # quadrados por lado; cada um com os próprios 4 vértices (cantos repetidos)
+
+
+def texture_png(size=512):
+    """Gradiente com ruído, opaco: PNG grande que o otimizador consegue reduzir."""
+    ramp = np.linspace(0, 255, size, dtype=np.float64)
+    noise = np.random.default_rng(7).integers(0, 24, (size, size, 3))
+    pixels = np.stack([np.add.outer(ramp, ramp) / 2, np.tile(ramp, (size, 1)), np.tile(ramp[:, None], (1, size))], axis=2)
+    output = io.BytesIO()
+    Image.fromarray(np.clip(pixels + noise, 0, 255).astype(np.uint8), "RGB").save(output, format="PNG")
+    return output.getvalue()
+
+
+def quad_grid():
+    positions, normals, texcoords, indices = [], [], [], []
+    for row in range(GRID):
+        for col in range(GRID):
+            base = len(positions)
+            for dx, dy in ((0, 0), (1, 0), (1, 1), (0, 1)):
+                positions.append((col + dx, row + dy, 0.1 * ((col + dx) % 3)))
+                normals.append((0.0, 0.6, 0.8))
+                texcoords.append(((col + dx) / GRID, (row + dy) / GRID))
+            indices += [base, base + 1, base + 2, base, base + 2, base + 3]
+    return (np.array(positions, "<f4"), np.array(normals, "<f4"), np.array(texcoords, "<f4"),
+            np.array(indices, "<u4"))
+
+
+def build_glb():
+    """
+    Uma malha com duas primitivas de geometria idêntica gravada em bufferViews
+    separadas (dados duplicados) e uma textura PNG embutida.
+    """
+    positions, normals, texcoords, indices = quad_grid()
+    gltf = {
+        "asset": {"version": "2.0"},
+        "buffers": [{}], "bufferViews": [], "accessors": [],
+        "images": [], "textures": [{"source": 0}],
+        "materials": [{"pbrMetallicRoughness": {"baseColorTexture": {"index": 0}}}],
+        "meshes": [{"primitives": []}],
+        "nodes": [{"mesh": 0}], "scenes": [{"nodes": [0]}], "scene": 0,
+    }
+    binary = bytearray()
+
+    def view(data, target=None):
+        binary.extend(b"\x00" * (-len(binary) % 4))
+        entry = {"buffer": 0, "byteOffset": len(binary), "byteLength": len(data)}
+        if target:
+            entry["target"] = target
+        binary.extend(data)
+        gltf["bufferViews"].append(entry)
+        return len(gltf["bufferViews"]) - 1
+
+    def accessor(values, component_type, accessor_type, target):
+        entry = {"bufferView": view(values.tobytes(), target), "componentType": component_type,
+                 "count": len(values), "type": accessor_type}
+        if accessor_type == "VEC3" and target == ARRAY_BUFFER:
+            entry.update(min=values.min(axis=0).tolist(), max=values.max(axis=0).tolist())
+        gltf["accessors"].append(entry)
+        return len(gltf["accessors"]) - 1
+
+    for _ in range(2):
+        gltf["meshes"][0]["primitives"].append({
+            "attributes": {
+                "POSITION": accessor(positions, FLOAT, "VEC3", ARRAY_BUFFER),
+                "NORMAL": accessor(normals, FLOAT, "VEC3", ARRAY_BUFFER),
+                "TEXCOORD_0": accessor(texcoords, FLOAT, "VEC2", ARRAY_BUFFER),
+            },
+            "indices": accessor(indices, UNSIGNED_INT, "SCALAR", ELEMENT_ARRAY_BUFFER),
+            "material": 0,
+        })
+    gltf["images"].append({"bufferView": view(texture_png()), "mimeType": "image/png"})
+    gltf["buffers"][0]["byteLength"] = len(binary)
+
+    return write_glb(gltf, bytes(binary))
+
+
+@pytest.fixture(scope="module")
+def glb():
+    return build_glb()
+
+
+def primitive_arrays(doc):
+    for primitive in doc.primitives():
+        attributes = primitive["attributes"]
+        yield {
+            "indices": doc.read(primitive["indices"]).reshape(-1),
+            "positions": doc.read_float(attributes["POSITION"]),
+            "normals": doc.read_float(attributes["NORMAL"]),
+            "texcoords": doc.read_float(attributes["TEXCOORD_0"]),
+        }
+
+
+def texture(doc):
+    image = doc.gltf["images"][0]
+    return image["mimeType"], doc.views[image["bufferView"]]
+
+
+def test_optimized_glb_keeps_geometry_within_quantization_error(glb):
+    original = GltfDocument(glb)
+    result = optimize_glb(glb, max_texture_size=128)
+    optimized = GltfDocument(result.data)  # o resultado volta a ser um GLB válido
+
+    assert result.stats["size_bytes"] == len(result.data) < len(glb)
+    assert QUANTIZATION_EXTENSION in optimized.gltf["extensionsRequired"]
+    for before, after in zip(primitive_arrays(original), primitive_arrays(optimized), strict=True):
+        np.testing.assert_array_equal(after["indices"], before["indices"])
+        np.testing.assert_array_equal(after["positions"], before["positions"])  # POSITION fica em float32
+        assert np.abs(after["normals"] - before["normals"]).max() <= 0.5 / 127 + 1e-6
+        assert np.abs(after["texcoords"] - before["texcoords"]).max() <= 0.5 / 65535 + 1e-6
+    assert result.stats["quantization_error"]["NORMAL"] <= 0.5 / 127 + 1e-6
+    assert (result.stats["triangles"], result.stats["vertices"]) == (2 * 2 * GRID * GRID, 2 * 4 * GRID * GRID)
+
+    # Índices em uint16; as duas primitivas iguais apontam para as mesmas bufferViews
+    indices = [optimized.accessors[p["indices"]] for p in optimized.primitives()]
+    assert {accessor["componentType"] for accessor in indices} == {5123}
+    assert indices[0]["bufferView"] == indices[1]["bufferView"]
+    assert len(optimized.gltf["bufferViews"]) == 4 + 1
+
+
+def test_optimized_texture_is_smaller(glb):
+    _, before = texture(GltfDocument(glb))
+    result = optimize_glb(glb, max_texture_size=128)
+    mime_type, after = texture(GltfDocument(result.data))
+
+    assert len(after) < len(before)
+    assert mime_type == "image/jpeg"  # opaca: JPEG
+    assert Image.open(io.BytesIO(after)).size == (128, 128)
+    assert result.stats["textures_resized"] == 1
+    assert result.stats["texture_bytes_after"] == len(after)
+
+
+def test_preview_merges_duplicate_vertices(glb):
+    result = preview_glb(glb, grid=64, max_texture_size=64)
+    preview = GltfDocument(result.data)
+
+    assert result.stats["primitives_simplified"] == 2
+    # Os cantos repetidos dos quadrados viram um vértice; nenhum triângulo some
+    assert result.stats["vertices"] == 2 * (GRID + 1) ** 2
+    assert result.stats["triangles"] == 2 * 2 * GRID * GRID
+    corners = {(x, y) for x in range(GRID + 1) for y in range(GRID + 1)}
+    for arrays in primitive_arrays(preview):
+        assert {(x, y) for x, y, _ in arrays["positions"].tolist()} == corners
+    assert Image.open(io.BytesIO(texture(preview)[1])).size == (64, 64)
+
+
+@pytest.mark.parametrize("data, message", [
+    (b"not a glb at all....", "não é um GLB"),
+    (b"glTF" + struct.pack("<II", 1, 20) + b"\x00" * 8, "Versão"),
+    (b"glTF" + struct.pack("<II", 2, 999) + b"\x00" * 8, "truncado"),
+])
+def test_invalid_glb(data, message):
+    with pytest.raises(GlbError, match=message):
+        read_glb(data)
+
+
+class MemoryStorage:
+    def __init__(self, files):
+        self.files = dict(files)
+
+    def download(self, path):
+        return self.files[path]
+
+    def upload(self, fileobj, path, content_type):
+        self.files[path] = fileobj.read()
+        return SimpleNamespace(public_url=f"https://cdn/{path}")
+
+
+@pytest.fixture
+def pipeline_db(environment_db, pg_connect):
+    @contextmanager
+    def scope():
+        yield pg_connect()
+
+    def make(storage):
+        return AssetPipeline(scope, lambda: storage, max_texture_size=128, preview_grid=64)
+
+    return environment_db, make
+
+
+def test_pipeline_stores_optimized_and_preview_variants(glb, pipeline_db):
+    conn, make_pipeline = pipeline_db
+    cursor = conn.cursor()
+    assert enqueue_glb(cursor, 1, "environments/sala.glb")
+    assert not enqueue_glb(cursor, 2, "environments/planta.pdf")
+    conn.commit()
+    storage = MemoryStorage({"environments/sala.glb": glb})
+
+    assert make_pipeline(storage).run_once() == 1
+
+    cursor.execute("SELECT * FROM environment_asset_variants")
+    (row,) = cursor.fetchall()
+    assert row["status"] == "done" and row["error"] is None and row["locked_until"] is None
+    assert row["optimized_url"] == "https://cdn/environments/sala.optimized.glb"
+    assert row["preview_url"] == "https://cdn/environments/sala.preview.glb"
+    assert row["original_size"] == len(glb)
+    assert row["optimized_size"] < row["original_size"] and row["preview_size"] < row["original_size"]
+    for variant, size in (("optimized", row["optimized_size"]), ("preview", row["preview_size"])):
+        data = storage.files[variant_path("environments/sala.glb", variant)]
+        assert len(data) == size
+        read_glb(data)
+    assert row["stats"]["original"]["triangles"] == row["stats"]["optimized"]["triangles"]
+
+
+def test_pipeline_gives_up_on_invalid_glb(pipeline_db):
+    conn, make_pipeline = pipeline_db
+    cursor = conn.cursor()
+    enqueue_glb(cursor, 1, "environments/quebrado.glb")
+    conn.commit()
+    pipeline = make_pipeline(MemoryStorage({"environments/quebrado.glb": b"PK\x03\x04 zip, nao GLB"}))
+
+    assert pipeline.run_once() == 1
+    assert pipeline.run_once() == 0  # não volta para a fila
+
+    cursor.execute("SELECT status, attempts, error, optimized_url FROM environment_asset_variants")
+    row = cursor.fetchone()
+    assert (row["status"], row["attempts"], row["optimized_url"]) == ("error", pipeline.max_attempts, None)
+    assert "não é um GLB" in row["error"]
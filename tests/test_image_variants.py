@@ -0,0 +1,136 @@
+import io
+import threading
+
+import pytest
+from PIL import Image
+
+from utils.image_variants import ImageVariantError, ImageVariantService, render_variant
+
+
+def save(tmp_path, name, image, **params):
+    path = tmp_path / name
+    image.save(path, **params)
+    return path
+
+
+def decode(data):
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+
+@pytest.fixture
+def landscape(tmp_path):
+    """600x300: metade esquerda vermelha, direita azul, com uma faixa verde no centro."""
+    image = Image.new("RGB", (600, 300), (255, 0, 0))
+    image.paste((0, 0, 255), (300, 0, 600, 300))
+    image.paste((0, 255, 0), (290, 0, 310, 300))
+    return save(tmp_path, "paisagem.png", image)
+
+
+def test_avatar_is_a_centered_square_crop(landscape):
+    avatar = decode(render_variant(landscape, "avatar", 160, "jpg"))
+
+    assert avatar.format == "JPEG" and avatar.size == (160, 160)
+    # Recorte do centro (150..450): vermelho à esquerda, verde no meio, azul à direita
+    red, green, blue = avatar.getpixel((5, 80)), avatar.getpixel((80, 80)), avatar.getpixel((154, 80))
+    assert red[0] > 200 and red[2] < 60
+    assert green[1] > 200
+    assert blue[2] > 200 and blue[0] < 60
+
+
+def test_photo_keeps_the_aspect_ratio(landscape):
+    photo = decode(render_variant(landscape, "photo", 320, "webp"))
+    assert photo.format == "WEBP" and photo.size == (320, 160)
+
+
+@pytest.mark.parametrize("preset, width, expected", [
+    ("photo", 1280, (600, 300)),  # maior que a original: mantém
+    ("avatar", 320, (300, 300)),  # quadrado limitado ao menor lado
+    ("avatar", 40, (40, 40)),
+])
+def test_never_upscales(landscape, preset, width, expected):
+    assert decode(render_variant(landscape, preset, width, "jpg")).size == expected
+
+
+def test_alpha_becomes_white_in_jpeg(tmp_path):
+    image = Image.new("RGBA", (100, 100), (0, 0, 0, 0))
+    image.paste((200, 0, 0, 255), (0, 0, 50, 100))  # metade opaca
+    path = save(tmp_path, "logo.png", image)
+
+    jpeg = decode(render_variant(path, "avatar", 80, "jpg"))
+    assert jpeg.mode == "RGB"
+    assert jpeg.getpixel((75, 40)) == pytest.approx((255, 255, 255), abs=3)  # transparente: branco, não preto
+    assert jpeg.getpixel((5, 40)) == pytest.approx((200, 0, 0), abs=12)
+
+    webp = decode(render_variant(path, "avatar", 80, "webp"))
+    assert webp.mode == "RGBA" and webp.getpixel((75, 40))[3] == 0  # WebP mantém a transparência
+
+
+def test_palette_with_transparency_becomes_white_in_jpeg(tmp_path):
+    image = Image.new("P", (50, 50), 0)
+    image.putpalette([0, 0, 0, 0, 128, 0] + [0] * 762)
+    image.paste(1, (0, 0, 25, 50))
+    path = save(tmp_path, "icone.gif", image, transparency=0)
+
+    jpeg = decode(render_variant(path, "avatar", 40, "jpg"))
+    assert jpeg.getpixel((35, 20)) == pytest.approx((255, 255, 255), abs=3)
+
+
+def test_exif_orientation_is_applied(tmp_path):
+    image = Image.new("RGB", (400, 200), (255, 255, 255))
+    exif = image.getexif()
+    exif[0x0112] = 6  # girar 90°: a foto é retrato
+    path = save(tmp_path, "celular.jpg", image, exif=exif)
+
+    assert decode(render_variant(path, "photo", 320, "jpg")).size == (200, 400)
+
+
+@pytest.mark.parametrize("preset, width, fmt", [
+    ("banner", 320, "jpg"),
+    ("photo", 321, "jpg"),
+    ("avatar", 1280, "jpg"),
+    ("photo", 320, "gif"),
+])
+def test_invalid_variant(landscape, preset, width, fmt):
+    with pytest.raises(ImageVariantError):
+        render_variant(landscape, preset, width, fmt)
+
+
+def test_unreadable_image(tmp_path):
+    path = tmp_path / "foto.jpg"
+    path.write_bytes(b"isto nao e uma imagem")
+    with pytest.raises(ImageVariantError, match="não suportada"):
+        render_variant(path, "photo", 320, "jpg")
+
+
+def test_service_renders_once_per_content(tmp_path, landscape, monkeypatch):
+    import utils.image_variants as image_variants
+
+    renders = []
+    original = image_variants.render_variant
+
+    def counting(*args, **kwargs):
+        renders.append(args[1:4])
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(image_variants, "render_variant", counting)
+    # Duas URLs com o mesmo conteúdo (mesmo sha256)
+    service = ImageVariantService(tmp_path / "variants", lambda url: (landscape, "abc123"))
+    barrier = threading.Barrier(4)
+    paths = []
+
+    def request(url):
+        barrier.wait()
+        paths.append(service.variant(url, "avatar", 80, "webp"))
+
+    threads = [threading.Thread(target=request, args=(f"https://cdn/{n % 2}.png",)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert renders == [("avatar", 80, "webp")]
+    assert set(paths) == {tmp_path / "variants" / "abc123" / "avatar-80.webp"}
+    assert decode(paths[0].read_bytes()).size == (80, 80)
+    assert not list((tmp_path / "variants" / "tmp").iterdir())
@@ -0,0 +1,153 @@
+import threading
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from scripts.fake_graph_server import FakePlanner, make_handler
+from utils.planner_client import PlannerClient
+from utils.planner_sync import BATCH_LIMIT, PlannerSyncEngine, PlannerTaskSpec
+
+START = datetime(2024, 3, 4, 8)
+
+
+class FailingPlanner(FakePlanner):
+    """Graph falso que também recusa itens específicos."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stale = set()  # tarefas cujo ETag muda depois do GET (PATCH dá 412)
+
+    def handle(self, method, url, headers, body):
+        if method == "POST" and "recusada" in (body or {}).get("title", ""):
+            with self.lock:
+                self.operations += 1
+            return {"status": 403, "headers": {}, "body": {"error": {"message": "Plano sem permissão"}}}
+        result = super().handle(method, url, headers, body)
+        task_id = url.split("/")[-2] if url.endswith("/details") else None
+        if method == "POST" and result["status"] == 201 and "desatualizada" in body.get("title", ""):
+            self.stale.add(result["body"]["id"])
+        if method == "GET" and result["status"] == 200 and task_id in self.stale:
+            self.details[task_id]["etag"] += "-editada"
+        return result
+
+
+@pytest.fixture
+def graph():
+    """Graph falso em porta efêmera; devolve ``(estado, cliente)``."""
+    started = []
+
+    def start(throttle=0.0, retry_after=7):
+        state = FailingPlanner(throttle, retry_after)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(state))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        started.append(server)
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        client = PlannerClient(
+            tenant_id="fake", client_id="fake", client_secret="fake", plan_id="plan", bucket_id="bucket",
+            graph_base=f"{url}/v1.0", token_url=f"{url}/token",
+        )
+        return state, client
+
+    yield start
+    for server in started:
+        server.shutdown()
+        server.server_close()
+
+
+class RecordingSleep:
+    """Relógio das pausas do engine: registra e não dorme (o teste não espera o Retry-After)."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, seconds):
+        self.calls.append(seconds)
+
+
+def specs(count, title="Agenda"):
+    return [PlannerTaskSpec(i, f"Usuário {i}", f"{title} {i}", f"Dashboards do usuário {i}", 2, str(i))
+            for i in range(count)]
+
+
+def run(engine, items):
+    return engine.run(items, START, START + timedelta(hours=6))
+
+
+def test_users_are_synced_in_batches_of_twenty(graph):
+    state, client = graph()
+    engine = PlannerSyncEngine(client, max_workers=3, sleep=RecordingSleep())
+
+    outcomes = run(engine, specs(45))
+
+    assert [o.status for o in outcomes] == ["success"] * 45
+    assert [o.spec.user_id for o in outcomes] == list(range(45))  # na ordem dos usuários
+    assert {o.task_id for o in outcomes} == set(state.tasks)
+    assert sorted(d["description"] for d in state.details.values()) == sorted(f"Dashboards do usuário {i}" for i in range(45))
+    # 3 grupos (20 + 20 + 5) x 3 lotes; o servidor recusa lotes acima de 20
+    assert engine.requests_sent == 9
+    # Fora os lotes, só o token (cada thread pode pedi-lo antes de o primeiro chegar)
+    assert 1 <= state.http_calls - 9 <= 3
+    assert state.operations == 45 * 3
+
+
+def test_throttled_items_are_retried_after_retry_after(graph):
+    state, client = graph(throttle=0.3, retry_after=7)
+    sleep = RecordingSleep()
+    engine = PlannerSyncEngine(client, max_workers=2, max_attempts=10, backoff_seconds=0.01, sleep=sleep)
+
+    outcomes = run(engine, specs(30))
+
+    assert [o.status for o in outcomes] == ["success"] * 30
+    assert state.throttled > 0
+    # Só os itens recusados voltam: operações = 3 por usuário + as limitadas
+    assert state.operations == 30 * 3 + state.throttled
+    assert engine.requests_sent > 6
+    assert 1 <= state.http_calls - engine.requests_sent <= 2
+    # Pausa compartilhada com o Retry-After do item (não o backoff de 0,01 s)
+    assert sleep.calls and max(sleep.calls) == pytest.approx(7, abs=0.5)
+    assert len(state.tasks) == 30  # nenhuma tarefa criada em dobro
+
+
+def test_items_still_throttled_after_max_attempts_fail(graph):
+    state, client = graph(throttle=1.0, retry_after=0)
+    engine = PlannerSyncEngine(client, max_attempts=3, backoff_seconds=0.01, sleep=RecordingSleep())
+
+    outcomes = run(engine, specs(5))
+
+    assert {o.status for o in outcomes} == {"error"}
+    assert all("Limite de requisições" in o.message for o in outcomes)
+    assert engine.requests_sent == 3
+    assert state.operations == 5 * 3 and state.tasks == {}
+
+
+def test_item_failures_only_affect_their_users(graph):
+    state, client = graph()
+    items = specs(BATCH_LIMIT + 4)
+    items[3].title = "Agenda recusada 3"
+    items[7].title = "Agenda desatualizada 7"
+    items[BATCH_LIMIT + 1].title = "Agenda recusada 21"
+    engine = PlannerSyncEngine(client, sleep=RecordingSleep())
+
+    outcomes = {o.spec.user_id: o for o in run(engine, items)}
+
+    failed = {user_id for user_id, o in outcomes.items() if o.status == "error"}
+    assert failed == {3, 7, BATCH_LIMIT + 1}
+    assert outcomes[3].message == "Erro ao criar tarefa: Plano sem permissão" and outcomes[3].task_id is None
+    assert outcomes[7].message == "Erro ao atualizar descrição da tarefa: ETag divergente"
+    assert outcomes[7].task_id in state.tasks  # a tarefa existe, só a descrição falhou
+    assert len(state.tasks) == len(items) - 2
+    described = {d["description"] for d in state.details.values() if d["description"]}
+    assert described == {f"Dashboards do usuário {i}" for i in range(len(items)) if i not in failed}
+
+
+def test_whole_batch_failure_marks_the_group(graph):
+    state, client = graph()
+    client.graph_base = client.graph_base.replace("/v1.0", "/beta")  # o Graph falso só atende /v1.0: 404
+    engine = PlannerSyncEngine(client, sleep=RecordingSleep())
+
+    outcomes = run(engine, specs(3))
+
+    assert {o.status for o in outcomes} == {"error"}
+    assert all("Erro no $batch do Graph" in o.message for o in outcomes)
+    assert state.operations == 0
@@ -0,0 +1,136 @@
+from utils.metrics import TimedCursor
+from utils.query_analysis import QueryAnalyzer
+from utils.query_budget_plugin import check_budgets, parse_budgets
+
+# Requisições simuladas: o TimedCursor entrega cada statement ao QueryAnalyzer,
+# como no app (a consulta em si vai para um cursor falso)
+REQUESTS = '''
+from utils.metrics import TimedCursor
+from utils.query_analysis import QueryAnalyzer
+
+analyzer = QueryAnalyzer(n_plus_one_threshold=10, slow_ms=60000)
+
+
+class FakeCursor:
+    def execute(self, query, vars=None):
+        pass
+
+
+def request(endpoint, statements):
+    analyzer.begin_request()
+    cursor = TimedCursor(FakeCursor(), analyzer.observe)
+    for sql, params in statements:
+        cursor.execute(sql, params)
+    return analyzer.end_request(endpoint)
+
+
+def environments_n_plus_one(count=20):
+    """Lista os ambientes e conta os recursos de cada um com uma consulta por ambiente."""
+    return request("environments_api", [("SELECT id FROM environments", None)] + [
+        ("SELECT COUNT(*) FROM environment_resources WHERE environment_id = %s", (environment_id,))
+        for environment_id in range(count)
+    ])
+
+
+def environments_joined():
+    return request("environments_api", [("SELECT e.id, e.resource_count FROM environments e", None)])
+'''
+
+
+def run(pytester, test_source, ini=None):
+    pytester.makepyfile(requests_sim=REQUESTS, test_budget=test_source)
+    if ini:
+        pytester.makeini(ini)
+    return pytester.runpytest("-p", "utils.query_budget_plugin")
+
+
+def test_ini_budget_fails_the_n_plus_one_endpoint(pytester):
+    result = run(
+        pytester,
+        """
+        from requests_sim import environments_joined, environments_n_plus_one
+
+        def test_joined():
+            environments_joined()
+
+        def test_n_plus_one():
+            environments_n_plus_one()
+        """,
+        ini="[pytest]\nquery_budgets =\n    environments_api = 3\n",
+    )
+    result.assert_outcomes(passed=1, failed=1)
+    result.stdout.fnmatch_lines([
+        "*Orçamento de consultas excedido*",
+        "*environments_api: 21 statements (orçamento 3; statements=21;*n_plus_one=1)*",
+    ])
+
+
+def test_marker_max_repeats_catches_the_repeated_query(pytester):
+    result = run(
+        pytester,
+        """
+        import pytest
+        from requests_sim import environments_n_plus_one
+
+        @pytest.mark.query_budget(max_repeats=5)
+        def test_n_plus_one():
+            environments_n_plus_one()
+
+        @pytest.mark.query_budget(max_repeats=5)
+        def test_few_environments():
+            environments_n_plus_one(count=5)
+        """,
+    )
+    result.assert_outcomes(passed=1, failed=1)
+    result.stdout.fnmatch_lines([
+        "*environments_api: 20x a mesma consulta (máximo 5): select count(*) from environment_resources where environment_id = ?*",
+    ])
+
+
+def test_marker_budget_overrides_ini_and_applies_to_every_endpoint(pytester):
+    result = run(
+        pytester,
+        """
+        import pytest
+        from requests_sim import environments_n_plus_one, request
+
+        @pytest.mark.query_budget(environments_api=25)
+        def test_raised_budget():
+            environments_n_plus_one()
+
+        @pytest.mark.query_budget(2)
+        def test_default_budget():
+            request("admin_dashboard", [("SELECT 1", None)] * 3)
+        """,
+        ini="[pytest]\nquery_budgets =\n    environments_api = 3\nquery_budget_max_repeats = 50\n",
+    )
+    result.assert_outcomes(passed=1, failed=1)
+    result.stdout.fnmatch_lines(["*admin_dashboard: 3 statements (orçamento 2;*"])
+
+
+def test_analyzer_flags_n_plus_one_by_fingerprint():
+    analyzer = QueryAnalyzer(n_plus_one_threshold=10, slow_ms=60000)
+
+    class FakeCursor:
+        def execute(self, query, vars=None):
+            pass
+
+    analyzer.begin_request()
+    cursor = TimedCursor(FakeCursor(), analyzer.observe)
+    for environment_id in range(12):
+        # Literais diferentes, mesma impressão digital
+        cursor.execute(f"SELECT * FROM environment_resources WHERE environment_id = {environment_id}")
+    cursor.execute("SELECT * FROM environments WHERE id IN (%s, %s, %s)", (1, 2, 3))
+    summary = analyzer.end_request("environment_detail")
+
+    assert summary.statements == 13
+    assert summary.n_plus_one == [("select * from environment_resources where environment_id = ?", 12)]
+    assert check_budgets([summary], {"environment_detail": 13}, max_repeats=12) == []
+    assert len(check_budgets([summary], {"environment_detail": 12}, max_repeats=11)) == 2
+
+
+def test_parse_budgets_ignores_blank_and_incomplete_lines():
+    assert parse_budgets(["admin_dashboard = 40", "", "environments_api=3", "sem_valor ="]) == {
+        "admin_dashboard": 40,
+        "environments_api": 3,
+    }
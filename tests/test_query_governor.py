@@ -0,0 +1,106 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from utils.query_governor import QueryGovernor, QueryRejected, estimate_rows_examined, tokenize
+
+QUERIES_FILE = Path(__file__).resolve().parent.parent / "agent_local" / "config" / "queries.json"
+CORPUS = json.loads(QUERIES_FILE.read_text(encoding="utf-8"))
+
+
+def outer_limit(sql):
+    """Valores depois do LIMIT de nível 0 (``None`` sem LIMIT externo)."""
+    tokens = [t for t in tokenize(sql) if t.kind not in ("space", "comment")]
+    positions = [i for i, t in enumerate(tokens) if t.upper == "LIMIT" and t.depth == 0]
+    if not positions:
+        return None
+    return [t.text for t in tokens[positions[-1] + 1:] if t.kind == "number" or t.text == ","]
+
+
+@pytest.fixture
+def governor():
+    return QueryGovernor(max_rows=1000, default_limit=50, max_execution_ms=30000)
+
+
+@pytest.mark.parametrize("entry", CORPUS, ids=[entry["id"] for entry in CORPUS])
+def test_corpus_queries_are_accepted_and_limited(governor, entry):
+    prepared = governor.prepare(entry["sql"])
+
+    assert prepared.startswith("SELECT /*+ MAX_EXECUTION_TIME(30000) */")
+    assert outer_limit(prepared) == ["50"]
+    # Reaplicar o governador não muda a query
+    assert governor.prepare(prepared) == prepared
+
+
+@pytest.mark.parametrize("sql, limit, expected", [
+    # LIMIT escrito na query vale até max_rows; default_limit só sem LIMIT
+    ("SELECT id FROM minuta LIMIT 800", None, ["800"]),
+    ("SELECT id FROM minuta LIMIT 800", 10, ["800"]),
+    ("SELECT id FROM minuta LIMIT 5000", None, ["1000"]),
+    ("SELECT id FROM minuta LIMIT 100, 5000", None, ["100", ",", "1000"]),
+    ("SELECT id FROM minuta LIMIT 5000 OFFSET 20", None, ["1000", "20"]),
+    ("SELECT id FROM minuta", None, ["50"]),
+    ("SELECT id FROM minuta", 200, ["200"]),
+    ("SELECT id FROM minuta", 999999, ["1000"]),
+    # Nomes e subqueries não contam como LIMIT externo
+    ("SELECT unlimited, `limit` FROM minuta", None, ["50"]),
+    ("SELECT * FROM (SELECT id FROM minuta LIMIT 10) m", None, ["50"]),
+    ("SELECT id FROM minuta WHERE obs = 'LIMIT 3' -- LIMIT 4", None, ["50"]),
+])
+def test_limit(governor, sql, limit, expected):
+    assert outer_limit(governor.prepare(sql, limit)) == expected
+
+
+@pytest.mark.parametrize("sql", [
+    "",
+    "DELETE FROM minuta",
+    "SELECT 1; DROP TABLE minuta",
+    "SELECT id INTO @x FROM minuta",
+    "SELECT id FROM minuta FOR UPDATE",
+    "WITH m AS (SELECT 1) UPDATE minuta SET data = NULL",
+    "SELECT id FROM minuta LIMIT %s",
+])
+def test_rejected(governor, sql):
+    with pytest.raises(QueryRejected):
+        governor.prepare(sql)
+
+
+@pytest.mark.parametrize("sql, call", [
+    ("SELECT REPLACE(nome, 'a', 'b') FROM cliente", "REPLACE(nome"),
+    ("SELECT INSERT(cnpj, 3, 0, '.') FROM cliente", "INSERT(cnpj"),
+    ("SELECT insert (cnpj, 3, 0, '.') FROM cliente", "insert (cnpj"),
+])
+def test_string_functions_are_read_only(governor, sql, call):
+    assert call in governor.prepare(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    "WITH m AS (SELECT 1) INSERT INTO minuta (id) SELECT 1",
+    "WITH m AS (SELECT 1) REPLACE INTO minuta (id) SELECT 1",
+])
+def test_insert_statement_is_rejected(governor, sql):
+    with pytest.raises(QueryRejected):
+        governor.prepare(sql)
+
+
+def test_nested_loop_cost_multiplies_fanout():
+    plan = {"query_block": {"nested_loop": [
+        {"table": {"table_name": "minuta", "rows_examined_per_scan": 1000, "rows_produced_per_join": 100}},
+        {"table": {"table_name": "cliente", "rows_examined_per_scan": 1, "rows_produced_per_join": 100}},
+    ]}}
+    assert estimate_rows_examined(json.dumps(plan)) == 1000 + 100
+
+
+def test_cost_budget(governor):
+    class Cursor:
+        def execute(self, sql, params=None):
+            self.sql = sql
+
+        def fetchone(self):
+            return {"EXPLAIN": json.dumps({"query_block": {"table": {"rows_examined_per_scan": 9_000_000}}})}
+
+    cursor = Cursor()
+    with pytest.raises(QueryRejected):
+        governor.check_cost(cursor, "SELECT * FROM minuta LIMIT 50")
+    assert cursor.sql.startswith("EXPLAIN FORMAT=JSON SELECT")
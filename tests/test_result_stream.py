@@ -0,0 +1,74 @@
+import sys
+from decimal import Decimal
+
+import pytest
+
+from utils.result_stream import stream_batches
+
+resource = pytest.importorskip("resource")
+
+TOTAL_ROWS = 2_000_000
+BATCH_SIZE = 2000
+
+
+class FakeStreamingCursor:
+    """Como o SSDictCursor: gera os registros sob demanda, sem guardar o resultado."""
+
+    def __init__(self, total):
+        self.total = total
+        self.sent = 0
+
+    def fetchmany(self, size):
+        count = min(size, self.total - self.sent)
+        start = self.sent
+        self.sent += count
+        return [
+            {"id": start + i, "cliente": f"Cliente {start + i}", "valor": Decimal("10.50")}
+            for i in range(count)
+        ]
+
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Linux: KB
+
+
+def test_millions_of_rows_stream_in_bounded_memory():
+    saved = []
+
+    def save_batch(seq, rows):
+        saved.append((seq, len(rows), rows[0]["id"]))
+
+    peak_before = peak_rss_bytes()
+    preview, row_count, chunks = stream_batches(
+        FakeStreamingCursor(TOTAL_ROWS),
+        BATCH_SIZE,
+        save_batch,
+        preview_rows=1000,
+        convert=lambda row: {k: str(v) if isinstance(v, Decimal) else v for k, v in row.items()},
+    )
+    growth = peak_rss_bytes() - peak_before
+
+    assert row_count == TOTAL_ROWS
+    assert chunks == TOTAL_ROWS // BATCH_SIZE
+    assert [seq for seq, _, _ in saved] == list(range(chunks))
+    assert saved[-1] == (chunks - 1, BATCH_SIZE, TOTAL_ROWS - BATCH_SIZE)
+    assert [row["id"] for row in preview] == list(range(1000))
+    assert preview[0]["valor"] == "10.50"
+    # Prévia + um lote (e a cópia convertida); o resultado inteiro passaria de 500 MB
+    assert growth < 50 * 1024 * 1024
+
+
+def test_short_result_fits_in_the_preview():
+    saved = []
+    preview, row_count, chunks = stream_batches(
+        FakeStreamingCursor(5), BATCH_SIZE, lambda seq, rows: saved.append(seq), preview_rows=1000
+    )
+    assert (row_count, chunks, saved) == (5, 1, [0])
+    assert [row["id"] for row in preview] == list(range(5))
+
+
+def test_empty_result_saves_nothing():
+    saved = []
+    assert stream_batches(FakeStreamingCursor(0), BATCH_SIZE, lambda seq, rows: saved.append(seq), 1000) == ([], 0, 0)
+    assert saved == []
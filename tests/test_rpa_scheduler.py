@@ -0,0 +1,195 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from utils.rpa_scheduler import RpaScheduler, ScheduleError, jitter_for, parse_schedule
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def occurrences(spec, start, count, tz_name="UTC"):
+    schedule = parse_schedule(spec, tz_name)
+    moments, moment = [], start
+    for _ in range(count):
+        moment = schedule.next_after(moment)
+        moments.append(moment)
+    return moments
+
+
+def scheduler(catch_up="once", max_jitter=0.0):
+    # plan/first_run não usam o banco
+    return RpaScheduler(None, lambda cursor: 0, max_jitter=max_jitter, catch_up=catch_up,
+                        grace_seconds=300, tz_name="UTC")
+
+
+@pytest.mark.parametrize("spec, start, expected", [
+    # */n
+    ("*/15 * * * *", utc(2024, 3, 4, 10, 7), [utc(2024, 3, 4, 10, 15), utc(2024, 3, 4, 10, 30),
+                                              utc(2024, 3, 4, 10, 45), utc(2024, 3, 4, 11, 0)]),
+    ("0 */6 * * *", utc(2024, 3, 4, 13, 0), [utc(2024, 3, 4, 18), utc(2024, 3, 5, 0), utc(2024, 3, 5, 6)]),
+    # Estritamente depois: o próprio minuto não conta
+    ("*/15 * * * *", utc(2024, 3, 4, 10, 15), [utc(2024, 3, 4, 10, 30)]),
+    ("*/15 * * * *", utc(2024, 3, 4, 10, 14, 59), [utc(2024, 3, 4, 10, 15)]),
+    # início/passo
+    ("5/20 * * * *", utc(2024, 3, 4, 10, 0), [utc(2024, 3, 4, 10, 5), utc(2024, 3, 4, 10, 25),
+                                              utc(2024, 3, 4, 10, 45), utc(2024, 3, 4, 11, 5)]),
+    # Faixas: sexta 17:30 -> segunda 9h
+    ("0 9-17 * * 1-5", utc(2024, 3, 8, 17, 30), [utc(2024, 3, 11, 9), utc(2024, 3, 11, 10)]),
+    ("10-12/2 8 * * *", utc(2024, 3, 4, 9), [utc(2024, 3, 5, 8, 10), utc(2024, 3, 5, 8, 12), utc(2024, 3, 6, 8, 10)]),
+    # Listas
+    ("0,30 8,12 * * *", utc(2024, 3, 4, 8, 10), [utc(2024, 3, 4, 8, 30), utc(2024, 3, 4, 12),
+                                                 utc(2024, 3, 4, 12, 30), utc(2024, 3, 5, 8)]),
+    ("0 6 1,15 * *", utc(2024, 3, 2), [utc(2024, 3, 15, 6), utc(2024, 4, 1, 6)]),
+])
+def test_cron_fields(spec, start, expected):
+    assert occurrences(spec, start, len(expected)) == expected
+
+
+@pytest.mark.parametrize("spec, expected", [
+    # Só o dia do mês: dias 13
+    ("0 0 13 * *", [utc(2024, 9, 13), utc(2024, 10, 13), utc(2024, 11, 13)]),
+    # Só o dia da semana: sextas
+    ("0 0 * * 5", [utc(2024, 9, 6), utc(2024, 9, 13), utc(2024, 9, 20)]),
+    # Os dois restritos: dia 13 OU sexta (como no cron), não sexta-feira 13
+    ("0 0 13 * 5", [utc(2024, 9, 6), utc(2024, 9, 13), utc(2024, 9, 20), utc(2024, 9, 27), utc(2024, 10, 4)]),
+    # 0 e 7 são domingo
+    ("0 0 * * 0", [utc(2024, 9, 1), utc(2024, 9, 8)]),
+    ("0 0 * * 7", [utc(2024, 9, 1), utc(2024, 9, 8)]),
+])
+def test_day_of_month_and_day_of_week(spec, expected):
+    assert occurrences(spec, utc(2024, 8, 31, 12), len(expected)) == expected
+
+
+@pytest.mark.parametrize("spec, start, expected", [
+    # Dia 31 pula os meses que não o têm
+    ("0 0 31 * *", utc(2024, 1, 31), [utc(2024, 3, 31), utc(2024, 5, 31), utc(2024, 7, 31)]),
+    # Virada do ano
+    ("0 0 1 * *", utc(2024, 12, 31, 23, 59), [utc(2025, 1, 1), utc(2025, 2, 1)]),
+    ("59 23 31 12 *", utc(2024, 12, 31, 23, 59), [utc(2025, 12, 31, 23, 59)]),
+    # 29 de fevereiro: só nos anos bissextos
+    ("0 12 29 2 *", utc(2024, 3, 1), [utc(2028, 2, 29, 12)]),
+    ("0 6 * 2,11 1", utc(2024, 2, 26, 7), [utc(2024, 11, 4, 6)]),
+])
+def test_month_rollover(spec, start, expected):
+    assert occurrences(spec, start, len(expected)) == expected
+
+
+def test_cron_runs_in_the_configured_timezone():
+    # 6h em São Paulo (UTC-3) é 9h UTC; o dia vira pelo fuso local
+    assert occurrences("daily", utc(2024, 3, 4, 8, 59), 2, "America/Sao_Paulo") == [
+        utc(2024, 3, 4, 9), utc(2024, 3, 5, 9),
+    ]
+    # 2h UTC do dia 4 ainda é dia 3 em São Paulo: a meia-noite seguinte é a do dia 4
+    assert occurrences("0 0 * * *", utc(2024, 3, 4, 2), 1, "America/Sao_Paulo") == [utc(2024, 3, 4, 3)]
+
+
+def test_intervals_and_aliases():
+    assert parse_schedule("every 15m").interval == timedelta(minutes=15)
+    assert parse_schedule("@every 2h").interval == timedelta(hours=2)
+    assert parse_schedule("interval: 1d").interval == timedelta(days=1)
+    assert parse_schedule("once") is None and parse_schedule(None) is None and parse_schedule("manual") is None
+    assert parse_schedule("weekly", "UTC").period == timedelta(weeks=1)
+
+    every = parse_schedule("every 1h")
+    anchor = utc(2024, 3, 4, 10, 20)
+    assert every.next_after_grid(anchor, utc(2024, 3, 4, 13, 55)) == utc(2024, 3, 4, 14, 20)
+    assert every.next_after_grid(anchor, utc(2024, 3, 4, 14, 20)) == utc(2024, 3, 4, 15, 20)
+    assert every.next_after_grid(anchor, utc(2024, 3, 4, 9)) == utc(2024, 3, 4, 11, 20)
+
+
+@pytest.mark.parametrize("spec", [
+    "every 30s",  # abaixo de 1 minuto
+    "61 * * * *",
+    "* 24 * * *",
+    "0 0 0 * *",
+    "0 0 * 13 *",
+    "0 0 * * 8",
+    "*/0 * * * *",
+    "5-1 * * * *",
+    "a * * * *",
+    "0 0 * *",
+    "daily please",
+])
+def test_invalid_schedules(spec):
+    with pytest.raises(ScheduleError):
+        parse_schedule(spec, "UTC")
+
+
+def test_impossible_cron_raises():
+    with pytest.raises(ScheduleError, match="5 anos"):
+        parse_schedule("0 0 30 2 *", "UTC").next_after(utc(2024, 1, 1))
+
+
+# ---------------------------------------------------------------------------
+# Execuções perdidas (servidor fora do ar das 10h às 13h20)
+# ---------------------------------------------------------------------------
+DUE = utc(2024, 3, 4, 10)
+BACK = utc(2024, 3, 4, 13, 20)
+
+
+@pytest.mark.parametrize("catch_up, expected", [
+    ("once", (True, utc(2024, 3, 4, 14))),  # roda uma vez e volta para a grade
+    ("skip", (False, utc(2024, 3, 4, 14))),  # descarta as perdidas
+    ("all", (True, utc(2024, 3, 4, 11))),  # uma por vez, a partir da primeira perdida
+])
+def test_catch_up_after_downtime(catch_up, expected):
+    assert scheduler(catch_up).plan(1, "0 * * * *", DUE, BACK) == expected
+
+
+@pytest.mark.parametrize("catch_up", ["once", "skip"])
+def test_small_delay_within_grace_still_runs(catch_up):
+    assert scheduler(catch_up).plan(1, "0 * * * *", DUE, DUE + timedelta(minutes=4)) == (True, utc(2024, 3, 4, 11))
+
+
+def test_catch_up_all_replays_every_missed_run():
+    planner = scheduler("all")
+    due, fired = DUE, []
+    while due <= BACK:
+        fire, due = planner.plan(1, "0 * * * *", due, BACK)
+        fired.append(fire)
+    assert fired == [True] * 4 and due == utc(2024, 3, 4, 14)
+
+
+def test_interval_catch_up_keeps_the_grid():
+    # every 1h ancorado às 10h20: depois da queda volta para :20, não para a hora da volta
+    anchor = utc(2024, 3, 4, 10, 20)
+    assert scheduler("once").plan(1, "every 1h", anchor, BACK) == (True, utc(2024, 3, 4, 14, 20))
+    assert scheduler("skip").plan(1, "every 1h", anchor, BACK) == (False, utc(2024, 3, 4, 14, 20))
+
+
+def test_once_rpa_is_never_planned():
+    assert scheduler().plan(1, "once", DUE, BACK) == (False, None)
+    assert scheduler().first_run(1, "once", DUE) is None
+
+
+# ---------------------------------------------------------------------------
+# Jitter
+# ---------------------------------------------------------------------------
+@pytest.mark.parametrize("spec, max_jitter, window", [
+    ("0 * * * *", 300, 300),  # limitado por max_jitter
+    ("0 * * * *", 3600, 360),  # limitado a 10% do período
+    ("every 1m", 300, 6),
+    ("0 6 * * *", 0, 0),
+])
+def test_jitter_stays_within_its_bound(spec, max_jitter, window):
+    schedule = parse_schedule(spec, "UTC")
+    jitters = [jitter_for(rpa_id, schedule, max_jitter) for rpa_id in range(1, 500)]
+    assert all(timedelta(0) <= jitter <= timedelta(seconds=window) for jitter in jitters)
+    if window:
+        assert len(set(jitters)) > 1  # espalha as RPAs
+    assert jitter_for(42, schedule, max_jitter) == jitters[41]  # estável por RPA
+
+
+def test_jittered_runs_stay_on_the_schedule():
+    planner = scheduler("once", max_jitter=300)
+    schedule = parse_schedule("0 * * * *", "UTC")
+    for rpa_id in range(1, 50):
+        jitter = jitter_for(rpa_id, schedule, 300)
+        first = planner.first_run(rpa_id, "0 * * * *", utc(2024, 3, 4, 9, 30))
+        assert first == utc(2024, 3, 4, 10) + jitter
+        # Disparo no horário com jitter: o próximo mantém o mesmo deslocamento
+        assert planner.plan(rpa_id, "0 * * * *", first, first) == (True, utc(2024, 3, 4, 11) + jitter)
+        # Depois de uma queda também
+        assert planner.plan(rpa_id, "0 * * * *", first, BACK) == (True, utc(2024, 3, 4, 14) + jitter)
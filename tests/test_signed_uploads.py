@@ -0,0 +1,178 @@
+import hashlib
+import io
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import pytest
+
+from utils.signed_uploads import (
+    LocalStorage,
+    UploadRejected,
+    check_completed_upload,
+    check_new_upload,
+    resource_type_for,
+)
+from utils.storage_upload import UploadTooLarge
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 56
+WEBP = b"RIFF" + (56).to_bytes(4, "little") + b"WEBPVP8 " + b"\x00" * 48
+MAX_BYTES = 1024 * 1024
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return LocalStorage(str(tmp_path / "storage"), "segredo")
+
+
+def signed_put(storage, url, body, max_bytes=MAX_BYTES):
+    """O que a rota PUT do storage local faz com a URL assinada."""
+    parts = urlsplit(url)
+    path = unquote(parts.path[len(storage.base_path) + 1:])
+    query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+    if not storage.verify(path, query.get("expires"), query.get("signature")):
+        raise PermissionError("Assinatura inválida ou expirada")
+    return storage.write(path, io.BytesIO(body), max_bytes, chunk_size=16)
+
+
+def create(storage, filename, body, sha256=True):
+    """Criação do upload: validação, linha pendente e URL assinada."""
+    check_new_upload(filename, len(body), MAX_BYTES)
+    path = f"environments/1_20240101_abcd1234_{filename}"
+    pending = {
+        "storage_path": path,
+        "file_name": filename,
+        "expected_size": len(body),
+        "sha256": hashlib.sha256(body).hexdigest() if sha256 else None,
+    }
+    return pending, storage.create_signed_upload(path)
+
+
+def complete(storage, pending):
+    info = storage.stat(pending["storage_path"])
+    head = storage.read_head(pending["storage_path"]) if info else b""
+    check_completed_upload(pending, info, head)
+    return info
+
+
+@pytest.mark.parametrize("filename, body", [("foto de capa.png", PNG), ("sala.webp", WEBP)])
+def test_create_put_complete(storage, filename, body):
+    pending, url = create(storage, filename, body)
+    assert url.startswith("/api/storage/local/environments/")
+
+    assert signed_put(storage, url, body).size == len(body)
+    info = complete(storage, pending)
+
+    assert info.sha256 == pending["sha256"]
+    assert storage.download(pending["storage_path"]) == body
+    assert unquote(storage.public_url(pending["storage_path"])) == f"/api/storage/local/{pending['storage_path']}"
+    assert resource_type_for(filename) == "photo"
+    assert not list(storage.root.rglob("*.part"))
+
+
+@pytest.mark.parametrize("filename, size, error", [
+    ("virus.exe", 10, UploadRejected),
+    ("sem_extensao", 10, UploadRejected),
+    ("planta.pdf", 0, UploadRejected),
+    ("planta.pdf", "muito", UploadRejected),
+    ("planta.pdf", MAX_BYTES + 1, UploadTooLarge),
+])
+def test_new_upload_is_validated_before_signing(filename, size, error):
+    with pytest.raises(error):
+        check_new_upload(filename, size, MAX_BYTES)
+
+
+def test_missing_object_is_rejected(storage):
+    pending, _ = create(storage, "planta.pdf", b"%PDF-1.7")
+    with pytest.raises(UploadRejected, match="não encontrado"):
+        complete(storage, pending)
+
+
+def test_size_mismatch_is_rejected(storage):
+    pending, url = create(storage, "foto.png", PNG)
+    signed_put(storage, url, PNG + b"extra")
+    with pytest.raises(UploadRejected, match="Tamanho divergente"):
+        complete(storage, pending)
+
+
+def test_put_above_the_limit_leaves_nothing_behind(storage):
+    pending, url = create(storage, "foto.png", PNG)
+    with pytest.raises(UploadTooLarge):
+        signed_put(storage, url, PNG, max_bytes=32)
+    assert storage.stat(pending["storage_path"]) is None
+    assert not list(storage.root.rglob("*.part"))
+
+
+@pytest.mark.parametrize("filename, body", [
+    ("foto.png", b"\xff\xd8\xff" + b"\x00" * 61),  # JPEG com extensão .png
+    ("modelo.glb", b"PK\x03\x04" + b"\x00" * 60),
+    ("planta.pdf", b"<html>" + b"\x00" * 58),
+    ("sala.webp", b"RIFF" + b"\x00" * 4 + b"WAVE" + b"\x00" * 56),  # RIFF, mas não WEBP
+    ("sala.webp", b"RIFF"),
+])
+def test_wrong_magic_bytes_are_rejected(storage, filename, body):
+    pending, url = create(storage, filename, body)
+    signed_put(storage, url, body)
+    with pytest.raises(UploadRejected, match="não corresponde"):
+        complete(storage, pending)
+
+
+def test_checksum_mismatch_is_rejected(storage):
+    pending, url = create(storage, "foto.png", PNG)
+    signed_put(storage, url, PNG[:-1] + b"\x01")  # mesmo tamanho e assinatura
+    with pytest.raises(UploadRejected, match="Checksum"):
+        complete(storage, pending)
+
+
+def test_checksum_is_optional(storage):
+    pending, url = create(storage, "foto.png", PNG, sha256=False)
+    signed_put(storage, url, PNG[:-1] + b"\x01")
+    complete(storage, pending)
+
+
+def test_expired_signature_is_refused(storage):
+    path = "environments/foto.png"
+    url = storage.create_signed_upload(path, ttl=-1)
+    with pytest.raises(PermissionError):
+        signed_put(storage, url, PNG)
+    assert storage.stat(path) is None
+
+
+@pytest.mark.parametrize("tamper", [
+    lambda url: url.replace("foto.png", "outra.png"),  # assinatura de outro caminho
+    lambda url: url.replace("signature=", "signature=0"),
+    lambda url: url.split("&signature=")[0],
+    lambda url: url.replace("expires=", "expires=9"),  # validade estendida
+])
+def test_forged_signature_is_refused(storage, tamper):
+    url = storage.create_signed_upload("environments/foto.png")
+    with pytest.raises(PermissionError):
+        signed_put(storage, tamper(url), PNG)
+    assert not list(storage.root.rglob("*.png"))
+
+
+def test_signature_from_another_secret_is_refused(tmp_path, storage):
+    other = LocalStorage(str(tmp_path / "storage"), "outro segredo")
+    with pytest.raises(PermissionError):
+        signed_put(storage, other.create_signed_upload("environments/foto.png"), PNG)
+
+
+@pytest.mark.parametrize("path", [
+    "../fora.png",
+    "environments/../../fora.png",
+    "/tmp/fora.png",
+    "",
+    ".",
+])
+def test_paths_outside_the_root_are_rejected(storage, tmp_path, path):
+    with pytest.raises(UploadRejected, match="Caminho inválido"):
+        storage.write(path, io.BytesIO(PNG), MAX_BYTES)
+    for method in (storage.stat, storage.download, storage.delete):
+        with pytest.raises(UploadRejected):
+            method(path)
+    assert not (tmp_path / "fora.png").exists()
+
+
+def test_validly_signed_traversal_is_still_rejected(storage, tmp_path):
+    url = storage.create_signed_upload("../fora.png")
+    with pytest.raises(UploadRejected, match="Caminho inválido"):
+        signed_put(storage, url, PNG)
+    assert not (tmp_path / "fora.png").exists()
@@ -0,0 +1,275 @@
+"""
+Registro de agentes locais e distribuição de jobs por capacidade.
+
+Cada agente se registra com as suas capacidades (tipos de job, hosts Brudam
+alcançáveis, concorrência máxima) e informa a carga nos heartbeats. Quando um
+agente pede trabalho, os jobs pendentes são distribuídos entre os agentes
+vivos por menor carga ponderada (jobs em execução / concorrência máxima), com
+bônus de afinidade para quem executou o mesmo template/query por último
+(cache aquecido). O agente leva só os jobs em que é o escolhido, além dos que
+já esperaram demais pelo agente escolhido.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import psycopg2.extras
+
+from utils.agent_jobs import JOB_KINDS
+from utils.query_cache import normalize_sql
+
+
+logger = logging.getLogger("GeRot")
+
+
+@dataclass
+class AgentInfo:
+    agent_id: str
+    job_types: List[str]
+    hosts: Optional[List[str]]  # None = não informado (qualquer host)
+    max_concurrency: int = 1
+    running: int = 0
+
+    def can_run(self, job_type: str, target_host: Optional[str] = None) -> bool:
+        if job_type not in self.job_types:
+            return False
+        if self.hosts is None:
+            return True
+        if target_host:
+            return target_host in self.hosts
+        return bool(self.hosts)
+
+    def load(self) -> float:
+        return self.running / max(self.max_concurrency, 1)
+
+
+@dataclass
+class PendingJob:
+    job_id: int
+    job_type: str
+    affinity_key: Optional[str] = None
+    target_host: Optional[str] = None
+    waited: float = 0.0
+
+
+@dataclass
+class Decision:
+    job_id: int
+    agent_id: Optional[str]
+    reason: str
+    scores: Dict[str, float] = field(default_factory=dict)
+
+
+def affinity_key_for(template_id, payload: Optional[dict]) -> Optional[str]:
+    """Chave de afinidade: o template do dashboard ou o hash da query."""
+    if template_id:
+        return f"template:{template_id}"
+    query = (payload or {}).get("query")
+    if not query:
+        return None
+    return "query:" + hashlib.sha256(normalize_sql(query).encode("utf-8")).hexdigest()[:16]
+
+
+def assign(
+    jobs: Iterable[PendingJob],
+    agents: List[AgentInfo],
+    affinity: Dict[str, str],
+    affinity_bonus: float = 0.5,
+) -> List[Decision]:
+    """
+    Escolhe um agente para cada job (na ordem da fila).
+
+    Pontuação = carga ponderada, menos ``affinity_bonus`` para o agente com
+    afinidade; vence a menor. A carga do escolhido é incrementada a cada
+    atribuição, então um lote se espalha entre os agentes.
+    """
+    decisions = []
+    for job in jobs:
+        warm = affinity.get(job.affinity_key) if job.affinity_key else None
+        scores = {}
+        for agent in agents:
+            if not agent.can_run(job.job_type, job.target_host) or agent.running >= agent.max_concurrency:
+                continue
+            score = agent.load() - (affinity_bonus if agent.agent_id == warm else 0.0)
+            scores[agent.agent_id] = round(score, 3)
+
+        if not scores:
+            decisions.append(Decision(job.job_id, None, "sem agente com capacidade livre"))
+            continue
+
+        chosen = min(scores, key=lambda agent_id: (scores[agent_id], agent_id))
+        next(a for a in agents if a.agent_id == chosen).running += 1
+        reason = "afinidade" if chosen == warm else "menor carga"
+        decisions.append(Decision(job.job_id, chosen, reason, scores))
+    return decisions
+
+
+# ---------------------------------------------------------------------------
+# Persistência
+# ---------------------------------------------------------------------------
+def register_agent(cursor, agent_id: str, capabilities: dict, hostname: str = None, version: str = None) -> None:
+    """Cria ou atualiza o registro do agente (o commit fica com o chamador)."""
+    cursor.execute(
+        """
+        INSERT INTO agent_registry (agent_id, hostname, version, capabilities, max_concurrency, last_seen_at)
+        VALUES (%s, %s, %s, %s, %s, NOW())
+        ON CONFLICT (agent_id) DO UPDATE SET
+            hostname = EXCLUDED.hostname,
+            version = EXCLUDED.version,
+            capabilities = EXCLUDED.capabilities,
+            max_concurrency = EXCLUDED.max_concurrency,
+            last_seen_at = NOW()
+        """,
+        (
+            agent_id,
+            hostname,
+            version,
+            psycopg2.extras.Json(capabilities),
+            max(int(capabilities.get("max_concurrency") or 1), 1),
+        ),
+    )
+
+
+def touch_agent(cursor, agent_id: str, running: Optional[int] = None) -> None:
+    """Heartbeat do agente: marca como vivo e guarda a carga informada."""
+    cursor.execute(
+        """
+        UPDATE agent_registry
+        SET last_seen_at = NOW(), reported_running = COALESCE(%s, reported_running)
+        WHERE agent_id = %s
+        """,
+        (running, agent_id),
+    )
+
+
+def live_agents(cursor, liveness_seconds: int) -> List[AgentInfo]:
+    """Agentes vistos recentemente, com a carga = max(informada, leases ativos)."""
+    leased = " + ".join(
+        f"(SELECT COUNT(*) FROM {kind.table} WHERE leased_by = r.agent_id AND status = '{kind.running_status}')"
+        for kind in JOB_KINDS.values()
+    )
+    cursor.execute(
+        f"""
+        SELECT r.agent_id, r.capabilities, r.max_concurrency,
+               GREATEST(r.reported_running, {leased}) AS running
+        FROM agent_registry r
+        WHERE r.last_seen_at > NOW() - make_interval(secs => %s)
+        ORDER BY r.agent_id
+        """,
+        (liveness_seconds,),
+    )
+    agents = []
+    for row in cursor.fetchall():
+        capabilities = row["capabilities"] or {}
+        agents.append(
+            AgentInfo(
+                agent_id=row["agent_id"],
+                job_types=capabilities.get("job_types") or list(JOB_KINDS),
+                hosts=capabilities.get("hosts"),
+                max_concurrency=row["max_concurrency"],
+                running=int(row["running"] or 0),
+            )
+        )
+    return agents
+
+
+def pending_jobs(cursor, kind: str, limit: int) -> List[PendingJob]:
+    """
+    Jobs pendentes na ordem da fila, com chave de afinidade e host alvo.
+    A espera conta desde a última entrada na fila (``queued_at``), não desde a
+    criação: RPAs recorrentes e jobs devolvidos pelo reaper recomeçam do zero.
+    """
+    job = JOB_KINDS[kind]
+    affinity = f"c.{job.affinity_column}" if job.affinity_column else "NULL"
+    cursor.execute(
+        f"""
+        SELECT c.id, c.{job.payload_column} AS payload, {affinity} AS template_id,
+               EXTRACT(EPOCH FROM (NOW() - COALESCE(c.queued_at, c.created_at))) AS waited
+        FROM {job.table} c
+        WHERE c.status = 'pending' AND {job.eligible}
+        ORDER BY {job.order_by}
+        LIMIT %s
+        """,
+        (limit,),
+    )
+    return [
+        PendingJob(
+            job_id=row["id"],
+            job_type=kind,
+            affinity_key=affinity_key_for(row["template_id"], row["payload"]),
+            target_host=(row["payload"] or {}).get("host"),
+            waited=float(row["waited"] or 0),
+        )
+        for row in cursor.fetchall()
+    ]
+
+
+def load_affinity(cursor, keys: Iterable[str]) -> Dict[str, str]:
+    keys = sorted({key for key in keys if key})
+    if not keys:
+        return {}
+    cursor.execute(
+        "SELECT affinity_key, agent_id FROM agent_affinity WHERE affinity_key = ANY(%s)",
+        (keys,),
+    )
+    return {row["affinity_key"]: row["agent_id"] for row in cursor.fetchall()}
+
+
+def remember_affinity(cursor, agent_id: str, keys: Iterable[str]) -> None:
+    for key in {key for key in keys if key}:
+        cursor.execute(
+            """
+            INSERT INTO agent_affinity (affinity_key, agent_id, updated_at)
+            VALUES (%s, %s, NOW())
+            ON CONFLICT (affinity_key) DO UPDATE SET agent_id = EXCLUDED.agent_id, updated_at = NOW()
+            """,
+            (key, agent_id),
+        )
+
+
+def plan_claim(
+    cursor,
+    kind: str,
+    agent_id: str,
+    limit: int,
+    liveness_seconds: int = 200,
+    max_wait: float = 30.0,
+    affinity_bonus: float = 0.5,
+) -> Optional[Tuple[List[int], Dict[int, Decision], Dict[int, str]]]:
+    """
+    Decide quais jobs pendentes cabem ao agente que está pedindo trabalho.
+
+    Retorna ``None`` quando não há o que distribuir (agente sem registro ou
+    sozinho): o chamador reserva na ordem da fila, como antes. Caso contrário
+    retorna ``(ids, decisões, chaves de afinidade)``.
+    """
+    agents = live_agents(cursor, liveness_seconds)
+    me = next((agent for agent in agents if agent.agent_id == agent_id), None)
+    if me is None or len(agents) < 2:
+        return None
+
+    jobs = pending_jobs(cursor, kind, max(limit, 1) * len(agents) * 2)
+    affinity = load_affinity(cursor, (job.affinity_key for job in jobs))
+    decisions = assign(jobs, agents, affinity, affinity_bonus)
+
+    mine: List[int] = []
+    by_id: Dict[int, Decision] = {}
+    for job, decision in zip(jobs, decisions):
+        if len(mine) >= limit:
+            break
+        if decision.agent_id == agent_id:
+            mine.append(job.job_id)
+        elif job.waited >= max_wait and me.can_run(job.job_type, job.target_host):
+            # O escolhido não buscou o job a tempo: quem pediu leva
+            decision = Decision(job.job_id, agent_id, f"espera > {int(max_wait)}s", decision.scores)
+            mine.append(job.job_id)
+        else:
+            continue
+        by_id[job.job_id] = decision
+
+    keys = {job.job_id: job.affinity_key for job in jobs if job.job_id in by_id}
+    return mine, by_id, keys
@@ -0,0 +1,179 @@
+"""
+Fila de jobs do agente local (RPAs e dashboards) sobre as próprias tabelas.
+
+Os jobs são reservados com um único ``UPDATE ... WHERE id IN (SELECT ... FOR
+UPDATE SKIP LOCKED)``: dois agentes (ou uma repetição da mesma chamada) nunca
+recebem o mesmo job. Cada reserva tem um lease (``lease_expires_at``) renovado
+pelos heartbeats do agente; o reaper devolve à fila os jobs cujo lease venceu
+e falha os que já esgotaram as tentativas.
+"""
+
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+logger = logging.getLogger("GeRot")
+
+PRIORITY_ORDER = {"critical": 1, "high": 2, "medium": 3}
+
+
+@dataclass(frozen=True)
+class JobKind:
+    table: str
+    running_status: str
+    started_column: str
+    returning: str
+    eligible: str
+    order_by: str
+    payload_column: str
+    result_column: str
+    affinity_column: Optional[str] = None
+
+
+JOB_KINDS: Dict[str, JobKind] = {
+    "rpa": JobKind(
+        table="agent_rpas",
+        running_status="running",
+        started_column="executed_at",
+        returning="""
+            j.id, j.name, j.description, j.parameters, j.priority, j.created_at,
+            j.attempts, j.fingerprint, (SELECT t.name FROM agent_rpa_types t WHERE t.id = j.rpa_type_id) AS type_name
+        """,
+        # RPAs do tipo "Extração de Dados" ou com parâmetros brudam
+        # (seguidores de um job idêntico esperam o líder, ver job_coalescing)
+        eligible="""
+            (EXISTS (SELECT 1 FROM agent_rpa_types t
+                     WHERE t.id = c.rpa_type_id AND t.name LIKE '%%Extração%%')
+             OR c.parameters::text LIKE '%%brudam%%'
+             OR c.parameters::text LIKE '%%query%%')
+            AND c.leader_id IS NULL
+        """,
+        order_by="""
+            CASE c.priority
+                WHEN 'critical' THEN 1
+                WHEN 'high' THEN 2
+                WHEN 'medium' THEN 3
+                ELSE 4
+            END,
+            c.created_at ASC
+        """,
+        payload_column="parameters",
+        result_column="result",
+    ),
+    "dashboard": JobKind(
+        table="agent_dashboard_requests",
+        running_status="processing",
+        started_column="processed_at",
+        returning="""
+            j.id, j.title, j.description, j.category, j.chart_types, j.filters,
+            j.created_by, j.created_at, j.attempts, j.fingerprint
+        """,
+        # Apenas solicitações que têm query nos filtros (seguidores esperam o líder)
+        eligible="c.filters IS NOT NULL AND c.filters::text LIKE '%%query%%' AND c.leader_id IS NULL",
+        order_by="c.created_at ASC",
+        payload_column="filters",
+        result_column="result_data",
+        affinity_column="template_id",
+    ),
+}
+
+
+def claim_jobs(
+    cursor,
+    kind: str,
+    agent_id: str,
+    limit: int = 10,
+    lease_seconds: int = 300,
+    only_ids: Optional[List[int]] = None,
+) -> List[dict]:
+    """
+    Reserva até ``limit`` jobs pendentes para ``agent_id`` em uma única instrução.
+
+    Linhas já travadas por outra transação são puladas (SKIP LOCKED), então
+    reservas concorrentes nunca se sobrepõem. ``only_ids`` restringe a reserva
+    aos jobs escolhidos pelo dispatcher. O commit fica com o chamador.
+    """
+    job = JOB_KINDS[kind]
+    only_filter = "AND c.id = ANY(%s)" if only_ids is not None else ""
+    params = [job.running_status, agent_id, lease_seconds]
+    if only_ids is not None:
+        params.append(list(only_ids))
+    params.append(limit)
+    cursor.execute(
+        f"""
+        UPDATE {job.table} j
+        SET status = %s,
+            {job.started_column} = NOW(),
+            leased_by = %s,
+            lease_expires_at = NOW() + make_interval(secs => %s),
+            attempts = j.attempts + 1,
+            progress = NULL,
+            updated_at = NOW()
+        WHERE j.id IN (
+            SELECT c.id FROM {job.table} c
+            WHERE c.status = 'pending' AND {job.eligible} {only_filter}
+            ORDER BY {job.order_by}
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING {job.returning}
+        """,
+        params,
+    )
+    jobs = [dict(row) for row in cursor.fetchall()]
+    # RETURNING não garante ordem: reaplicar prioridade/antiguidade
+    jobs.sort(key=lambda j: (PRIORITY_ORDER.get(j.get("priority"), 4), j["created_at"]))
+    return jobs
+
+
+def renew_leases(cursor, kind: str, agent_id: str, job_ids: Iterable[int], lease_seconds: int = 300) -> List[int]:
+    """Heartbeat: estende o lease dos jobs que ainda pertencem ao agente."""
+    ids = [int(job_id) for job_id in job_ids]
+    if not ids:
+        return []
+    job = JOB_KINDS[kind]
+    cursor.execute(
+        f"""
+        UPDATE {job.table}
+        SET lease_expires_at = NOW() + make_interval(secs => %s)
+        WHERE id = ANY(%s) AND leased_by = %s AND status = %s
+        RETURNING id
+        """,
+        (lease_seconds, ids, agent_id, job.running_status),
+    )
+    return [row["id"] for row in cursor.fetchall()]
+
+
+def reap_expired(cursor, kind: str, max_attempts: int = 3) -> Tuple[int, int]:
+    """
+    Devolve à fila os jobs com lease vencido (agente caiu ou travou).
+
+    Jobs que já usaram ``max_attempts`` tentativas são marcados como 'failed'.
+    Retorna ``(reenfileirados, falhos)``; o commit fica com o chamador.
+    """
+    job = JOB_KINDS[kind]
+    cursor.execute(
+        f"""
+        UPDATE {job.table}
+        SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'pending' END,
+            error_message = CASE WHEN attempts >= %s
+                THEN 'Lease expirado após ' || attempts || ' tentativa(s) (agente ' || COALESCE(leased_by, '?') || ')'
+                ELSE error_message END,
+            leased_by = NULL,
+            lease_expires_at = NULL,
+            queued_at = CASE WHEN attempts >= %s THEN queued_at ELSE NOW() END,
+            updated_at = NOW()
+        WHERE status = %s AND lease_expires_at < NOW()
+        RETURNING id, status
+        """,
+        (max_attempts, max_attempts, max_attempts, job.running_status),
+    )
+    rows = cursor.fetchall()
+    requeued = sum(1 for row in rows if row["status"] == "pending")
+    failed = len(rows) - requeued
+    if rows:
+        logger.warning(f"[AGENT-JOBS] {kind}: {requeued} job(s) reenfileirado(s), {failed} falho(s) por lease vencido")
+    return requeued, failed
@@ -0,0 +1,238 @@
+"""
+Armazenamento do ``agent_logs``: partições mensais, retenção e escrita em lote.
+
+A tabela é particionada por ``created_at`` (uma partição ``agent_logs_AAAAMM``
+por mês). ``AgentLogStore.maintain`` cria as partições dos próximos meses e
+descarta as que saíram da retenção com ``DROP TABLE`` — sem DELETE em massa,
+sem inchaço de índices e sem VACUUM pesado.
+
+As requisições não gravam o log na hora: ``write`` só coloca o registro em
+uma fila do processo e uma thread grava em lote (um INSERT por lote) a cada
+``flush_seconds`` ou quando a fila enche.
+"""
+
+from __future__ import annotations
+
+import atexit
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from datetime import date, datetime, timezone
+from typing import Callable, List, Optional
+
+import psycopg2.extras
+
+
+logger = logging.getLogger("GeRot")
+
+_PARTITION_RE = re.compile(r"^agent_logs_(\d{4})(\d{2})$")
+
+
+def month_start(day: date, offset: int = 0) -> date:
+    """Primeiro dia do mês de ``day`` deslocado ``offset`` meses."""
+    months = day.year * 12 + day.month - 1 + offset
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"agent_logs_{month.year:04d}{month.month:02d}"
+
+
+def expired_partitions(names, today: date, retention_months: int) -> List[str]:
+    """Partições cujo mês inteiro é anterior à janela de retenção."""
+    oldest_kept = month_start(today, -(retention_months - 1))
+    expired = []
+    for name in names:
+        match = _PARTITION_RE.match(name)
+        if match and date(int(match.group(1)), int(match.group(2)), 1) < oldest_kept:
+            expired.append(name)
+    return sorted(expired)
+
+
+class AgentLogStore:
+    """
+    Escrita em lote e manutenção das partições do ``agent_logs``.
+
+    ``connection_scope`` é um context manager que fornece uma conexão
+    (``background_db`` no app). Uma instância por processo: a thread é
+    iniciada no primeiro ``write`` (depois do fork dos workers).
+    """
+
+    def __init__(
+        self,
+        connection_scope: Callable,
+        retention_months: int = 6,
+        months_ahead: int = 2,
+        flush_seconds: float = 2.0,
+        batch_size: int = 500,
+        max_queue: int = 20000,
+        maintenance_seconds: float = 6 * 3600,
+    ):
+        self._connection_scope = connection_scope
+        self.retention_months = max(1, retention_months)
+        self.months_ahead = months_ahead
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self.maintenance_seconds = maintenance_seconds
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self.dropped = 0
+
+    # ---------------------------------------------------------------------#
+    # Escrita
+    # ---------------------------------------------------------------------#
+    def write(self, action_type: str, entity_type=None, entity_id=None, user_id=None, details=None) -> None:
+        """Enfileira um registro de log; nunca bloqueia a requisição."""
+        self._ensure_thread()
+        try:
+            # O horário é o da ação, não o da gravação do lote
+            self._queue.put_nowait(
+                (action_type, entity_type, entity_id, user_id, details, datetime.now(timezone.utc))
+            )
+            if self._queue.qsize() >= self.batch_size:
+                self._wake.set()
+        except queue.Full:
+            # Banco indisponível por muito tempo: descarta em vez de segurar a requisição
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning(f"[AGENT-LOGS] Fila cheia; {self.dropped} registro(s) descartado(s)")
+
+    def flush(self) -> int:
+        """Grava tudo o que está na fila, em lotes. Retorna quantos registros gravou."""
+        written = 0
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return written
+            try:
+                self._insert(batch)
+                written += len(batch)
+            except Exception as exc:
+                logger.error(f"[AGENT-LOGS] Falha ao gravar {len(batch)} registro(s): {exc}")
+                return written
+
+    def _insert(self, batch) -> None:
+        with self._connection_scope() as conn:
+            cursor = conn.cursor()
+            try:
+                psycopg2.extras.execute_values(
+                    cursor,
+                    """
+                    INSERT INTO agent_logs (action_type, entity_type, entity_id, user_id, details, created_at)
+                    VALUES %s
+                    """,
+                    [
+                        (action, entity, entity_id, user_id,
+                         None if details is None else psycopg2.extras.Json(details), created_at)
+                        for action, entity, entity_id, user_id, details, created_at in batch
+                    ],
+                    page_size=self.batch_size,
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def _ensure_thread(self) -> None:
+        # Após o fork o processo filho herda o objeto, mas não a thread
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="agent-log-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _loop(self) -> None:
+        next_maintenance = 0.0  # manutenção antes do primeiro lote: a partição do mês precisa existir
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            if time.monotonic() >= next_maintenance:
+                next_maintenance = time.monotonic() + self.maintenance_seconds
+                try:
+                    self.maintain()
+                except Exception as exc:
+                    logger.error(f"[AGENT-LOGS] Erro na manutenção das partições: {exc}")
+            self.flush()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        self.flush()
+
+    # ---------------------------------------------------------------------#
+    # Partições
+    # ---------------------------------------------------------------------#
+    def maintain(self, today: Optional[date] = None) -> dict:
+        """
+        Cria as partições do mês atual e dos próximos ``months_ahead`` meses e
+        remove as anteriores à retenção. Um processo por vez (advisory lock).
+        """
+        today = today or date.today()
+        with self._connection_scope() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT pg_try_advisory_xact_lock(hashtext('agent_logs_maintenance')) AS locked")
+                if not cursor.fetchone()["locked"]:
+                    conn.rollback()
+                    return {"created": [], "dropped": []}
+
+                cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('agent_logs')")
+                table = cursor.fetchone()
+                if not table or table["relkind"] != "p":
+                    conn.rollback()
+                    logger.warning("[AGENT-LOGS] agent_logs não é particionada; rode setup_agent_tables.py")
+                    return {"created": [], "dropped": []}
+
+                created = []
+                for offset in range(self.months_ahead + 1):
+                    name = self._create_partition(cursor, month_start(today, offset))
+                    if name:
+                        created.append(name)
+
+                cursor.execute("""
+                    SELECT c.relname AS name
+                    FROM pg_inherits i
+                    JOIN pg_class c ON c.oid = i.inhrelid
+                    WHERE i.inhparent = 'agent_logs'::regclass
+                """)
+                partitions = [row["name"] for row in cursor.fetchall()]
+                dropped = expired_partitions(partitions, today, self.retention_months)
+                for name in dropped:
+                    cursor.execute(f"DROP TABLE IF EXISTS {name}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+        if created or dropped:
+            logger.info(f"[AGENT-LOGS] Partições criadas: {created or '-'}; removidas: {dropped or '-'}")
+        return {"created": created, "dropped": dropped}
+
+    @staticmethod
+    def _create_partition(cursor, month: date) -> Optional[str]:
+        name = partition_name(month)
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL AS exists", (name,))
+        if cursor.fetchone()["exists"]:
+            return None
+        cursor.execute(
+            f"CREATE TABLE {name} PARTITION OF agent_logs FOR VALUES FROM (%s) TO (%s)",
+            (month.isoformat(), month_start(month, 1).isoformat()),
+        )
+        return name
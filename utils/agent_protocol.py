@@ -0,0 +1,93 @@
+"""
+Protocolo de troca única (``POST /api/agent/work``) entre o GeRot e o agente local.
+
+Em uma requisição o agente envia resultados, heartbeats e capacidade livre e
+recebe o próximo lote de jobs, cada um marcado com ``type``. Versão 1::
+
+    requisição: {"version": 1, "capacity": 5, "wait": 150, "running": 2,
+                 "heartbeats": {"rpa": [12], "dashboard": []},
+                 "results": [{"type": "rpa", "id": 11, "success": true,
+                              "data": [...], "row_count": 3, "chunks": 0,
+                              "error": null, "logs": [...]}]}
+    resposta:   {"version": 1,
+                 "acks": [{"type": "rpa", "id": 11, "code": 200, "success": true,
+                           "status": "completed"}],
+                 "renewed": {"rpa": [12], "dashboard": []}, "lease_seconds": 300,
+                 "jobs": [{"type": "dashboard", "id": 7, ...}]}
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+
+PROTOCOL_VERSION = 1
+SUPPORTED_VERSIONS = {1}
+JOB_TYPES = ("rpa", "dashboard")
+
+
+class ProtocolError(ValueError):
+    """Requisição fora do schema do protocolo."""
+
+
+@dataclass
+class WorkRequest:
+    version: int
+    capacity: int
+    wait: float
+    heartbeats: Dict[str, List[int]] = field(default_factory=dict)
+    results: List[dict] = field(default_factory=list)
+    running: Optional[int] = None
+
+
+def _ids(values, where: str) -> List[int]:
+    if not isinstance(values, list):
+        raise ProtocolError(f"{where} deve ser uma lista de ids")
+    try:
+        return [int(value) for value in values]
+    except (TypeError, ValueError):
+        raise ProtocolError(f"{where} contém id inválido")
+
+
+def parse_work_request(body, max_capacity: int = 20, max_wait: float = 150) -> WorkRequest:
+    """Valida o corpo de ``/api/agent/work`` e normaliza os limites."""
+    if not isinstance(body, dict):
+        raise ProtocolError("Corpo JSON obrigatório")
+
+    version = body.get("version", PROTOCOL_VERSION)
+    if version not in SUPPORTED_VERSIONS:
+        raise ProtocolError(f"Versão de protocolo não suportada: {version}")
+
+    try:
+        capacity = int(body.get("capacity", 1))
+        wait = float(body.get("wait", 0))
+        running = None if body.get("running") is None else max(int(body["running"]), 0)
+    except (TypeError, ValueError):
+        raise ProtocolError("capacity/wait/running inválidos")
+
+    heartbeats = body.get("heartbeats") or {}
+    if not isinstance(heartbeats, dict) or set(heartbeats) - set(JOB_TYPES):
+        raise ProtocolError("heartbeats deve mapear tipos de job para listas de ids")
+
+    results = body.get("results") or []
+    if not isinstance(results, list):
+        raise ProtocolError("results deve ser uma lista")
+    for result in results:
+        if not isinstance(result, dict) or result.get("type") not in JOB_TYPES:
+            raise ProtocolError("Cada resultado precisa de type ('rpa' ou 'dashboard')")
+        result["id"] = _ids([result.get("id")], "results[].id")[0]
+
+    return WorkRequest(
+        version=version,
+        capacity=max(0, min(capacity, max_capacity)),
+        wait=max(0.0, min(wait, max_wait)),
+        heartbeats={kind: _ids(ids or [], f"heartbeats.{kind}") for kind, ids in heartbeats.items()},
+        results=results,
+        running=running,
+    )
+
+
+def tag_jobs(kind: str, jobs: List[dict]) -> List[dict]:
+    """Marca cada job com o seu tipo para a lista única da resposta."""
+    return [dict(job, type=kind) for job in jobs]
@@ -0,0 +1,232 @@
+"""
+Migrações do schema do agente local: lease dos jobs, agendamento,
+coalescência, snapshots, extração incremental, uploads em partes, registro
+dos agentes e ``agent_logs`` particionada.
+
+Tudo é idempotente (``ADD COLUMN IF NOT EXISTS``, ``CREATE ... IF NOT
+EXISTS``) e roda a cada inicialização pelo ``ensure_schema()`` do app, sob o
+advisory lock da migração; ``setup_agent_tables.py`` usa as mesmas funções.
+Bancos criados antes dessas colunas são atualizados sem passo manual.
+"""
+
+from __future__ import annotations
+
+import logging
+from datetime import date
+from typing import Optional
+
+from utils.agent_log_store import month_start, partition_name
+
+
+logger = logging.getLogger("GeRot")
+
+# Tabelas criadas por setup_agent_tables.py / ensure_agent_tables()
+BASE_TABLES = ("agent_rpas", "agent_dashboard_requests", "agent_dashboard_templates")
+JOB_TABLES = (("agent_rpas", "running"), ("agent_dashboard_requests", "processing"))
+
+
+def tables_exist(cursor) -> bool:
+    cursor.execute(
+        "SELECT bool_and(to_regclass(t) IS NOT NULL) AS exists FROM unnest(%s::text[]) t",
+        (list(BASE_TABLES),),
+    )
+    return bool(cursor.fetchone()["exists"])
+
+
+def migrate(cursor, retention_months: int = 6, today: Optional[date] = None) -> None:
+    """Aplica todas as migrações do agente. O commit fica com o chamador."""
+    cursor.execute("""
+        ALTER TABLE agent_dashboard_requests ADD COLUMN IF NOT EXISTS template_id BIGINT
+            REFERENCES agent_dashboard_templates(id) ON DELETE SET NULL;
+    """)
+
+    # Lease dos jobs do agente local (reserva com SKIP LOCKED + reaper)
+    for table, running_status in JOB_TABLES:
+        cursor.execute(f"""
+            ALTER TABLE {table} ADD COLUMN IF NOT EXISTS leased_by TEXT;
+            ALTER TABLE {table} ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMPTZ;
+            ALTER TABLE {table} ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+            ALTER TABLE {table} ADD COLUMN IF NOT EXISTS progress JSONB;
+            -- Entrada na fila (criação, reenfileiramento pelo reaper, disparo do agendador)
+            ALTER TABLE {table} ADD COLUMN IF NOT EXISTS queued_at TIMESTAMPTZ;
+            ALTER TABLE {table} ALTER COLUMN queued_at SET DEFAULT NOW();
+
+            CREATE INDEX IF NOT EXISTS idx_{table}_pending ON {table}(created_at) WHERE status = 'pending';
+            CREATE INDEX IF NOT EXISTS idx_{table}_lease ON {table}(lease_expires_at) WHERE status = '{running_status}';
+            CREATE INDEX IF NOT EXISTS idx_{table}_leased_by ON {table}(leased_by) WHERE status = '{running_status}';
+        """)
+
+    # Agendamento das RPAs recorrentes (utils/rpa_scheduler.py)
+    cursor.execute("""
+        ALTER TABLE agent_rpas ADD COLUMN IF NOT EXISTS next_run_at TIMESTAMPTZ;
+        ALTER TABLE agent_rpas ADD COLUMN IF NOT EXISTS last_scheduled_at TIMESTAMPTZ;
+
+        CREATE INDEX IF NOT EXISTS idx_agent_rpas_next_run ON agent_rpas(next_run_at) WHERE next_run_at IS NOT NULL;
+    """)
+
+    # Coalescência de jobs idênticos (utils/job_coalescing.py)
+    for table, _ in JOB_TABLES:
+        cursor.execute(f"""
+            ALTER TABLE {table} ADD COLUMN IF NOT EXISTS fingerprint TEXT;
+            ALTER TABLE {table} ADD COLUMN IF NOT EXISTS leader_id BIGINT REFERENCES {table}(id) ON DELETE SET NULL;
+
+            CREATE INDEX IF NOT EXISTS idx_{table}_fingerprint ON {table}(fingerprint, completed_at DESC) WHERE fingerprint IS NOT NULL;
+            CREATE INDEX IF NOT EXISTS idx_{table}_leader ON {table}(leader_id) WHERE leader_id IS NOT NULL;
+        """)
+
+    # Snapshots materializados dos dashboards (servidos pelo execute-query)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS agent_dashboard_snapshots (
+            template_id BIGINT PRIMARY KEY REFERENCES agent_dashboard_templates(id) ON DELETE CASCADE,
+            query_hash TEXT,
+            data JSONB NOT NULL DEFAULT '[]'::jsonb,
+            fields JSONB NOT NULL DEFAULT '[]'::jsonb,
+            row_count INTEGER NOT NULL DEFAULT 0,
+            watermark TEXT,
+            refreshed_at TIMESTAMPTZ,
+            refresh_started_at TIMESTAMPTZ,
+            last_error TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+    """)
+
+    # Extração incremental dos dashboards (utils/incremental_extract.py)
+    cursor.execute("""
+        ALTER TABLE agent_dashboard_requests ADD COLUMN IF NOT EXISTS watermark_from TEXT;
+
+        CREATE TABLE IF NOT EXISTS agent_dashboard_watermarks (
+            dashboard_id BIGINT PRIMARY KEY REFERENCES agent_dashboard_requests(id) ON DELETE CASCADE,
+            state_hash TEXT NOT NULL,
+            watermark TEXT,
+            rows JSONB NOT NULL DEFAULT '[]'::jsonb,
+            row_count INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+    """)
+
+    # Partes de resultados grandes enviados em streaming (RPAs e dashboards)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS agent_result_chunks (
+            entity_type TEXT NOT NULL,
+            entity_id BIGINT NOT NULL,
+            seq INTEGER NOT NULL,
+            rows JSONB NOT NULL DEFAULT '[]'::jsonb,
+            row_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (entity_type, entity_id, seq)
+        );
+    """)
+
+    # Uploads retomáveis (NDJSON gzip): partes ficam em staging até o commit
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS agent_result_uploads (
+            upload_id TEXT PRIMARY KEY,
+            entity_type TEXT NOT NULL,
+            entity_id BIGINT NOT NULL,
+            agent_id TEXT,
+            status TEXT NOT NULL DEFAULT 'open',
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_agent_result_uploads_open
+            ON agent_result_uploads(entity_type, entity_id, agent_id) WHERE status = 'open';
+
+        CREATE TABLE IF NOT EXISTS agent_result_upload_parts (
+            upload_id TEXT NOT NULL REFERENCES agent_result_uploads(upload_id) ON DELETE CASCADE,
+            seq INTEGER NOT NULL,
+            rows JSONB NOT NULL,
+            row_count INTEGER NOT NULL DEFAULT 0,
+            checksum TEXT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (upload_id, seq)
+        );
+    """)
+
+    # Registro dos agentes locais e afinidade para a distribuição de jobs
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS agent_registry (
+            agent_id TEXT PRIMARY KEY,
+            hostname TEXT,
+            version TEXT,
+            capabilities JSONB NOT NULL DEFAULT '{}',
+            max_concurrency INTEGER NOT NULL DEFAULT 1,
+            reported_running INTEGER NOT NULL DEFAULT 0,
+            registered_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            last_seen_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_agent_registry_last_seen ON agent_registry(last_seen_at);
+
+        CREATE TABLE IF NOT EXISTS agent_affinity (
+            affinity_key TEXT PRIMARY KEY,
+            agent_id TEXT NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+    """)
+
+    migrate_agent_logs(cursor, retention_months, today)
+
+
+def migrate_agent_logs(cursor, retention_months: int = 6, today: Optional[date] = None) -> Optional[int]:
+    """
+    ``agent_logs`` particionada por mês (utils/agent_log_store.py). A tabela
+    antiga, não particionada, é convertida mantendo os meses da retenção.
+    Retorna os registros migrados, ou ``None`` se não havia tabela antiga.
+    """
+    today = today or date.today()
+    retention_months = max(1, retention_months)
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('agent_logs')")
+    existing = cursor.fetchone()
+    legacy = existing is not None and existing["relkind"] == "r"
+    if legacy:
+        cursor.execute("""
+            ALTER TABLE agent_logs RENAME TO agent_logs_legacy;
+            DROP INDEX IF EXISTS idx_agent_logs_action_type;
+            DROP INDEX IF EXISTS idx_agent_logs_created_at;
+        """)
+
+    cursor.execute("""
+        CREATE SEQUENCE IF NOT EXISTS agent_logs_id_seq;
+
+        CREATE TABLE IF NOT EXISTS agent_logs (
+            id BIGINT NOT NULL DEFAULT nextval('agent_logs_id_seq'),
+            action_type TEXT NOT NULL,
+            entity_type TEXT,
+            entity_id BIGINT,
+            user_id BIGINT REFERENCES users_new(id) ON DELETE SET NULL,
+            details JSONB,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at);
+
+        ALTER SEQUENCE agent_logs_id_seq OWNED BY agent_logs.id;
+
+        -- Consultas do visualizador: logs de uma entidade e por tipo de ação, mais recentes primeiro
+        CREATE INDEX IF NOT EXISTS idx_agent_logs_entity ON agent_logs(entity_type, entity_id, created_at DESC);
+        CREATE INDEX IF NOT EXISTS idx_agent_logs_action_created ON agent_logs(action_type, created_at DESC);
+    """)
+
+    first = month_start(today, -(retention_months - 1)) if legacy else month_start(today)
+    offset = 0
+    while month_start(first, offset) <= month_start(today, 2):
+        month = month_start(first, offset)
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {partition_name(month)} "
+            "PARTITION OF agent_logs FOR VALUES FROM (%s) TO (%s)",
+            (month.isoformat(), month_start(month, 1).isoformat()),
+        )
+        offset += 1
+
+    if not legacy:
+        return None
+    cursor.execute("""
+        INSERT INTO agent_logs (id, action_type, entity_type, entity_id, user_id, details, created_at)
+        SELECT id, action_type, entity_type, entity_id, user_id, details, created_at
+        FROM agent_logs_legacy
+        WHERE created_at >= %s
+    """, (first.isoformat(),))
+    migrated = cursor.rowcount
+    cursor.execute("DROP TABLE agent_logs_legacy")
+    logger.info(f"[AGENT-LOGS] {migrated} registro(s) migrado(s) para a tabela particionada")
+    return migrated
@@ -0,0 +1,203 @@
+"""
+Cache em disco dos modelos 3D servidos por ``/api/3d-model/<tipo>``.
+
+Os arquivos são endereçados pelo conteúdo: ``objects/<sha256>`` guarda os
+bytes e ``index/<hash da url>.json`` aponta a URL de origem para o objeto. O
+SHA-256 do conteúdo vira o ETag forte da resposta e a versão da URL
+(``?v=<sha256>``), que pode ser servida com ``Cache-Control: immutable``.
+
+- Preenchimento atômico: o download vai para ``tmp/`` e entra no cache com
+  ``os.replace``; um leitor nunca vê arquivo pela metade.
+- Single-flight: em misses simultâneos só uma requisição baixa a origem, as
+  demais esperam o lock da chave (lock de thread + ``flock`` entre os workers
+  do gunicorn) e encontram o objeto pronto.
+- LRU: cada acerto atualiza o mtime do objeto; acima de ``max_bytes`` os
+  menos usados são removidos.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional
+
+import requests
+
+try:  # Linux (produção); no Windows o single-flight fica só entre threads
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+logger = logging.getLogger("GeRot")
+
+CONTENT_TYPES = {
+    ".glb": "model/gltf-binary",
+    ".gltf": "model/gltf+json",
+    ".fbx": "application/octet-stream",
+}
+CHUNK_SIZE = 1024 * 1024
+
+
+class AssetCacheError(Exception):
+    """Falha ao baixar o arquivo de origem para o cache."""
+
+
+@dataclass
+class CachedAsset:
+    path: Path
+    sha256: str
+    size: int
+    content_type: str
+
+
+def url_key(url: str) -> str:
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+class KeyedLock:
+    """Lock por chave: entre threads do processo e, com ``flock``, entre processos."""
+
+    def __init__(self, locks_dir):
+        self._locks_dir = Path(locks_dir)
+        self._locks_dir.mkdir(parents=True, exist_ok=True)
+        self._guard = threading.Lock()
+        self._locks: Dict[str, threading.Lock] = {}
+
+    @contextmanager
+    def hold(self, key: str):
+        with self._guard:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self._locks_dir / f"{key}.lock", "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class AssetCache:
+    """Cache LRU em disco, endereçado por conteúdo, para arquivos remotos."""
+
+    def __init__(self, root, max_bytes: int, session: Optional[requests.Session] = None):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.session = session or requests.Session()
+        self._objects = self.root / "objects"
+        self._index = self.root / "index"
+        self._tmp = self.root / "tmp"
+        for folder in (self._objects, self._index, self._tmp):
+            folder.mkdir(parents=True, exist_ok=True)
+        self._single_flight = KeyedLock(self.root / "locks")
+
+    def version(self, url: str) -> Optional[str]:
+        """SHA-256 do conteúdo em cache (sem baixar); ``None`` se ainda não está no cache."""
+        asset = self._lookup(url_key(url), touch=False)
+        return asset.sha256 if asset else None
+
+    def fetch(self, url: str) -> CachedAsset:
+        """Arquivo de ``url`` no disco local, baixando a origem só no primeiro acesso."""
+        key = url_key(url)
+        asset = self._lookup(key)
+        if asset:
+            return asset
+
+        with self._single_flight.hold(key):
+            asset = self._lookup(key)  # outra requisição pode ter preenchido enquanto esperávamos
+            if asset:
+                return asset
+            asset = self._download(url, key)
+        self._evict(keep=asset.sha256)
+        return asset
+
+    # ---------------------------------------------------------------------#
+    # Índice e objetos
+    # ---------------------------------------------------------------------#
+    def _lookup(self, key: str, touch: bool = True) -> Optional[CachedAsset]:
+        index_file = self._index / f"{key}.json"
+        try:
+            entry = json.loads(index_file.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        path = self._objects / entry["sha256"]
+        try:
+            if touch:
+                os.utime(path)  # mtime = último uso (LRU)
+            size = path.stat().st_size
+        except FileNotFoundError:
+            # Objeto removido pelo LRU: o índice ficou órfão
+            index_file.unlink(missing_ok=True)
+            return None
+        return CachedAsset(path, entry["sha256"], size, entry["content_type"])
+
+    def _download(self, url: str, key: str) -> CachedAsset:
+        started = time.monotonic()
+        digest = hashlib.sha256()
+        handle = tempfile.NamedTemporaryFile(dir=self._tmp, delete=False)
+        try:
+            with handle, self.session.get(url, stream=True, timeout=(30, 300)) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    digest.update(chunk)
+                    handle.write(chunk)
+                source_type = response.headers.get("Content-Type")
+            sha256 = digest.hexdigest()
+            path = self._objects / sha256
+            os.replace(handle.name, path)
+        except requests.exceptions.RequestException as exc:
+            Path(handle.name).unlink(missing_ok=True)
+            raise AssetCacheError(f"Erro ao baixar {url}: {exc}")
+        except BaseException:
+            Path(handle.name).unlink(missing_ok=True)
+            raise
+
+        ext = os.path.splitext(url.split("?")[0])[1].lower()
+        content_type = (
+            CONTENT_TYPES.get(ext) or mimetypes.guess_type(url)[0] or source_type or "application/octet-stream"
+        )
+        self._write_index(key, {"url": url, "sha256": sha256, "content_type": content_type})
+
+        size = path.stat().st_size
+        logger.info(
+            f"[ASSET-CACHE] {url}: {size / (1024 * 1024):.1f} MB em cache "
+            f"({time.monotonic() - started:.1f}s, sha256 {sha256[:12]})"
+        )
+        return CachedAsset(path, sha256, size, content_type)
+
+    def _write_index(self, key: str, entry: dict) -> None:
+        fd, tmp_name = tempfile.mkstemp(dir=self._tmp, suffix=".json")
+        with os.fdopen(fd, "w", encoding="utf-8") as handle:
+            json.dump(entry, handle)
+        os.replace(tmp_name, self._index / f"{key}.json")
+
+    def _evict(self, keep: str) -> None:
+        """Remove os objetos menos usados até o cache caber em ``max_bytes``."""
+        objects = []
+        for path in self._objects.iterdir():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            objects.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in objects)
+        for _, size, path in sorted(objects):
+            if total <= self.max_bytes:
+                break
+            if path.name == keep:
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
+            logger.info(f"[ASSET-CACHE] Removido do cache (LRU): {path.name[:12]} ({size} bytes)")
@@ -0,0 +1,219 @@
+"""
+Processamento assíncrono dos modelos 3D enviados para os ambientes.
+
+Depois do upload, cada GLB ganha uma linha ``pending`` em
+``environment_asset_variants``. O ``AssetPipeline`` (uma thread por worker)
+pega as linhas com ``FOR UPDATE SKIP LOCKED``, baixa o original do storage,
+gera a variante otimizada e a prévia low-poly (utils/glb_optimizer.py) e
+grava as duas ao lado do original, com as estatísticas de tamanho/qualidade.
+Um lease vencido devolve o trabalho para a fila se o worker morrer no meio.
+"""
+
+from __future__ import annotations
+
+import io
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+import psycopg2.extras
+
+from utils.glb_optimizer import GlbError, inspect_glb, optimize_glb, preview_glb
+
+
+logger = logging.getLogger("GeRot")
+
+GLB_CONTENT_TYPE = "model/gltf-binary"
+RETRY_DELAY = timedelta(minutes=5)
+
+
+def variant_path(storage_path: str, variant: str) -> str:
+    """``environments/x.glb`` -> ``environments/x.<variant>.glb``."""
+    base, ext = os.path.splitext(storage_path)
+    return f"{base}.{variant}{ext or '.glb'}"
+
+
+def enqueue_glb(cursor, resource_id: int, storage_path: str) -> bool:
+    """Agenda o processamento de um recurso; ignora o que não for GLB."""
+    if os.path.splitext(storage_path)[1].lower() != ".glb":
+        return False
+    cursor.execute(
+        """
+        INSERT INTO environment_asset_variants (resource_id, storage_path)
+        VALUES (%s, %s)
+        ON CONFLICT (resource_id) DO UPDATE
+        SET storage_path = EXCLUDED.storage_path, status = 'pending', attempts = 0,
+            error = NULL, locked_until = NULL, updated_at = NOW()
+        """,
+        (resource_id, storage_path),
+    )
+    return True
+
+
+class AssetPipeline:
+    """Fila de otimização de modelos 3D guardada no banco."""
+
+    def __init__(
+        self,
+        connection_scope: Callable,
+        storage_factory: Callable,
+        tick_seconds: float = 60.0,
+        lease_minutes: int = 30,
+        max_attempts: int = 3,
+        max_texture_size: int = 2048,
+        preview_grid: int = 64,
+    ) -> None:
+        self._connection_scope = connection_scope
+        self._storage_factory = storage_factory
+        self.tick_seconds = tick_seconds
+        self.lease_minutes = lease_minutes
+        self.max_attempts = max_attempts
+        self.max_texture_size = max_texture_size
+        self.preview_grid = preview_grid
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="asset-pipeline", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def wake(self) -> None:
+        """Processa logo (chamado depois do commit que enfileirou o recurso)."""
+        self._wake.set()
+
+    def run_once(self) -> int:
+        processed = 0
+        while not self._stop.is_set():
+            job = self._claim()
+            if job is None:
+                return processed
+            self._process(job)
+            processed += 1
+        return processed
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as exc:
+                logger.error(f"[ASSETS] Erro na fila de otimização: {exc}")
+            self._wake.wait(self.tick_seconds)
+            self._wake.clear()
+
+    # ---------------------------------------------------------------------#
+    # Fila
+    # ---------------------------------------------------------------------#
+    def _claim(self) -> Optional[dict]:
+        with self._connection_scope() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    """
+                    UPDATE environment_asset_variants
+                    SET status = 'processing', attempts = attempts + 1,
+                        locked_until = NOW() + make_interval(mins => %s), updated_at = NOW()
+                    WHERE resource_id = (
+                        SELECT resource_id FROM environment_asset_variants
+                        WHERE attempts < %s
+                          AND (status = 'pending' OR (status = 'processing' AND locked_until < NOW()))
+                        ORDER BY created_at
+                        LIMIT 1
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING resource_id, storage_path, attempts
+                    """,
+                    (self.lease_minutes, self.max_attempts),
+                )
+                job = cursor.fetchone()
+                conn.commit()
+                return dict(job) if job else None
+            except Exception:
+                conn.rollback()
+                raise
+
+    def _finish(self, resource_id: int, **values) -> None:
+        values.setdefault("locked_until", None)
+        columns = ", ".join(f"{column} = %s" for column in values)
+        with self._connection_scope() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    f"""
+                    UPDATE environment_asset_variants
+                    SET {columns}, updated_at = NOW()
+                    WHERE resource_id = %s
+                    """,
+                    (*values.values(), resource_id),
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    # ---------------------------------------------------------------------#
+    # Processamento
+    # ---------------------------------------------------------------------#
+    def _process(self, job: dict) -> None:
+        resource_id, path = job["resource_id"], job["storage_path"]
+        started = time.monotonic()
+        try:
+            storage = self._storage_factory()
+            data = storage.download(path)
+            original = inspect_glb(data)
+            optimized = optimize_glb(data, max_texture_size=self.max_texture_size)
+            preview = preview_glb(data, grid=self.preview_grid)
+
+            # Variante maior que o original (já otimizado na origem) não é gravada
+            optimized_url = None
+            if optimized.stats["size_bytes"] < original["size_bytes"]:
+                optimized_url = storage.upload(
+                    io.BytesIO(optimized.data), variant_path(path, "optimized"), GLB_CONTENT_TYPE
+                ).public_url
+            preview_url = storage.upload(
+                io.BytesIO(preview.data), variant_path(path, "preview"), GLB_CONTENT_TYPE
+            ).public_url
+        except GlbError as exc:
+            logger.warning(f"[ASSETS] {path}: GLB não suportado ({exc})")
+            self._finish(resource_id, status="error", error=str(exc), attempts=self.max_attempts)
+            return
+        except Exception as exc:
+            logger.error(f"[ASSETS] {path}: falha na otimização (tentativa {job['attempts']}): {exc}")
+            if job["attempts"] < self.max_attempts:
+                # Continua 'processing' até o lease vencer: a nova tentativa espera RETRY_DELAY
+                self._finish(resource_id, status="processing", error=str(exc),
+                             locked_until=datetime.now(timezone.utc) + RETRY_DELAY)
+            else:
+                self._finish(resource_id, status="error", error=str(exc))
+            return
+
+        self._finish(
+            resource_id,
+            status="done",
+            error=None,
+            optimized_url=optimized_url,
+            preview_url=preview_url,
+            original_size=original["size_bytes"],
+            optimized_size=optimized.stats["size_bytes"],
+            preview_size=preview.stats["size_bytes"],
+            stats=psycopg2.extras.Json({
+                "original": original,
+                "optimized": optimized.stats,
+                "preview": preview.stats,
+                "seconds": round(time.monotonic() - started, 2),
+            }),
+        )
+        logger.info(
+            f"[ASSETS] {path}: {original['size_bytes'] / (1024 * 1024):.1f} MB -> "
+            f"{optimized.stats['size_bytes'] / (1024 * 1024):.1f} MB otimizado, "
+            f"{preview.stats['size_bytes'] / (1024 * 1024):.1f} MB prévia"
+        )
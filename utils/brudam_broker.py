@@ -0,0 +1,235 @@
+"""Escolha do host MySQL Brudam: corrida de conexões TCP e circuit breaker por host."""
+
+from __future__ import annotations
+
+import logging
+import queue
+import socket
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+
+logger = logging.getLogger("GeRot")
+
+
+class BrokerUnavailable(Exception):
+    """Nenhum host candidato aceitou conexão."""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker simples: após ``failure_threshold`` falhas seguidas o host
+    fica "aberto" (ignorado) por ``reset_timeout`` segundos. Depois disso uma
+    única tentativa é liberada (meio-aberto); sucesso fecha o circuito.
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 60.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_progress = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._trial_in_progress:
+            self._trial_in_progress = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_progress = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_in_progress = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class ConnectionBroker:
+    """
+    Abre conexões para o primeiro host candidato que responder.
+
+    - O último host vencedor é "grudento": enquanto continuar saudável ele é
+      tentado sozinho, com timeout curto, antes de qualquer corrida.
+    - Sem host preferido (ou se ele falhar), todos os hosts liberados pelo
+      circuit breaker disputam uma corrida de ``connect`` TCP em paralelo; o
+      primeiro handshake vence e os demais sockets são descartados.
+    - O socket vencedor é entregue à ``factory``, que faz o handshake MySQL
+      sobre ele (sem abrir uma segunda conexão).
+    """
+
+    def __init__(
+        self,
+        hosts: Sequence[str],
+        port: int,
+        connect_timeout: float = 10.0,
+        sticky_timeout: float = 2.0,
+        sticky_ttl: float = 300.0,
+        failure_threshold: int = 3,
+        reset_timeout: float = 60.0,
+    ) -> None:
+        self.hosts: List[str] = list(dict.fromkeys(hosts))
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.sticky_timeout = sticky_timeout
+        self.sticky_ttl = sticky_ttl
+        self.breakers: Dict[str, CircuitBreaker] = {
+            host: CircuitBreaker(failure_threshold, reset_timeout) for host in self.hosts
+        }
+        self._preferred: Optional[str] = None
+        self._preferred_at = 0.0
+        self._lock = threading.Lock()
+
+    # ---------------------------------------------------------------------#
+    # Operações públicas
+    # ---------------------------------------------------------------------#
+    def connect(self, factory: Callable[[str, socket.socket], object]):
+        """Retorna ``factory(host, sock)`` usando o melhor host disponível."""
+        tried: set = set()
+        last_error: Optional[BaseException] = None
+
+        while True:
+            try:
+                host, sock = self.acquire_socket(exclude=tried)
+            except BrokerUnavailable as exc:
+                if last_error is None:
+                    raise
+                raise BrokerUnavailable(f"{exc}; último erro do MySQL: {last_error}") from last_error
+            tried.add(host)
+            try:
+                return factory(host, sock)
+            except Exception as exc:
+                # O TCP conectou mas o MySQL recusou: conta como falha do host
+                self._record(host, success=False)
+                last_error = exc
+                try:
+                    sock.close()
+                except OSError:
+                    pass
+                if len(tried) >= len(self.hosts):
+                    raise BrokerUnavailable(
+                        f"Nenhum host Brudam aceitou a conexão MySQL ({host}: {exc})"
+                    ) from last_error
+
+    def acquire_socket(self, exclude: Sequence[str] = ()) -> Tuple[str, socket.socket]:
+        """Devolve ``(host, socket_conectado)`` do host preferido ou da corrida."""
+        preferred = self._sticky_host()
+        if preferred and preferred not in exclude:
+            try:
+                sock = self._open(preferred, self.sticky_timeout)
+                self._record(preferred, success=True)
+                return preferred, sock
+            except OSError as exc:
+                logger.warning(f"[MYSQL] Host preferido {preferred} falhou: {exc}")
+                self._record(preferred, success=False)
+                exclude = list(exclude) + [preferred]
+
+        candidates = [host for host in self.hosts if host not in exclude and self._allow(host)]
+        if not candidates:
+            raise BrokerUnavailable(
+                "Nenhum host Brudam disponível (circuit breaker aberto para todos)"
+            )
+        return self._race(candidates)
+
+    def status(self) -> dict:
+        """Estado atual dos hosts, para diagnóstico."""
+        with self._lock:
+            return {
+                "preferred": self._preferred,
+                "hosts": {
+                    host: {"state": breaker.state, "failures": breaker.failures}
+                    for host, breaker in self.breakers.items()
+                },
+            }
+
+    # ---------------------------------------------------------------------#
+    # Métodos auxiliares
+    # ---------------------------------------------------------------------#
+    def _race(self, candidates: List[str]) -> Tuple[str, socket.socket]:
+        results: "queue.Queue" = queue.Queue()
+
+        def attempt(host: str) -> None:
+            try:
+                results.put((host, self._open(host, self.connect_timeout), None))
+            except OSError as exc:
+                results.put((host, None, exc))
+
+        for host in candidates:
+            threading.Thread(target=attempt, args=(host,), daemon=True).start()
+
+        errors: Dict[str, BaseException] = {}
+        for pending in range(len(candidates), 0, -1):
+            host, sock, error = results.get()
+            if sock is None:
+                self._record(host, success=False)
+                errors[host] = error
+                continue
+
+            self._record(host, success=True)
+            if pending > 1:
+                # Perdedores ainda em andamento: fechar/registrar em segundo plano
+                threading.Thread(
+                    target=self._drain, args=(results, pending - 1), daemon=True
+                ).start()
+            return host, sock
+
+        detail = "; ".join(f"{host}: {err}" for host, err in errors.items())
+        raise BrokerUnavailable(f"Nenhum host Brudam respondeu ({detail})")
+
+    def _drain(self, results: "queue.Queue", remaining: int) -> None:
+        for _ in range(remaining):
+            host, sock, _error = results.get()
+            if sock is None:
+                self._record(host, success=False)
+            else:
+                self._record(host, success=True, prefer=False)
+                sock.close()
+
+    def _open(self, host: str, timeout: float) -> socket.socket:
+        sock = socket.create_connection((host, self.port), timeout=timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(None)
+        return sock
+
+    def _sticky_host(self) -> Optional[str]:
+        with self._lock:
+            if not self._preferred:
+                return None
+            if time.monotonic() - self._preferred_at > self.sticky_ttl:
+                self._preferred = None
+                return None
+            if self.breakers[self._preferred].state != "closed":
+                return None
+            return self._preferred
+
+    def _allow(self, host: str) -> bool:
+        with self._lock:
+            return self.breakers[host].allow()
+
+    def _record(self, host: str, success: bool, prefer: bool = True) -> None:
+        with self._lock:
+            breaker = self.breakers[host]
+            if success:
+                breaker.record_success()
+                if prefer:
+                    self._preferred = host
+                    self._preferred_at = time.monotonic()
+            else:
+                breaker.record_failure()
+                if self._preferred == host:
+                    self._preferred = None
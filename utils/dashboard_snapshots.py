@@ -0,0 +1,370 @@
+"""Snapshots materializados (no Postgres) dos dashboards alimentados pelo Brudam."""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence
+
+import psycopg2.extras
+
+from utils.query_cache import normalize_sql
+
+
+logger = logging.getLogger("GeRot")
+
+_IDENTIFIER_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def query_fingerprint(sql: str) -> str:
+    """Hash do SQL normalizado; muda quando a query do dashboard é editada."""
+    return hashlib.sha256(normalize_sql(sql).encode("utf-8")).hexdigest()
+
+
+def _watermark_sort_key(value):
+    try:
+        return (0, float(value), "")
+    except (TypeError, ValueError):
+        return (1, 0.0, str(value))
+
+
+def max_watermark(rows: Sequence[dict], column: str, current: Optional[str] = None):
+    """Maior valor de ``column`` entre as linhas (e o watermark atual)."""
+    values = [row.get(column) for row in rows if row.get(column) is not None]
+    if current is not None:
+        values.append(current)
+    if not values:
+        return None
+    return str(max(values, key=_watermark_sort_key))
+
+
+def merge_rows(
+    existing: List[dict],
+    new_rows: List[dict],
+    key_columns: Sequence[str] = (),
+    max_rows: Optional[int] = None,
+) -> List[dict]:
+    """
+    Junta linhas novas ao snapshot.
+
+    Com ``key_columns`` as linhas são substituídas pela chave (upsert); sem chave
+    as novas são apenas acrescentadas. ``max_rows`` mantém as mais recentes.
+    """
+    if key_columns:
+        merged: Dict[tuple, dict] = {
+            tuple(row.get(col) for col in key_columns): row for row in existing
+        }
+        for row in new_rows:
+            merged[tuple(row.get(col) for col in key_columns)] = row
+        rows = list(merged.values())
+    else:
+        rows = list(existing) + list(new_rows)
+
+    if max_rows and len(rows) > max_rows:
+        rows = rows[-max_rows:]
+    return rows
+
+
+class DashboardSnapshotStore:
+    """
+    Lê e grava snapshots na tabela ``agent_dashboard_snapshots``.
+
+    A coluna ``refresh_started_at`` funciona como um lease: só quem consegue
+    marcá-la executa a query no ERP, então vários workers (ou visitantes)
+    nunca disparam a mesma atualização em paralelo.
+    """
+
+    def __init__(
+        self,
+        connection_scope: Callable,
+        run_query: Callable[..., dict],
+        default_interval: int = 0,
+        lease_seconds: int = 600,
+        max_rows: int = 5000,
+        max_pages: int = 10,
+    ) -> None:
+        self._connection_scope = connection_scope
+        self._run_query = run_query
+        self.default_interval = default_interval
+        self.lease_seconds = lease_seconds
+        self.max_rows = max_rows
+        self.max_pages = max_pages
+
+    # ---------------------------------------------------------------------#
+    # Leitura
+    # ---------------------------------------------------------------------#
+    def interval_for(self, query_config: dict) -> int:
+        try:
+            return int(query_config.get("snapshot_interval", self.default_interval) or 0)
+        except (TypeError, ValueError):
+            return 0
+
+    def get(self, template_id: int, query: str) -> Optional[dict]:
+        """Snapshot válido do template (mesma query), com a idade em segundos."""
+        with self._connection_scope() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT data, fields, row_count, watermark, query_hash, refreshed_at,
+                       EXTRACT(EPOCH FROM (NOW() - refreshed_at)) AS age_seconds
+                FROM agent_dashboard_snapshots
+                WHERE template_id = %s AND refreshed_at IS NOT NULL
+                """,
+                (template_id,),
+            )
+            row = cursor.fetchone()
+
+        if not row or row["query_hash"] != query_fingerprint(query):
+            return None
+        snapshot = dict(row)
+        snapshot["age_seconds"] = float(snapshot["age_seconds"] or 0)
+        return snapshot
+
+    def due_templates(self) -> List[dict]:
+        """Templates cujo snapshot venceu segundo o intervalo configurado."""
+        with self._connection_scope() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT id, query_config FROM (
+                    SELECT t.id, t.query_config, s.refreshed_at,
+                           CASE WHEN (t.query_config->>'snapshot_interval') ~ '^[0-9]+$'
+                                THEN (t.query_config->>'snapshot_interval')::int
+                                ELSE %s END AS snapshot_interval
+                    FROM agent_dashboard_templates t
+                    LEFT JOIN agent_dashboard_snapshots s ON s.template_id = t.id
+                    WHERE COALESCE(t.query_config->>'query', '') <> ''
+                ) due
+                WHERE snapshot_interval > 0
+                  AND (refreshed_at IS NULL
+                       OR refreshed_at < NOW() - make_interval(secs => snapshot_interval))
+                ORDER BY refreshed_at NULLS FIRST
+                """,
+                (self.default_interval,),
+            )
+            rows = [dict(row) for row in cursor.fetchall()]
+        return rows
+
+    # ---------------------------------------------------------------------#
+    # Atualização
+    # ---------------------------------------------------------------------#
+    def claim(self, template_id: int) -> bool:
+        """Tenta obter o lease de atualização do template."""
+        with self._connection_scope() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                INSERT INTO agent_dashboard_snapshots (template_id, refresh_started_at)
+                VALUES (%s, NOW())
+                ON CONFLICT (template_id) DO UPDATE SET refresh_started_at = NOW()
+                WHERE agent_dashboard_snapshots.refresh_started_at IS NULL
+                   OR agent_dashboard_snapshots.refresh_started_at
+                      < NOW() - make_interval(secs => %s)
+                RETURNING template_id
+                """,
+                (template_id, self.lease_seconds),
+            )
+            claimed = cursor.fetchone() is not None
+            conn.commit()
+        return claimed
+
+    def refresh(self, template_id: int, query_config: dict, claim: bool = True) -> Optional[dict]:
+        """
+        Executa a query do dashboard e grava o snapshot.
+
+        Se ``query_config`` declarar ``watermark_column`` e já houver snapshot da
+        mesma query, busca apenas as linhas acima do watermark e faz o merge
+        (por ``key_columns``, quando informadas). Retorna ``None`` quando outro
+        processo já está atualizando o template.
+        """
+        if claim and not self.claim(template_id):
+            return None
+
+        query = normalize_sql(query_config.get("query") or "")
+        try:
+            watermark_column = query_config.get("watermark_column")
+            if watermark_column and not _IDENTIFIER_RE.match(watermark_column):
+                raise ValueError(f"Coluna de watermark inválida: {watermark_column}")
+            key_columns = query_config.get("key_columns") or []
+
+            previous = self.get(template_id, query) if watermark_column else None
+            if previous and previous.get("watermark") is not None:
+                new_rows, fields, watermark = self._read_increment(query, watermark_column, previous["watermark"])
+                rows = merge_rows(previous["data"] or [], new_rows, key_columns, self.max_rows)
+                fields = fields or previous["fields"] or []
+            elif watermark_column:
+                # Primeira carga também em ordem e paginada: um LIMIT sobre a
+                # query sem ORDER BY devolveria um subconjunto qualquer e o
+                # watermark pularia as linhas que ficaram de fora
+                new_rows, fields, watermark = self._read_increment(query, watermark_column, None)
+                rows = merge_rows([], new_rows, key_columns, self.max_rows)
+            else:
+                result = self._run_query(query, None, max_rows=self.max_rows)
+                rows, fields, watermark = result["data"], result["fields"], None
+
+            self._save(template_id, query, rows, fields, watermark)
+            return {"data": rows, "fields": fields}
+        except Exception as exc:
+            self._release(template_id, str(exc))
+            raise
+
+    def load(self, template_id: int, query_config: dict, timeout: float, poll: float = 0.5) -> Optional[dict]:
+        """
+        Primeira carga do dashboard: gera o snapshot ou, se outro processo já
+        está gerando, espera até ``timeout`` segundos pelo snapshot dele em vez
+        de consultar o ERP de novo. Se quem tinha o lease falhar, o lease fica
+        livre e a próxima volta do laço assume a atualização. Retorna ``None``
+        quando o tempo acaba.
+        """
+        query = query_config.get("query") or ""
+        deadline = time.monotonic() + timeout
+        while True:
+            snapshot = self.get(template_id, query)
+            if snapshot is not None:
+                return {"data": snapshot["data"] or [], "fields": snapshot["fields"] or []}
+            result = self.refresh(template_id, query_config)
+            if result is not None:
+                return result
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            time.sleep(min(poll, remaining))
+
+    def _read_increment(self, query: str, column: str, watermark: Optional[str]):
+        """
+        Linhas acima do watermark (todas, com ``watermark=None``), em ordem
+        crescente da coluna e em páginas de ``max_rows`` (no máximo
+        ``max_pages`` por atualização). O watermark avança só até a última
+        linha lida: o que ficar além do limite vem na próxima atualização. Numa
+        página cheia, as linhas empatadas com a última ficam para a página
+        seguinte, para o LIMIT não cortar um grupo de empate.
+        Retorna ``(linhas, campos, watermark)``.
+        """
+        order = f"ORDER BY snapshot_src.`{column}` ASC LIMIT {int(self.max_rows)}"
+        rows, fields = [], []
+        for _ in range(self.max_pages):
+            if watermark is None:
+                sql, params = f"SELECT * FROM ({query}) AS snapshot_src {order}", None
+            else:
+                # Com parâmetros o pymysql formata a string: escapar '%' literais.
+                sql = (
+                    f"SELECT * FROM ({query.replace('%', '%%')}) AS snapshot_src "
+                    f"WHERE snapshot_src.`{column}` > %s {order}"
+                )
+                params = (watermark,)
+            result = self._run_query(sql, params, max_rows=self.max_rows)
+            page = result["data"]
+            fields = fields or result["fields"]
+            if len(page) < self.max_rows:
+                rows += page
+                if page:
+                    watermark = str(page[-1][column])
+                break
+            last = page[-1][column]
+            complete = [row for row in page if row[column] != last]
+            if not complete:
+                # Página inteira com o mesmo valor: não há como separar o empate
+                logger.warning(f"[SNAPSHOT] Mais de {self.max_rows} linhas com {column} = {last}; watermark avança")
+                complete = page
+            rows += complete
+            watermark = str(complete[-1][column])
+        return rows, fields, watermark
+
+    def _save(self, template_id, query, rows, fields, watermark) -> None:
+        with self._connection_scope() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                INSERT INTO agent_dashboard_snapshots
+                    (template_id, data, fields, row_count, watermark, query_hash, refreshed_at)
+                VALUES (%s, %s, %s, %s, %s, %s, NOW())
+                ON CONFLICT (template_id) DO UPDATE SET
+                    data = EXCLUDED.data,
+                    fields = EXCLUDED.fields,
+                    row_count = EXCLUDED.row_count,
+                    watermark = EXCLUDED.watermark,
+                    query_hash = EXCLUDED.query_hash,
+                    refreshed_at = NOW(),
+                    refresh_started_at = NULL,
+                    last_error = NULL
+                """,
+                (
+                    template_id,
+                    psycopg2.extras.Json(rows),
+                    psycopg2.extras.Json(fields),
+                    len(rows),
+                    watermark,
+                    query_fingerprint(query),
+                ),
+            )
+            conn.commit()
+
+    def _release(self, template_id, error: str) -> None:
+        try:
+            with self._connection_scope() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    """
+                    UPDATE agent_dashboard_snapshots
+                    SET refresh_started_at = NULL, last_error = %s
+                    WHERE template_id = %s
+                    """,
+                    (error[:2000], template_id),
+                )
+                conn.commit()
+        except Exception as exc:
+            logger.error(f"[SNAPSHOT] Erro ao liberar lease do template {template_id}: {exc}")
+
+
+class SnapshotScheduler:
+    """
+    Atualiza periodicamente os snapshots vencidos.
+
+    Pode rodar em todos os workers do gunicorn: o lease do store garante que
+    cada snapshot é atualizado por apenas um deles.
+    """
+
+    def __init__(self, store: DashboardSnapshotStore, tick_seconds: float = 30.0, max_workers: int = 2) -> None:
+        self.store = store
+        self.tick_seconds = tick_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="snapshot")
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="snapshot-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def revalidate(self, template_id: int, query_config: dict) -> None:
+        """Agenda uma atualização em segundo plano (stale-while-revalidate)."""
+        self._executor.submit(self._refresh_quietly, template_id, query_config)
+
+    def run_once(self) -> int:
+        refreshed = 0
+        for template in self.store.due_templates():
+            if self._refresh_quietly(template["id"], template["query_config"] or {}):
+                refreshed += 1
+        return refreshed
+
+    def _refresh_quietly(self, template_id: int, query_config: dict) -> bool:
+        try:
+            return self.store.refresh(template_id, query_config) is not None
+        except Exception as exc:
+            logger.error(f"[SNAPSHOT] Falha ao atualizar dashboard {template_id}: {exc}")
+            return False
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.tick_seconds):
+            try:
+                self.run_once()
+            except Exception as exc:
+                logger.error(f"[SNAPSHOT] Erro no agendador: {exc}")
@@ -0,0 +1,198 @@
+"""
+Contadores de recursos por ambiente (``environments.resource_count`` etc.).
+
+``/api/environments`` é consultada em polling pelas telas de ambientes; em vez
+de contar ``environment_resources`` a cada chamada, cada ambiente guarda as
+contagens em colunas próprias. Triggers em ``environment_resources`` mantêm
+os contadores exatos no INSERT, no DELETE e no UPDATE que troca o ambiente ou
+o tipo do recurso: cada escrita faz ``contador ± 1`` na linha do ambiente, e o
+lock de linha do UPDATE serializa escritas concorrentes no mesmo ambiente.
+
+O que passar por fora dos triggers (TRUNCATE, ``session_replication_role``,
+carga manual) é corrigido por ``EnvironmentCounters.reconcile``, que recalcula
+tudo periodicamente e registra a divergência encontrada.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+from typing import Callable, List, Optional
+
+
+logger = logging.getLogger("GeRot")
+
+# Tipo do recurso -> coluna em environments (resource_count conta todos)
+COUNTER_COLUMNS = {
+    "model_3d": "models_3d",
+    "plant_2d": "plants_2d",
+    "photo": "photos",
+    "document": "documents",
+}
+ALL_COLUMNS = ("resource_count", *COUNTER_COLUMNS.values())
+
+
+def _deltas(record: str, sign: str) -> str:
+    """``coluna = coluna ± 1`` de cada contador para a linha ``OLD``/``NEW`` do trigger."""
+    assignments = [f"resource_count = resource_count {sign} 1"]
+    for resource_type, column in COUNTER_COLUMNS.items():
+        assignments.append(
+            f"{column} = {column} {sign} ({record}.resource_type IS NOT DISTINCT FROM '{resource_type}')::int"
+        )
+    return ",\n                ".join(assignments)
+
+
+SCHEMA_SQL = [
+    *(
+        f"ALTER TABLE environments ADD COLUMN IF NOT EXISTS {column} INTEGER NOT NULL DEFAULT 0"
+        for column in ALL_COLUMNS
+    ),
+    f"""
+    CREATE OR REPLACE FUNCTION environment_resource_counters() RETURNS trigger AS $$
+    BEGIN
+        -- Troca de ambiente: atualiza as duas linhas sempre na ordem do id (sem deadlock)
+        IF TG_OP = 'UPDATE' AND NEW.environment_id < OLD.environment_id THEN
+            UPDATE environments SET
+                {_deltas("NEW", "+")}
+            WHERE id = NEW.environment_id;
+            UPDATE environments SET
+                {_deltas("OLD", "-")}
+            WHERE id = OLD.environment_id;
+            RETURN NULL;
+        END IF;
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            UPDATE environments SET
+                {_deltas("OLD", "-")}
+            WHERE id = OLD.environment_id;
+        END IF;
+        IF TG_OP IN ('UPDATE', 'INSERT') THEN
+            UPDATE environments SET
+                {_deltas("NEW", "+")}
+            WHERE id = NEW.environment_id;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS trg_environment_resource_counters ON environment_resources",
+    """
+    CREATE TRIGGER trg_environment_resource_counters
+        AFTER INSERT OR DELETE ON environment_resources
+        FOR EACH ROW EXECUTE FUNCTION environment_resource_counters()
+    """,
+    "DROP TRIGGER IF EXISTS trg_environment_resource_counters_update ON environment_resources",
+    """
+    CREATE TRIGGER trg_environment_resource_counters_update
+        AFTER UPDATE OF environment_id, resource_type ON environment_resources
+        FOR EACH ROW
+        WHEN (OLD.environment_id IS DISTINCT FROM NEW.environment_id
+              OR OLD.resource_type IS DISTINCT FROM NEW.resource_type)
+        EXECUTE FUNCTION environment_resource_counters()
+    """,
+]
+
+_actual = ",\n           ".join(
+    ["COUNT(r.id) AS resource_count"]
+    + [
+        f"COUNT(r.id) FILTER (WHERE r.resource_type = '{resource_type}') AS {column}"
+        for resource_type, column in COUNTER_COLUMNS.items()
+    ]
+)
+
+RECONCILE_SQL = f"""
+WITH actual AS (
+    SELECT e.id,
+           {_actual}
+    FROM environments e
+    LEFT JOIN environment_resources r ON r.environment_id = e.id
+    GROUP BY e.id
+)
+UPDATE environments e
+SET {", ".join(f"{column} = a.{column}" for column in ALL_COLUMNS)}
+FROM actual a
+WHERE e.id = a.id
+  AND ({", ".join(f"e.{column}" for column in ALL_COLUMNS)}) IS DISTINCT FROM ({", ".join(f"a.{column}" for column in ALL_COLUMNS)})
+RETURNING e.id
+"""
+
+
+def tables_exist(cursor) -> bool:
+    """As tabelas de ambientes são criadas no Supabase, não pelo ``ensure_schema``."""
+    cursor.execute(
+        "SELECT to_regclass('environments') IS NOT NULL AND to_regclass('environment_resources') IS NOT NULL AS ok"
+    )
+    return bool(cursor.fetchone()["ok"])
+
+
+def install(cursor) -> List[int]:
+    """
+    Cria colunas, função e triggers e acerta os contadores existentes.
+
+    ``CREATE TRIGGER`` bloqueia escritas em ``environment_resources`` até o
+    commit, então a contagem inicial não perde nenhum recurso.
+    """
+    for statement in SCHEMA_SQL:
+        cursor.execute(statement)
+    cursor.execute(RECONCILE_SQL)
+    return [row["id"] for row in cursor.fetchall()]
+
+
+def reconcile(cursor, lock_timeout: str = "5s") -> List[int]:
+    """
+    Recalcula os contadores e corrige os divergentes; devolve os ids corrigidos.
+
+    O ``SHARE`` em ``environment_resources`` espera as escritas em andamento
+    e segura as novas até o commit: sem isso, um recurso gravado durante o
+    recálculo seria sobrescrito pela contagem antiga.
+    """
+    cursor.execute("SET LOCAL lock_timeout = %s", (lock_timeout,))
+    cursor.execute("LOCK TABLE environment_resources IN SHARE MODE")
+    cursor.execute(RECONCILE_SQL)
+    return [row["id"] for row in cursor.fetchall()]
+
+
+class EnvironmentCounters:
+    """Reconciliação periódica dos contadores (um worker por vez, advisory lock)."""
+
+    def __init__(self, connection_scope: Callable, interval_seconds: float = 3600.0) -> None:
+        self._connection_scope = connection_scope
+        self.interval_seconds = interval_seconds
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="environment-counters", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                self.reconcile()
+            except Exception as exc:
+                logger.error(f"[ENV-COUNTERS] Erro na reconciliação dos contadores: {exc}")
+
+    def reconcile(self) -> Optional[List[int]]:
+        """Ids dos ambientes corrigidos; ``None`` se outro worker já está reconciliando."""
+        with self._connection_scope() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    "SELECT pg_try_advisory_xact_lock(hashtext('environment_counters_reconcile')) AS locked"
+                )
+                if not cursor.fetchone()["locked"] or not tables_exist(cursor):
+                    conn.rollback()
+                    return None
+                fixed = reconcile(cursor)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+        if fixed:
+            logger.warning(f"[ENV-COUNTERS] Contadores divergentes corrigidos nos ambientes {fixed}")
+        return fixed
@@ -0,0 +1,112 @@
+"""
+Consultas da página de instalações do CD (``/cd/facilities``).
+
+A página recebe só o resumo dos ambientes: contagem de recursos por tipo (os
+contadores de utils/environment_counters.py) e o modelo 3D principal de cada
+um. Os demais recursos (fotos, plantas) são buscados por ambiente e tipo, em
+páginas com cursor (keyset) e só com as colunas que a interface usa, então o
+HTML inicial não cresce com o número de recursos cadastrados.
+
+As consultas usam o índice ``idx_environment_resources_scope``
+(``environment_id, resource_type, primário, ordem, id``): o modelo principal e
+cada página vêm na ordem do índice, sem sort.
+``tests/test_facilities.py`` confere os planos com EXPLAIN.
+"""
+
+from __future__ import annotations
+
+import base64
+import json
+from typing import List, Optional, Tuple
+
+
+RESOURCE_TYPES = ("model_3d", "photo", "plant_2d", "document")
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+SCOPE_INDEX = "idx_environment_resources_scope"
+
+# Ordem das listas: primário primeiro, depois display_order e id (igual ao índice)
+SORT_KEY = "(r.is_primary IS NOT TRUE), COALESCE(r.display_order, 0), r.id"
+
+SCOPE_INDEX_SQL = f"""
+CREATE INDEX IF NOT EXISTS {SCOPE_INDEX}
+    ON environment_resources (environment_id, resource_type, (is_primary IS NOT TRUE), COALESCE(display_order, 0), id)
+"""
+
+SUMMARY_SQL = f"""
+SELECT e.id, e.code, e.name, e.description, e.icon, e.floor,
+       e.models_3d AS models, e.photos, e.plants_2d AS plants, e.documents,
+       m.file_url AS model_url, m.preview_url AS model_preview_url
+FROM environments e
+LEFT JOIN LATERAL (
+    SELECT COALESCE(v.optimized_url, r.file_url) AS file_url, v.preview_url
+    FROM environment_resources r
+    LEFT JOIN environment_asset_variants v ON v.resource_id = r.id AND v.status = 'done'
+    WHERE r.environment_id = e.id AND r.resource_type = 'model_3d'
+    ORDER BY {SORT_KEY}
+    LIMIT 1
+) m ON TRUE
+WHERE e.is_active = true
+ORDER BY e.display_order ASC
+"""
+
+
+class CursorError(ValueError):
+    """Cursor de paginação inválido."""
+
+
+def encode_cursor(row: dict) -> str:
+    key = [not row["is_primary"], row["display_order"] or 0, row["id"]]
+    return base64.urlsafe_b64encode(json.dumps(key).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[bool, int, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        not_primary, display_order, resource_id = json.loads(raw)
+        return bool(not_primary), int(display_order), int(resource_id)
+    except (ValueError, TypeError):
+        raise CursorError("Cursor inválido")
+
+
+def page_size(value, default: int = DEFAULT_PAGE_SIZE) -> int:
+    try:
+        return max(1, min(int(value), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return default
+
+
+def resource_page_query(environment_id: int, resource_type: Optional[str], limit: int,
+                        after: Optional[Tuple[bool, int, int]] = None) -> Tuple[str, list]:
+    """SQL e parâmetros de uma página de recursos (busca ``limit + 1`` para saber se há mais)."""
+    conditions = ["r.environment_id = %s"]
+    params: List[object] = [environment_id]
+    if resource_type:
+        conditions.append("r.resource_type = %s")
+        params.append(resource_type)
+    if after:
+        conditions.append(f"({SORT_KEY}) > (%s, %s, %s)")
+        params.extend(after)
+    params.append(limit + 1)
+    sql = f"""
+        SELECT r.id, r.resource_type, r.file_name, r.mime_type, r.is_primary, r.display_order,
+               COALESCE(v.optimized_url, r.file_url) AS file_url, r.file_url AS original_url,
+               v.preview_url
+        FROM environment_resources r
+        LEFT JOIN environment_asset_variants v ON v.resource_id = r.id AND v.status = 'done'
+        WHERE {' AND '.join(conditions)}
+        ORDER BY {SORT_KEY}
+        LIMIT %s
+    """
+    return sql, params
+
+
+def fetch_resource_page(cursor, environment_id: int, resource_type: Optional[str] = None,
+                        limit: int = DEFAULT_PAGE_SIZE, after: Optional[str] = None) -> dict:
+    """Uma página de recursos do ambiente e o cursor da próxima (``None`` no fim)."""
+    sql, params = resource_page_query(environment_id, resource_type, limit, decode_cursor(after) if after else None)
+    cursor.execute(sql, params)
+    rows = [dict(row) for row in cursor.fetchall()]
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {"items": rows, "next_cursor": encode_cursor(rows[-1]) if has_more else None}
@@ -0,0 +1,525 @@
+"""
+Otimização de modelos GLB (glTF 2.0 binário) em Python/NumPy.
+
+``optimize_glb`` gera a variante servida no visualizador do CD:
+
+- buffers deduplicados: bufferViews com o mesmo conteúdo viram um só e
+  dados que nenhum accessor/imagem usa são descartados;
+- atributos quantizados: NORMAL/TANGENT em int8 normalizado
+  (``KHR_mesh_quantization``), TEXCOORD em uint16 e COLOR em uint8
+  normalizados, índices em uint16 quando cabem. POSITION fica em float32
+  (quantizar exigiria reescrever as transformações dos nós);
+- texturas embutidas reduzidas (lado máximo ``max_texture_size``) e
+  recodificadas com o Pillow; a versão nova só é usada se ficar menor.
+
+``preview_glb`` gera a prévia low-poly: decimação por agrupamento de vértices
+numa grade (vertex clustering), texturas pequenas e a mesma quantização.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import struct
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+from PIL import Image
+
+
+GLB_MAGIC = b"glTF"
+CHUNK_JSON = 0x4E4F534A
+CHUNK_BIN = 0x004E4942
+
+ARRAY_BUFFER = 34962
+ELEMENT_ARRAY_BUFFER = 34963
+
+BYTE, UNSIGNED_BYTE, SHORT, UNSIGNED_SHORT, UNSIGNED_INT, FLOAT = 5120, 5121, 5122, 5123, 5125, 5126
+COMPONENT_DTYPES = {
+    BYTE: np.dtype("<i1"),
+    UNSIGNED_BYTE: np.dtype("<u1"),
+    SHORT: np.dtype("<i2"),
+    UNSIGNED_SHORT: np.dtype("<u2"),
+    UNSIGNED_INT: np.dtype("<u4"),
+    FLOAT: np.dtype("<f4"),
+}
+TYPE_SIZES = {"SCALAR": 1, "VEC2": 2, "VEC3": 3, "VEC4": 4, "MAT2": 4, "MAT3": 9, "MAT4": 16}
+NORMALIZED_MAX = {BYTE: 127.0, UNSIGNED_BYTE: 255.0, SHORT: 32767.0, UNSIGNED_SHORT: 65535.0}
+QUANTIZATION_EXTENSION = "KHR_mesh_quantization"
+
+
+class GlbError(ValueError):
+    """Arquivo GLB inválido ou com recursos não suportados."""
+
+
+@dataclass
+class OptimizedAsset:
+    data: bytes
+    stats: Dict[str, object] = field(default_factory=dict)
+
+
+# ---------------------------------------------------------------------------
+# Contêiner GLB
+# ---------------------------------------------------------------------------
+def read_glb(data: bytes):
+    """Separa o JSON e o chunk binário de um GLB."""
+    if len(data) < 20 or data[:4] != GLB_MAGIC:
+        raise GlbError("Arquivo não é um GLB")
+    version, length = struct.unpack_from("<II", data, 4)
+    if version != 2:
+        raise GlbError(f"Versão de glTF não suportada: {version}")
+    if length > len(data):
+        raise GlbError("GLB truncado")
+
+    gltf, binary, offset = None, b"", 12
+    while offset + 8 <= length:
+        chunk_length, chunk_type = struct.unpack_from("<II", data, offset)
+        chunk = data[offset + 8:offset + 8 + chunk_length]
+        if chunk_type == CHUNK_JSON and gltf is None:
+            gltf = json.loads(chunk.decode("utf-8"))
+        elif chunk_type == CHUNK_BIN and not binary:
+            binary = bytes(chunk)
+        offset += 8 + chunk_length
+    if gltf is None:
+        raise GlbError("GLB sem chunk JSON")
+    return gltf, binary
+
+
+def write_glb(gltf: dict, binary: bytes) -> bytes:
+    json_chunk = json.dumps(gltf, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    json_chunk += b" " * (-len(json_chunk) % 4)
+    binary += b"\x00" * (-len(binary) % 4)
+    length = 12 + 8 + len(json_chunk) + (8 + len(binary) if binary else 0)
+    parts = [GLB_MAGIC, struct.pack("<II", 2, length), struct.pack("<II", len(json_chunk), CHUNK_JSON), json_chunk]
+    if binary:
+        parts += [struct.pack("<II", len(binary), CHUNK_BIN), binary]
+    return b"".join(parts)
+
+
+class GltfDocument:
+    """glTF em memória com o conteúdo de cada bufferView separado."""
+
+    def __init__(self, data: bytes):
+        self.gltf, binary = read_glb(data)
+        buffers = self.gltf.get("buffers", [])
+        if len(buffers) > 1 or any("uri" in buffer for buffer in buffers):
+            raise GlbError("GLB com buffers externos não é suportado")
+        self.views: List[bytes] = []
+        for view in self.gltf.get("bufferViews", []):
+            start = view.get("byteOffset", 0)
+            self.views.append(binary[start:start + view["byteLength"]])
+
+    @property
+    def accessors(self) -> List[dict]:
+        return self.gltf.setdefault("accessors", [])
+
+    def primitives(self):
+        for mesh in self.gltf.get("meshes", []):
+            for primitive in mesh.get("primitives", []):
+                yield primitive
+
+    # ------------------------------------------------------------------#
+    # Leitura e escrita de accessors
+    # ------------------------------------------------------------------#
+    def readable(self, index: int) -> bool:
+        accessor = self.accessors[index]
+        return "bufferView" in accessor and "sparse" not in accessor
+
+    def read(self, index: int) -> np.ndarray:
+        """Valores do accessor como matriz (count, componentes), no tipo armazenado."""
+        accessor = self.accessors[index]
+        if not self.readable(index):
+            raise GlbError(f"Accessor {index} sem bufferView ou esparso")
+        dtype = COMPONENT_DTYPES[accessor["componentType"]]
+        components = TYPE_SIZES[accessor["type"]]
+        view = self.gltf["bufferViews"][accessor["bufferView"]]
+        stride = view.get("byteStride") or dtype.itemsize * components
+        array = np.ndarray(
+            shape=(accessor["count"], components),
+            dtype=dtype,
+            buffer=self.views[accessor["bufferView"]],
+            offset=accessor.get("byteOffset", 0),
+            strides=(stride, dtype.itemsize),
+        )
+        return array.copy()
+
+    def read_float(self, index: int) -> np.ndarray:
+        """Valores já convertidos para float (desfaz a normalização)."""
+        accessor = self.accessors[index]
+        values = self.read(index).astype(np.float64)
+        if accessor.get("normalized") and accessor["componentType"] in NORMALIZED_MAX:
+            values = np.maximum(values / NORMALIZED_MAX[accessor["componentType"]], -1.0)
+        return values
+
+    def add_view(self, data: bytes, target: Optional[int] = None, stride: Optional[int] = None) -> int:
+        view = {"buffer": 0, "byteLength": len(data)}
+        if stride:
+            view["byteStride"] = stride
+        if target:
+            view["target"] = target
+        self.gltf.setdefault("bufferViews", []).append(view)
+        self.views.append(data)
+        return len(self.views) - 1
+
+    def store(self, values: np.ndarray, component_type: int, accessor_type: str, target: int,
+              normalized: bool = False, index: Optional[int] = None) -> int:
+        """
+        Grava ``values`` em uma bufferView nova. Atributos de vértice ficam
+        alinhados a 4 bytes por elemento, como exige a especificação.
+        """
+        dtype = COMPONENT_DTYPES[component_type]
+        values = np.ascontiguousarray(values, dtype=dtype).reshape(len(values), TYPE_SIZES[accessor_type])
+        element = values.shape[1] * dtype.itemsize
+        stride = None
+        raw = values.tobytes()
+        if target == ARRAY_BUFFER:
+            stride = element + (-element % 4)
+            if stride != element:
+                padded = np.zeros((len(values), stride), dtype=np.uint8)
+                padded[:, :element] = values.view(np.uint8).reshape(len(values), element)
+                raw = padded.tobytes()
+
+        accessor = {
+            "bufferView": self.add_view(raw, target, stride),
+            "componentType": component_type,
+            "count": int(len(values)),
+            "type": accessor_type,
+        }
+        if normalized:
+            accessor["normalized"] = True
+        if index is None:
+            self.accessors.append(accessor)
+            return len(self.accessors) - 1
+        # Reaproveita o accessor (mantém nome e extras); min/max só valem no tipo antigo
+        previous = self.accessors[index]
+        accessor.update({key: previous[key] for key in ("name", "extras") if key in previous})
+        self.accessors[index] = accessor
+        return index
+
+    def set_bounds(self, index: int, values: np.ndarray) -> None:
+        if len(values):
+            self.accessors[index]["min"] = values.min(axis=0).tolist()
+            self.accessors[index]["max"] = values.max(axis=0).tolist()
+
+    # ------------------------------------------------------------------#
+    # Empacotamento (dedup + compactação)
+    # ------------------------------------------------------------------#
+    def _referenced_accessors(self) -> Set[int]:
+        used: Set[int] = set()
+        for primitive in self.primitives():
+            used.update(primitive.get("attributes", {}).values())
+            if "indices" in primitive:
+                used.add(primitive["indices"])
+            for target in primitive.get("targets", []):
+                used.update(target.values())
+        for skin in self.gltf.get("skins", []):
+            if "inverseBindMatrices" in skin:
+                used.add(skin["inverseBindMatrices"])
+        for animation in self.gltf.get("animations", []):
+            for sampler in animation.get("samplers", []):
+                used.update((sampler["input"], sampler["output"]))
+        return used
+
+    def _compact_accessors(self) -> None:
+        used = sorted(self._referenced_accessors())
+        remap = {old: new for new, old in enumerate(used)}
+        self.gltf["accessors"] = [self.accessors[old] for old in used]
+
+        for primitive in self.primitives():
+            primitive["attributes"] = {key: remap[value] for key, value in primitive.get("attributes", {}).items()}
+            if "indices" in primitive:
+                primitive["indices"] = remap[primitive["indices"]]
+            primitive["targets"] = [
+                {key: remap[value] for key, value in target.items()} for target in primitive.get("targets", [])
+            ]
+            if not primitive["targets"]:
+                del primitive["targets"]
+        for skin in self.gltf.get("skins", []):
+            if "inverseBindMatrices" in skin:
+                skin["inverseBindMatrices"] = remap[skin["inverseBindMatrices"]]
+        for animation in self.gltf.get("animations", []):
+            for sampler in animation.get("samplers", []):
+                sampler["input"], sampler["output"] = remap[sampler["input"]], remap[sampler["output"]]
+
+    def _view_users(self):
+        for accessor in self.accessors:
+            if "bufferView" in accessor:
+                yield accessor
+            sparse = accessor.get("sparse")
+            if sparse:
+                yield sparse["indices"]
+                yield sparse["values"]
+        for image in self.gltf.get("images", []):
+            if "bufferView" in image:
+                yield image
+
+    def pack(self) -> bytes:
+        """Remove dados órfãos, deduplica bufferViews iguais e gera o GLB."""
+        self._compact_accessors()
+        views = self.gltf.get("bufferViews", [])
+        canonical: Dict[tuple, int] = {}
+        remap: Dict[int, int] = {}
+        new_views: List[dict] = []
+        binary = bytearray()
+
+        for user in self._view_users():
+            old = user["bufferView"]
+            if old not in remap:
+                view, data = views[old], self.views[old]
+                key = (hashlib.sha256(data).digest(), view.get("byteStride"), view.get("target"))
+                if key not in canonical:
+                    binary += b"\x00" * (-len(binary) % 4)
+                    packed = {k: v for k, v in view.items() if k not in ("byteOffset", "byteLength")}
+                    packed.update(buffer=0, byteOffset=len(binary), byteLength=len(data))
+                    binary += data
+                    canonical[key] = len(new_views)
+                    new_views.append(packed)
+                remap[old] = canonical[key]
+            user["bufferView"] = remap[old]
+
+        self.gltf["bufferViews"] = new_views
+        self.views = []
+        if new_views:
+            self.gltf["buffers"] = [{"byteLength": len(binary)}]
+        else:
+            self.gltf.pop("buffers", None)
+            self.gltf.pop("bufferViews", None)
+        return write_glb(self.gltf, bytes(binary))
+
+    def require_extension(self, name: str) -> None:
+        for key in ("extensionsUsed", "extensionsRequired"):
+            extensions = self.gltf.setdefault(key, [])
+            if name not in extensions:
+                extensions.append(name)
+
+
+# ---------------------------------------------------------------------------
+# Estatísticas
+# ---------------------------------------------------------------------------
+def geometry_stats(doc: GltfDocument) -> Dict[str, int]:
+    triangles, vertices, seen = 0, 0, set()
+    for primitive in doc.primitives():
+        position = primitive.get("attributes", {}).get("POSITION")
+        if position is not None and position not in seen:
+            seen.add(position)
+            vertices += doc.accessors[position]["count"]
+        if primitive.get("mode", 4) == 4:
+            count_from = primitive.get("indices", position)
+            if count_from is not None:
+                triangles += doc.accessors[count_from]["count"] // 3
+    return {"triangles": triangles, "vertices": vertices}
+
+
+# ---------------------------------------------------------------------------
+# Quantização
+# ---------------------------------------------------------------------------
+def quantize_attributes(doc: GltfDocument) -> Dict[str, float]:
+    """Reduz a precisão dos atributos; devolve o erro máximo por semântica."""
+    semantics: Dict[int, str] = {}
+    locked: Set[int] = set()
+    for primitive in doc.primitives():
+        for semantic, index in primitive.get("attributes", {}).items():
+            semantics.setdefault(index, semantic.split("_")[0])
+        for target in primitive.get("targets", []):
+            locked.update(target.values())  # morph targets ficam como estão
+        if "indices" in primitive:
+            semantics.setdefault(primitive["indices"], "INDICES")
+    for skin in doc.gltf.get("skins", []):
+        locked.add(skin.get("inverseBindMatrices"))
+    for animation in doc.gltf.get("animations", []):
+        for sampler in animation.get("samplers", []):
+            locked.update((sampler["input"], sampler["output"]))
+
+    errors: Dict[str, float] = {}
+    uses_extension = False
+    for index, semantic in semantics.items():
+        accessor = doc.accessors[index]
+        if index in locked or not doc.readable(index):
+            continue
+
+        if semantic == "INDICES":
+            if accessor["componentType"] == UNSIGNED_INT:
+                values = doc.read(index)
+                if len(values) and values.max() < 65535:
+                    doc.store(values, UNSIGNED_SHORT, "SCALAR", ELEMENT_ARRAY_BUFFER, index=index)
+            continue
+        if accessor["componentType"] != FLOAT:
+            continue
+
+        values = doc.read_float(index)
+        if semantic in ("NORMAL", "TANGENT"):
+            quantized = np.round(np.clip(values, -1.0, 1.0) * 127.0)
+            doc.store(quantized, BYTE, accessor["type"], ARRAY_BUFFER, normalized=True, index=index)
+            uses_extension = True
+            scale = 127.0
+        elif semantic == "TEXCOORD" and len(values) and values.min() >= 0.0 and values.max() <= 1.0:
+            quantized = np.round(values * 65535.0)
+            doc.store(quantized, UNSIGNED_SHORT, accessor["type"], ARRAY_BUFFER, normalized=True, index=index)
+            scale = 65535.0
+        elif semantic == "COLOR" and len(values) and values.min() >= 0.0 and values.max() <= 1.0:
+            quantized = np.round(values * 255.0)
+            doc.store(quantized, UNSIGNED_BYTE, accessor["type"], ARRAY_BUFFER, normalized=True, index=index)
+            scale = 255.0
+        else:
+            continue
+        error = float(np.abs(quantized / scale - values).max()) if len(values) else 0.0
+        errors[semantic] = max(errors.get(semantic, 0.0), round(error, 6))
+
+    if uses_extension:
+        doc.require_extension(QUANTIZATION_EXTENSION)
+    return errors
+
+
+# ---------------------------------------------------------------------------
+# Texturas
+# ---------------------------------------------------------------------------
+def _normal_map_images(doc: GltfDocument) -> Set[int]:
+    textures = doc.gltf.get("textures", [])
+    images = set()
+    for material in doc.gltf.get("materials", []):
+        info = material.get("normalTexture")
+        if info and info["index"] < len(textures) and "source" in textures[info["index"]]:
+            images.add(textures[info["index"]]["source"])
+    return images
+
+
+def downscale_textures(doc: GltfDocument, max_size: int, jpeg_quality: int = 85) -> Dict[str, int]:
+    """
+    Reduz as texturas embutidas maiores que ``max_size`` e recodifica: JPEG
+    para imagens opacas, PNG quando há transparência e nos normal maps
+    (compressão com perdas distorce as normais).
+    """
+    lossless = _normal_map_images(doc)
+    stats = {"textures": 0, "textures_resized": 0, "texture_bytes_before": 0, "texture_bytes_after": 0}
+
+    for index, image in enumerate(doc.gltf.get("images", [])):
+        if "bufferView" not in image or image.get("mimeType") not in ("image/png", "image/jpeg"):
+            continue
+        original = doc.views[image["bufferView"]]
+        stats["textures"] += 1
+        stats["texture_bytes_before"] += len(original)
+        try:
+            picture = Image.open(io.BytesIO(original))
+            picture.load()
+        except Exception:
+            stats["texture_bytes_after"] += len(original)
+            continue
+
+        resized = max(picture.size) > max_size
+        if resized:
+            picture.thumbnail((max_size, max_size), Image.LANCZOS)
+
+        has_alpha = picture.mode in ("RGBA", "LA") or (picture.mode == "P" and "transparency" in picture.info)
+        if has_alpha and picture.mode != "RGBA":
+            picture = picture.convert("RGBA")
+        if has_alpha:
+            has_alpha = picture.getchannel("A").getextrema()[0] < 255
+
+        output = io.BytesIO()
+        if has_alpha or index in lossless:
+            picture.save(output, format="PNG", optimize=True)
+            mime_type = "image/png"
+        else:
+            picture.convert("RGB").save(output, format="JPEG", quality=jpeg_quality, optimize=True)
+            mime_type = "image/jpeg"
+
+        encoded = output.getvalue()
+        if resized or len(encoded) < len(original):
+            image["bufferView"] = doc.add_view(encoded)
+            image["mimeType"] = mime_type
+            stats["textures_resized"] += int(resized)
+            stats["texture_bytes_after"] += len(encoded)
+        else:
+            stats["texture_bytes_after"] += len(original)
+    return stats
+
+
+# ---------------------------------------------------------------------------
+# Decimação (prévia low-poly)
+# ---------------------------------------------------------------------------
+def simplify_primitive(doc: GltfDocument, primitive: dict, grid: int) -> bool:
+    """
+    Agrupa os vértices numa grade de ``grid`` células no maior eixo: cada
+    célula vira um vértice e triângulos degenerados são removidos.
+    """
+    attributes = primitive.get("attributes", {})
+    if primitive.get("mode", 4) != 4 or primitive.get("targets") or "POSITION" not in attributes:
+        return False
+    if not all(doc.readable(index) for index in attributes.values()):
+        return False
+    if "indices" in primitive and not doc.readable(primitive["indices"]):
+        return False
+
+    positions = doc.read_float(attributes["POSITION"])
+    if not len(positions):
+        return False
+    if "indices" in primitive:
+        indices = doc.read(primitive["indices"]).reshape(-1).astype(np.int64)
+    else:
+        indices = np.arange(len(positions), dtype=np.int64)
+    indices = indices[: len(indices) - len(indices) % 3]
+
+    low, high = positions.min(axis=0), positions.max(axis=0)
+    cell = max(float((high - low).max()) / grid, 1e-9)
+    cells = np.floor((positions - low) / cell).astype(np.int64)
+    size = grid + 1
+    keys = (cells[:, 0] * size + cells[:, 1]) * size + cells[:, 2]
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    representative = first[inverse.reshape(-1)]
+
+    triangles = representative[indices].reshape(-1, 3)
+    triangles = triangles[
+        (triangles[:, 0] != triangles[:, 1]) & (triangles[:, 1] != triangles[:, 2]) & (triangles[:, 0] != triangles[:, 2])
+    ]
+    # Triângulos repetidos (mesmos vértices, qualquer ordem) aparecem uma vez
+    _, unique_rows = np.unique(np.sort(triangles, axis=1), axis=0, return_index=True)
+    triangles = triangles[np.sort(unique_rows)]
+
+    used, remapped = np.unique(triangles, return_inverse=True)
+    new_attributes = {}
+    for semantic, index in attributes.items():
+        accessor = doc.accessors[index]
+        values = doc.read(index)[used]
+        new_index = doc.store(values, accessor["componentType"], accessor["type"], ARRAY_BUFFER,
+                              normalized=accessor.get("normalized", False))
+        if semantic == "POSITION":
+            doc.set_bounds(new_index, values)
+        new_attributes[semantic] = new_index
+    primitive["attributes"] = new_attributes
+
+    index_type = UNSIGNED_SHORT if len(used) < 65535 else UNSIGNED_INT
+    primitive["indices"] = doc.store(remapped.reshape(-1), index_type, "SCALAR", ELEMENT_ARRAY_BUFFER)
+    return True
+
+
+# ---------------------------------------------------------------------------
+# Variantes
+# ---------------------------------------------------------------------------
+def inspect_glb(data: bytes) -> Dict[str, int]:
+    return dict(geometry_stats(GltfDocument(data)), size_bytes=len(data))
+
+
+def optimize_glb(data: bytes, max_texture_size: int = 2048) -> OptimizedAsset:
+    doc = GltfDocument(data)
+    errors = quantize_attributes(doc)
+    textures = downscale_textures(doc, max_texture_size)
+    geometry = geometry_stats(doc)
+    optimized = doc.pack()
+    return OptimizedAsset(optimized, {
+        "size_bytes": len(optimized), **geometry, **textures, "quantization_error": errors,
+    })
+
+
+def preview_glb(data: bytes, grid: int = 64, max_texture_size: int = 256) -> OptimizedAsset:
+    doc = GltfDocument(data)
+    simplified = sum(simplify_primitive(doc, primitive, grid) for primitive in list(doc.primitives()))
+    textures = downscale_textures(doc, max_texture_size)
+    errors = quantize_attributes(doc)
+    geometry = geometry_stats(doc)
+    preview = doc.pack()
+    return OptimizedAsset(preview, {
+        "size_bytes": len(preview), **geometry, **textures, "grid": grid,
+        "primitives_simplified": simplified, "quantization_error": errors,
+    })
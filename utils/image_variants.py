@@ -0,0 +1,131 @@
+"""
+Variantes redimensionadas de fotos e avatares.
+
+As imagens enviadas ficam no storage na resolução original; a interface usa
+miniaturas (40×40 na lista de usuários, cards da galeria de ambientes). Cada
+preset tem larguras fixas e a URL ``/img/<preset>/<largura>.<formato>?src=...``
+devolve a variante em WebP ou JPEG, pronta para ``srcset``.
+
+As variantes ficam em disco endereçadas pelo conteúdo da imagem original
+(``<root>/<sha256>/<preset>-<largura>.<formato>``): a mesma foto em duas URLs
+gera uma vez só. No upload, ``warm`` gera as variantes do preset em segundo
+plano; uma variante que ainda não existe é gerada na primeira requisição
+(single-flight, gravação atômica) e fica em cache.
+"""
+
+from __future__ import annotations
+
+import io
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Tuple
+
+from PIL import Image, ImageOps
+
+from utils.asset_cache import KeyedLock
+
+
+logger = logging.getLogger("GeRot")
+
+PRESETS = {
+    # Avatares: recorte quadrado
+    "avatar": {"widths": (40, 80, 160, 320), "square": True},
+    # Fotos de ambientes: mantém a proporção
+    "photo": {"widths": (320, 640, 1280, 1920), "square": False},
+}
+FORMATS = {"webp": ("WEBP", "image/webp"), "jpg": ("JPEG", "image/jpeg")}
+
+
+class ImageVariantError(ValueError):
+    """Preset, largura ou formato inválido, ou imagem que o Pillow não lê."""
+
+
+def check_variant(preset: str, width: int, fmt: str) -> None:
+    if preset not in PRESETS:
+        raise ImageVariantError(f"Preset inválido: {preset}")
+    if width not in PRESETS[preset]["widths"]:
+        raise ImageVariantError(f"Largura inválida para {preset}: {width}")
+    if fmt not in FORMATS:
+        raise ImageVariantError(f"Formato inválido: {fmt}")
+
+
+def render_variant(source: Path, preset: str, width: int, fmt: str, quality: int = 80) -> bytes:
+    """Redimensiona (sem ampliar) e recodifica a imagem."""
+    check_variant(preset, width, fmt)
+    try:
+        with Image.open(source) as original:
+            image = ImageOps.exif_transpose(original)
+            if PRESETS[preset]["square"]:
+                side = min(width, *image.size)
+                image = ImageOps.fit(image, (side, side), Image.LANCZOS)
+            elif image.width > width:
+                image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+
+            has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+            output = io.BytesIO()
+            if fmt == "webp":
+                image = image.convert("RGBA" if has_alpha else "RGB")
+                image.save(output, format="WEBP", quality=quality, method=4)
+            else:
+                if has_alpha:
+                    # JPEG não tem transparência: fundo branco
+                    rgba = image.convert("RGBA")
+                    image = Image.new("RGB", rgba.size, (255, 255, 255))
+                    image.paste(rgba, mask=rgba.getchannel("A"))
+                image.convert("RGB").save(output, format="JPEG", quality=quality, optimize=True, progressive=True)
+            return output.getvalue()
+    except (OSError, Image.DecompressionBombError) as exc:
+        raise ImageVariantError(f"Imagem não suportada: {exc}")
+
+
+class ImageVariantService:
+    """
+    Geração e cache em disco das variantes.
+
+    ``load_source(url)`` devolve ``(caminho local, sha256)`` da imagem
+    original (no app: o cache de arquivos remotos ou o storage local).
+    """
+
+    def __init__(self, root, load_source: Callable[[str], Tuple[Path, str]], max_workers: int = 2, quality: int = 80):
+        self.root = Path(root)
+        self._load_source = load_source
+        self.quality = quality
+        self._tmp = self.root / "tmp"
+        self._tmp.mkdir(parents=True, exist_ok=True)
+        self._single_flight = KeyedLock(self.root / "locks")
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-variants")
+
+    def variant(self, source_url: str, preset: str, width: int, fmt: str) -> Path:
+        """Caminho da variante, gerando na primeira vez."""
+        check_variant(preset, width, fmt)
+        source, sha256 = self._load_source(source_url)
+        target = self.root / sha256 / f"{preset}-{width}.{fmt}"
+        if target.exists():
+            return target
+
+        with self._single_flight.hold(f"{sha256}-{preset}-{width}-{fmt}"):
+            if target.exists():
+                return target
+            data = render_variant(source, preset, width, fmt, self.quality)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(dir=self._tmp)
+            with os.fdopen(fd, "wb") as handle:
+                handle.write(data)
+            os.replace(tmp_name, target)
+        return target
+
+    def warm(self, source_url: str, preset: str, formats=("webp",)) -> None:
+        """Gera as variantes do preset em segundo plano (chamado após o upload)."""
+        self._executor.submit(self._warm_quietly, source_url, preset, formats)
+
+    def _warm_quietly(self, source_url: str, preset: str, formats) -> None:
+        try:
+            for fmt in formats:
+                for width in PRESETS[preset]["widths"]:
+                    self.variant(source_url, preset, width, fmt)
+            logger.info(f"[IMAGES] Variantes '{preset}' geradas para {source_url}")
+        except Exception as exc:
+            logger.error(f"[IMAGES] Falha ao gerar variantes de {source_url}: {exc}")
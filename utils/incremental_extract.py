@@ -0,0 +1,194 @@
+"""
+Extração incremental (por watermark) dos dashboards recorrentes.
+
+O dashboard declara no bloco ``incremental`` dos filtros a coluna de
+watermark, a chave das linhas e a janela de atraso::
+
+    {"query": "SELECT id, numero, data_alteracao FROM manifestos ...",
+     "incremental": {"watermark": "data_alteracao", "key": ["id"], "overlap": 3600}}
+
+A primeira execução extrai tudo. Nas seguintes o GeRot envia ao agente a
+query limitada a ``watermark >= último watermark - overlap`` (ordenada pela
+coluna, para que um resultado truncado continue de onde parou) e faz o merge
+das linhas novas no snapshot guardado, pela chave. ``overlap`` é em segundos
+para colunas de data/hora e na própria unidade para colunas numéricas.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import re
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple
+
+import psycopg2.extras
+
+from utils.dashboard_snapshots import max_watermark, merge_rows, query_fingerprint
+
+
+logger = logging.getLogger("GeRot")
+
+_IDENTIFIER_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+class IncrementalError(ValueError):
+    """Bloco ``incremental`` inválido."""
+
+
+@dataclass(frozen=True)
+class IncrementalSpec:
+    watermark: str
+    key: Tuple[str, ...]
+    overlap: float = 0
+
+    def state_hash(self, query: str) -> str:
+        """Muda quando a query, a coluna ou a chave mudam: o snapshot é refeito."""
+        spec = json.dumps([query_fingerprint(query), self.watermark, list(self.key)])
+        return hashlib.sha256(spec.encode("utf-8")).hexdigest()
+
+
+def parse_incremental(payload) -> Optional[IncrementalSpec]:
+    """Lê o bloco ``incremental`` dos filtros; ``None`` quando ausente."""
+    spec = payload.get("incremental") if isinstance(payload, dict) else None
+    if not spec:
+        return None
+    if not isinstance(spec, dict):
+        raise IncrementalError("incremental deve ser um objeto")
+
+    watermark = spec.get("watermark")
+    key = spec.get("key") or []
+    if isinstance(key, str):
+        key = [key]
+    for column in [watermark, *key]:
+        if not isinstance(column, str) or not _IDENTIFIER_RE.match(column):
+            raise IncrementalError(f"Coluna inválida em incremental: {column}")
+    # Sem chave a janela de atraso duplicaria as linhas já guardadas
+    if not key:
+        raise IncrementalError("incremental.key é obrigatório")
+    try:
+        overlap = float(spec.get("overlap") or 0)
+    except (TypeError, ValueError):
+        raise IncrementalError("incremental.overlap deve ser numérico")
+    if overlap < 0:
+        raise IncrementalError("incremental.overlap não pode ser negativo")
+    return IncrementalSpec(watermark, tuple(key), overlap)
+
+
+def lower_bound(watermark: str, overlap: float):
+    """Início da janela incremental: ``watermark - overlap`` no tipo da coluna."""
+    try:
+        number = float(watermark)
+    except (TypeError, ValueError):
+        number = None
+    if number is not None:
+        bound = number - overlap
+        return int(bound) if bound.is_integer() and "." not in str(watermark) else bound
+
+    text = str(watermark).replace("T", " ")
+    if len(text) == 10:
+        day = date.fromisoformat(text)
+        return (day - timedelta(days=-(-overlap // 86400))).isoformat()
+    moment = datetime.fromisoformat(text[:19])
+    return (moment - timedelta(seconds=overlap)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def incremental_payload(payload: dict, spec: IncrementalSpec, watermark_from) -> dict:
+    """Filtros do job com a query restrita às linhas a partir de ``watermark_from``."""
+    query = payload.get("query") or ""
+    params = dict(payload.get("params") or {})
+    if not payload.get("params"):
+        # Com parâmetros o pymysql formata a string: escapar '%' literais
+        query = query.replace("%", "%%")
+    params["watermark_from"] = watermark_from
+
+    column = f"incremental_src.`{spec.watermark}`"
+    return dict(
+        payload,
+        query=(
+            f"SELECT * FROM ({query.rstrip().rstrip(';')}) AS incremental_src "
+            f"WHERE {column} >= %(watermark_from)s ORDER BY {column}"
+        ),
+        params=params,
+    )
+
+
+def prepare_incremental_job(cursor, table: str, job_id: int, payload) -> dict:
+    """
+    Decide entre extração completa e incremental para o job reservado e
+    registra o início da janela em ``watermark_from`` (``NULL`` = completa).
+    Devolve os filtros a enviar ao agente.
+    """
+    spec = parse_incremental(payload)
+    if spec is None:
+        return payload
+
+    cursor.execute(
+        "SELECT state_hash, watermark FROM agent_dashboard_watermarks WHERE dashboard_id = %s",
+        (job_id,),
+    )
+    state = cursor.fetchone()
+    watermark_from = None
+    if state and state["watermark"] is not None and state["state_hash"] == spec.state_hash(payload["query"]):
+        watermark_from = lower_bound(state["watermark"], spec.overlap)
+
+    cursor.execute(
+        f"UPDATE {table} SET watermark_from = %s WHERE id = %s",
+        (None if watermark_from is None else str(watermark_from), job_id),
+    )
+    if watermark_from is None:
+        return payload
+    return incremental_payload(payload, spec, watermark_from)
+
+
+def merge_increment(
+    cursor, dashboard_id: int, payload, new_rows: List[dict], incremental: bool, max_rows: Optional[int] = None
+) -> Tuple[List[dict], dict]:
+    """
+    Junta as linhas recebidas ao snapshot do dashboard (ou o substitui, na
+    extração completa), avança o watermark e grava o estado. Devolve as
+    linhas resultantes e um resumo para o ``result_data``.
+    """
+    spec = parse_incremental(payload)
+    state_hash = spec.state_hash(payload["query"])
+
+    cursor.execute(
+        """
+        SELECT state_hash, watermark, rows FROM agent_dashboard_watermarks
+        WHERE dashboard_id = %s FOR UPDATE
+        """,
+        (dashboard_id,),
+    )
+    state = cursor.fetchone()
+    if incremental and state and state["state_hash"] == state_hash:
+        rows = merge_rows(state["rows"] or [], new_rows, spec.key, max_rows)
+        watermark = max_watermark(new_rows, spec.watermark, state["watermark"])
+    else:
+        incremental = False
+        rows = merge_rows([], new_rows, spec.key, max_rows)
+        watermark = max_watermark(rows, spec.watermark)
+
+    cursor.execute(
+        """
+        INSERT INTO agent_dashboard_watermarks (dashboard_id, state_hash, watermark, rows, row_count, updated_at)
+        VALUES (%s, %s, %s, %s, %s, NOW())
+        ON CONFLICT (dashboard_id) DO UPDATE SET
+            state_hash = EXCLUDED.state_hash,
+            watermark = EXCLUDED.watermark,
+            rows = EXCLUDED.rows,
+            row_count = EXCLUDED.row_count,
+            updated_at = NOW()
+        """,
+        (dashboard_id, state_hash, watermark, psycopg2.extras.Json(rows), len(rows)),
+    )
+    logger.info(
+        f"[INCREMENTAL] Dashboard #{dashboard_id}: {len(new_rows)} linha(s) recebida(s), "
+        f"{len(rows)} no snapshot, watermark {watermark}"
+    )
+    return rows, {
+        "mode": "incremental" if incremental else "full",
+        "new_rows": len(new_rows),
+        "watermark": watermark,
+    }
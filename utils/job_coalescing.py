@@ -0,0 +1,144 @@
+"""
+Coalescência (single-flight) de jobs idênticos do agente local.
+
+Jobs com a mesma query normalizada e os mesmos parâmetros têm o mesmo
+``fingerprint``. Ao criar um job:
+
+- se um job igual terminou há menos de ``freshness_seconds``, o resultado é
+  reaproveitado na hora e o job já nasce concluído;
+- se há um job igual pendente ou em execução (o líder), o novo vira seguidor
+  (``leader_id``) e não é entregue aos agentes;
+- senão, o próprio job é o líder.
+
+Quando o líder termina, ``fan_out_results`` copia o status e o resultado
+para os seguidores. A carga no ERP fica proporcional às queries distintas, e
+não aos cliques. Se o líder for excluído, o FK solta os seguidores, que voltam
+a ser jobs comuns.
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import Optional, Tuple
+
+from utils.agent_jobs import JOB_KINDS
+from utils.query_cache import QueryResultCache
+
+
+logger = logging.getLogger("GeRot")
+
+# Origem real de um resultado: a de quem já era seguidor, senão o próprio job
+_SOURCE = "COALESCE(({alias}.{col}->>'coalesced_from')::bigint, {alias}.id)"
+
+
+def job_fingerprint(kind: str, payload) -> Optional[str]:
+    """Hash de (tipo, SQL normalizado, demais parâmetros); ``None`` sem query."""
+    if not isinstance(payload, dict) or not payload.get("query"):
+        return None
+    params = {key: value for key, value in payload.items() if key != "query"}
+    return QueryResultCache.make_key(kind, payload["query"], params)
+
+
+def coalesce_job(
+    cursor, kind: str, job_id: int, payload, freshness_seconds: float = 120
+) -> Optional[Tuple[str, int]]:
+    """
+    Liga o job recém-criado a um job idêntico (o commit fica com o chamador).
+
+    Retorna ``("reused", origem)`` quando um resultado recente foi copiado,
+    ``("attached", líder)`` quando o job passou a seguir um líder em
+    andamento, ou ``None`` quando o job é o líder.
+    """
+    fingerprint = job_fingerprint(kind, payload)
+    if fingerprint is None:
+        return None
+    job = JOB_KINDS[kind]
+
+    # Serializa as criações com o mesmo fingerprint: dois cliques simultâneos
+    # não viram dois líderes
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (fingerprint,))
+    cursor.execute(
+        f"UPDATE {job.table} SET fingerprint = %s, leader_id = NULL WHERE id = %s",
+        (fingerprint, job_id),
+    )
+
+    if freshness_seconds > 0:
+        # Um seguidor aponta para a origem real (onde estão as partes)
+        cursor.execute(
+            f"""
+            UPDATE {job.table} j
+            SET status = 'completed',
+                {job.result_column} = COALESCE(s.{job.result_column}, '{{}}'::jsonb)
+                    || jsonb_build_object('coalesced_from', {_SOURCE.format(alias="s", col=job.result_column)}),
+                error_message = NULL,
+                completed_at = NOW(),
+                updated_at = NOW()
+            FROM (
+                SELECT id, {job.result_column} FROM {job.table}
+                WHERE fingerprint = %s AND id <> %s AND status = 'completed'
+                  AND completed_at > NOW() - make_interval(secs => %s)
+                ORDER BY completed_at DESC
+                LIMIT 1
+            ) s
+            WHERE j.id = %s
+            RETURNING {_SOURCE.format(alias="s", col=job.result_column)} AS source
+            """,
+            (fingerprint, job_id, freshness_seconds, job_id),
+        )
+        fresh = cursor.fetchone()
+        if fresh:
+            logger.info(f"[AGENT-JOBS] {kind} #{job_id} reaproveitou o resultado de #{fresh['source']}")
+            return "reused", fresh["source"]
+
+    cursor.execute(
+        f"""
+        SELECT id FROM {job.table}
+        WHERE fingerprint = %s AND id <> %s AND leader_id IS NULL
+          AND status IN ('pending', %s)
+        ORDER BY id
+        LIMIT 1
+        """,
+        (fingerprint, job_id, job.running_status),
+    )
+    leader = cursor.fetchone()
+    if not leader:
+        return None
+
+    cursor.execute(
+        f"UPDATE {job.table} SET leader_id = %s, updated_at = NOW() WHERE id = %s",
+        (leader["id"], job_id),
+    )
+    logger.info(f"[AGENT-JOBS] {kind} #{job_id} aguardando o job idêntico #{leader['id']}")
+    return "attached", leader["id"]
+
+
+def fan_out_results(cursor, kind: str) -> int:
+    """
+    Copia status e resultado dos líderes concluídos/falhos para os seguidores.
+
+    Os seguidores são soltos do líder (``leader_id = NULL``) e guardam a origem
+    em ``coalesced_from`` no resultado. Retorna quantos foram atualizados.
+    """
+    job = JOB_KINDS[kind]
+    cursor.execute(
+        f"""
+        UPDATE {job.table} f
+        SET status = l.status,
+            {job.result_column} = COALESCE(l.{job.result_column}, '{{}}'::jsonb)
+                || jsonb_build_object('coalesced_from', {_SOURCE.format(alias="l", col=job.result_column)}),
+            error_message = l.error_message,
+            leader_id = NULL,
+            completed_at = NOW(),
+            updated_at = NOW()
+        FROM {job.table} l
+        WHERE f.leader_id = l.id
+          AND f.status = 'pending'
+          AND l.status IN ('completed', 'failed')
+        RETURNING f.id
+        """
+    )
+    followers = len(cursor.fetchall())
+    if followers:
+        logger.info(f"[AGENT-JOBS] {kind}: resultado repassado a {followers} job(s) idêntico(s)")
+    return followers
+
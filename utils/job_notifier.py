@@ -0,0 +1,117 @@
+"""
+Sinalização de jobs novos para o long-poll do agente local.
+
+Requisições estacionadas esperam numa ``threading.Condition`` do processo.
+Ela é acordada diretamente pelos caminhos que criam jobs no mesmo processo e,
+quando há uma conexão direta ao Postgres (``LISTEN`` não funciona através do
+pgbouncer em modo transação), por uma thread que escuta o canal via
+``LISTEN`` e repassa cada ``NOTIFY`` vindo de outros workers/hosts.
+"""
+
+from __future__ import annotations
+
+import logging
+import select
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+import psycopg2
+import psycopg2.extensions
+
+
+logger = logging.getLogger("GeRot")
+
+AGENT_JOBS_CHANNEL = "agent_jobs"
+
+
+class JobNotifier:
+    """Condição compartilhada com limite de requisições estacionadas."""
+
+    def __init__(self, max_parked: int = 2, channel: str = AGENT_JOBS_CHANNEL) -> None:
+        self.max_parked = max_parked
+        self.channel = channel
+        self._cond = threading.Condition()
+        self._version = 0
+        self._parked = 0
+        self._listener: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def version(self) -> int:
+        with self._cond:
+            return self._version
+
+    @property
+    def listening(self) -> bool:
+        return self._listener is not None and self._listener.is_alive()
+
+    def notify(self) -> None:
+        """Acorda todas as requisições estacionadas neste processo."""
+        with self._cond:
+            self._version += 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def parked(self) -> Iterator[bool]:
+        """Reserva uma vaga de espera; produz ``False`` se o limite foi atingido."""
+        with self._cond:
+            if self._parked >= self.max_parked:
+                admitted = False
+            else:
+                self._parked += 1
+                admitted = True
+        try:
+            yield admitted
+        finally:
+            if admitted:
+                with self._cond:
+                    self._parked -= 1
+
+    def wait(self, since_version: int, timeout: float) -> bool:
+        """Espera até ``timeout`` segundos por um aviso posterior a ``since_version``."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._version != since_version, timeout)
+
+    # ---------------------------------------------------------------------#
+    # LISTEN no Postgres
+    # ---------------------------------------------------------------------#
+    def listen(self, dsn: str) -> None:
+        """Inicia a thread que repassa os ``NOTIFY`` do canal para este processo."""
+        if self._listener is not None:
+            return
+        self._listener = threading.Thread(
+            target=self._listen_loop, args=(dsn,), name="agent-jobs-listen", daemon=True
+        )
+        self._listener.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _listen_loop(self, dsn: str) -> None:
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(dsn)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                conn.cursor().execute(f"LISTEN {self.channel}")
+                logger.info(f"[AGENT-JOBS] Escutando canal {self.channel}")
+                # Acorda quem já estava esperando: jobs podem ter chegado sem aviso
+                self.notify()
+
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 30) == ([], [], []):
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        conn.notifies.clear()
+                        self.notify()
+            except Exception as exc:
+                logger.error(f"[AGENT-JOBS] LISTEN interrompido: {exc}")
+                self._stop.wait(5)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
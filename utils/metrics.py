@@ -0,0 +1,201 @@
+"""
+Métricas do app no formato Prometheus (``/metrics``).
+
+- Requisições: latência por endpoint, método e status.
+- Postgres: duração de cada statement (cursor do ``ConnectionWrapper``), tempo
+  de banco e número de statements por requisição, espera para tirar conexão
+  do pool e conexões em uso.
+- Chamadas externas: Gemini, Microsoft Graph, Supabase Storage e MySQL
+  Brudam, por serviço e resultado.
+
+Com ``PROMETHEUS_MULTIPROC_DIR`` definido (gunicorn.conf.py), cada worker
+grava os valores em arquivos mmap nesse diretório e ``/metrics`` soma todos os
+workers; sem a variável (``python app_production.py``) vale só o processo
+atual. O custo por requisição é de alguns microssegundos: um ``observe`` por
+métrica, sem lock entre processos.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Gauge, Histogram, generate_latest, multiprocess
+from requests.adapters import HTTPAdapter
+
+
+# Latências de requisições web e chamadas externas (5 ms a 60 s)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Statements e esperas no banco são bem mais curtos
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+REQUEST_LATENCY = Histogram(
+    "gerot_http_request_duration_seconds",
+    "Duração das requisições HTTP",
+    ["endpoint", "method", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_QUERY_LATENCY = Histogram(
+    "gerot_db_query_duration_seconds", "Duração de cada statement no Postgres", buckets=DB_BUCKETS
+)
+DB_REQUEST_TIME = Histogram(
+    "gerot_db_request_time_seconds",
+    "Tempo total de Postgres por requisição",
+    ["endpoint"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_REQUEST_STATEMENTS = Histogram(
+    "gerot_db_request_statements",
+    "Statements no Postgres por requisição",
+    ["endpoint"],
+    buckets=STATEMENT_BUCKETS,
+)
+POOL_WAIT = Histogram(
+    "gerot_db_pool_wait_seconds", "Espera para obter conexão do pool", ["pool"], buckets=DB_BUCKETS
+)
+POOL_IN_USE = Gauge(
+    "gerot_db_pool_in_use", "Conexões emprestadas do pool", ["pool"], multiprocess_mode="livesum"
+)
+OUTBOUND_LATENCY = Histogram(
+    "gerot_outbound_duration_seconds",
+    "Duração das chamadas a serviços externos",
+    ["service", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+
+_request = threading.local()
+
+
+# ---------------------------------------------------------------------------#
+# Requisições
+# ---------------------------------------------------------------------------#
+def begin_request() -> None:
+    _request.started = time.perf_counter()
+    _request.db_seconds = 0.0
+    _request.statements = 0
+
+
+def end_request(endpoint: str, method: str, status: int) -> None:
+    started = getattr(_request, "started", None)
+    if started is None:
+        return
+    _request.started = None
+    REQUEST_LATENCY.labels(endpoint, method, str(status)).observe(time.perf_counter() - started)
+    DB_REQUEST_TIME.labels(endpoint).observe(_request.db_seconds)
+    DB_REQUEST_STATEMENTS.labels(endpoint).observe(_request.statements)
+
+
+def record_query(seconds: float) -> None:
+    DB_QUERY_LATENCY.observe(seconds)
+    if getattr(_request, "started", None) is not None:
+        _request.db_seconds += seconds
+        _request.statements += 1
+
+
+class TimedCursor:
+    """
+    Cursor que mede cada ``execute``; o resto vai direto para o cursor do
+    psycopg2. ``observer(query, params, segundos, cursor)`` recebe os
+    statements bem-sucedidos (utils/query_analysis.py).
+    """
+
+    __slots__ = ("_cursor", "_observer")
+
+    def __init__(self, cursor, observer=None):
+        self._cursor = cursor
+        self._observer = observer
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            result = self._cursor.execute(query, vars)
+        finally:
+            seconds = time.perf_counter() - started
+            record_query(seconds)
+        if self._observer is not None:
+            self._observer(query, vars, seconds, self._cursor)
+        return result
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            result = self._cursor.executemany(query, vars_list)
+        finally:
+            seconds = time.perf_counter() - started
+            record_query(seconds)
+        if self._observer is not None:
+            self._observer(query, None, seconds, self._cursor)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._cursor.__exit__(*exc_info)
+
+
+# ---------------------------------------------------------------------------#
+# Pools e serviços externos
+# ---------------------------------------------------------------------------#
+@contextmanager
+def pool_checkout(pool: str):
+    """Mede a espera por uma conexão (o bloco deve só obter a conexão)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        POOL_WAIT.labels(pool).observe(time.perf_counter() - started)
+
+
+@contextmanager
+def outbound(service: str):
+    """Mede uma chamada externa; exceção conta como ``error``."""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        OUTBOUND_LATENCY.labels(service, outcome).observe(time.perf_counter() - started)
+
+
+class TimedAdapter(HTTPAdapter):
+    """``HTTPAdapter`` que mede cada requisição enviada (resposta 5xx conta como ``error``)."""
+
+    def __init__(self, service: str, **kwargs):
+        self.service = service
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            response = super().send(request, **kwargs)
+            if response.status_code < 500:
+                outcome = "ok"
+            return response
+        finally:
+            OUTBOUND_LATENCY.labels(self.service, outcome).observe(time.perf_counter() - started)
+
+
+# ---------------------------------------------------------------------------#
+# Exposição
+# ---------------------------------------------------------------------------#
+def render_metrics():
+    """``(corpo, content-type)`` do ``/metrics``, somando os workers no modo multiprocesso."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
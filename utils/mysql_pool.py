@@ -0,0 +1,143 @@
+"""Pool de conexões MySQL com verificação de saúde, um pool por host."""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+
+
+class MySQLPoolTimeout(Exception):
+    """Nenhuma conexão ficou disponível dentro do tempo de espera."""
+
+
+class MySQLConnectionPool:
+    """
+    Pool limitado de conexões pymysql.
+
+    As conexões ociosas são reutilizadas em ordem LIFO (a mais recente primeiro,
+    que é a com maior chance de ainda estar viva). Conexões paradas há mais de
+    ``ping_after`` segundos recebem um ``ping`` antes de serem entregues, e as
+    paradas há mais de ``max_idle`` segundos são descartadas.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], object],
+        max_size: int = 5,
+        ping_after: float = 30.0,
+        max_idle: float = 300.0,
+        acquire_timeout: float = 15.0,
+    ) -> None:
+        self._factory = factory
+        self.max_size = max_size
+        self.ping_after = ping_after
+        self.max_idle = max_idle
+        self.acquire_timeout = acquire_timeout
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle: deque = deque()
+        self._lock = threading.Lock()
+
+    # ---------------------------------------------------------------------#
+    # Operações públicas
+    # ---------------------------------------------------------------------#
+    def acquire(self):
+        """Retira uma conexão saudável do pool, abrindo uma nova se necessário."""
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise MySQLPoolTimeout(
+                f"Pool MySQL esgotado ({self.max_size} conexões em uso)"
+            )
+        try:
+            conn = self._pop_healthy()
+            return conn if conn is not None else self._factory()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn, discard: bool = False) -> None:
+        """Devolve a conexão ao pool (ou fecha, se ``discard`` ou já fechada)."""
+        try:
+            if discard or not getattr(conn, "open", True):
+                self._safe_close(conn)
+            else:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Context manager que devolve a conexão ao pool ao final do bloco."""
+        conn = self.acquire()
+        failed = False
+        try:
+            yield conn
+        except Exception:
+            # Após erro não sabemos o estado da sessão; melhor não reaproveitar.
+            failed = True
+            raise
+        finally:
+            self.release(conn, discard=failed)
+
+    def close_all(self) -> None:
+        """Fecha todas as conexões ociosas."""
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for conn, _ in idle:
+            self._safe_close(conn)
+
+    @property
+    def idle_count(self) -> int:
+        return len(self._idle)
+
+    # ---------------------------------------------------------------------#
+    # Métodos auxiliares
+    # ---------------------------------------------------------------------#
+    def _pop_healthy(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                conn, last_used = self._idle.pop()
+
+            idle_for = time.monotonic() - last_used
+            if idle_for > self.max_idle:
+                self._safe_close(conn)
+                continue
+            if idle_for > self.ping_after:
+                try:
+                    conn.ping(reconnect=False)
+                except Exception:
+                    self._safe_close(conn)
+                    continue
+            return conn
+
+    @staticmethod
+    def _safe_close(conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+_pools: Dict[Tuple[str, int], MySQLConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_mysql_pool(
+    host: str,
+    port: int,
+    factory: Callable[[], object],
+    max_size: int = 5,
+    **options,
+) -> MySQLConnectionPool:
+    """Retorna (criando na primeira chamada) o pool do par host/porta."""
+    key = (host, port)
+    with _pools_lock:
+        pool: Optional[MySQLConnectionPool] = _pools.get(key)
+        if pool is None:
+            pool = MySQLConnectionPool(factory, max_size=max_size, **options)
+            _pools[key] = pool
+        return pool
@@ -0,0 +1,43 @@
+"""Partes de upload em NDJSON comprimido com gzip (um registro JSON por linha)."""
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import zlib
+from typing import List, Tuple
+
+
+class PartError(ValueError):
+    """Parte corrompida, grande demais ou com checksum divergente."""
+
+
+def encode_part(rows: List[dict]) -> Tuple[bytes, str]:
+    """Serializa as linhas em NDJSON gzip. Retorna ``(corpo, sha256 do NDJSON)``."""
+    payload = "".join(json.dumps(row, ensure_ascii=False, default=str) + "\n" for row in rows).encode("utf-8")
+    return gzip.compress(payload, compresslevel=6), hashlib.sha256(payload).hexdigest()
+
+
+def decode_part(body: bytes, checksum: str, max_bytes: int = 64 * 1024 * 1024) -> List[dict]:
+    """
+    Descomprime e valida uma parte.
+
+    O checksum é do NDJSON descomprimido (o cabeçalho gzip traz a data de
+    compressão, então o mesmo conteúdo comprimido duas vezes difere).
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        payload = decompressor.decompress(body, max_bytes)
+    except zlib.error as exc:
+        raise PartError(f"gzip inválido: {exc}")
+    if decompressor.unconsumed_tail:
+        raise PartError(f"Parte maior que {max_bytes} bytes descomprimida")
+
+    if hashlib.sha256(payload).hexdigest() != (checksum or "").lower():
+        raise PartError("Checksum divergente")
+
+    try:
+        return [json.loads(line) for line in payload.decode("utf-8").splitlines() if line.strip()]
+    except ValueError as exc:
+        raise PartError(f"NDJSON inválido: {exc}")
@@ -0,0 +1,124 @@
+"""
+Extração particionada por data (auditoria fiscal e outros relatórios por período).
+
+O job traz a query com os marcadores ``%(inicio)s`` (inclusivo) e ``%(fim)s``
+(exclusivo) e um bloco ``partition``::
+
+    {"query": "... WHERE m.data_emissao >= %(inicio)s AND m.data_emissao < %(fim)s ...",
+     "params": {"operador": 12},
+     "partition": {"start": "2026-01-01", "end": "2026-03-31", "unit": "week"}}
+
+O período vira partes de um dia ou uma semana, executadas em paralelo pelo
+agente; ``run_ordered`` devolve os resultados na ordem das partes com uma
+janela limitada, para a memória não crescer com o tamanho do período.
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, Tuple, TypeVar
+
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+PARTITION_UNITS = {"day": 1, "week": 7}
+MAX_SHARDS = 400
+
+
+class PartitionError(ValueError):
+    """Bloco ``partition`` inválido."""
+
+
+@dataclass(frozen=True)
+class Shard:
+    index: int
+    start: date  # inclusivo
+    end: date  # exclusivo
+
+    def params(self, base: dict) -> dict:
+        return dict(base or {}, inicio=self.start.isoformat(), fim=self.end.isoformat())
+
+    @property
+    def label(self) -> str:
+        last = self.end - timedelta(days=1)
+        return self.start.isoformat() if last == self.start else f"{self.start.isoformat()} a {last.isoformat()}"
+
+
+@dataclass(frozen=True)
+class Partition:
+    start: date
+    end: date  # inclusivo, como informado pelo usuário
+    unit: str = "day"
+    descending: bool = True
+    shards: List[Shard] = field(default_factory=list, compare=False)
+
+
+def suggested_unit(start: date, end: date) -> str:
+    """Dias para períodos de até dois meses; semanas acima disso."""
+    return "day" if (end - start).days <= 62 else "week"
+
+
+def date_shards(start: date, end: date, unit: str = "day", descending: bool = True) -> List[Shard]:
+    """Divide ``[start, end]`` (datas inclusivas) em partes de um dia ou uma semana."""
+    if unit not in PARTITION_UNITS:
+        raise PartitionError(f"Unidade inválida: {unit} (use {', '.join(PARTITION_UNITS)})")
+    if end < start:
+        raise PartitionError("Data final anterior à inicial")
+
+    step = timedelta(days=PARTITION_UNITS[unit])
+    stop = end + timedelta(days=1)
+    ranges = []
+    cursor = start
+    while cursor < stop:
+        ranges.append((cursor, min(cursor + step, stop)))
+        cursor += step
+    if len(ranges) > MAX_SHARDS:
+        raise PartitionError(f"Período gera {len(ranges)} partes (máximo {MAX_SHARDS}); use unit='week'")
+    if descending:
+        ranges.reverse()
+    return [Shard(index, first, last) for index, (first, last) in enumerate(ranges)]
+
+
+def parse_partition(spec) -> Partition:
+    """Valida o bloco ``partition`` do job e calcula as partes."""
+    if not isinstance(spec, dict):
+        raise PartitionError("partition deve ser um objeto")
+    try:
+        start = date.fromisoformat(str(spec["start"])[:10])
+        end = date.fromisoformat(str(spec["end"])[:10])
+    except (KeyError, ValueError):
+        raise PartitionError("partition.start/end devem ser datas YYYY-MM-DD")
+    unit = spec.get("unit") or suggested_unit(start, end)
+    descending = bool(spec.get("descending", True))
+    return Partition(start, end, unit, descending, date_shards(start, end, unit, descending))
+
+
+def run_ordered(
+    tasks: Iterable[T], worker: Callable[[T], R], max_workers: int = 4
+) -> Iterator[Tuple[T, R]]:
+    """
+    Executa ``worker`` em paralelo e produz ``(tarefa, resultado)`` na ordem
+    das tarefas. No máximo ``2 * max_workers`` resultados ficam pendentes; o
+    primeiro erro interrompe o restante.
+    """
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="shard")
+    pending: deque = deque()
+    iterator = iter(tasks)
+    try:
+        for task in islice(iterator, max_workers * 2):
+            pending.append((task, executor.submit(worker, task)))
+        while pending:
+            task, future = pending.popleft()
+            result = future.result()
+            for following in islice(iterator, 1):
+                pending.append((following, executor.submit(worker, following)))
+            yield task, result
+    finally:
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
@@ -0,0 +1,243 @@
+"""
+Sincronização das agendas de dashboards com o Microsoft Planner em lote.
+
+Cada usuário precisa de três chamadas ao Graph: criar a tarefa, ler o ETag dos
+detalhes e gravar a descrição (PATCH com ``If-Match``). Em vez de três
+requisições HTTPS por usuário, as operações vão em requisições JSON
+``$batch`` de até 20 itens:
+
+1. um lote com os POST de criação dos 20 usuários do grupo;
+2. um lote com os GET dos detalhes das tarefas criadas;
+3. um lote com os PATCH das descrições, usando os ETags lidos.
+
+O ``$batch`` não repassa a resposta de um item (o id da tarefa, o ETag) para
+outro, então a cadeia criar → detalhes → descrição vira três lotes em
+sequência. Grupos diferentes são independentes e rodam em paralelo, num pool
+limitado. Respostas 429/503 (do lote inteiro ou de itens) respeitam o
+``Retry-After``: todas as threads pausam juntas e só os itens recusados são
+reenviados.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence
+
+from utils.planner_client import PlannerClient, PlannerIntegrationError
+
+
+logger = logging.getLogger("GeRot")
+
+BATCH_LIMIT = 20  # máximo de requisições por $batch no Graph
+RETRYABLE_STATUS = {429, 503, 504}
+
+
+def dashboards_hash(dashboards: Sequence[dict]) -> str:
+    """Identifica o conjunto de dashboards do usuário (ordem irrelevante)."""
+    items = sorted(json.dumps(dash, sort_keys=True, ensure_ascii=False) for dash in dashboards)
+    return hashlib.sha256("\n".join(items).encode("utf-8")).hexdigest()
+
+
+@dataclass
+class PlannerTaskSpec:
+    user_id: int
+    user_name: str
+    title: str
+    description: str
+    dashboard_count: int
+    dashboard_hash: str
+
+
+@dataclass
+class SyncOutcome:
+    spec: PlannerTaskSpec
+    status: str  # 'success' | 'error'
+    message: str
+    task_id: Optional[str] = None
+
+
+class Throttle:
+    """Pausa compartilhada entre as threads quando o Graph pede para esperar."""
+
+    def __init__(self, sleep: Callable[[float], None] = time.sleep):
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._until = 0.0
+
+    def defer(self, seconds: float) -> None:
+        with self._lock:
+            self._until = max(self._until, time.monotonic() + seconds)
+
+    def wait(self) -> None:
+        remaining = self._until - time.monotonic()
+        if remaining > 0:
+            self._sleep(remaining)
+
+
+def retry_after_seconds(headers, default: float) -> float:
+    """Lê o ``Retry-After`` (segundos) de headers HTTP ou de um item do lote."""
+    for key, value in (headers or {}).items():
+        if key.lower() == "retry-after":
+            try:
+                return max(float(value), 0.0)
+            except (TypeError, ValueError):
+                break
+    return default
+
+
+def _error_message(item: dict) -> str:
+    body = item.get("body") or {}
+    error = body.get("error") if isinstance(body, dict) else None
+    if isinstance(error, dict) and error.get("message"):
+        return error["message"]
+    return f"HTTP {item.get('status')}"
+
+
+class PlannerSyncEngine:
+    """Executa as criações de tarefas em lotes ``$batch`` paralelos."""
+
+    def __init__(
+        self,
+        client: PlannerClient,
+        max_workers: int = 4,
+        batch_size: int = BATCH_LIMIT,
+        max_attempts: int = 5,
+        backoff_seconds: float = 2.0,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.client = client
+        self.max_workers = max(1, max_workers)
+        self.batch_size = max(1, min(batch_size, BATCH_LIMIT))
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.throttle = Throttle(sleep)
+        self.requests_sent = 0
+
+    def run(self, specs: Sequence[PlannerTaskSpec], start_time: datetime, due_time: datetime) -> List[SyncOutcome]:
+        groups = [list(specs[i:i + self.batch_size]) for i in range(0, len(specs), self.batch_size)]
+        if not groups:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(groups)), thread_name_prefix="planner") as pool:
+            results = pool.map(lambda group: self._sync_group(group, start_time, due_time), groups)
+            return [outcome for group in results for outcome in group]
+
+    # ---------------------------------------------------------------------#
+    # Um grupo de até 20 usuários: criar → detalhes → descrição
+    # ---------------------------------------------------------------------#
+    def _sync_group(self, group: List[PlannerTaskSpec], start_time: datetime, due_time: datetime) -> List[SyncOutcome]:
+        specs = {str(index): spec for index, spec in enumerate(group)}
+        outcomes: Dict[str, SyncOutcome] = {}
+
+        try:
+            created = self._batch([
+                {
+                    "id": key,
+                    "method": "POST",
+                    "url": "/planner/tasks",
+                    "headers": {"Content-Type": "application/json"},
+                    "body": self.client.task_payload(spec.title, start_time, due_time),
+                }
+                for key, spec in specs.items()
+            ])
+            task_ids = {}
+            for key, item in created.items():
+                if item["status"] >= 300:
+                    outcomes[key] = SyncOutcome(specs[key], "error", f"Erro ao criar tarefa: {_error_message(item)}")
+                else:
+                    task_ids[key] = item["body"]["id"]
+
+            details = self._batch([
+                {"id": key, "method": "GET", "url": f"/planner/tasks/{task_id}/details"}
+                for key, task_id in task_ids.items()
+            ])
+            etags = {}
+            for key, item in details.items():
+                if item["status"] >= 300:
+                    outcomes[key] = SyncOutcome(
+                        specs[key], "error", f"Erro ao obter detalhes da tarefa: {_error_message(item)}", task_ids[key]
+                    )
+                else:
+                    etags[key] = (item.get("body") or {}).get("@odata.etag")
+
+            patched = self._batch([
+                {
+                    "id": key,
+                    "method": "PATCH",
+                    "url": f"/planner/tasks/{task_ids[key]}/details",
+                    "headers": {"Content-Type": "application/json", **({"If-Match": etag} if etag else {})},
+                    "body": {"description": specs[key].description[:2000]},
+                }
+                for key, etag in etags.items()
+            ])
+            for key, item in patched.items():
+                if item["status"] >= 300:
+                    message = f"Erro ao atualizar descrição da tarefa: {_error_message(item)}"
+                    outcomes[key] = SyncOutcome(specs[key], "error", message, task_ids[key])
+                else:
+                    outcomes[key] = SyncOutcome(specs[key], "success", "Tarefa criada e agenda enviada.", task_ids[key])
+        except PlannerIntegrationError as exc:
+            # Falha do lote inteiro (token, rede): quem ainda não terminou fica com o erro
+            for key, spec in specs.items():
+                outcomes.setdefault(key, SyncOutcome(spec, "error", str(exc)))
+
+        return [outcomes[key] for key in specs]
+
+    # ---------------------------------------------------------------------#
+    # $batch com reenvio dos itens limitados (429/503)
+    # ---------------------------------------------------------------------#
+    def _batch(self, operations: List[dict]) -> Dict[str, dict]:
+        """Envia as operações em um ``$batch``; devolve a resposta de cada ``id``."""
+        pending = {operation["id"]: operation for operation in operations}
+        results: Dict[str, dict] = {}
+
+        for attempt in range(self.max_attempts):
+            if not pending:
+                break
+            self.throttle.wait()
+            try:
+                response = self.client.session.post(
+                    f"{self.client.graph_base}/$batch",
+                    json={"requests": list(pending.values())},
+                    headers=self.client.auth_headers(),
+                    timeout=60,
+                )
+            except Exception as exc:
+                raise PlannerIntegrationError(f"Falha de comunicação com o Graph: {exc}")
+            self.requests_sent += 1
+            backoff = self.backoff_seconds * (2 ** attempt)
+
+            if response.status_code in RETRYABLE_STATUS:
+                delay = retry_after_seconds(response.headers, backoff)
+                logger.warning(f"[PLANNER] Graph respondeu {response.status_code}; aguardando {delay:.0f}s")
+                self.throttle.defer(delay)
+                continue
+            if response.status_code >= 300:
+                raise PlannerIntegrationError(f"Erro no $batch do Graph: {response.text}")
+
+            delay = 0.0
+            for item in response.json().get("responses", []):
+                if item.get("id") not in pending:
+                    continue
+                if item.get("status") in RETRYABLE_STATUS:
+                    delay = max(delay, retry_after_seconds(item.get("headers"), backoff))
+                    continue
+                results[item["id"]] = item
+                del pending[item["id"]]
+            if pending:
+                logger.warning(f"[PLANNER] {len(pending)} operação(ões) limitada(s); nova tentativa em {delay:.0f}s")
+                self.throttle.defer(delay or backoff)
+
+        for key in pending:
+            results[key] = {
+                "id": key,
+                "status": 429,
+                "body": {"error": {"message": "Limite de requisições do Graph excedido"}},
+            }
+        return results
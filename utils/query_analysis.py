@@ -0,0 +1,195 @@
+"""
+Análise das consultas ao Postgres por requisição: N+1 e consultas lentas.
+
+O ``TimedCursor`` (utils/metrics.py) entrega cada statement executado a
+``QueryAnalyzer.observe``. O SQL vira uma impressão digital (literais,
+parâmetros e listas ``IN``/``VALUES`` trocados por ``?``), e cada requisição
+acumula contagem e duração por impressão digital.
+
+- N+1: ao fim da requisição, a mesma impressão digital repetida
+  ``n_plus_one_threshold`` vezes ou mais gera um aviso no log.
+- Consulta lenta: acima de ``slow_ms`` vai para o log; uma amostra
+  (``explain_sample``, no máximo uma vez por impressão digital a cada
+  ``explain_interval`` segundos) sai com o plano do ``EXPLAIN``, executado na
+  mesma conexão dentro de um savepoint.
+- ``RequestSummary.header`` resume a requisição para o cabeçalho
+  ``X-Query-Summary`` (modo debug) e o plugin do pytest
+  (utils/query_budget_plugin.py) confere orçamentos de consultas por endpoint.
+"""
+
+from __future__ import annotations
+
+import logging
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+logger = logging.getLogger("GeRot")
+
+MAX_FINGERPRINT_SQL = 4096  # execute_values gera SQL enorme; o começo basta
+
+_COMMENTS = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_PLACEHOLDERS = re.compile(r"%\(\w+\)s|%s")
+_NUMBERS = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SPACES = re.compile(r"\s+")
+_COMMAS = re.compile(r"\s*,\s*")
+_IN_LISTS = re.compile(r"\bin \(\?(?:, \?)*\)")
+_VALUES_LISTS = re.compile(r"\bvalues (\([^()]*\))(?:, \([^()]*\))+")
+_EXPLAINABLE = ("select", "with")
+
+# Recebem o RequestSummary de cada requisição (plugin do pytest)
+_listeners: List[Callable[["RequestSummary"], None]] = []
+
+
+def add_listener(listener: Callable[["RequestSummary"], None]) -> None:
+    _listeners.append(listener)
+
+
+def remove_listener(listener: Callable[["RequestSummary"], None]) -> None:
+    _listeners.remove(listener)
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(sql) -> str:
+    """SQL normalizado: mesma forma de consulta, mesma impressão digital."""
+    if isinstance(sql, bytes):
+        sql = sql[:MAX_FINGERPRINT_SQL].decode("utf-8", errors="replace")
+    else:
+        sql = str(sql)[:MAX_FINGERPRINT_SQL]
+    sql = _COMMENTS.sub(" ", sql)
+    sql = _STRINGS.sub("?", sql)
+    sql = _PLACEHOLDERS.sub("?", sql)
+    sql = _NUMBERS.sub("?", sql)
+    sql = _SPACES.sub(" ", sql).strip().lower()
+    sql = _COMMAS.sub(", ", sql).replace("( ", "(").replace(" )", ")")
+    sql = _IN_LISTS.sub("in (?)", sql)
+    return _VALUES_LISTS.sub(r"values \1, ...", sql)
+
+
+@dataclass
+class RequestSummary:
+    endpoint: str
+    statements: int
+    seconds: float
+    # impressão digital -> [execuções, segundos]
+    fingerprints: Dict[str, List] = field(default_factory=dict)
+    n_plus_one: List[Tuple[str, int]] = field(default_factory=list)
+
+    def header(self) -> str:
+        return (
+            f"statements={self.statements}; db_ms={self.seconds * 1000:.1f}; "
+            f"distinct={len(self.fingerprints)}; n_plus_one={len(self.n_plus_one)}"
+        )
+
+
+class QueryAnalyzer:
+    """Acumula as consultas de cada requisição (estado por thread)."""
+
+    def __init__(
+        self,
+        n_plus_one_threshold: int = 10,
+        slow_ms: float = 500.0,
+        explain_sample: float = 0.1,
+        explain_interval: float = 300.0,
+    ) -> None:
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.slow_seconds = slow_ms / 1000
+        self.explain_sample = explain_sample
+        self.explain_interval = explain_interval
+        self._state = threading.local()
+        self._explained: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    # ---------------------------------------------------------------------#
+    # Requisição
+    # ---------------------------------------------------------------------#
+    def begin_request(self) -> None:
+        self._state.fingerprints = {}
+
+    def end_request(self, endpoint: str) -> Optional[RequestSummary]:
+        fingerprints = getattr(self._state, "fingerprints", None)
+        if fingerprints is None:
+            return None
+        self._state.fingerprints = None
+
+        summary = RequestSummary(
+            endpoint,
+            sum(count for count, _ in fingerprints.values()),
+            sum(seconds for _, seconds in fingerprints.values()),
+            fingerprints,
+        )
+        for sql, (count, seconds) in fingerprints.items():
+            if count >= self.n_plus_one_threshold:
+                summary.n_plus_one.append((sql, count))
+                logger.warning(
+                    f"[QUERIES] Possível N+1 em {endpoint}: {count}x ({seconds * 1000:.0f} ms) {sql[:300]}"
+                )
+        for listener in list(_listeners):
+            listener(summary)
+        return summary
+
+    # ---------------------------------------------------------------------#
+    # Statements
+    # ---------------------------------------------------------------------#
+    def observe(self, query, params, seconds: float, cursor) -> None:
+        """Chamado pelo ``TimedCursor`` depois de cada statement bem-sucedido."""
+        sql = fingerprint(query if isinstance(query, (str, bytes)) else str(query))
+        fingerprints = getattr(self._state, "fingerprints", None)
+        if fingerprints is not None:
+            entry = fingerprints.get(sql)
+            if entry is None:
+                fingerprints[sql] = [1, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+
+        if seconds >= self.slow_seconds:
+            plan = self._sampled_plan(sql, query, params, cursor)
+            logger.warning(
+                f"[QUERIES] Consulta lenta ({seconds * 1000:.0f} ms): {sql[:500]}"
+                + (f"\n{plan}" if plan else "")
+            )
+
+    def _sampled_plan(self, sql: str, query, params, cursor) -> Optional[str]:
+        if not sql.startswith(_EXPLAINABLE) or random.random() >= self.explain_sample:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            if now - self._explained.get(sql, float("-inf")) < self.explain_interval:
+                return None
+            self._explained[sql] = now
+        try:
+            return explain(cursor.connection, query, params)
+        except Exception as exc:
+            return f"(EXPLAIN falhou: {exc})"
+
+
+def explain(conn, query, params=None) -> str:
+    """
+    Plano estimado (sem ANALYZE: a consulta não roda de novo). Dentro de uma
+    transação usa savepoint, para um EXPLAIN que falhe não abortar a transação
+    da requisição.
+    """
+    prefix = b"EXPLAIN " if isinstance(query, bytes) else "EXPLAIN "
+    cursor = conn.cursor()  # cursor do psycopg2, fora das métricas
+    savepoint = not conn.autocommit
+    if savepoint:
+        cursor.execute("SAVEPOINT query_analysis_explain")
+    try:
+        cursor.execute(prefix + query, params)
+        rows = cursor.fetchall()
+    except Exception:
+        if savepoint:
+            cursor.execute("ROLLBACK TO SAVEPOINT query_analysis_explain")
+        raise
+    finally:
+        if savepoint:
+            cursor.execute("RELEASE SAVEPOINT query_analysis_explain")
+        cursor.close()
+    return "\n".join(next(iter(row.values())) if isinstance(row, dict) else row[0] for row in rows)
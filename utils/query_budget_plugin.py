@@ -0,0 +1,103 @@
+"""
+Plugin do pytest: orçamento de consultas ao Postgres por endpoint.
+
+Cada requisição feita durante o teste (``app.test_client()``) passa pelo
+``QueryAnalyzer`` do app; o teste falha se algum endpoint executar mais
+statements que o orçamento ou repetir a mesma consulta (N+1) acima do limite.
+
+Ativação (``conftest.py``)::
+
+    pytest_plugins = ["utils.query_budget_plugin"]
+
+Orçamentos no ``pytest.ini`` (valem para todos os testes)::
+
+    [pytest]
+    query_budgets =
+        admin_dashboard = 40
+        environments_api = 3
+    query_budget_max_repeats = 10
+
+Ou no próprio teste, com precedência sobre o ini::
+
+    @pytest.mark.query_budget(environments_api=3, max_repeats=2)
+    def test_environments(client): ...
+
+    @pytest.mark.query_budget(5)  # qualquer endpoint chamado no teste
+    def test_summary(client): ...
+"""
+
+from __future__ import annotations
+
+from typing import Dict, List, Optional
+
+import pytest
+
+from utils.query_analysis import RequestSummary, add_listener, remove_listener
+
+
+def pytest_addoption(parser):
+    parser.addini("query_budgets", "Máximo de statements por endpoint (endpoint = N)", type="linelist", default=[])
+    parser.addini("query_budget_max_repeats", "Máximo de execuções da mesma consulta por requisição", default="")
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers",
+        "query_budget(max=None, max_repeats=None, **endpoints): orçamento de consultas por endpoint",
+    )
+
+
+def parse_budgets(lines) -> Dict[str, int]:
+    budgets = {}
+    for line in lines:
+        endpoint, _, value = line.partition("=")
+        if endpoint.strip() and value.strip():
+            budgets[endpoint.strip()] = int(value)
+    return budgets
+
+
+def check_budgets(
+    summaries: List[RequestSummary],
+    budgets: Dict[str, int],
+    default: Optional[int] = None,
+    max_repeats: Optional[int] = None,
+) -> List[str]:
+    """Descrição de cada requisição que estourou o orçamento."""
+    violations = []
+    for summary in summaries:
+        budget = budgets.get(summary.endpoint, default)
+        if budget is not None and summary.statements > budget:
+            violations.append(
+                f"{summary.endpoint}: {summary.statements} statements (orçamento {budget}; {summary.header()})"
+            )
+        if max_repeats is not None:
+            for sql, (count, _) in summary.fingerprints.items():
+                if count > max_repeats:
+                    violations.append(f"{summary.endpoint}: {count}x a mesma consulta (máximo {max_repeats}): {sql[:200]}")
+    return violations
+
+
+@pytest.hookimpl(wrapper=True)
+def pytest_runtest_call(item):
+    budgets = parse_budgets(item.config.getini("query_budgets"))
+    max_repeats = item.config.getini("query_budget_max_repeats")
+    max_repeats = int(max_repeats) if max_repeats else None
+    default = None
+    marker = item.get_closest_marker("query_budget")
+    if marker is not None:
+        kwargs = dict(marker.kwargs)
+        default = marker.args[0] if marker.args else kwargs.pop("max", None)
+        max_repeats = kwargs.pop("max_repeats", max_repeats)
+        budgets.update(kwargs)
+
+    summaries: List[RequestSummary] = []
+    add_listener(summaries.append)
+    try:
+        result = yield
+    finally:
+        remove_listener(summaries.append)
+
+    violations = check_budgets(summaries, budgets, default, max_repeats)
+    if violations:
+        pytest.fail("Orçamento de consultas excedido:\n" + "\n".join(violations), pytrace=False)
+    return result
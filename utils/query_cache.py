@@ -0,0 +1,116 @@
+"""Cache em memória de resultados de queries, com TTL e deduplicação (single-flight)."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Tuple
+
+
+_QUOTED_RE = re.compile(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`)")
+_SPACES_RE = re.compile(r"\s+")
+
+
+def normalize_sql(sql: str) -> str:
+    """Compacta espaços fora de literais e remove o ``;`` final."""
+    parts = _QUOTED_RE.split(sql or "")
+    for idx in range(0, len(parts), 2):
+        parts[idx] = _SPACES_RE.sub(" ", parts[idx])
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+class _Flight:
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class QueryResultCache:
+    """
+    Cache LRU de resultados, thread-safe.
+
+    Requisições concorrentes pela mesma chave esperam a execução em andamento
+    em vez de disparar uma nova query (single-flight).
+    """
+
+    def __init__(self, max_entries: int = 256, wait_timeout: float = 120.0) -> None:
+        self.max_entries = max_entries
+        self.wait_timeout = wait_timeout
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: dict = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(scope: str, sql: str, params: Any = None) -> str:
+        """Gera a chave do cache a partir de (escopo, SQL normalizado, parâmetros)."""
+        raw = json.dumps(
+            [scope, normalize_sql(sql), params], sort_keys=True, default=str
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get_or_compute(
+        self, key: str, ttl: float, compute: Callable[[], Any]
+    ) -> Tuple[Any, float, bool]:
+        """
+        Retorna ``(valor, idade_em_segundos, veio_do_cache)``.
+
+        Com ``ttl <= 0`` o resultado não é armazenado, mas chamadas simultâneas
+        continuam compartilhando a mesma execução.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                age = time.monotonic() - entry[0]
+                if age < ttl:
+                    self._entries.move_to_end(key)
+                    return entry[1], age, True
+                del self._entries[key]
+
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._inflight[key] = flight
+
+        if not leader:
+            if not flight.event.wait(self.wait_timeout):
+                raise TimeoutError("Tempo esgotado aguardando query em andamento")
+            if flight.error is not None:
+                raise flight.error
+            return flight.value, 0.0, True
+
+        try:
+            flight.value = compute()
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        else:
+            if ttl > 0:
+                self._store(key, flight.value)
+            return flight.value, 0.0, False
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _store(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,262 @@
+"""
+Governança de queries ad-hoc enviadas ao ERP Brudam (MySQL).
+
+Um tokenizador leve separa literais, comentários e parênteses, o que permite:
+- aceitar apenas uma instrução de leitura (SELECT / WITH ... SELECT);
+- localizar o LIMIT externo de verdade (ignorando subqueries, literais e nomes
+  como ``unlimited``) para injetá-lo ou reduzi-lo ao máximo permitido;
+- incluir o hint ``MAX_EXECUTION_TIME`` no SELECT principal;
+- estimar, via ``EXPLAIN FORMAT=JSON``, quantas linhas serão examinadas e
+  recusar a query quando o orçamento for excedido.
+"""
+
+from __future__ import annotations
+
+import json
+import re
+from dataclasses import dataclass
+from typing import Iterable, List, Optional
+
+
+class QueryRejected(Exception):
+    """A query não passou pelas regras do governador."""
+
+
+@dataclass
+class Token:
+    kind: str  # keyword | ident | string | number | comment | hint | space | punct | param
+    text: str
+    depth: int
+
+    @property
+    def upper(self) -> str:
+        return self.text.upper()
+
+
+_TOKEN_RE = re.compile(
+    r"""
+    (?P<space>\s+)
+  | (?P<hint>/\*\+.*?\*/)
+  | (?P<comment>/\*.*?\*/|--[^\n]*|\#[^\n]*)
+  | (?P<string>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*")
+  | (?P<quoted>`(?:[^`]|``)*`)
+  | (?P<param>%\([A-Za-z_][A-Za-z0-9_]*\)s|%s|\?)
+  | (?P<number>\d+(?:\.\d+)?)
+  | (?P<word>[A-Za-z_$@][A-Za-z0-9_$@.]*)
+  | (?P<punct>.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+READ_ONLY_STARTS = {"SELECT", "WITH"}
+WRITE_KEYWORDS = {
+    "INSERT", "UPDATE", "DELETE", "REPLACE", "DROP", "ALTER", "CREATE", "TRUNCATE",
+    "RENAME", "GRANT", "REVOKE", "LOAD", "HANDLER", "CALL", "LOCK", "UNLOCK", "SET",
+}
+KEYWORDS = WRITE_KEYWORDS | READ_ONLY_STARTS | {
+    "FROM", "WHERE", "GROUP", "ORDER", "BY", "HAVING", "LIMIT", "OFFSET", "UNION",
+    "INTO", "FOR", "SHARE", "MODE", "IN", "JOIN", "AS", "ON",
+}
+
+
+def tokenize(sql: str) -> List[Token]:
+    """Quebra o SQL em tokens, anotando a profundidade de parênteses."""
+    tokens: List[Token] = []
+    depth = 0
+    for match in _TOKEN_RE.finditer(sql or ""):
+        kind = match.lastgroup
+        text = match.group()
+        if kind == "quoted":
+            kind = "ident"
+        elif kind == "word":
+            kind = "keyword" if text.upper() in KEYWORDS else "ident"
+        elif kind == "punct" and text == ")":
+            depth = max(depth - 1, 0)
+
+        tokens.append(Token(kind, text, depth))
+
+        if kind == "punct" and text == "(":
+            depth += 1
+    return tokens
+
+
+def _significant(tokens: Iterable[Token]) -> List[Token]:
+    return [t for t in tokens if t.kind not in ("space", "comment")]
+
+
+def _render(tokens: Iterable[Token]) -> str:
+    return "".join(t.text for t in tokens)
+
+
+def ensure_read_only(tokens: List[Token]) -> List[Token]:
+    """
+    Garante uma única instrução de leitura. Retorna os tokens sem o ``;`` final.
+    """
+    # Remove ';', espaços e comentários finais (um "-- comentário" no fim
+    # engoliria o LIMIT acrescentado depois)
+    while tokens and (tokens[-1].kind in ("space", "comment") or tokens[-1].text == ";"):
+        tokens = tokens[:-1]
+    significant = _significant(tokens)
+
+    if not significant:
+        raise QueryRejected("Query vazia")
+    if significant[0].upper not in READ_ONLY_STARTS:
+        raise QueryRejected("Apenas queries SELECT são permitidas")
+
+    for idx, token in enumerate(significant):
+        if token.text == ";":
+            raise QueryRejected("Apenas uma instrução por query é permitida")
+        if token.kind != "keyword":
+            continue
+        following = significant[idx + 1] if idx + 1 < len(significant) else None
+        if token.upper in ("REPLACE", "INSERT") and following is not None and following.text == "(":
+            continue  # funções REPLACE(str, from, to) e INSERT(str, pos, len, newstr)
+        if token.upper in WRITE_KEYWORDS:
+            raise QueryRejected(f"Instrução não permitida: {token.upper}")
+        if token.upper == "INTO":
+            raise QueryRejected("SELECT ... INTO não é permitido")
+        if token.upper == "FOR" and following is not None and following.upper in ("UPDATE", "SHARE"):
+            raise QueryRejected("Locks (FOR UPDATE/SHARE) não são permitidos")
+    return tokens
+
+
+def apply_limit(tokens: List[Token], max_rows: int, default: Optional[int] = None) -> List[Token]:
+    """
+    Sem LIMIT externo, injeta ``LIMIT default`` (ou ``max_rows``); um LIMIT
+    existente só é reduzido quando passa de ``max_rows``.
+    """
+    outer_limit = None
+    for idx, token in enumerate(tokens):
+        if token.kind == "keyword" and token.upper == "LIMIT" and token.depth == 0:
+            outer_limit = idx
+
+    if outer_limit is None:
+        return tokens + [
+            Token("space", " ", 0),
+            Token("keyword", "LIMIT", 0),
+            Token("space", " ", 0),
+            Token("number", str(min(default or max_rows, max_rows)), 0),
+        ]
+
+    # LIMIT n | LIMIT offset, n | LIMIT n OFFSET offset
+    tail = [(i, t) for i, t in enumerate(tokens) if i > outer_limit and t.kind not in ("space", "comment")]
+    numbers = []
+    for pos, (i, t) in enumerate(tail):
+        if t.kind == "number":
+            numbers.append(i)
+        elif t.text == "," or t.upper == "OFFSET":
+            continue
+        elif t.kind == "param":
+            raise QueryRejected("LIMIT parametrizado não é suportado pelo governador")
+        else:
+            break
+        if pos >= 3:
+            break
+
+    if not numbers:
+        raise QueryRejected("LIMIT inválido")
+
+    has_comma = any(t.text == "," for _, t in tail[:3])
+    count_idx = numbers[1] if has_comma and len(numbers) > 1 else numbers[0]
+    if int(float(tokens[count_idx].text)) > max_rows:
+        tokens = list(tokens)
+        tokens[count_idx] = Token("number", str(max_rows), 0)
+    return tokens
+
+
+def add_execution_time_hint(tokens: List[Token], max_execution_ms: int) -> List[Token]:
+    """Inclui ``/*+ MAX_EXECUTION_TIME(ms) */`` logo após o SELECT principal."""
+    if any(t.kind == "hint" and "MAX_EXECUTION_TIME" in t.upper for t in tokens):
+        return tokens
+    for idx, token in enumerate(tokens):
+        if token.kind == "keyword" and token.upper == "SELECT" and token.depth == 0:
+            hint = Token("hint", f" /*+ MAX_EXECUTION_TIME({int(max_execution_ms)}) */", 0)
+            return tokens[: idx + 1] + [hint] + tokens[idx + 1 :]
+    return tokens
+
+
+def estimate_rows_examined(plan) -> int:
+    """
+    Estima as linhas examinadas a partir do JSON do ``EXPLAIN FORMAT=JSON``.
+
+    Em um nested loop cada tabela é lida uma vez para cada linha produzida
+    pelas anteriores, por isso o custo é acumulado com o fan-out do join.
+    """
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    def walk(node, prefix: float = 1.0) -> float:
+        if isinstance(node, list):
+            return sum(walk(item, prefix) for item in node)
+        if not isinstance(node, dict):
+            return 0.0
+
+        total = 0.0
+        if "nested_loop" in node:
+            fanout = prefix
+            for item in node["nested_loop"]:
+                table = item.get("table", item) if isinstance(item, dict) else {}
+                total += walk(item, fanout)
+                produced = table.get("rows_produced_per_join")
+                if produced is not None:
+                    fanout = max(float(produced), 1.0)
+            return total
+
+        if "rows_examined_per_scan" in node:
+            total += prefix * float(node.get("rows_examined_per_scan") or 0)
+
+        for key, value in node.items():
+            if isinstance(value, (dict, list)):
+                total += walk(value, prefix if key == "table" else 1.0)
+        return total
+
+    return int(walk(plan))
+
+
+class QueryGovernor:
+    """Aplica as regras de leitura, limite, tempo máximo e orçamento de linhas."""
+
+    def __init__(
+        self,
+        max_rows: int = 5000,
+        default_limit: int = 500,
+        max_execution_ms: int = 60000,
+        max_rows_examined: Optional[int] = 5_000_000,
+    ) -> None:
+        self.max_rows = max_rows
+        self.default_limit = default_limit
+        self.max_execution_ms = max_execution_ms
+        self.max_rows_examined = max_rows_examined
+
+    def prepare(self, sql: str, limit: Optional[int] = None) -> str:
+        """
+        Valida e reescreve a query. Um LIMIT escrito na query é mantido até
+        ``max_rows``; sem LIMIT entra ``limit`` (o pedido pelo chamador, nunca
+        acima de ``max_rows``) ou, na falta dele, ``default_limit``.
+        """
+        try:
+            wanted = int(limit) if limit else self.default_limit
+        except (TypeError, ValueError):
+            wanted = self.default_limit
+        wanted = max(1, min(wanted, self.max_rows))
+
+        tokens = ensure_read_only(tokenize(sql))
+        tokens = apply_limit(tokens, self.max_rows, wanted)
+        if self.max_execution_ms:
+            tokens = add_execution_time_hint(tokens, self.max_execution_ms)
+        return _render(tokens).strip()
+
+    def check_cost(self, cursor, sql: str, params=None) -> int:
+        """Roda ``EXPLAIN FORMAT=JSON`` e recusa a query acima do orçamento."""
+        if not self.max_rows_examined:
+            return 0
+        cursor.execute(f"EXPLAIN FORMAT=JSON {sql}", params)
+        row = cursor.fetchone()
+        plan = next(iter(row.values())) if isinstance(row, dict) else row[0]
+        estimated = estimate_rows_examined(plan)
+        if estimated > self.max_rows_examined:
+            raise QueryRejected(
+                f"Query recusada: ~{estimated:,} linhas seriam examinadas "
+                f"(limite {self.max_rows_examined:,}). Adicione filtros mais seletivos."
+            )
+        return estimated
@@ -0,0 +1,36 @@
+"""
+Leitura em lotes de um resultado grande (cursor não bufferizado, como o
+``SSDictCursor`` do pymysql): cada lote vira uma parte gravada pelo chamador
+e só a prévia fica em memória, qualquer que seja o total de registros.
+"""
+
+from __future__ import annotations
+
+from typing import Callable, List, Optional, Tuple
+
+
+def stream_batches(
+    cursor,
+    batch_size: int,
+    save_batch: Callable[[int, List[dict]], None],
+    preview_rows: int,
+    convert: Optional[Callable[[dict], dict]] = None,
+) -> Tuple[List[dict], int, int]:
+    """
+    Lê ``cursor`` com ``fetchmany(batch_size)`` e entrega cada lote a
+    ``save_batch(seq, registros)``. Retorna ``(prévia, registros, partes)``.
+    """
+    preview: List[dict] = []
+    row_count = chunks = 0
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        if convert is not None:
+            rows = [convert(row) for row in rows]
+        save_batch(chunks, rows)
+        chunks += 1
+        row_count += len(rows)
+        if len(preview) < preview_rows:
+            preview.extend(rows[:preview_rows - len(preview)])
+    return preview, row_count, chunks
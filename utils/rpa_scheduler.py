@@ -0,0 +1,352 @@
+"""
+Agendador de RPAs recorrentes a partir da coluna ``agent_rpas.frequency``.
+
+Formatos aceitos em ``frequency``:
+
+- ``once`` (padrão): sem recorrência;
+- ``hourly``, ``daily``, ``weekly``, ``monthly`` (atalhos de cron);
+- ``every 15m`` / ``@every 2h`` (intervalo: s, m, h, d, w);
+- expressão cron de 5 campos (``*/15 6-18 * * 1-5``), no fuso
+  ``SCHEDULER_TIMEZONE``.
+
+A próxima execução fica em ``next_run_at`` (indexada). Cada tique reserva as
+RPAs vencidas com ``FOR UPDATE SKIP LOCKED`` e, na mesma transação, recoloca
+a RPA na fila e grava o próximo horário; por isso o agendador pode rodar em
+todos os workers do gunicorn sem disparos duplicados.
+"""
+
+from __future__ import annotations
+
+import logging
+import re
+import threading
+import zlib
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Callable, FrozenSet, List, Optional
+
+from utils.agent_jobs import JOB_KINDS
+
+try:
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+except ImportError:  # Python < 3.9
+    ZoneInfo = None
+    ZoneInfoNotFoundError = Exception
+
+
+logger = logging.getLogger("GeRot")
+
+CRON_ALIASES = {
+    "hourly": "0 * * * *",
+    "daily": "0 6 * * *",
+    "weekly": "0 6 * * 1",
+    "monthly": "0 6 1 * *",
+    "@hourly": "0 * * * *",
+    "@daily": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *",
+}
+CATCH_UP_POLICIES = ("once", "all", "skip")
+
+_INTERVAL_RE = re.compile(r"^(?:@?every|interval)\s*:?\s*(\d+)\s*([smhdw])$")
+_UNIT_SECONDS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+# (mínimo, máximo) de cada campo do cron
+_CRON_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+class ScheduleError(ValueError):
+    """Frequência em formato desconhecido."""
+
+
+def _zone(name: str):
+    if ZoneInfo is None:
+        return timezone.utc
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        logger.warning(f"[SCHEDULER] Fuso {name} indisponível; usando UTC")
+        return timezone.utc
+
+
+def _parse_cron_field(text: str, low: int, high: int) -> FrozenSet[int]:
+    values = set()
+    for part in text.split(","):
+        step = 1
+        if "/" in part:
+            part, step_text = part.split("/", 1)
+            step = int(step_text)
+            if step <= 0:
+                raise ScheduleError(f"Passo inválido: {text}")
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start, end = (int(value) for value in part.split("-", 1))
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end:
+            raise ScheduleError(f"Valor fora de {low}-{high}: {text}")
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+@dataclass(frozen=True)
+class Schedule:
+    """Recorrência: intervalo fixo (``interval``) ou cron (``fields``)."""
+
+    spec: str
+    interval: Optional[timedelta] = None
+    fields: Optional[tuple] = None
+    tz: object = timezone.utc
+
+    @property
+    def period(self) -> timedelta:
+        """Período aproximado, usado para limitar o jitter (estável: data fixa)."""
+        if self.interval is not None:
+            return self.interval
+        first = self.next_after(datetime(2001, 1, 1, tzinfo=timezone.utc))
+        return self.next_after(first) - first
+
+    def next_after_grid(self, anchor: datetime, moment: datetime) -> datetime:
+        """Primeira ocorrência depois de ``moment`` na grade que passa por ``anchor``."""
+        if self.interval is None:
+            return self.next_after(max(anchor, moment))
+        if moment < anchor:
+            return anchor + self.interval
+        return anchor + self.interval * ((moment - anchor) // self.interval + 1)
+
+    def next_after(self, moment: datetime) -> datetime:
+        """Primeira ocorrência estritamente depois de ``moment`` (UTC aware)."""
+        if self.interval is not None:
+            return moment + self.interval
+        minutes, hours, days, months, weekdays = self.fields
+        # No cron 0 e 7 são domingo e 1 é segunda; em Python segunda é 0
+        py_weekdays = {(day - 1) % 7 for day in weekdays}
+        dom_any = len(days) == 31
+        dow_any = len(py_weekdays) == 7
+
+        local = moment.astimezone(self.tz).replace(tzinfo=None, second=0, microsecond=0) + timedelta(minutes=1)
+        limit = local + timedelta(days=366 * 5)
+        while local < limit:
+            if local.month not in months:
+                year, month = (local.year + 1, 1) if local.month == 12 else (local.year, local.month + 1)
+                local = local.replace(year=year, month=month, day=1, hour=0, minute=0)
+                continue
+            dom_ok, dow_ok = local.day in days, local.weekday() in py_weekdays
+            # Como no cron: com os dois campos restritos, basta um deles
+            day_ok = (dom_ok and dow_ok) if (dom_any or dow_any) else (dom_ok or dow_ok)
+            if not day_ok:
+                local = (local + timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            if local.hour not in hours:
+                local = (local + timedelta(hours=1)).replace(minute=0)
+                continue
+            if local.minute not in minutes:
+                local += timedelta(minutes=1)
+                continue
+            return local.replace(tzinfo=self.tz).astimezone(timezone.utc)
+        raise ScheduleError(f"Cron sem ocorrência nos próximos 5 anos: {self.spec}")
+
+
+def parse_schedule(spec: Optional[str], tz_name: str = "America/Sao_Paulo") -> Optional[Schedule]:
+    """Interpreta ``frequency``; ``None`` para execução única."""
+    text = (spec or "once").strip().lower()
+    if text in ("", "once", "manual"):
+        return None
+
+    match = _INTERVAL_RE.match(text)
+    if match:
+        seconds = int(match.group(1)) * _UNIT_SECONDS[match.group(2)]
+        if seconds < 60:
+            raise ScheduleError("Intervalo mínimo de 1 minuto")
+        return Schedule(spec=text, interval=timedelta(seconds=seconds))
+
+    expression = CRON_ALIASES.get(text, text)
+    parts = expression.split()
+    if len(parts) != 5:
+        raise ScheduleError(f"Frequência inválida: {spec!r} (use once, daily, 'every 15m' ou cron de 5 campos)")
+    try:
+        fields = tuple(_parse_cron_field(part, low, high) for part, (low, high) in zip(parts, _CRON_FIELDS))
+    except ValueError as exc:
+        raise ScheduleError(f"Cron inválido {spec!r}: {exc}")
+    return Schedule(spec=text, fields=fields, tz=_zone(tz_name))
+
+
+def jitter_for(rpa_id: int, schedule: Schedule, max_jitter: float) -> timedelta:
+    """
+    Deslocamento estável por RPA (até 10% do período e ``max_jitter``), para
+    RPAs com a mesma frequência não dispararem no mesmo minuto.
+    """
+    window = min(max_jitter, schedule.period.total_seconds() * 0.1)
+    if window <= 0:
+        return timedelta(0)
+    fraction = (zlib.crc32(str(rpa_id).encode()) % 1000) / 1000
+    return timedelta(seconds=int(window * fraction))
+
+
+class RpaScheduler:
+    """
+    Recoloca na fila as RPAs recorrentes vencidas.
+
+    ``catch_up`` decide o que fazer com execuções perdidas (servidor fora do
+    ar, RPA ainda rodando) há mais de ``grace_seconds``:
+
+    - ``once``: roda uma vez agora e segue a partir do próximo horário futuro;
+    - ``all``: roda cada ocorrência perdida, uma após a outra;
+    - ``skip``: descarta as perdidas e espera o próximo horário.
+    """
+
+    def __init__(
+        self,
+        connection_scope: Callable,
+        max_concurrent: Callable[[object], int],
+        on_fired: Optional[Callable[[object], None]] = None,
+        tick_seconds: float = 30.0,
+        max_jitter: float = 300.0,
+        catch_up: str = "once",
+        grace_seconds: float = 300.0,
+        tz_name: str = "America/Sao_Paulo",
+    ) -> None:
+        if catch_up not in CATCH_UP_POLICIES:
+            raise ValueError(f"catch_up deve ser um de {CATCH_UP_POLICIES}")
+        self._connection_scope = connection_scope
+        self._max_concurrent = max_concurrent
+        self._on_fired = on_fired
+        self.tick_seconds = tick_seconds
+        self.max_jitter = max_jitter
+        self.catch_up = catch_up
+        self.grace = timedelta(seconds=grace_seconds)
+        self.tz_name = tz_name
+        self._backfilled = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="rpa-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def first_run(self, rpa_id: int, frequency: Optional[str], now: Optional[datetime] = None) -> Optional[datetime]:
+        """``next_run_at`` de uma RPA nova/alterada (levanta ScheduleError)."""
+        schedule = parse_schedule(frequency, self.tz_name)
+        if schedule is None:
+            return None
+        now = now or datetime.now(timezone.utc)
+        return schedule.next_after(now) + jitter_for(rpa_id, schedule, self.max_jitter)
+
+    def plan(self, rpa_id: int, frequency: str, due_at: datetime, now: datetime):
+        """
+        Decide um disparo: retorna ``(disparar, próximo next_run_at)``.
+
+        ``due_at`` é o ``next_run_at`` vencido (com jitter).
+        """
+        schedule = parse_schedule(frequency, self.tz_name)
+        if schedule is None:
+            return False, None
+        jitter = jitter_for(rpa_id, schedule, self.max_jitter)
+        nominal = due_at - jitter
+        late = now - due_at > self.grace
+
+        if self.catch_up == "all":
+            return True, schedule.next_after(nominal) + jitter
+        # Próxima ocorrência futura, mantendo a grade do agendamento
+        upcoming = schedule.next_after_grid(nominal, now - jitter) + jitter
+        if late and self.catch_up == "skip":
+            return False, upcoming
+        return True, upcoming
+
+    def backfill(self, cursor) -> int:
+        """Calcula ``next_run_at`` das RPAs recorrentes que ainda não o têm."""
+        cursor.execute(
+            """
+            SELECT id, frequency FROM agent_rpas
+            WHERE next_run_at IS NULL AND COALESCE(frequency, 'once') NOT IN ('once', '')
+            FOR UPDATE SKIP LOCKED
+            """
+        )
+        scheduled = 0
+        for row in cursor.fetchall():
+            try:
+                next_run = self.first_run(row["id"], row["frequency"])
+            except ScheduleError as exc:
+                logger.error(f"[SCHEDULER] RPA #{row['id']} com frequência inválida: {exc}")
+                continue
+            cursor.execute("UPDATE agent_rpas SET next_run_at = %s WHERE id = %s", (next_run, row["id"]))
+            scheduled += 1
+        return scheduled
+
+    def run_once(self) -> List[int]:
+        """Um tique: dispara as RPAs vencidas. Retorna os ids recolocados na fila."""
+        fired: List[int] = []
+        with self._connection_scope() as conn:
+            cursor = conn.cursor()
+            try:
+                if not self._backfilled:
+                    self.backfill(cursor)
+                    self._backfilled = True
+                slots = self._max_concurrent(cursor)
+                # Ocupam vaga só as RPAs em execução e as pendentes que o agente
+                # pode reservar; pendentes de outros tipos e seguidores de um
+                # job idêntico (leader_id) nunca saem da fila por ele
+                cursor.execute(
+                    f"""
+                    SELECT id, frequency, next_run_at, NOW() AS now
+                    FROM agent_rpas
+                    WHERE next_run_at <= NOW()
+                      AND status NOT IN ('pending', 'running')
+                    ORDER BY next_run_at
+                    LIMIT GREATEST(%s - (
+                        SELECT COUNT(*) FROM agent_rpas c
+                        WHERE c.status = 'running'
+                           OR (c.status = 'pending' AND {JOB_KINDS["rpa"].eligible})
+                    ), 0)
+                    FOR UPDATE SKIP LOCKED
+                    """,
+                    (slots,),
+                )
+                for row in cursor.fetchall():
+                    try:
+                        fire, next_run = self.plan(row["id"], row["frequency"], row["next_run_at"], row["now"])
+                    except ScheduleError as exc:
+                        logger.error(f"[SCHEDULER] RPA #{row['id']} com frequência inválida: {exc}")
+                        fire, next_run = False, None
+
+                    if fire:
+                        cursor.execute(
+                            """
+                            UPDATE agent_rpas
+                            SET status = 'pending', error_message = NULL, attempts = 0,
+                                last_scheduled_at = %s, next_run_at = %s, queued_at = NOW(), updated_at = NOW()
+                            WHERE id = %s
+                            """,
+                            (row["next_run_at"], next_run, row["id"]),
+                        )
+                        fired.append(row["id"])
+                    else:
+                        cursor.execute(
+                            "UPDATE agent_rpas SET next_run_at = %s WHERE id = %s",
+                            (next_run, row["id"]),
+                        )
+                        if next_run is not None:
+                            logger.info(f"[SCHEDULER] RPA #{row['id']}: execuções perdidas descartadas (catch_up=skip)")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+            if fired:
+                logger.info(f"[SCHEDULER] {len(fired)} RPA(s) recolocada(s) na fila: {fired}")
+                if self._on_fired is not None:
+                    self._on_fired(conn)
+        return fired
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.tick_seconds):
+            try:
+                self.run_once()
+            except Exception as exc:
+                logger.error(f"[SCHEDULER] Erro no agendador: {exc}")
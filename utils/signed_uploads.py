@@ -0,0 +1,167 @@
+"""
+Upload direto do navegador para o storage (URL assinada).
+
+1. ``POST /api/environments/<id>/uploads`` valida nome, tipo e tamanho,
+   grava a linha pendente em ``environment_uploads`` e devolve a URL
+   assinada de curta duração;
+2. o navegador envia o arquivo com ``PUT`` direto ao storage;
+3. ``POST .../uploads/<upload_id>/complete`` confere tamanho, assinatura do
+   formato (primeiros bytes) e checksum e ativa o recurso do ambiente.
+
+Os bytes do arquivo não passam pelos workers da aplicação. ``LocalStorage``
+substitui o Supabase em desenvolvimento e testes: grava em disco e assina as
+URLs com HMAC.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import hmac
+import os
+import time
+from pathlib import Path
+from typing import BinaryIO, Optional
+from urllib.parse import quote, urlencode
+
+from utils.storage_upload import ObjectInfo, UploadResult, UploadTooLarge, _HashingReader
+
+
+# extensão -> (tipo do recurso, assinaturas aceitas no início do arquivo)
+UPLOAD_TYPES = {
+    ".glb": ("model_3d", (b"glTF",)),
+    ".gltf": ("model_3d", (b"{",)),
+    ".fbx": ("model_3d", (b"Kaydara FBX Binary", b"; FBX")),
+    ".obj": ("model_3d", ()),
+    ".jpg": ("photo", (b"\xff\xd8\xff",)),
+    ".jpeg": ("photo", (b"\xff\xd8\xff",)),
+    ".png": ("photo", (b"\x89PNG\r\n\x1a\n",)),
+    ".webp": ("photo", (b"RIFF",)),
+    ".pdf": ("plant_2d", (b"%PDF",)),
+}
+SIGNED_UPLOAD_TTL = 15 * 60
+
+
+class UploadRejected(ValueError):
+    """Arquivo recusado na criação ou na conclusão do upload."""
+
+
+def resource_type_for(filename: str) -> str:
+    """Tipo do recurso do ambiente a partir da extensão."""
+    ext = os.path.splitext(filename)[1].lower()
+    return UPLOAD_TYPES.get(ext, ("document", ()))[0]
+
+
+def check_new_upload(filename: str, size, max_bytes: int) -> None:
+    """Validação antes de assinar a URL (nome, extensão e tamanho declarado)."""
+    ext = os.path.splitext(filename)[1].lower()
+    if ext not in UPLOAD_TYPES:
+        raise UploadRejected(f"Tipo de arquivo não permitido: {ext or filename}")
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise UploadRejected("Tamanho do arquivo obrigatório")
+    if size <= 0:
+        raise UploadRejected("Arquivo vazio")
+    if size > max_bytes:
+        raise UploadTooLarge(f"Arquivo acima do limite de {max_bytes // (1024 * 1024)} MB")
+
+
+def check_completed_upload(pending: dict, info: Optional[ObjectInfo], head: bytes) -> None:
+    """Confere o objeto enviado contra o que foi declarado na criação."""
+    if info is None:
+        raise UploadRejected("Arquivo não encontrado no storage")
+    if info.size != pending["expected_size"]:
+        raise UploadRejected(f"Tamanho divergente: {info.size} bytes (esperado {pending['expected_size']})")
+
+    ext = os.path.splitext(pending["file_name"])[1].lower()
+    signatures = UPLOAD_TYPES.get(ext, ("document", ()))[1]
+    if signatures and not any(head.startswith(signature) for signature in signatures):
+        raise UploadRejected("Conteúdo não corresponde ao tipo do arquivo")
+    if ext == ".webp" and head[8:12] != b"WEBP":
+        raise UploadRejected("Conteúdo não corresponde ao tipo do arquivo")
+
+    # O Supabase não informa o hash do conteúdo; o storage local sim
+    if pending.get("sha256") and info.sha256 and info.sha256 != pending["sha256"]:
+        raise UploadRejected("Checksum divergente")
+
+
+class LocalStorage:
+    """Storage em disco com URLs de upload assinadas (desenvolvimento e testes)."""
+
+    def __init__(self, root: str, secret: str, base_path: str = "/api/storage/local"):
+        self.root = Path(root)
+        self.secret = secret.encode("utf-8")
+        self.base_path = base_path.rstrip("/")
+
+    def _file(self, path: str) -> Path:
+        target = (self.root / path).resolve()
+        if self.root.resolve() not in target.parents:
+            raise UploadRejected("Caminho inválido")
+        return target
+
+    def _signature(self, path: str, expires: int) -> str:
+        return hmac.new(self.secret, f"{path}:{expires}".encode("utf-8"), hashlib.sha256).hexdigest()
+
+    def public_url(self, path: str) -> str:
+        return f"{self.base_path}/{quote(path)}"
+
+    def create_signed_upload(self, path: str, ttl: int = SIGNED_UPLOAD_TTL) -> str:
+        expires = int(time.time()) + ttl
+        query = urlencode({"expires": expires, "signature": self._signature(path, expires)})
+        return f"{self.base_path}/{quote(path)}?{query}"
+
+    def verify(self, path: str, expires, signature) -> bool:
+        try:
+            expires = int(expires)
+        except (TypeError, ValueError):
+            return False
+        return expires >= time.time() and hmac.compare_digest(self._signature(path, expires), str(signature or ""))
+
+    def write(self, path: str, stream: BinaryIO, max_bytes: int, chunk_size: int = 1024 * 1024) -> ObjectInfo:
+        """Grava o corpo do PUT em disco, em partes."""
+        target = self._file(path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        partial = target.with_name(target.name + ".part")
+        size = 0
+        with open(partial, "wb") as handle:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    handle.close()
+                    partial.unlink(missing_ok=True)
+                    raise UploadTooLarge(f"Arquivo acima do limite de {max_bytes // (1024 * 1024)} MB")
+                handle.write(chunk)
+        partial.replace(target)
+        return ObjectInfo(size, None)
+
+    def upload(self, stream: BinaryIO, path: str, content_type: Optional[str], max_bytes: Optional[int] = None) -> UploadResult:
+        """Mesma interface de ``SupabaseStorage.upload`` (rota antiga de upload)."""
+        reader = _HashingReader(stream, max_bytes)
+        info = self.write(path, reader, max_bytes if max_bytes is not None else float("inf"))
+        return UploadResult(self.public_url(path), info.size, reader.sha256.hexdigest())
+
+    def stat(self, path: str) -> Optional[ObjectInfo]:
+        target = self._file(path)
+        if not target.is_file():
+            return None
+        digest = hashlib.sha256()
+        with open(target, "rb") as handle:
+            for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return ObjectInfo(target.stat().st_size, None, digest.hexdigest())
+
+    def read_head(self, path: str, length: int = 64) -> bytes:
+        with open(self._file(path), "rb") as handle:
+            return handle.read(length)
+
+    def local_path(self, path: str) -> Path:
+        return self._file(path)
+
+    def download(self, path: str) -> bytes:
+        return self._file(path).read_bytes()
+
+    def delete(self, path: str) -> None:
+        self._file(path).unlink(missing_ok=True)
@@ -0,0 +1,279 @@
+"""
+Upload em streaming (TUS) para o Supabase Storage.
+
+O arquivo é lido do stream do werkzeug em partes de ``TUS_CHUNK_SIZE`` e
+enviado pelo protocolo TUS (``/storage/v1/upload/resumable``): só uma parte
+fica em memória, o SHA-256 é calculado durante o envio e uma falha de rede no
+meio da parte é retomada a partir do ``Upload-Offset`` informado pelo
+servidor. Arquivos de até uma parte vão em um único POST. Todas as chamadas usam uma sessão HTTP com pool de conexões.
+"""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import BinaryIO, Optional
+
+import requests
+
+from utils.metrics import TimedAdapter
+
+
+logger = logging.getLogger("GeRot")
+
+# O Supabase exige partes de exatamente 6 MB (menos a última)
+TUS_CHUNK_SIZE = 6 * 1024 * 1024
+TUS_VERSION = "1.0.0"
+
+
+class StorageUploadError(Exception):
+    """Falha ao enviar o arquivo para o storage."""
+
+
+class UploadTooLarge(StorageUploadError):
+    """Arquivo acima do limite permitido."""
+
+
+@dataclass
+class UploadResult:
+    public_url: str
+    size: int
+    sha256: str
+
+
+@dataclass
+class ObjectInfo:
+    size: int
+    content_type: Optional[str]
+    sha256: Optional[str] = None  # nem todo backend informa o hash do conteúdo
+
+
+def storage_session(pool_size: int = 8) -> requests.Session:
+    """Sessão HTTP com keep-alive e pool de conexões para o storage."""
+    session = requests.Session()
+    adapter = TimedAdapter("storage", pool_connections=2, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def stream_size(stream: BinaryIO) -> Optional[int]:
+    """Tamanho de um stream posicionável (o werkzeug grava uploads grandes em disco)."""
+    try:
+        position = stream.tell()
+        stream.seek(0, os.SEEK_END)
+        size = stream.tell()
+        stream.seek(position)
+        return size - position
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def _metadata(**values) -> str:
+    return ",".join(
+        f"{key} {base64.b64encode(str(value).encode('utf-8')).decode('ascii')}"
+        for key, value in values.items()
+    )
+
+
+class _HashingReader:
+    """Lê o stream repassando os bytes para o hash e contando o tamanho."""
+
+    def __init__(self, stream: BinaryIO, max_bytes: Optional[int]):
+        self._stream = stream
+        self._max_bytes = max_bytes
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._stream.read(size)
+        self.size += len(data)
+        if self._max_bytes is not None and self.size > self._max_bytes:
+            raise UploadTooLarge(f"Arquivo acima do limite de {self._max_bytes // (1024 * 1024)} MB")
+        self.sha256.update(data)
+        return data
+
+
+class SupabaseStorage:
+    """Cliente mínimo do Supabase Storage para uploads."""
+
+    def __init__(
+        self,
+        url: str,
+        key: str,
+        bucket: str = "environment-assets",
+        session: Optional[requests.Session] = None,
+        chunk_size: int = TUS_CHUNK_SIZE,
+        max_retries: int = 3,
+    ):
+        self.url = url.rstrip("/")
+        self.key = key
+        self.bucket = bucket
+        self.session = session or storage_session()
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+
+    def public_url(self, path: str) -> str:
+        return f"{self.url}/storage/v1/object/public/{self.bucket}/{path}"
+
+    def upload(
+        self,
+        stream: BinaryIO,
+        path: str,
+        content_type: Optional[str],
+        max_bytes: Optional[int] = None,
+    ) -> UploadResult:
+        """
+        Envia ``stream`` para ``path`` no bucket. Levanta ``UploadTooLarge``
+        antes de enviar qualquer byte quando o tamanho já é conhecido.
+        """
+        content_type = content_type or "application/octet-stream"
+        size = stream_size(stream)
+        if size is not None and max_bytes is not None and size > max_bytes:
+            raise UploadTooLarge(f"Arquivo acima do limite de {max_bytes // (1024 * 1024)} MB")
+
+        reader = _HashingReader(stream, max_bytes)
+        if size is not None and size <= self.chunk_size:
+            self._upload_single(reader, path, content_type)
+        elif size is not None:
+            self._upload_tus(reader, path, content_type, size)
+        else:
+            raise StorageUploadError("Tamanho do arquivo desconhecido")
+
+        if size is not None and reader.size != size:
+            raise StorageUploadError(f"Arquivo incompleto: {reader.size} de {size} bytes")
+        return UploadResult(self.public_url(path), reader.size, reader.sha256.hexdigest())
+
+    # ---------------------------------------------------------------------#
+    # Upload direto do navegador (URL assinada)
+    # ---------------------------------------------------------------------#
+    def create_signed_upload(self, path: str) -> str:
+        """URL assinada para o navegador enviar o arquivo com PUT (vale 2 horas)."""
+        response = self._request(
+            "POST", f"{self.url}/storage/v1/object/upload/sign/{self.bucket}/{path}",
+            headers=self._headers(),
+        )
+        if response.status_code not in (200, 201):
+            raise StorageUploadError(f"Falha ao assinar upload ({response.status_code}): {response.text}")
+        return f"{self.url}/storage/v1{response.json()['url']}"
+
+    def stat(self, path: str) -> Optional[ObjectInfo]:
+        """Tamanho e tipo do objeto; ``None`` quando não existe."""
+        response = self._request("HEAD", f"{self.url}/storage/v1/object/{self.bucket}/{path}", headers=self._headers())
+        if response.status_code == 404 or response.status_code == 400:
+            return None
+        if response.status_code >= 300:
+            raise StorageUploadError(f"Falha ao consultar objeto ({response.status_code})")
+        return ObjectInfo(int(response.headers.get("Content-Length") or 0), response.headers.get("Content-Type"))
+
+    def read_head(self, path: str, length: int = 64) -> bytes:
+        """Primeiros bytes do objeto (assinatura do formato)."""
+        response = self._request(
+            "GET", f"{self.url}/storage/v1/object/{self.bucket}/{path}",
+            headers=self._headers(Range=f"bytes=0-{length - 1}"),
+        )
+        if response.status_code not in (200, 206):
+            raise StorageUploadError(f"Falha ao ler objeto ({response.status_code})")
+        return response.content[:length]
+
+    def download(self, path: str) -> bytes:
+        """Conteúdo completo do objeto (processamento de modelos no servidor)."""
+        response = self._request("GET", f"{self.url}/storage/v1/object/{self.bucket}/{path}", headers=self._headers())
+        if response.status_code != 200:
+            raise StorageUploadError(f"Falha ao baixar objeto ({response.status_code})")
+        return response.content
+
+    def delete(self, path: str) -> None:
+        self._request("DELETE", f"{self.url}/storage/v1/object/{self.bucket}/{path}", headers=self._headers())
+
+    # ---------------------------------------------------------------------#
+    # Envio
+    # ---------------------------------------------------------------------#
+    def _headers(self, **extra) -> dict:
+        return {"Authorization": f"Bearer {self.key}", "x-upsert": "true", **extra}
+
+    def _upload_single(self, reader: _HashingReader, path: str, content_type: str) -> None:
+        data = reader.read()
+        response = self._request(
+            "POST", f"{self.url}/storage/v1/object/{self.bucket}/{path}",
+            data=data, headers=self._headers(**{"Content-Type": content_type}),
+        )
+        if response.status_code not in (200, 201):
+            raise StorageUploadError(f"Supabase Upload Failed ({response.status_code}): {response.text}")
+
+    def _upload_tus(self, reader: _HashingReader, path: str, content_type: str, size: int) -> None:
+        response = self._request(
+            "POST", f"{self.url}/storage/v1/upload/resumable",
+            headers=self._headers(**{
+                "Tus-Resumable": TUS_VERSION,
+                "Upload-Length": str(size),
+                "Upload-Metadata": _metadata(
+                    bucketName=self.bucket, objectName=path, contentType=content_type, cacheControl="3600"
+                ),
+            }),
+        )
+        if response.status_code != 201 or not response.headers.get("Location"):
+            raise StorageUploadError(f"Falha ao iniciar upload TUS ({response.status_code}): {response.text}")
+        location = response.headers["Location"]
+        if location.startswith("/"):
+            location = f"{self.url}{location}"
+
+        offset = 0
+        started = time.monotonic()
+        while offset < size:
+            chunk = reader.read(min(self.chunk_size, size - offset))
+            if not chunk:
+                break
+            offset = self._send_chunk(location, offset, chunk)
+        logger.info(
+            f"[STORAGE] {path}: {size / (1024 * 1024):.1f} MB enviados via TUS "
+            f"em {time.monotonic() - started:.1f}s"
+        )
+
+    def _send_chunk(self, location: str, offset: int, chunk: bytes) -> int:
+        """Envia uma parte; em falha consulta o offset no servidor e reenvia o restante."""
+        chunk_start, end = offset, offset + len(chunk)
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.patch(
+                    location,
+                    data=chunk[offset - chunk_start:],
+                    headers=self._headers(**{
+                        "Tus-Resumable": TUS_VERSION,
+                        "Upload-Offset": str(offset),
+                        "Content-Type": "application/offset+octet-stream",
+                    }),
+                    timeout=(10, 120),
+                )
+                if response.status_code == 204:
+                    offset = int(response.headers.get("Upload-Offset", end))
+                    if offset >= end:
+                        return end
+                    continue  # o servidor aceitou só parte: enviar o restante
+                if response.status_code < 500 and response.status_code != 409:
+                    raise StorageUploadError(f"Falha no upload TUS ({response.status_code}): {response.text}")
+            except requests.exceptions.RequestException as exc:
+                logger.warning(f"[STORAGE] Erro de rede no upload TUS (tentativa {attempt + 1}): {exc}")
+
+            if attempt == self.max_retries:
+                break
+            time.sleep(2 ** attempt)
+            # Retomar de onde o servidor parou, dentro da parte em memória
+            head = self._request("HEAD", location, headers=self._headers(**{"Tus-Resumable": TUS_VERSION}))
+            server_offset = int(head.headers.get("Upload-Offset", offset))
+            if not chunk_start <= server_offset <= end:
+                raise StorageUploadError("Upload TUS fora de sincronia com o servidor")
+            if server_offset == end:
+                return end
+            offset = server_offset
+        raise StorageUploadError("Falha no upload TUS após várias tentativas")
+
+    def _request(self, method: str, url: str, **kwargs):
+        try:
+            return self.session.request(method, url, timeout=(10, 120), **kwargs)
+        except requests.exceptions.RequestException as exc:
+            raise StorageUploadError(f"Erro de conexão com o storage: {exc}")